@@ -1,11 +1,577 @@
 
-from collections import defaultdict
-from datetime import datetime
-from sqlalchemy import func, text
-from utils import PLATFORM_PRIORITY, now_thai, sla_status, due_date_for, normalize_platform, TH_TZ
-from models import db, Shop, Product, Stock, Sales, OrderLine
+import os
+import threading
+from collections import defaultdict, OrderedDict
+from datetime import datetime, date, time, timedelta
+from sqlalchemy import bindparam, func, text, select
+from utils import (
+    PLATFORM_PRIORITY, now_thai, sla_status, due_date_for, normalize_platform, TH_TZ,
+    SALES_PACKED, classify_sales_status,
+)
+from models import db, Shop, Product, Stock, Sales, OrderLine, OrderLineArchive
+from allocation_row import AllocationRow
 
-def compute_allocation(session, filters:dict):
+# ===================== Incremental allocation state =====================
+# เก็บผลการจัดสรร (allocation_status รายบรรทัด) แยกตาม SKU ต่อ scope (platform, shop_id)
+# ครั้งถัดไปจะวน Priority/FIFO ใหม่เฉพาะ SKU ที่ถูก mark ว่า "dirty" เท่านั้น
+#
+# Write path ที่กระทบผลจัดสรร (import orders/stock/sales, กดรับ, ยกเลิก, จ่ายงาน, บิลเปล่า)
+# ต้องเรียก mark_*_dirty() "หลัง commit" เสมอ
+_state_lock = threading.Lock()
+_dirty_seq = 0                       # ตัวนับลำดับการ mark (เพิ่มขึ้นเรื่อยๆ)
+_reset_seq = 0                       # ลำดับล่าสุดที่สั่ง mark ทุก SKU
+_dirty_skus: dict[str, int] = {}     # sku -> ลำดับล่าสุดที่ถูก mark
+_dirty_orders: dict[str, int] = {}   # order_id -> ลำดับล่าสุดที่ถูก mark
+_sku_state: dict[tuple, dict[str, tuple]] = {}  # scope -> sku -> (seq, signature, {line_id: status})
+
+# ถ้า mark ราย Order สะสมเยอะเกินนี้ ให้ล้างทั้งหมดแทน (กันหน่วยความจำบวม)
+_MAX_DIRTY_ENTRIES = 50000
+
+# ===================== Cross-request result cache =====================
+# แคชผล compute_allocation ทั้งก้อน (rows, kpis) ข้าม Request โดยใช้ key = (filters, data version, วันที่)
+# data version เพิ่มทุกครั้งที่มีการเขียนข้อมูล (mark_*_dirty / bump_data_version) -> ผลเก่าใช้ไม่ได้ทันที
+_data_version = 0
+_result_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_RESULT_CACHE_SIZE = int(os.environ.get("ALLOC_CACHE_SIZE", "32") or 0)
+# callback ที่ถูกเรียกทุกครั้งที่ data version เปลี่ยน (เช่นปลุก Refresher ของตาราง allocation_results)
+_version_listeners: list = []
+
+
+def bump_data_version():
+    """ประกาศว่าข้อมูลเปลี่ยน -> ผลที่แคชไว้ทั้งหมดหมดอายุ"""
+    global _data_version
+    with _state_lock:
+        _data_version += 1
+        _result_cache.clear()
+    for listener in _version_listeners:
+        listener()
+
+
+def on_data_version_change(listener) -> None:
+    """ลงทะเบียน callback (ไม่มี argument) ให้ถูกเรียกหลัง bump_data_version ทุกครั้ง"""
+    if listener not in _version_listeners:
+        _version_listeners.append(listener)
+
+
+def data_version() -> int:
+    return _data_version
+
+
+# ===================== Allocation kernel =====================
+# "python" = Loop ราย SKU (_allocate_sku_rows), "numpy" = Kernel แบบ Columnar (allocation_kernel.py)
+# Kernel จะถูกใช้เมื่อจำนวนแถวที่ต้องคำนวณใหม่ถึง _KERNEL_MIN_ROWS (ก้อนเล็ก Loop เร็วกว่า)
+_KERNEL = (os.environ.get("ALLOC_KERNEL") or "python").strip().lower()
+_KERNEL_MIN_ROWS = int(os.environ.get("ALLOC_KERNEL_MIN_ROWS", "2000") or 0)
+
+
+def _columnar_kernel():
+    """คืน allocation_kernel.allocate_rows ถ้าเลือก Kernel numpy และ import ได้ (ไม่งั้น None)"""
+    if _KERNEL != "numpy":
+        return None
+    try:
+        from allocation_kernel import allocate_rows
+    except Exception:
+        return None
+    return allocate_rows
+
+
+def mark_all_dirty():
+    """ทิ้งผลจัดสรรที่เก็บไว้ทั้งหมด (ใช้กับ full stock sync / ล้างข้อมูล)"""
+    global _dirty_seq, _reset_seq
+    with _state_lock:
+        _dirty_seq += 1
+        _reset_seq = _dirty_seq
+        _dirty_skus.clear()
+        _dirty_orders.clear()
+    bump_data_version()
+
+
+def mark_skus_dirty(skus):
+    """mark SKU ที่ผลจัดสรรต้องคำนวณใหม่ (เช่น สต็อกเปลี่ยน / กดรับ)"""
+    global _dirty_seq
+    skus = [str(s).strip() for s in (skus or []) if s]
+    if not skus:
+        return
+    with _state_lock:
+        _dirty_seq += 1
+        for sku in skus:
+            _dirty_skus[sku] = _dirty_seq
+    bump_data_version()
+    if len(_dirty_skus) > _MAX_DIRTY_ENTRIES:
+        mark_all_dirty()
+
+
+def mark_orders_dirty(order_ids):
+    """mark ทุก SKU ที่อยู่ใน Order เหล่านี้ (เช่น ยกเลิก / จ่ายงาน / Sales เปลี่ยน / บิลเปล่า)"""
+    global _dirty_seq
+    oids = [str(o).strip() for o in (order_ids or []) if o]
+    if not oids:
+        return
+    with _state_lock:
+        _dirty_seq += 1
+        for oid in oids:
+            _dirty_orders[oid] = _dirty_seq
+    bump_data_version()
+    if len(_dirty_orders) > _MAX_DIRTY_ENTRIES:
+        mark_all_dirty()
+
+
+def _sku_signature(arr: list[dict]) -> tuple:
+    """ลายเซ็นของข้อมูลที่ใช้ตัดสต็อก: สต็อกตั้งต้น + ชุดบรรทัดที่ยังไม่ Packed/Cancelled
+    (กันกรณีมีบรรทัดถูกเพิ่ม/ลบ หรือสต็อกเปลี่ยน โดยไม่ได้ผ่าน write path ที่ mark dirty)"""
+    return (
+        arr[0]["stock_qty"],
+        frozenset(r["id"] for r in arr if not r["is_packed"] and not r["is_cancelled"]),
+    )
+
+
+def _is_sku_dirty(entry_seq: int, sku: str, arr: list[dict]) -> bool:
+    if entry_seq < _reset_seq or _dirty_skus.get(sku, 0) > entry_seq:
+        return True
+    return any(_dirty_orders.get(r["order_id"], 0) > entry_seq for r in arr)
+
+
+def _allocate_sku_rows(arr: list[dict], bill_empty_order_ids: set) -> None:
+    """วน Priority/FIFO ของ SKU เดียว แล้วเขียน allocation_status ลงในแต่ละแถว"""
+    # เรียงตาม Priority: Platform > Order Time (> id เพื่อให้ลำดับคงที่เมื่อรวมแถวจาก 2 query)
+    arr.sort(key=lambda x: (
+        PLATFORM_PRIORITY.get(x["platform"], 999), 
+        x["order_time"] or datetime.max,
+        x["id"],
+    ))
+    
+    # สต็อกเริ่มต้นของ SKU นี้
+    current_stock = arr[0]["stock_qty"]
+    
+    for r in arr:
+        # ข้อ 3: Order ที่ Packed หรือ Cancelled -> ไม่ดึง Qty มาคำนวณ (จบงานแล้ว)
+        if r["is_packed"]:
+            r["allocation_status"] = "PACKED"
+            continue
+        
+        if r["is_cancelled"]:
+            r["allocation_status"] = "CANCELLED"
+            continue
+        
+        # เช็ค BILL_EMPTY (ต้องเช็คก่อนคำนวณสถานะอื่น)
+        if r["order_id"] in bill_empty_order_ids:
+            r["allocation_status"] = "BILL_EMPTY"
+            continue
+        
+        # --- คำนวณสถานะก่อน (ยังไม่ดู Issued/Accepted) ---
+        req_qty = r["qty"]
+        calculated_status = ""
+        
+        if current_stock <= 0:
+            calculated_status = "SHORTAGE"
+        elif current_stock < req_qty:
+            calculated_status = "NOT_ENOUGH"
+        else:
+            # สต็อกพอ -> ถ้าเหลือน้อยเป็น LOW_STOCK
+            if current_stock - req_qty <= 3:
+                calculated_status = "LOW_STOCK"
+            else:
+                calculated_status = "READY_ACCEPT"
+        
+        # --- บันทึกสถานะ และ ตัดสต็อก ---
+        
+        # [แก้ไข] ย้ายเช็ค Accepted ขึ้นมาก่อน Issued
+        # เพื่อให้ถ้ากดรับแล้ว สถานะต้องเป็น "ACCEPTED" (รับแล้ว) เท่านั้น
+        if r["accepted"]:
+            r["allocation_status"] = "ACCEPTED"
+            # ตัดสต็อกเฉพาะกรณีของพอ
+            if calculated_status in ["READY_ACCEPT", "LOW_STOCK"]:
+                current_stock -= req_qty
+            continue
+        
+        # ถ้า Issued (จ่ายแล้ว) -> คงสถานะที่คำนวณได้ไว้ (เช่น LOW_STOCK, SHORTAGE)
+        # และทำการตัดสต็อก (ถ้าของพอ) เพื่อจองของ
+        if r["is_issued"]:
+            r["allocation_status"] = calculated_status  # เก็บสถานะจริงไว้
+            # ตัดสต็อกเฉพาะกรณีของพอ (READY_ACCEPT หรือ LOW_STOCK)
+            if calculated_status in ["READY_ACCEPT", "LOW_STOCK"]:
+                current_stock -= req_qty
+            continue
+        
+        # --- Order ใหม่ / ยังไม่ดำเนินการ ---
+        if calculated_status in ["SHORTAGE", "NOT_ENOUGH"]:
+            r["allocation_status"] = calculated_status
+            # ของไม่พอ ไม่ตัดสต็อก
+        else:
+            r["allocation_status"] = calculated_status
+            current_stock -= req_qty  # ของพอ จองของไว้
+
+
+def _allocate_incremental(scope: tuple, by_sku: dict, bill_empty_order_ids: set, seq_at_start: int) -> int:
+    """จัดสรรสต็อกราย SKU โดยใช้ผลเดิมซ้ำถ้า SKU ไม่ dirty; คืนจำนวน SKU ที่คำนวณใหม่
+    seq_at_start = _dirty_seq ก่อนอ่านข้อมูลจาก DB (mark ที่เกิดระหว่างอ่าน จะทำให้ผลรอบนี้ dirty ในรอบถัดไป)"""
+    with _state_lock:
+        state = _sku_state.setdefault(scope, {})
+
+    dirty: list[tuple] = []
+    for sku, arr in by_sku.items():
+        sig = _sku_signature(arr)
+        entry = state.get(sku)
+        if entry is not None and entry[1] == sig and not _is_sku_dirty(entry[0], sku, arr):
+            cached = entry[2]
+            for r in arr:
+                status = cached.get(r["id"])
+                if status is None:
+                    # แถว Packed/Cancelled ที่รอบก่อนไม่ได้โหลดมา (เช่นรอบ active_only)
+                    status = "PACKED" if r["is_packed"] else "CANCELLED"
+                r["allocation_status"] = status
+            continue
+        dirty.append((sku, sig, arr))
+
+    kernel = _columnar_kernel()
+    if kernel is not None and sum(len(arr) for _, _, arr in dirty) >= _KERNEL_MIN_ROWS:
+        kernel([r for _, _, arr in dirty for r in arr], bill_empty_order_ids)
+    else:
+        for _, _, arr in dirty:
+            _allocate_sku_rows(arr, bill_empty_order_ids)
+
+    for sku, sig, arr in dirty:
+        state[sku] = (seq_at_start, sig, {r["id"]: r["allocation_status"] for r in arr})
+    return len(dirty)
+
+# จำนวน SKU ต่อ 1 ก้อน IN (...) กันชนเพดานตัวแปรของ SQLite
+_SKU_CHUNK = 500
+
+
+# คอลัมน์ที่ compute_allocation ใช้ (แทนการโหลด OrderLine/Shop/Product/Stock/Sales ทั้ง Entity)
+# line = OrderLine หรือ OrderLineArchive (ชื่อคอลัมน์เดียวกัน)
+def _alloc_columns(line) -> tuple:
+    return (
+        line.id, line.order_id, line.sku, line.qty, line.item_name,
+        line.order_time, line.import_date, line.logistic_type,
+        line.accepted, line.accepted_at, line.accepted_by_username, line.dispatch_round,
+        line.printed_warehouse, line.printed_warehouse_at, line.printed_warehouse_by,
+        line.printed_picking, line.printed_picking_at, line.printed_picking_by,
+        Shop.id.label("shop_id"), Shop.platform, Shop.name.label("shop_name"),
+        Product.id.label("product_id"), Product.brand, Product.model,
+        Stock.qty.label("stock_qty"),
+        Sales.id.label("sales_id"), Sales.status.label("sales_status"), Sales.status_class.label("sales_class"),
+    )
+
+
+_ALLOC_COLUMNS = _alloc_columns(OrderLine)
+
+
+def _sales_class(status_class, status) -> str:
+    """Sales.status_class (จัดกลุ่มไว้ตอนนำเข้า) — แถวเก่าที่ยังไม่ backfill ให้จัดกลุ่มจากข้อความแทน"""
+    return status_class or classify_sales_status(status)
+
+
+def _has_window_filter(filters: dict) -> bool:
+    """มี Filter ช่วงเวลาที่ทำให้ "แถวที่แสดง" เป็นแค่ส่วนย่อยของข้อมูลหรือไม่"""
+    if filters.get("accepted_from") or filters.get("accepted_to"):
+        return True
+    if filters.get("active_only") or filters.get("all_time"):
+        return False
+    return any(filters.get(k) for k in ("import_from", "import_to", "import_date", "date_from", "date_to"))
+
+
+def _naive_dt(v) -> datetime:
+    """แปลงค่าใน Filter ให้เป็น datetime แบบไม่มีโซน (เวลาไทยตามที่เก็บใน DB)"""
+    if isinstance(v, datetime):
+        return v.replace(tzinfo=None)
+    return datetime.combine(v, time.min)
+
+
+def _as_date(v):
+    return v.date() if hasattr(v, "date") else v
+
+
+def _apply_window_sql(q, filters: dict, model=OrderLine):
+    """กรองช่วงเวลาใน SQL แบบ "ครอบคลุมกว่า" (superset) ของเงื่อนไขจริง
+    เงื่อนไขละเอียด (Timezone ฯลฯ) ยังตรวจซ้ำใน Loop เหมือนเดิม ผลลัพธ์จึงไม่เปลี่ยน
+    model = ตารางที่มีคอลัมน์ import_date / order_time / accepted_at (OrderLine หรือ AllocationResult)"""
+    slack = timedelta(days=1)
+    if not (filters.get("active_only") or filters.get("all_time")):
+        if filters.get("import_from"):
+            q = q.filter(model.import_date >= _as_date(filters["import_from"]))
+        if filters.get("import_to"):
+            q = q.filter(model.import_date <= _as_date(filters["import_to"]))
+        if filters.get("import_date"):
+            q = q.filter(model.import_date == filters["import_date"])
+        if filters.get("date_from"):
+            q = q.filter(model.order_time >= _naive_dt(filters["date_from"]) - slack)
+        if filters.get("date_to"):
+            q = q.filter(model.order_time < _naive_dt(filters["date_to"]) + slack)
+    if filters.get("accepted_from"):
+        q = q.filter(model.accepted_at >= _naive_dt(filters["accepted_from"]) - slack)
+    if filters.get("accepted_to"):
+        q = q.filter(model.accepted_at < _naive_dt(filters["accepted_to"]) + slack)
+    return q
+
+
+def _load_open_backlog(session, filters: dict, skus: set, skip_ids: set,
+                       cancelled_order_ids: set, issued_order_ids: set) -> list[AllocationRow]:
+    """Phase 1: โหลดเฉพาะคอลัมน์ที่ใช้ตัดสต็อก ของบรรทัดที่ยังเปิดอยู่ (ไม่ Packed/Cancelled)
+    ใน SKU ที่เกี่ยวข้อง แถวเหล่านี้ใช้คำนวณ FIFO/AllQty เท่านั้น ไม่แสดงผล"""
+    backlog = []
+    sku_list = sorted(skus)
+    for i in range(0, len(sku_list), _SKU_CHUNK):
+        chunk = sku_list[i:i + _SKU_CHUNK]
+        q = select(
+                OrderLine.id, OrderLine.order_id, OrderLine.sku, OrderLine.qty,
+                OrderLine.order_time, OrderLine.accepted, Shop.platform,
+                Stock.qty, Sales.id, Sales.status, Sales.status_class,
+            )\
+            .join(Shop, Shop.id==OrderLine.shop_id)\
+            .outerjoin(Stock, Stock.sku==OrderLine.sku)\
+            .outerjoin(Sales, Sales.order_id==OrderLine.order_id)\
+            .filter(OrderLine.sku.in_(chunk))
+        if filters.get("platform"):
+            q = q.filter(Shop.platform==filters["platform"])
+        if filters.get("shop_id"):
+            q = q.filter(Shop.id==filters["shop_id"])
+
+        for (line_id, order_id, sku, qty, order_time, accepted, platform,
+             stock_qty, sales_id, sales_status, sales_class) in session.execute(q):
+            if line_id in skip_ids or order_id in cancelled_order_ids:
+                continue
+            if sales_id is not None and _sales_class(sales_class, sales_status) == SALES_PACKED:
+                continue
+            backlog.append(AllocationRow({
+                "id": line_id,
+                "platform": platform,
+                "order_id": order_id,
+                "sku": sku,
+                "stock_qty": int(stock_qty) if stock_qty is not None else 0,
+                "qty": int(qty or 0),
+                "order_time": order_time,
+                "accepted": bool(accepted),
+                "is_packed": False,
+                "is_cancelled": False,
+                "is_issued": order_id in issued_order_ids,
+                "allocation_status": "",
+                "show_in_view": False,
+            }))
+    return backlog
+
+
+def _passes_date_filters(import_date, order_time, filters: dict) -> bool:
+    """เงื่อนไขช่วงวันที่นำเข้า/วันที่สั่ง (ใช้ทั้งใน compute_allocation และ AllocationSnapshot)"""
+    # ถ้าเป็นโหมดดูงานค้าง/ทั้งหมด ไม่ต้องเช็ควันที่
+    if filters.get("active_only") or filters.get("all_time"):
+        return True
+
+    # [แก้ไข] เตรียมตัวแปรเวลา Order ให้มี Timezone (ถ้ายังไม่มี) เพื่อให้เทียบกับ Filter ได้
+    current_order_time = order_time
+    if current_order_time and current_order_time.tzinfo is None:
+        # ถ้าเวลาจาก DB ไม่มีโซน ให้ใส่โซนไทยเข้าไป (TH_TZ)
+        current_order_time = current_order_time.replace(tzinfo=TH_TZ)
+
+    # กรอง Import Date (เทียบเป็น date object)
+    ol_imp_date = import_date
+    # แปลง datetime เป็น date ถ้าจำเป็น
+    if hasattr(ol_imp_date, 'date'):
+        ol_imp_date = ol_imp_date.date()
+
+    if filters.get("import_from"):
+        imp_from_val = filters["import_from"]
+        if hasattr(imp_from_val, 'date'):
+            imp_from_val = imp_from_val.date()
+        if not ol_imp_date or ol_imp_date < imp_from_val:
+            return False
+
+    if filters.get("import_to"):
+        imp_to_val = filters["import_to"]
+        if hasattr(imp_to_val, 'date'):
+            imp_to_val = imp_to_val.date()
+        if not ol_imp_date or ol_imp_date > imp_to_val:
+            return False
+
+    # รองรับ key เก่า
+    if filters.get("import_date") and import_date != filters["import_date"]:
+        return False
+
+    # [แก้ไข] กรอง Order Date (ใช้ current_order_time ที่แก้ Timezone แล้ว)
+    if filters.get("date_from"):
+        if not current_order_time or current_order_time < filters["date_from"]:
+            return False
+
+    if filters.get("date_to"):
+        if not current_order_time or current_order_time >= filters["date_to"]:
+            return False
+
+    return True
+
+
+def _passes_accepted_filters(accepted_at, filters: dict) -> bool:
+    """เงื่อนไขช่วงวันที่กดรับ (Accepted Date) แบบ Timezone-Safe"""
+    if not (filters.get("accepted_from") or filters.get("accepted_to")):
+        return True
+
+    # ดึงเวลาจาก DB และทำให้เป็น Naive (ไม่มีโซน) เพื่อเทียบกันได้
+    acc_at = accepted_at
+    if acc_at and acc_at.tzinfo:
+        acc_at = acc_at.replace(tzinfo=None)
+
+    # เตรียมเวลาจาก Filter และทำให้เป็น Naive เหมือนกัน
+    limit_from = filters.get("accepted_from")
+    if limit_from and hasattr(limit_from, 'tzinfo') and limit_from.tzinfo:
+        limit_from = limit_from.replace(tzinfo=None)
+
+    limit_to = filters.get("accepted_to")
+    if limit_to and hasattr(limit_to, 'tzinfo') and limit_to.tzinfo:
+        limit_to = limit_to.replace(tzinfo=None)
+
+    # เริ่มเปรียบเทียบ
+    if limit_from and (not acc_at or acc_at < limit_from):
+        return False
+    if limit_to and (not acc_at or acc_at >= limit_to):
+        return False
+    return True
+
+
+def _compute_kpis(final_rows: list[AllocationRow]) -> dict:
+    """KPI ของแถวที่แสดงผล (final_rows)"""
+    all_active_rows = [r for r in final_rows if not r["is_packed"] and not r["is_cancelled"]]
+    unique_active_orders = set(r["order_id"] for r in all_active_rows)
+    
+    orders_ready_actionable = set(r["order_id"] for r in all_active_rows 
+                                  if r["allocation_status"] == "READY_ACCEPT" 
+                                  and not r["accepted"] 
+                                  and not r["is_issued"])
+    
+    orders_low_actionable = set(r["order_id"] for r in all_active_rows 
+                                if r["allocation_status"] == "LOW_STOCK" 
+                                and not r["accepted"] 
+                                and not r["is_issued"])
+
+    kpis = {
+        "total_items": len(final_rows),
+        "total_qty": sum(r["qty"] for r in final_rows),
+        "orders_total": len(set(r["order_id"] for r in final_rows if r["order_id"])),
+        "orders_unique": len(unique_active_orders),
+        "ready": sum(1 for r in final_rows if r["allocation_status"]=="READY_ACCEPT"),
+        "accepted": sum(1 for r in final_rows if r["allocation_status"]=="ACCEPTED"),
+        "low": sum(1 for r in final_rows if r["allocation_status"]=="LOW_STOCK"),
+        "nostock": sum(1 for r in final_rows if r["allocation_status"]=="SHORTAGE"),
+        "notenough": sum(1 for r in final_rows if r["allocation_status"]=="NOT_ENOUGH"),
+        "packed": sum(1 for r in final_rows if r["allocation_status"]=="PACKED"),
+        "orders_ready": len(orders_ready_actionable),
+        "orders_low": len(orders_low_actionable),
+        "orders_cancelled": len(set(r["order_id"] for r in final_rows if r["is_cancelled"])),
+        "orders_not_in_sbs": len(set(r["order_id"] for r in final_rows if r.get("is_not_in_sbs"))),
+        "orders_nosales": len(set(r["order_id"] for r in final_rows if not r.get("is_not_in_sbs") and r.get("sales_status") == "ยังไม่มีการเปิดใบขาย")),
+    }
+    return kpis
+
+
+def _line_row(ol, cancelled_order_ids: set, issued_order_ids: set, show_this_row: bool,
+              active_only: bool = False) -> AllocationRow | None:
+    """แถวผลจัดสรร (ยังไม่มี allocation_status / allqty) จาก 1 แถวของ _alloc_columns()
+    active_only=True -> คืน None ถ้า Order จบงานแล้ว (Packed / Cancelled)"""
+    stock_qty = int(ol.stock_qty) if ol.stock_qty is not None else 0
+    brand = ol.brand if ol.product_id is not None else ""
+    model = ol.model if ol.product_id is not None else (ol.item_name or "")
+
+    # [แก้ไข] แยกแยะระหว่าง "ยังไม่นำเข้า SBS" กับ "ยังไม่มีการเปิดใบขาย"
+    is_not_in_sbs = False
+    if ol.sales_id is None:
+        # กรณีไม่มีข้อมูลในตาราง Sales เลย -> Order ยังไม่นำเข้า SBS
+        s_label = "Orderยังไม่นำเข้าSBS"
+        is_not_in_sbs = True
+    else:
+        # กรณีมีข้อมูล Sales แต่สถานะว่าง -> ยังไม่มีการเปิดใบขาย
+        s_label = ol.sales_status if ol.sales_status else "ยังไม่มีการเปิดใบขาย"
+
+    sla, due = sla_status(ol.platform, ol.order_time or now_thai())
+
+    # เช็คสถานะ Packed / เปิดใบขายครบ (ระวัง: ต้องไม่นับ "Orderยังไม่นำเข้าSBS" เป็น packed)
+    sales_class = None if is_not_in_sbs else _sales_class(ol.sales_class, ol.sales_status)
+    is_packed = sales_class == SALES_PACKED
+
+    is_cancelled = ol.order_id in cancelled_order_ids
+    is_issued = ol.order_id in issued_order_ids
+
+    # ถ้าเป็นโหมด active_only (ดูงานค้าง) ให้ข้ามพวกที่จบงานแล้วไปเลย
+    if active_only:
+        if is_packed or is_cancelled:
+            return None
+
+    # ถ้าผ่านเกณฑ์ หรือเป็น Order ที่ต้องใช้คำนวณสต็อก ให้สร้าง Object เตรียมไว้
+    return AllocationRow({
+        "id": ol.id,
+        "platform": ol.platform,
+        "shop": ol.shop_name,
+        "shop_id": ol.shop_id,
+        "order_id": ol.order_id,
+        "sku": ol.sku,
+        "brand": brand,
+        "model": model,
+        "stock_qty": stock_qty,
+        "qty": int(ol.qty or 0),
+        "order_time": ol.order_time,
+        "order_time_iso": (ol.order_time.astimezone(TH_TZ).isoformat() if ol.order_time else ""),
+        "import_date": ol.import_date,  # [เพิ่ม] เพื่อให้ Dashboard รู้ว่านำเข้าวันไหน
+        "due_date": due,
+        "sla": sla,
+        "logistic": ol.logistic_type or "",
+        "sales_status": s_label,
+        "sales_class": sales_class,
+        "is_not_in_sbs": is_not_in_sbs,
+        "accepted": bool(ol.accepted),
+        "accepted_by": ol.accepted_by_username or "",
+        "accepted_at": ol.accepted_at,
+        "dispatch_round": ol.dispatch_round,
+        "printed_warehouse": ol.printed_warehouse,
+        "printed_warehouse_at": ol.printed_warehouse_at,
+        "printed_warehouse_by": ol.printed_warehouse_by,
+        "printed_picking": ol.printed_picking,
+        "printed_picking_at": ol.printed_picking_at,
+        "printed_picking_by": ol.printed_picking_by,
+        "is_packed": is_packed,
+        "is_cancelled": is_cancelled,
+        "is_issued": is_issued,
+        "allocation_status": "",
+        "show_in_view": show_this_row  # flag เพื่อบอกว่าแถวนี้ต้องแสดงในผลลัพธ์หรือไม่
+    })
+
+
+def _cache_key(session, filters: dict):
+    """key ของแคช (None = แคชไม่ได้ เช่นมีค่าใน filters ที่ hash ไม่ได้)"""
+    try:
+        fkey = tuple(sorted((k, v) for k, v in filters.items() if v is not None and v is not False))
+        hash(fkey)
+    except TypeError:
+        return None
+    return (str(session.get_bind().url), fkey, now_thai().date())
+
+
+def compute_allocation(session, filters: dict, fresh: bool = False):
+    """
+    ผลจัดสรรตาม filters (ผ่านแคชข้าม Request)
+    fresh=True = ข้ามแคชแล้วคำนวณจาก DB ทันที (ใช้กับ write path ที่ต้องตรวจสอบกับข้อมูลล่าสุด)
+    แถวที่คืนเป็นสำเนาเสมอ ผู้เรียกแก้ไขได้โดยไม่กระทบแคช
+    """
+    key = None if (fresh or _RESULT_CACHE_SIZE <= 0) else _cache_key(session, filters)
+    version = _data_version
+    if key is not None:
+        with _state_lock:
+            hit = _result_cache.get((version, key))
+            if hit is not None:
+                _result_cache.move_to_end((version, key))
+        if hit is not None:
+            rows, kpis = hit
+            return [r.copy() for r in rows], dict(kpis)
+
+    rows, kpis = _compute_allocation_uncached(session, filters)
+
+    if key is not None:
+        with _state_lock:
+            # ถ้าระหว่างคำนวณมีการเขียนข้อมูล (version เปลี่ยน) ไม่ต้องเก็บผลนี้
+            if version == _data_version:
+                _result_cache[(version, key)] = ([r.copy() for r in rows], dict(kpis))
+                while len(_result_cache) > _RESULT_CACHE_SIZE:
+                    _result_cache.popitem(last=False)
+    return rows, kpis
+
+
+def _compute_allocation_uncached(session, filters:dict):
     """
     คืน list ของ dict ครบทุกคอลัมน์ที่จอ Dashboard ต้องใช้
 
@@ -24,8 +590,12 @@ def compute_allocation(session, filters:dict):
     logger = logging.getLogger(__name__)
     logger.info(f"🔧 compute_allocation called with filters: {filters}")
 
-    # Query ข้อมูล Order ทั้งหมด
-    q = session.query(OrderLine, Shop, Product, Stock, Sales)\
+    # ลำดับ mark ก่อน query แรก: ผลที่เก็บใน _sku_state ต้องไม่ใหม่กว่าข้อมูลที่อ่านได้
+    with _state_lock:
+        seq_at_start = _dirty_seq
+
+    # Query ข้อมูล Order ทั้งหมด (เลือกเฉพาะคอลัมน์ที่ใช้ -> ได้ Row tuple ไม่สร้าง ORM object / ไม่เข้า identity map)
+    q = select(*_ALLOC_COLUMNS)\
         .join(Shop, Shop.id==OrderLine.shop_id)\
         .outerjoin(Product, Product.sku==OrderLine.sku)\
         .outerjoin(Stock, Stock.sku==OrderLine.sku)\
@@ -37,8 +607,13 @@ def compute_allocation(session, filters:dict):
     if filters.get("shop_id"):
         q = q.filter(Shop.id==filters["shop_id"])
     
-    # [แก้ไขหลัก] ไม่กรองวันที่ใน SQL เพื่อให้โหลด Order ค้างเก่ามาคำนวณสต็อกด้วยเสมอ
-    # (เราจะไปกรองวันที่ใน Loop ด้านล่างแทน)
+    # [แก้ไขหลัก] ถ้ามีช่วงวันที่ ใช้แผน 2 ขั้น:
+    #   Phase 2 (query นี้) = โหลดแถวเต็มเฉพาะที่เข้าช่วงวันที่ (กรองหยาบใน SQL, กรองละเอียดใน Loop)
+    #   Phase 1 (_load_open_backlog) = โหลด Order ค้างของ SKU เดียวกันแบบคอลัมน์น้อย เพื่อตัดสต็อกให้ครบ
+    # ถ้าไม่มีช่วงวันที่ โหลดทั้งหมดเหมือนเดิม
+    windowed = _has_window_filter(filters)
+    if windowed:
+        q = _apply_window_sql(q, filters)
 
     # ดึงรายการ Order ที่ยกเลิก (จากตาราง cancelled_orders)
     cancelled_order_ids = set()
@@ -70,156 +645,40 @@ def compute_allocation(session, filters:dict):
     rows = []
 
     # เรียงลำดับเวลา เพื่อให้ FIFO (First-In-First-Out) ทำงานถูกต้อง
-    all_data = q.order_by(OrderLine.order_time.asc()).all()
+    all_data = session.execute(q.order_by(OrderLine.order_time.asc(), OrderLine.id.asc()))
 
     # Debug: count filters
     filtered_by_date = 0
     total_rows_checked = 0
 
-    for ol, shop, prod, stock, sales in all_data:
+    for ol in all_data:
         # --- ตรวจสอบเงื่อนไขการแสดงผล (Filter) ใน Python ---
-        show_this_row = True
         total_rows_checked += 1
-
-        # [แก้ไข] เตรียมตัวแปรเวลา Order ให้มี Timezone (ถ้ายังไม่มี) เพื่อให้เทียบกับ Filter ได้
-        current_order_time = ol.order_time
-        if current_order_time and current_order_time.tzinfo is None:
-            # ถ้าเวลาจาก DB ไม่มีโซน ให้ใส่โซนไทยเข้าไป (TH_TZ)
-            current_order_time = current_order_time.replace(tzinfo=TH_TZ)
-
-        # ถ้าไม่ใช่โหมดดูงานค้าง/ทั้งหมด (คือมีการระบุวันที่) ให้เช็ควันที่
-        was_shown_before_date_filter = show_this_row
-        if not (filters.get("active_only") or filters.get("all_time")):
-            # กรอง Import Date (เทียบเป็น date object)
-            if filters.get("import_from"):
-                imp_from_val = filters["import_from"]
-                ol_imp_date = ol.import_date
-                # แปลง datetime เป็น date ถ้าจำเป็น
-                if hasattr(imp_from_val, 'date'):
-                    imp_from_val = imp_from_val.date()
-                if hasattr(ol_imp_date, 'date'):
-                    ol_imp_date = ol_imp_date.date()
-                if not ol_imp_date or ol_imp_date < imp_from_val:
-                    show_this_row = False
-
-            if filters.get("import_to"):
-                imp_to_val = filters["import_to"]
-                ol_imp_date = ol.import_date
-                # แปลง datetime เป็น date ถ้าจำเป็น
-                if hasattr(imp_to_val, 'date'):
-                    imp_to_val = imp_to_val.date()
-                if hasattr(ol_imp_date, 'date'):
-                    ol_imp_date = ol_imp_date.date()
-                if not ol_imp_date or ol_imp_date > imp_to_val:
-                    show_this_row = False
-
-            # รองรับ key เก่า
-            if filters.get("import_date") and ol.import_date != filters["import_date"]:
-                show_this_row = False
-
-            # [แก้ไข] กรอง Order Date (ใช้ current_order_time ที่แก้ Timezone แล้ว)
-            if filters.get("date_from"):
-                if not current_order_time or current_order_time < filters["date_from"]:
-                    show_this_row = False
-
-            if filters.get("date_to"):
-                if not current_order_time or current_order_time >= filters["date_to"]:
-                    show_this_row = False
+        show_this_row = _passes_date_filters(ol.import_date, ol.order_time, filters)
 
         # Track filtering
-        if was_shown_before_date_filter and not show_this_row:
+        if not show_this_row:
             filtered_by_date += 1
 
         # --- กรองวันที่กดรับ (Accepted Date) แบบ Timezone-Safe ---
-        if filters.get("accepted_from") or filters.get("accepted_to"):
-            # ดึงเวลาจาก DB และทำให้เป็น Naive (ไม่มีโซน) เพื่อเทียบกันได้
-            acc_at = ol.accepted_at
-            if acc_at and acc_at.tzinfo:
-                acc_at = acc_at.replace(tzinfo=None)
-            
-            # เตรียมเวลาจาก Filter และทำให้เป็น Naive เหมือนกัน
-            limit_from = filters.get("accepted_from")
-            if limit_from and hasattr(limit_from, 'tzinfo') and limit_from.tzinfo:
-                limit_from = limit_from.replace(tzinfo=None)
-                
-            limit_to = filters.get("accepted_to")
-            if limit_to and hasattr(limit_to, 'tzinfo') and limit_to.tzinfo:
-                limit_to = limit_to.replace(tzinfo=None)
-
-            # เริ่มเปรียบเทียบ
-            if limit_from and (not acc_at or acc_at < limit_from): 
-                show_this_row = False
-            if limit_to and (not acc_at or acc_at >= limit_to): 
-                show_this_row = False
+        if not _passes_accepted_filters(ol.accepted_at, filters):
+            show_this_row = False
         # --- จบส่วนการกรอง ---
 
-        stock_qty = int(stock.qty) if stock and stock.qty is not None else 0
-        brand = prod.brand if prod else ""
-        model = prod.model if prod else (ol.item_name or "")
-        
-        # [แก้ไข] แยกแยะระหว่าง "ยังไม่นำเข้า SBS" กับ "ยังไม่มีการเปิดใบขาย"
-        is_not_in_sbs = False
-        if sales is None:
-            # กรณีไม่มีข้อมูลในตาราง Sales เลย -> Order ยังไม่นำเข้า SBS
-            s_label = "Orderยังไม่นำเข้าSBS"
-            is_not_in_sbs = True
-        else:
-            # กรณีมีข้อมูล Sales แต่สถานะว่าง -> ยังไม่มีการเปิดใบขาย
-            s_label = sales.status if sales.status else "ยังไม่มีการเปิดใบขาย"
-        
-        sla, due = sla_status(shop.platform, ol.order_time or now_thai())
-        
-        # เช็คสถานะ Packed / เปิดใบขายครบ (ระวัง: ต้องไม่นับ "Orderยังไม่นำเข้าSBS" เป็น packed)
-        is_packed = False
-        if s_label and not is_not_in_sbs:
-            s_lower = s_label.lower()
-            if any(keyword in s_lower for keyword in ["ครบตามจำนวน", "packed", "แพ็คแล้ว", "opened_full"]):
-                is_packed = True
-        
-        is_cancelled = ol.order_id in cancelled_order_ids
-        is_issued = ol.order_id in issued_order_ids
-        
-        # ถ้าเป็นโหมด active_only (ดูงานค้าง) ให้ข้ามพวกที่จบงานแล้วไปเลย
-        if filters.get("active_only"):
-            if is_packed or is_cancelled:
-                continue
-        
-        # ถ้าผ่านเกณฑ์ หรือเป็น Order ที่ต้องใช้คำนวณสต็อก ให้สร้าง Object เตรียมไว้
-        row_data = {
-            "id": ol.id,
-            "platform": shop.platform,
-            "shop": shop.name,
-            "shop_id": shop.id,
-            "order_id": ol.order_id,
-            "sku": ol.sku,
-            "brand": brand,
-            "model": model,
-            "stock_qty": stock_qty,
-            "qty": int(ol.qty or 0),
-            "order_time": ol.order_time,
-            "order_time_iso": (ol.order_time.astimezone(TH_TZ).isoformat() if ol.order_time else ""),
-            "import_date": ol.import_date,  # [เพิ่ม] เพื่อให้ Dashboard รู้ว่านำเข้าวันไหน
-            "due_date": due,
-            "sla": sla,
-            "logistic": ol.logistic_type or "",
-            "sales_status": s_label,
-            "is_not_in_sbs": is_not_in_sbs,
-            "accepted": bool(ol.accepted),
-            "accepted_by": ol.accepted_by_username or "",
-            "dispatch_round": ol.dispatch_round if hasattr(ol, 'dispatch_round') else None,
-            "printed_warehouse": ol.printed_warehouse if hasattr(ol, 'printed_warehouse') else 0,
-            "printed_warehouse_at": ol.printed_warehouse_at if hasattr(ol, 'printed_warehouse_at') else None,
-            "printed_warehouse_by": ol.printed_warehouse_by if hasattr(ol, 'printed_warehouse_by') else None,
-            "printed_picking": ol.printed_picking if hasattr(ol, 'printed_picking') else 0,
-            "printed_picking_at": ol.printed_picking_at if hasattr(ol, 'printed_picking_at') else None,
-            "printed_picking_by": ol.printed_picking_by if hasattr(ol, 'printed_picking_by') else None,
-            "is_packed": is_packed,
-            "is_cancelled": is_cancelled,
-            "is_issued": is_issued,
-            "allocation_status": "", 
-            "show_in_view": show_this_row  # flag เพื่อบอกว่าแถวนี้ต้องแสดงในผลลัพธ์หรือไม่
-        }
-        rows.append(row_data)
+        row_data = _line_row(ol, cancelled_order_ids, issued_order_ids, show_this_row,
+                             active_only=bool(filters.get("active_only")))
+        if row_data is not None:
+            rows.append(row_data)
+
+    # Phase 1: เติม Order ค้างของ SKU ที่เกี่ยวข้อง (นอกช่วงวันที่) เพื่อให้ FIFO/AllQty เหมือนโหลดทั้งหมด
+    if windowed and rows:
+        rows.extend(_load_open_backlog(
+            session, filters,
+            skus={r["sku"] for r in rows},
+            skip_ids={r["id"] for r in rows},
+            cancelled_order_ids=cancelled_order_ids,
+            issued_order_ids=issued_order_ids,
+        ))
 
     # คำนวณ AllQty (ยอดรวมที่ต้องใช้ต่อ SKU) - นับเฉพาะที่ยังไม่ Packed/Cancelled
     sku_total = defaultdict(int)
@@ -235,114 +694,105 @@ def compute_allocation(session, filters:dict):
     for r in rows:
         by_sku[r["sku"]].append(r)
     
-    for sku, arr in by_sku.items():
-        # เรียงตาม Priority: Platform > Order Time
-        arr.sort(key=lambda x: (
-            PLATFORM_PRIORITY.get(x["platform"], 999), 
-            x["order_time"] or datetime.max
-        ))
-        
-        # สต็อกเริ่มต้นของ SKU นี้
-        current_stock = arr[0]["stock_qty"]
-        
-        for r in arr:
-            # ข้อ 3: Order ที่ Packed หรือ Cancelled -> ไม่ดึง Qty มาคำนวณ (จบงานแล้ว)
-            if r["is_packed"]:
-                r["allocation_status"] = "PACKED"
-                continue
-            
-            if r["is_cancelled"]:
-                r["allocation_status"] = "CANCELLED"
-                continue
-            
-            # เช็ค BILL_EMPTY (ต้องเช็คก่อนคำนวณสถานะอื่น)
-            if r["order_id"] in bill_empty_order_ids:
-                r["allocation_status"] = "BILL_EMPTY"
-                continue
-            
-            # --- คำนวณสถานะก่อน (ยังไม่ดู Issued/Accepted) ---
-            req_qty = r["qty"]
-            calculated_status = ""
-            
-            if current_stock <= 0:
-                calculated_status = "SHORTAGE"
-            elif current_stock < req_qty:
-                calculated_status = "NOT_ENOUGH"
-            else:
-                # สต็อกพอ -> ถ้าเหลือน้อยเป็น LOW_STOCK
-                if current_stock - req_qty <= 3:
-                    calculated_status = "LOW_STOCK"
-                else:
-                    calculated_status = "READY_ACCEPT"
-            
-            # --- บันทึกสถานะ และ ตัดสต็อก ---
-            
-            # [แก้ไข] ย้ายเช็ค Accepted ขึ้นมาก่อน Issued
-            # เพื่อให้ถ้ากดรับแล้ว สถานะต้องเป็น "ACCEPTED" (รับแล้ว) เท่านั้น
-            if r["accepted"]:
-                r["allocation_status"] = "ACCEPTED"
-                # ตัดสต็อกเฉพาะกรณีของพอ
-                if calculated_status in ["READY_ACCEPT", "LOW_STOCK"]:
-                    current_stock -= req_qty
-                continue
-            
-            # ถ้า Issued (จ่ายแล้ว) -> คงสถานะที่คำนวณได้ไว้ (เช่น LOW_STOCK, SHORTAGE)
-            # และทำการตัดสต็อก (ถ้าของพอ) เพื่อจองของ
-            if r["is_issued"]:
-                r["allocation_status"] = calculated_status  # เก็บสถานะจริงไว้
-                # ตัดสต็อกเฉพาะกรณีของพอ (READY_ACCEPT หรือ LOW_STOCK)
-                if calculated_status in ["READY_ACCEPT", "LOW_STOCK"]:
-                    current_stock -= req_qty
-                continue
-            
-            # --- Order ใหม่ / ยังไม่ดำเนินการ ---
-            if calculated_status in ["SHORTAGE", "NOT_ENOUGH"]:
-                r["allocation_status"] = calculated_status
-                # ของไม่พอ ไม่ตัดสต็อก
-            else:
-                r["allocation_status"] = calculated_status
-                current_stock -= req_qty  # ของพอ จองของไว้
+    scope = (filters.get("platform"), filters.get("shop_id"))
+    recomputed_skus = _allocate_incremental(scope, by_sku, bill_empty_order_ids, seq_at_start)
 
     # --- คัดกรองแถวที่จะส่งออก (เฉพาะที่ตรงกับ Filter) ---
     final_rows = [r for r in rows if r["show_in_view"]]
 
     # --- KPI (คำนวณจาก final_rows ที่แสดงผล) ---
-    all_active_rows = [r for r in final_rows if not r["is_packed"] and not r["is_cancelled"]]
-    unique_active_orders = set(r["order_id"] for r in all_active_rows)
-    
-    orders_ready_actionable = set(r["order_id"] for r in all_active_rows 
-                                  if r["allocation_status"] == "READY_ACCEPT" 
-                                  and not r["accepted"] 
-                                  and not r["is_issued"])
-    
-    orders_low_actionable = set(r["order_id"] for r in all_active_rows 
-                                if r["allocation_status"] == "LOW_STOCK" 
-                                and not r["accepted"] 
-                                and not r["is_issued"])
-
-    kpis = {
-        "total_items": len(final_rows),
-        "total_qty": sum(r["qty"] for r in final_rows),
-        "orders_total": len(set(r["order_id"] for r in final_rows if r["order_id"])),
-        "orders_unique": len(unique_active_orders),
-        "ready": sum(1 for r in final_rows if r["allocation_status"]=="READY_ACCEPT"),
-        "accepted": sum(1 for r in final_rows if r["allocation_status"]=="ACCEPTED"),
-        "low": sum(1 for r in final_rows if r["allocation_status"]=="LOW_STOCK"),
-        "nostock": sum(1 for r in final_rows if r["allocation_status"]=="SHORTAGE"),
-        "notenough": sum(1 for r in final_rows if r["allocation_status"]=="NOT_ENOUGH"),
-        "packed": sum(1 for r in final_rows if r["allocation_status"]=="PACKED"),
-        "orders_ready": len(orders_ready_actionable),
-        "orders_low": len(orders_low_actionable),
-        "orders_cancelled": len(set(r["order_id"] for r in final_rows if r["is_cancelled"])),
-        "orders_not_in_sbs": len(set(r["order_id"] for r in final_rows if r.get("is_not_in_sbs"))),
-        "orders_nosales": len(set(r["order_id"] for r in final_rows if not r.get("is_not_in_sbs") and r.get("sales_status") == "ยังไม่มีการเปิดใบขาย")),
-    }
+    kpis = _compute_kpis(final_rows)
 
     # Debug logging
     logger.info(f"📊 compute_allocation returning {len(final_rows)} rows")
     logger.info(f"   Total rows checked: {total_rows_checked}, Filtered by date: {filtered_by_date}")
+    logger.info(f"   SKUs re-allocated: {recomputed_skus}/{len(by_sku)}")
     if filters.get("date_from") or filters.get("date_to"):
         logger.info(f"   Date range filter: {filters.get('date_from')} to {filters.get('date_to')}")
         logger.info(f"   Unique orders: {len(set(r['order_id'] for r in final_rows))}")
 
-    return final_rows, kpis
\ No newline at end of file
+    return final_rows, kpis
+
+
+def archived_rows(session, filters: dict, order_ids) -> list[AllocationRow]:
+    """แถวของ Order ที่ย้ายไป order_lines_archive แล้ว (order_archive.py) ในรูปเดียวกับผล compute_allocation
+    Order ในคลังจบงานแล้ว (Packed / Cancelled) ไม่ตัดสต็อก จึงไม่ต้องจัดสรร allqty = 0 (ผู้เรียกเติมเองได้)
+    ใช้ platform / shop_id / ช่วงวันที่ / วันที่กดรับ ของ filters เหมือน compute_allocation"""
+    line = OrderLineArchive
+    oids = sorted({str(o).strip() for o in order_ids if o})
+    rows = []
+    for i in range(0, len(oids), _SKU_CHUNK):
+        chunk = oids[i:i + _SKU_CHUNK]
+        in_chunk = {"oids": chunk}
+        cancelled = set(session.execute(
+            text("SELECT order_id FROM cancelled_orders WHERE order_id IN :oids")
+            .bindparams(bindparam("oids", expanding=True)), in_chunk).scalars())
+        issued = set(session.execute(
+            text("SELECT order_id FROM issued_orders WHERE order_id IN :oids")
+            .bindparams(bindparam("oids", expanding=True)), in_chunk).scalars())
+
+        q = select(*_alloc_columns(line))\
+            .join(Shop, Shop.id==line.shop_id)\
+            .outerjoin(Product, Product.sku==line.sku)\
+            .outerjoin(Stock, Stock.sku==line.sku)\
+            .outerjoin(Sales, Sales.order_id==line.order_id)\
+            .filter(line.order_id.in_(chunk))
+        if filters.get("platform"):
+            q = q.filter(Shop.platform==filters["platform"])
+        if filters.get("shop_id"):
+            q = q.filter(Shop.id==filters["shop_id"])
+
+        for ol in session.execute(q.order_by(line.order_time.asc(), line.id.asc())):
+            if not (_passes_date_filters(ol.import_date, ol.order_time, filters)
+                    and _passes_accepted_filters(ol.accepted_at, filters)):
+                continue
+            r = _line_row(ol, cancelled, issued, True)
+            r["allocation_status"] = "CANCELLED" if r["is_cancelled"] and not r["is_packed"] else "PACKED"
+            r["allqty"] = 0
+            rows.append(r)
+    return rows
+
+
+class AllocationSnapshot:
+    """
+    ผลจัดสรรของทั้ง Scope (platform/shop) คำนวณครั้งเดียวแบบ all_time
+    แล้วเลือกแถวตาม Filter ต่างๆ ใน memory ได้หลายครั้ง (ผล FIFO เหมือนเรียก compute_allocation ทีละครั้ง
+    เพราะ Filter วันที่มีผลแค่ "แถวที่แสดง" ไม่มีผลกับการตัดสต็อก)
+    """
+
+    def __init__(self, session, base_filters: dict):
+        self.base_filters = {
+            "platform": base_filters.get("platform"),
+            "shop_id": base_filters.get("shop_id"),
+        }
+        self.rows, _ = compute_allocation(session, {**self.base_filters, "all_time": True, "active_only": False})
+        self._stock_map = None
+        # ค่าที่คำนวณจาก Snapshot แล้วใช้ซ้ำได้ภายใน Request เดียวกัน (เช่น packed_oids)
+        self.memo: dict = {}
+
+    def select(self, filters: dict):
+        """คืน (rows, kpis) แบบเดียวกับ compute_allocation(session, filters) ภายใน Scope เดียวกัน
+        แถวที่คืนเป็นสำเนา (ผู้เรียกแก้ไขได้โดยไม่กระทบ Snapshot)"""
+        active_only = filters.get("active_only")
+        rows = []
+        for r in self.rows:
+            if active_only and (r["is_packed"] or r["is_cancelled"]):
+                continue
+            if not _passes_date_filters(r["import_date"], r["order_time"], filters):
+                continue
+            if not _passes_accepted_filters(r["accepted_at"], filters):
+                continue
+            rows.append(r.copy())
+        return rows, _compute_kpis(rows)
+
+    def rows_for_orders(self, order_ids) -> list[AllocationRow]:
+        """สำเนาแถวทั้งหมดของ Order ที่ระบุ (ไม่สนวันที่)"""
+        oids = set(order_ids)
+        return [r.copy() for r in self.rows if r["order_id"] in oids]
+
+    @property
+    def stock_map(self) -> dict[str, int]:
+        """{sku: stock_qty} ของทุก SKU ใน Snapshot"""
+        if self._stock_map is None:
+            self._stock_map = {r["sku"]: r["stock_qty"] for r in self.rows if r.get("sku")}
+        return self._stock_map
@@ -0,0 +1,180 @@
+# allocation_kernel.py
+"""
+Kernel จัดสรรสต็อกแบบ Columnar (NumPy) — ให้ผลเหมือน allocation._allocate_sku_rows ทุกแถว
+
+ใช้แทน Loop ราย SKU เมื่อ Backlog ใหญ่ (เลือกด้วย env ALLOC_KERNEL=numpy)
+
+หลักการ:
+- เรียงทุกแถวครั้งเดียวด้วย lexsort (sku, priority, order_time, id)
+- แถว Packed / Cancelled / บิลเปล่า ไม่ตัดสต็อก -> ตัดออกจากการคำนวณ
+- แถวที่เหลือ "ตัดสต็อก" ก็ต่อเมื่อ สต็อกก่อนถึงแถว > 0 และ >= qty (ไม่ขึ้นกับ Accepted/Issued)
+- กฎ NOT_ENOUGH (ข้ามแต่ไม่ตัดสต็อก) ทำให้ cumsum รอบเดียวไม่พอ จึงคำนวณเป็นรอบ:
+    1) สมมติทุกแถวที่ยังไม่ตัดสินตัดสต็อก -> grouped cumsum -> สต็อกก่อนถึงแต่ละแถว
+    2) แถวก่อน "แถวแรกที่ไม่ผ่าน" ของแต่ละ SKU ถูกต้องแน่นอน -> ตัดสินเป็น READY_ACCEPT / LOW_STOCK
+    3) แถวที่ไม่ผ่าน: สต็อก <= 0 -> SHORTAGE ทั้งหมดที่เหลือของ SKU (ไม่มีใครตัดสต็อกได้อีก)
+                    สต็อก > 0 แต่ไม่พอ -> NOT_ENOUGH ต่อเนื่องจนถึงแถวถัดไปที่ qty <= สต็อก
+    4) วนซ้ำกับแถวที่เหลือด้วยสต็อกคงเหลือใหม่
+  จำนวนรอบ = จำนวนช่วง NOT_ENOUGH ที่สลับกับแถวที่ตัดได้ (ไม่ใช่จำนวนแถว)
+"""
+
+from datetime import datetime, timedelta, timezone
+from operator import itemgetter
+
+import numpy as np
+
+from utils import PLATFORM_PRIORITY
+
+# รหัสสถานะภายใน Kernel (index ของ STATUSES)
+STATUSES = np.array([
+    "READY_ACCEPT", "LOW_STOCK", "SHORTAGE", "NOT_ENOUGH",
+    "ACCEPTED", "PACKED", "CANCELLED", "BILL_EMPTY",
+], dtype=object)
+READY, LOW, SHORT, NOTENOUGH, ACCEPTED, PACKED, CANCELLED, BILL_EMPTY = range(8)
+
+# เหลือสต็อก <= ค่านี้หลังตัด -> LOW_STOCK (ตรงกับ Loop เดิม)
+LOW_STOCK_THRESHOLD = 3
+
+_MAX_KEY = np.iinfo(np.int64).max
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = _EPOCH.replace(tzinfo=timezone.utc)
+_ONE_US = timedelta(microseconds=1)
+
+
+def _time_key(dt) -> int:
+    """แปลง order_time เป็น int64 (ไมโครวินาที) ให้เรียงลำดับเหมือน datetime; None = ท้ายสุด"""
+    if dt is None:
+        return _MAX_KEY
+    if dt.tzinfo is not None:
+        return (dt - _EPOCH_UTC) // _ONE_US
+    return (dt - _EPOCH) // _ONE_US
+
+
+def _group_starts(keys: np.ndarray) -> np.ndarray:
+    """ตำแหน่งเริ่มของแต่ละกลุ่ม (keys ต้องเรียงแล้ว)"""
+    if keys.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+
+def allocate_columns(sku_code, priority, order_key, row_id, qty, stock,
+                     packed, cancelled, bill_empty, accepted, issued) -> np.ndarray:
+    """
+    คำนวณ allocation_status จากข้อมูลแบบคอลัมน์ (ทุกอาร์เรย์ยาวเท่ากัน = จำนวนแถว)
+
+    Args:
+        sku_code:  int รหัส SKU (แถวที่ SKU เดียวกันต้องรหัสเดียวกัน)
+        priority:  int ลำดับ Platform (น้อย = ก่อน)
+        order_key: int64 เวลาสั่ง (ดู _time_key)
+        row_id:    int id ของแถว (ตัวตัดสินลำดับสุดท้าย)
+        qty:       int จำนวนที่สั่ง
+        stock:     int สต็อกตั้งต้นของ SKU (ใช้ค่าของแถวแรกตามลำดับ Priority เหมือน Loop เดิม)
+        packed/cancelled/bill_empty/accepted/issued: bool flags
+
+    Returns:
+        np.ndarray(dtype=object) ของสถานะ เรียงตามลำดับแถวที่ส่งเข้ามา
+    """
+    sku_code = np.asarray(sku_code, dtype=np.int64)
+    n = sku_code.size
+    out = np.full(n, READY, dtype=np.int8)
+    if n == 0:
+        return STATUSES[out]
+
+    qty = np.asarray(qty, dtype=np.int64)
+    packed = np.asarray(packed, dtype=bool)
+    cancelled = np.asarray(cancelled, dtype=bool)
+    bill_empty = np.asarray(bill_empty, dtype=bool)
+
+    order = np.lexsort((
+        np.asarray(row_id, dtype=np.int64),
+        np.asarray(order_key, dtype=np.int64),
+        np.asarray(priority, dtype=np.int64),
+        sku_code,
+    ))
+    s_sku = sku_code[order]
+
+    # สต็อกตั้งต้น = ค่าของแถวแรก (ตามลำดับ) ของแต่ละ SKU
+    starts = _group_starts(s_sku)
+    _, sku_idx = np.unique(s_sku, return_inverse=True)
+    remaining = np.asarray(stock, dtype=np.int64)[order][starts].copy()
+
+    # สถานะที่ตัดสินได้ทันที (ลำดับการเช็คเหมือน Loop: Packed > Cancelled > บิลเปล่า)
+    s_packed, s_cancelled, s_bill = packed[order], cancelled[order], bill_empty[order]
+    s_status = np.full(n, -1, dtype=np.int8)
+    s_status[s_bill] = BILL_EMPTY
+    s_status[s_cancelled] = CANCELLED
+    s_status[s_packed] = PACKED
+
+    s_qty = qty[order]
+    pending = np.flatnonzero(s_status < 0)
+
+    while pending.size:
+        g = sku_idx[pending]
+        q = s_qty[pending]
+        m = pending.size
+        pos = np.arange(m)
+
+        # stock_before = remaining - (ผลรวม qty ของแถวก่อนหน้าใน SKU เดียวกัน)
+        cs = np.cumsum(q)
+        g_starts = _group_starts(g)
+        g_len = np.diff(np.r_[g_starts, m])
+        base = np.repeat(cs[g_starts] - q[g_starts], g_len)
+        before = remaining[g] - (cs - q - base)
+
+        fail = (before <= 0) | (before < q)
+        first_fail = np.minimum.reduceat(np.where(fail, pos, m), g_starts)
+        first_fail_row = np.repeat(first_fail, g_len)
+
+        # 2) แถวก่อนแถวแรกที่ไม่ผ่าน -> ตัดสต็อก
+        ok = pos < first_fail_row
+        left = before[ok] - q[ok]
+        s_status[pending[ok]] = np.where(left <= LOW_STOCK_THRESHOLD, LOW, READY)
+        np.subtract.at(remaining, g[ok], q[ok])
+
+        # 3) แถวแรกที่ไม่ผ่านของแต่ละ SKU: สต็อกก่อนถึงแถวนี้แม่นยำ (แถวก่อนหน้าตัดสต็อกหมดแล้ว)
+        has_fail = first_fail < m
+        if not has_fail.any():
+            break
+        fail_stock = before[np.minimum(first_fail, m - 1)]
+        row_has = np.repeat(has_fail, g_len)
+        row_stock = np.repeat(fail_stock, g_len)
+        #    สต็อก <= 0 -> ไม่มีใครตัดได้อีก: ที่เหลือของ SKU เป็น SHORTAGE ทั้งหมด
+        #    สต็อก > 0  -> NOT_ENOUGH ต่อเนื่องจนถึงแถวถัดไปที่ qty <= สต็อก
+        resume = row_has & (pos > first_fail_row) & (row_stock > 0) & (q <= row_stock)
+        stop = np.minimum.reduceat(np.where(resume, pos, m), g_starts)
+        row_stop = np.repeat(stop, g_len)
+        skip = row_has & (pos >= first_fail_row) & (pos < row_stop)
+        s_status[pending[skip]] = np.where(row_stock[skip] <= 0, SHORT, NOTENOUGH)
+
+        pending = pending[s_status[pending] < 0]
+
+    # Accepted -> แสดง ACCEPTED (การตัดสต็อกเหมือนเดิม), Issued -> คงสถานะที่คำนวณได้
+    s_accepted = np.asarray(accepted, dtype=bool)[order]
+    s_status[(s_status <= NOTENOUGH) & s_accepted] = ACCEPTED
+
+    out[order] = s_status
+    return STATUSES[out]
+
+
+def allocate_rows(rows: list[dict], bill_empty_order_ids: set) -> None:
+    """
+    จัดสรรสต็อกให้ row dict หลาย SKU พร้อมกัน (รูปแบบเดียวกับ compute_allocation)
+    แล้วเขียน allocation_status ลงในแต่ละแถว
+    """
+    if not rows:
+        return
+    sku_codes: dict[str, int] = {}
+    statuses = allocate_columns(
+        sku_code=[sku_codes.setdefault(sku, len(sku_codes)) for sku in map(itemgetter("sku"), rows)],
+        priority=[PLATFORM_PRIORITY.get(p, 999) for p in map(itemgetter("platform"), rows)],
+        order_key=[_time_key(t) for t in map(itemgetter("order_time"), rows)],
+        row_id=list(map(itemgetter("id"), rows)),
+        qty=list(map(itemgetter("qty"), rows)),
+        stock=list(map(itemgetter("stock_qty"), rows)),
+        packed=list(map(itemgetter("is_packed"), rows)),
+        cancelled=list(map(itemgetter("is_cancelled"), rows)),
+        bill_empty=[oid in bill_empty_order_ids for oid in map(itemgetter("order_id"), rows)],
+        accepted=list(map(itemgetter("accepted"), rows)),
+        issued=list(map(itemgetter("is_issued"), rows)),
+    )
+    for r, st in zip(rows, statuses):
+        r["allocation_status"] = st
@@ -0,0 +1,139 @@
+# allocation_row.py
+"""
+AllocationRow: แถวผลจัดสรร 1 บรรทัด (แทน dict ~35 key)
+
+- ฟิลด์หลัก (FIELDS) เก็บเป็น list ช่องเดียวใน __slots__ -> หน่วยความจำราว ครึ่งหนึ่งของ dict
+  และ copy() เป็นการคัดลอก list ระดับ C (เร็วพอๆ กับ dict(r))
+- ค่าที่แต่ละหน้าเติมเพิ่ม (scanned_at, is_deleted, cancel_reason ฯลฯ) เก็บใน extras (dict แยก สร้างเมื่อใช้ครั้งแรก)
+- ใช้ได้ทั้งแบบ Mapping (r["sku"], r.get("sku"), "sku" in r, dict(r)) และแบบ Attribute (r.sku)
+  Jinja: {{ r.sku }} / {{ r["scanned_at"] }} / {{ r.scanned_at }} ใช้ได้หมด
+"""
+
+from collections.abc import MutableMapping
+from operator import itemgetter
+
+# ลำดับเดียวกับ dict เดิมของ compute_allocation (ลำดับ key ตอน iterate ไม่เปลี่ยน)
+FIELDS = (
+    "id", "platform", "shop", "shop_id", "order_id", "sku", "brand", "model",
+    "stock_qty", "qty", "order_time", "order_time_iso", "import_date", "due_date", "sla",
+    "logistic", "sales_status", "sales_class", "is_not_in_sbs", "accepted", "accepted_by", "accepted_at",
+    "dispatch_round", "printed_warehouse", "printed_warehouse_at", "printed_warehouse_by",
+    "printed_picking", "printed_picking_at", "printed_picking_by",
+    "is_packed", "is_cancelled", "is_issued", "allocation_status", "show_in_view", "allqty",
+)
+_INDEX = {name: i for i, name in enumerate(FIELDS)}
+
+# ค่าของฟิลด์หลักที่ถูกลบ (del r[key]) -> ถือว่าไม่มี key นี้ เหมือน dict
+_MISSING = object()
+
+
+class AllocationRow(MutableMapping):
+    __slots__ = ("_vals", "_extra")
+
+    def __init__(self, data=(), **kwargs):
+        self._vals = [_MISSING] * len(FIELDS)
+        self._extra = None
+        if data:
+            self.update(data)
+        if kwargs:
+            self.update(kwargs)
+
+    # ---------- Mapping ----------
+    def __getitem__(self, key):
+        i = _INDEX.get(key)
+        if i is not None:
+            v = self._vals[i]
+            if v is not _MISSING:
+                return v
+        elif self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        i = _INDEX.get(key)
+        if i is not None:
+            self._vals[i] = value
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        i = _INDEX.get(key)
+        if i is not None and self._vals[i] is not _MISSING:
+            self._vals[i] = _MISSING
+        elif i is None and self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        i = _INDEX.get(key)
+        if i is not None:
+            return self._vals[i] is not _MISSING
+        return self._extra is not None and key in self._extra
+
+    def get(self, key, default=None):
+        i = _INDEX.get(key)
+        if i is not None:
+            v = self._vals[i]
+            return default if v is _MISSING else v
+        if self._extra is not None:
+            return self._extra.get(key, default)
+        return default
+
+    def __iter__(self):
+        for name, v in zip(FIELDS, self._vals):
+            if v is not _MISSING:
+                yield name
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        n = len(FIELDS) - self._vals.count(_MISSING)
+        return n + (len(self._extra) if self._extra else 0)
+
+    # ---------- helpers ----------
+    @property
+    def extras(self) -> dict:
+        """ค่าเสริมรายหน้า (ไม่ใช่ฟิลด์หลัก)"""
+        if self._extra is None:
+            self._extra = {}
+        return self._extra
+
+    @classmethod
+    def from_values(cls, values) -> "AllocationRow":
+        """สร้างจากค่าตามลำดับ FIELDS (เช่นแถวจากตาราง allocation_results)"""
+        new = cls.__new__(cls)
+        new._vals = list(values)
+        new._extra = None
+        return new
+
+    def copy(self) -> "AllocationRow":
+        new = AllocationRow.__new__(AllocationRow)
+        new._vals = self._vals.copy()
+        new._extra = dict(self._extra) if self._extra else None
+        return new
+
+    def __repr__(self):
+        return f"AllocationRow({dict(self)!r})"
+
+
+def _field_property(i: int, name: str):
+    getter = itemgetter(i)
+
+    def fget(self):
+        v = getter(self._vals)
+        if v is _MISSING:
+            raise AttributeError(name)
+        return v
+
+    def fset(self, value):
+        self._vals[i] = value
+
+    return property(fget, fset, doc=name)
+
+
+for _i, _name in enumerate(FIELDS):
+    setattr(AllocationRow, _name, _field_property(_i, _name))
+del _i, _name
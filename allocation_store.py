@@ -0,0 +1,252 @@
+# allocation_store.py
+"""
+Materialized allocation results (ตาราง allocation_results)
+
+- Refresher เบื้องหลังคำนวณ compute_allocation (all_time ต่อ Scope platform/shop) แล้วเขียนลงตาราง
+  ตื่นเมื่อ data version เปลี่ยน (bump_data_version) และเช็คซ้ำทุก ALLOC_REFRESH_INTERVAL วินาที
+- หน้า Dashboard / Report / Export (report_snapshot) อ่านผลด้วย SELECT (WHERE ตาม index / ORDER BY seq)
+  แทนการคำนวณสดทุก Request
+- refresh เขียนเฉพาะแถวที่ผลเปลี่ยน (hash ของรอบก่อนเก็บใน process) ไม่ลบ/เขียนทั้ง Scope ทุกครั้งที่ version เปลี่ยน
+  ยอมให้ผลช้ากว่าข้อมูลจริงได้ไม่เกิน ALLOC_MAX_STALE วินาที ถ้าเกินจะกลับไปใช้ AllocationSnapshot (คำนวณสด)
+- ทางเขียนที่ต้องการความสดเสมอ (กดรับ / พิมพ์) ยังเรียก compute_allocation(..., fresh=True) เหมือนเดิม
+
+เปิดใช้ด้วย ALLOC_MATERIALIZED=1 (ค่าเริ่มต้นปิด)
+"""
+
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import select as sa_select
+
+from allocation import (
+    AllocationSnapshot, compute_allocation, data_version, on_data_version_change,
+    _apply_window_sql, _compute_kpis, _has_window_filter,
+    _passes_accepted_filters, _passes_date_filters,
+)
+from allocation_row import AllocationRow, FIELDS
+from models import AllocationResult
+from utils import now_thai
+
+logger = logging.getLogger(__name__)
+
+_MAX_STALE = float(os.environ.get("ALLOC_MAX_STALE", "10") or 0)
+_REFRESH_INTERVAL = float(os.environ.get("ALLOC_REFRESH_INTERVAL", "30") or 30)
+_DEBOUNCE = 0.5  # รวมการเขียนที่มาติดๆ กันให้ refresh ครั้งเดียว
+
+_TABLE = AllocationResult.__table__
+# คอลัมน์ตามลำดับ FIELDS (FIELDS[0] = "id" -> line_id)
+_ROW_COLUMNS = [_TABLE.c.line_id] + [_TABLE.c[name] for name in FIELDS[1:]]
+
+# Scope ที่ Refresher ต้องดูแล -> {"version", "day", "refreshed"} ของรอบล่าสุดที่เขียนลงตาราง
+_lock = threading.Lock()
+_wanted: set[tuple] = {("", 0)}
+_scope_state: dict[tuple, dict] = {}
+_wake = threading.Event()
+
+on_data_version_change(_wake.set)
+
+
+def enabled() -> bool:
+    """อ่านจาก env ทุกครั้ง (ค่าจาก .env ถูกโหลดหลัง import โมดูลนี้)"""
+    return (os.environ.get("ALLOC_MATERIALIZED") or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _scope_key(base_filters: dict) -> tuple:
+    return (base_filters.get("platform") or "", int(base_filters.get("shop_id") or 0))
+
+
+def _is_fresh(scope: tuple) -> bool:
+    state = _scope_state.get(scope)
+    if state is None or state["day"] != now_thai().date():
+        return False
+    return state["version"] == data_version() or time.monotonic() - state["refreshed"] <= _MAX_STALE
+
+
+def refresh_scope(session, scope: tuple) -> int:
+    """คำนวณผลจัดสรรของ Scope แล้วเขียนลงตาราง (ใน Transaction เดียว) คืนจำนวนแถวที่เขียน
+    รอบแรกของ process แทนที่ทั้ง Scope รอบถัดไปเขียนเฉพาะแถวที่ค่าเปลี่ยน (เทียบ hash กับรอบก่อน)
+    -> POST ที่ไม่กระทบผลจัดสรร (เช่นสแกน) ไม่เขียนตารางเลย"""
+    platform, shop_id = scope
+    version = data_version()
+    day = now_thai().date()
+    rows, _ = compute_allocation(session, {
+        "platform": platform or None,
+        "shop_id": shop_id or None,
+        "all_time": True,
+        "active_only": False,
+    })
+    computed_at = now_thai()
+    hashes = {r["id"]: hash((i, *(r.get(name) for name in FIELDS[1:]))) for i, r in enumerate(rows)}
+    url = str(session.get_bind().url)
+    state = _scope_state.get(scope) or {}
+    prev = state.get("hashes") if state.get("url") == url else None
+    where = (_TABLE.c.scope_platform == platform, _TABLE.c.scope_shop_id == shop_id)
+    if prev is None:
+        session.execute(_TABLE.delete().where(*where))
+        changed = list(enumerate(rows))
+    else:
+        changed = [(i, r) for i, r in enumerate(rows) if prev.get(r["id"]) != hashes[r["id"]]]
+        stale = [lid for lid in prev if lid not in hashes] + [r["id"] for _, r in changed if r["id"] in prev]
+        for i in range(0, len(stale), 500):
+            session.execute(_TABLE.delete().where(*where, _TABLE.c.line_id.in_(stale[i:i + 500])))
+    if changed:
+        session.execute(_TABLE.insert(), [
+            {
+                "scope_platform": platform,
+                "scope_shop_id": shop_id,
+                "line_id": r["id"],
+                "seq": i,
+                **{name: r.get(name) for name in FIELDS[1:]},
+                "computed_at": computed_at,
+            }
+            for i, r in changed
+        ])
+    session.commit()
+    with _lock:
+        # version ที่อ่านก่อนคำนวณ: ถ้ามีการเขียนระหว่างนั้น รอบถัดไปจะ refresh ซ้ำเอง
+        _scope_state[scope] = {"version": version, "day": day, "refreshed": time.monotonic(),
+                               "url": url, "hashes": hashes}
+    return len(changed)
+
+
+def refresh_stale(session) -> int:
+    """refresh ทุก Scope ที่ผลในตารางไม่ตรงกับ data version / วันที่ปัจจุบัน คืนจำนวน Scope ที่ refresh"""
+    with _lock:
+        scopes = sorted(_wanted)
+    today = now_thai().date()
+    done = 0
+    for scope in scopes:
+        state = _scope_state.get(scope)
+        if state is not None and state["version"] == data_version() and state["day"] == today:
+            continue
+        try:
+            refresh_scope(session, scope)
+            done += 1
+        except Exception:
+            session.rollback()
+            logger.exception(f"[allocation_results] refresh failed for scope {scope}")
+    return done
+
+
+def materialized_snapshot(session, base_filters: dict):
+    """MaterializedSnapshot ของ Scope ถ้าผลในตารางสดพอ ไม่งั้นคืน None (ผู้เรียกใช้ AllocationSnapshot แทน)
+    Scope ที่ยังไม่เคยถูกขอจะถูกเพิ่มให้ Refresher ดูแลตั้งแต่ครั้งแรกที่ถูกขอ"""
+    if not enabled():
+        return None
+    scope = _scope_key(base_filters)
+    with _lock:
+        if scope not in _wanted:
+            _wanted.add(scope)
+            _wake.set()
+        fresh = _is_fresh(scope)
+    return MaterializedSnapshot(session, base_filters) if fresh else None
+
+
+def report_snapshot(session, base_filters: dict) -> AllocationSnapshot:
+    """Snapshot สำหรับทางอ่านอย่างเดียว: MaterializedSnapshot ถ้าสดพอ ไม่งั้น AllocationSnapshot (คำนวณสด)"""
+    return materialized_snapshot(session, base_filters) or AllocationSnapshot(session, base_filters)
+
+
+class MaterializedSnapshot(AllocationSnapshot):
+    """AllocationSnapshot ที่อ่านแถวจากตาราง allocation_results แทนการคำนวณสด"""
+
+    def __init__(self, session, base_filters: dict):
+        self.session = session
+        self.base_filters = {
+            "platform": base_filters.get("platform"),
+            "shop_id": base_filters.get("shop_id"),
+        }
+        self.scope = _scope_key(base_filters)
+        self._rows = None
+        self._stock_map = None
+        self.memo: dict = {}
+
+    def _query(self):
+        platform, shop_id = self.scope
+        return sa_select(*_ROW_COLUMNS).where(
+            _TABLE.c.scope_platform == platform, _TABLE.c.scope_shop_id == shop_id,
+        )
+
+    def _fetch(self, q) -> list[AllocationRow]:
+        return [AllocationRow.from_values(rec) for rec in self.session.execute(q.order_by(_TABLE.c.seq))]
+
+    @property
+    def rows(self) -> list[AllocationRow]:
+        if self._rows is None:
+            self._rows = self._fetch(self._query())
+        return self._rows
+
+    def select(self, filters: dict):
+        """เหมือน AllocationSnapshot.select แต่กรองด้วย SQL (index ของ allocation_results)"""
+        q = self._query()
+        if filters.get("active_only"):
+            q = q.where(_TABLE.c.is_packed.is_(False), _TABLE.c.is_cancelled.is_(False))
+        if not _has_window_filter(filters):
+            rows = self._fetch(q)
+        else:
+            # SQL กรองแบบครอบคลุมกว่า -> ตรวจเงื่อนไขละเอียดซ้ำเหมือน AllocationSnapshot
+            rows = [
+                r for r in self._fetch(_apply_window_sql(q, filters, model=AllocationResult))
+                if _passes_date_filters(r["import_date"], r["order_time"], filters)
+                and _passes_accepted_filters(r["accepted_at"], filters)
+            ]
+        return rows, _compute_kpis(rows)
+
+    def rows_for_orders(self, order_ids) -> list[AllocationRow]:
+        oids = sorted(set(order_ids))
+        if not oids:
+            return []
+        platform, shop_id = self.scope
+        recs = []
+        for i in range(0, len(oids), 500):
+            q = sa_select(_TABLE.c.seq, *_ROW_COLUMNS).where(
+                _TABLE.c.scope_platform == platform, _TABLE.c.scope_shop_id == shop_id,
+                _TABLE.c.order_id.in_(oids[i:i + 500]),
+            )
+            recs.extend(self.session.execute(q))
+        recs.sort(key=lambda rec: rec[0])
+        return [AllocationRow.from_values(rec[1:]) for rec in recs]
+
+    @property
+    def stock_map(self) -> dict[str, int]:
+        if self._stock_map is None:
+            platform, shop_id = self.scope
+            q = sa_select(_TABLE.c.sku, _TABLE.c.stock_qty).distinct().where(
+                _TABLE.c.scope_platform == platform, _TABLE.c.scope_shop_id == shop_id,
+                _TABLE.c.sku.isnot(None), _TABLE.c.sku != "",
+            )
+            self._stock_map = {sku: qty for sku, qty in self.session.execute(q)}
+        return self._stock_map
+
+
+class AllocationRefresher(threading.Thread):
+    """Thread เบื้องหลังที่ทำให้ allocation_results ตามทัน data version"""
+
+    def __init__(self, app, interval: float = _REFRESH_INTERVAL):
+        super().__init__(name="allocation-refresher", daemon=True)
+        self.app = app
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        _wake.set()
+
+    def run(self):
+        from models import db
+
+        _wake.set()  # refresh รอบแรกทันทีที่เริ่ม
+        while not self._stop_event.is_set():
+            _wake.wait(timeout=self.interval)
+            if self._stop_event.wait(_DEBOUNCE):
+                break
+            _wake.clear()
+            with self.app.app_context():
+                try:
+                    n = refresh_stale(db.session)
+                    if n:
+                        logger.info(f"[allocation_results] refreshed {n} scope(s) @ version {data_version()}")
+                finally:
+                    db.session.remove()
@@ -1,7 +1,7 @@
 # app.py
 from __future__ import annotations
 
-import os, csv, json
+import os, csv, json, time
 from datetime import datetime, date, timedelta, timezone
 from io import BytesIO
 from functools import wraps
@@ -11,20 +11,40 @@ import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from flask import (
     Flask, render_template, request, redirect, url_for,
-    flash, send_file, jsonify, session
+    flash, send_file, jsonify, session, g, has_request_context
 )
+from markupsafe import escape
+from werkzeug.datastructures import FileStorage
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import func, text, or_, not_, and_
+from sqlalchemy import func, text, or_, not_, and_, inspect as sa_inspect
 from sqlalchemy.sql import bindparam
 from dotenv import load_dotenv
 
 from utils import (
     now_thai, to_thai_be, to_be_date_str, TH_TZ, current_be_year,
-    normalize_platform, sla_text, compute_due_date
+    normalize_platform, sla_text, compute_due_date,
+    SALES_PACKED, classify_sales_status,
 )
-from models import db, Shop, Product, Stock, Sales, OrderLine, User
-from importers import import_products, import_stock, import_sales, import_orders
-from allocation import compute_allocation
+from models import db, Shop, Product, Stock, Sales, OrderLine, OrderLineArchive, User
+from importers import (
+    import_products, import_stock, import_sales,
+    import_products_chunks, import_stock_chunks, import_sales_chunks, import_orders_chunks,
+    first_existing, COMMON_ORDER_ID,
+)
+from ingest import read_upload_chunks
+from allocation import (
+    compute_allocation, AllocationSnapshot, bump_data_version,
+    mark_all_dirty, mark_skus_dirty, mark_orders_dirty, archived_rows
+)
+import allocation_store
+import db_backend
+import db_indexes
+import db_tuning
+import import_cache
+import migrations
+import order_archive
+import gsheet_sync
+from services import import_jobs
 
 # โหลด environment variables จากไฟล์ .env (สำหรับ Local Development)
 load_dotenv()
@@ -113,10 +133,15 @@ def create_app():
         # Local development
         db_path = os.path.join(os.path.dirname(__file__), "data.db")
 
-    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+    # =========[ NEW ]========= PostgreSQL ผ่าน DATABASE_URL (ไม่ตั้ง = SQLite ไฟล์ data.db เหมือนเดิม)
+    app.config["SQLALCHEMY_DATABASE_URI"] = db_backend.database_uri(db_path)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = db_backend.engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
     db.init_app(app)
+    # =========[ NEW ]========= PRAGMA (WAL / busy_timeout / cache) ทุก connection ก่อนเปิด connection แรก
+    with app.app_context():
+        db_tuning.install(db.engine)
 
     # =========[ NEW ]=========
     # Model: ออเดอร์ที่ถูกทำเป็น "ยกเลิก"
@@ -170,6 +195,9 @@ def create_app():
         # เก็บ Batch Data (IDs ที่เพิ่ม/ซ้ำ/ไม่สำเร็จ) JSON String
         batch_data = db.Column(db.Text, nullable=True)
 
+        # sha256 ของไฟล์/ข้อมูลที่นำเข้า (import_cache) ใช้ตรวจไฟล์เดิมที่อัปโหลดซ้ำ
+        content_hash = db.Column(db.String(64), index=True)
+
         # แก้ไขให้ใช้ Thai timezone (GMT+7) แทน UTC
         created_at = db.Column(db.DateTime, default=lambda: datetime.now(TH_TZ))
     # =========[ /NEW ]=========
@@ -181,53 +209,90 @@ def create_app():
         except Exception:
             return getattr(OrderLine, "__tablename__", "order_lines")
 
+    # ---------- Helper: FROM ของ raw SQL บน order_lines (+ คลัง order_lines_archive สำหรับหน้าประวัติ) ----------
+    def _ol_source(include_archive: bool = False) -> str:
+        if not include_archive:
+            return _ol_table_name()
+        return order_archive.source(db.session.connection(), True)
+
+    def _archive_needed(kind: str, day_from=None) -> bool:
+        """ช่วงวันที่พิมพ์ (printed_{kind}) ที่เริ่ม day_from ต้องอ่านคลังด้วยหรือไม่ (None = ทุกวัน)"""
+        return order_archive.needs_archive(db.session.connection(), kind, day_from)
+
+    def _with_archived_print_days(days: list, kind: str) -> list:
+        """รายการวันที่พิมพ์ให้เลือก: order_lines + คลัง (วันที่ในคลังแคชไว้ใน order_archive)"""
+        archived = order_archive.print_days(db.session.connection(), kind)
+        if not archived:
+            return days
+        return sorted(set(days) | archived, key=lambda d: d or "", reverse=True)
+
+    def _archived_allocation_rows(order_ids, filters: dict, live_rows: list) -> list:
+        """แถวของ Order ในคลังที่ไม่อยู่ใน live_rows (ผล compute_allocation) allqty = ยอดงานค้างของ SKU จาก live_rows"""
+        live = {(r.get("order_id") or "").strip() for r in live_rows}
+        missing = [oid for oid in order_ids if oid not in live]
+        if not missing:
+            return []
+        rows = archived_rows(db.session, filters, missing)
+        allqty = {r["sku"]: r["allqty"] for r in live_rows}
+        for r in rows:
+            r["allqty"] = allqty.get(r["sku"], 0)
+        return rows
+
+    # ---------- Helper: วันที่ 'YYYY-MM-DD' ของคอลัมน์ printed_*_at (SQL ตาม dialect) ----------
+    def _sql_date(col: str) -> str:
+        return db_backend.iso_date_sql(col, db.engine.dialect.name)
+
+    # ---------- Helper: ค่า printed_*_at จาก raw SQL (SQLite = ข้อความ isoformat, PostgreSQL = datetime) ----------
+    def _db_datetime(value) -> datetime:
+        return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+    def _columns(con, table: str) -> set[str]:
+        return {c["name"] for c in sa_inspect(con).get_columns(table)}
+
     # ---------- Auto-migrate: ensure print columns exist ----------
-    def _ensure_orderline_print_columns():
+    def _ensure_orderline_print_columns(con):
         """Auto-migrate: เพิ่มคอลัมน์สำหรับติดตามสถานะการพิมพ์ Warehouse และ Picking"""
         tbl = _ol_table_name()
-        with db.engine.connect() as con:
-            cols = {row[1] for row in con.execute(text(f"PRAGMA table_info({tbl})")).fetchall()}
-
-            def add(col, ddl):
-                if col not in cols:
-                    con.execute(text(f"ALTER TABLE {tbl} ADD COLUMN {col} {ddl}"))
-
-            # สำหรับ "ใบงานคลัง (Warehouse Job Sheet)"
-            add("printed_warehouse", "INTEGER DEFAULT 0")  # จำนวนครั้งที่พิมพ์
-            add("printed_warehouse_at", "TEXT")  # timestamp ครั้งล่าสุด
-            add("printed_warehouse_by", "TEXT")  # username ผู้พิมพ์
-
-            # สำหรับ "Picking List"
-            add("printed_picking", "INTEGER DEFAULT 0")  # จำนวนครั้งที่พิมพ์
-            add("printed_picking_at", "TEXT")  # timestamp ครั้งล่าสุด
-            add("printed_picking_by", "TEXT")  # username ผู้พิมพ์
-
-            # สำหรับ "จ่ายงาน(รอบที่)"
-            add("dispatch_round", "INTEGER")
-
-            # สำหรับ "รายงานสินค้าน้อย" (แยกจากคลัง/Picking)
-            add("printed_lowstock", "INTEGER DEFAULT 0")
-            add("printed_lowstock_at", "TEXT")
-            add("printed_lowstock_by", "TEXT")
-            add("lowstock_round", "INTEGER")
-
-            # สำหรับ "รายงานไม่มีสินค้า" (แยกจาก lowstock)
-            add("printed_nostock", "INTEGER DEFAULT 0")
-            add("printed_nostock_at", "TEXT")
-            add("printed_nostock_by", "TEXT")
-            add("nostock_round", "INTEGER")
-
-            # สำหรับ "รายงานสินค้าไม่พอส่ง" (NOT_ENOUGH)
-            add("printed_notenough", "INTEGER DEFAULT 0")
-            add("printed_notenough_at", "TEXT")
-            add("printed_notenough_by", "TEXT")
-            add("notenough_round", "INTEGER")
-
-            # สำหรับ "Barcode Scan Check" (Warehouse)
-            add("scanned_at", "TEXT")
-            add("scanned_by", "TEXT")
-
-            con.commit()
+        cols = _columns(con, tbl)
+
+        def add(col, ddl):
+            if col not in cols:
+                con.execute(text(f"ALTER TABLE {tbl} ADD COLUMN {col} {ddl}"))
+
+        # สำหรับ "ใบงานคลัง (Warehouse Job Sheet)"
+        add("printed_warehouse", "INTEGER DEFAULT 0")  # จำนวนครั้งที่พิมพ์
+        add("printed_warehouse_at", "TEXT")  # timestamp ครั้งล่าสุด
+        add("printed_warehouse_by", "TEXT")  # username ผู้พิมพ์
+
+        # สำหรับ "Picking List"
+        add("printed_picking", "INTEGER DEFAULT 0")  # จำนวนครั้งที่พิมพ์
+        add("printed_picking_at", "TEXT")  # timestamp ครั้งล่าสุด
+        add("printed_picking_by", "TEXT")  # username ผู้พิมพ์
+
+        # สำหรับ "จ่ายงาน(รอบที่)"
+        add("dispatch_round", "INTEGER")
+
+        # สำหรับ "รายงานสินค้าน้อย" (แยกจากคลัง/Picking)
+        add("printed_lowstock", "INTEGER DEFAULT 0")
+        add("printed_lowstock_at", "TEXT")
+        add("printed_lowstock_by", "TEXT")
+        add("lowstock_round", "INTEGER")
+
+        # สำหรับ "รายงานไม่มีสินค้า" (แยกจาก lowstock)
+        add("printed_nostock", "INTEGER DEFAULT 0")
+        add("printed_nostock_at", "TEXT")
+        add("printed_nostock_by", "TEXT")
+        add("nostock_round", "INTEGER")
+
+        # สำหรับ "รายงานสินค้าไม่พอส่ง" (NOT_ENOUGH)
+        add("printed_notenough", "INTEGER DEFAULT 0")
+        add("printed_notenough_at", "TEXT")
+        add("printed_notenough_by", "TEXT")
+        add("notenough_round", "INTEGER")
+
+        # สำหรับ "Barcode Scan Check" (Warehouse)
+        add("scanned_at", "TEXT")
+        add("scanned_by", "TEXT")
 
     # ========== [NEW] Auto-migrate shops unique: (platform, name) ==========
     def _has_unique_index_on(conn, table: str, columns_exact: list[str]) -> tuple[bool, str | None]:
@@ -242,117 +307,163 @@ def create_app():
                 return True, idx_name
         return False, None
 
-    def _migrate_shops_unique_to_platform_name():
+    def _migrate_shops_unique_to_platform_name(con):
         """ย้าย unique จาก name เดี่ยว → เป็น (platform, name)"""
-        with db.engine.begin() as con:
-            has_composite, _ = _has_unique_index_on(con, "shops", ["platform", "name"])
-            if has_composite:
-                return
-            has_name_unique, idx_name = _has_unique_index_on(con, "shops", ["name"])
-            if has_name_unique:
-                is_auto = idx_name.startswith("sqlite_autoindex")
-                if is_auto:
-                    cols_info = con.execute(text("PRAGMA table_info(shops)")).fetchall()
-                    col_names = [c[1] for c in cols_info]
-                    has_created_at = "created_at" in col_names
-                    con.execute(text("ALTER TABLE shops RENAME TO shops_old"))
-                    create_sql = """
-                    CREATE TABLE shops (
-                        id INTEGER PRIMARY KEY,
-                        platform TEXT,
-                        name TEXT NOT NULL,
-                        created_at TEXT
-                    )
-                    """ if has_created_at else """
-                    CREATE TABLE shops (
-                        id INTEGER PRIMARY KEY,
-                        platform TEXT,
-                        name TEXT NOT NULL
-                    )
-                    """
-                    con.execute(text(create_sql))
-                    copy_cols = "id, platform, name" + (", created_at" if has_created_at else "")
-                    con.execute(text(f"INSERT INTO shops ({copy_cols}) SELECT {copy_cols} FROM shops_old"))
-                    con.execute(text("DROP TABLE shops_old"))
-                else:
-                    con.execute(text(f"DROP INDEX IF EXISTS {idx_name}"))
-            con.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_shops_platform_name ON shops(platform, name)"))
+        if con.dialect.name != "sqlite":
+            return  # ตาราง shops แบบเก่า (unique name เดี่ยว) มีเฉพาะใน SQLite ฐานใหม่ได้ uq_shops_platform_name จาก model
+        has_composite, _ = _has_unique_index_on(con, "shops", ["platform", "name"])
+        if has_composite:
+            return
+        has_name_unique, idx_name = _has_unique_index_on(con, "shops", ["name"])
+        if has_name_unique:
+            is_auto = idx_name.startswith("sqlite_autoindex")
+            if is_auto:
+                cols_info = con.execute(text("PRAGMA table_info(shops)")).fetchall()
+                col_names = [c[1] for c in cols_info]
+                has_created_at = "created_at" in col_names
+                con.execute(text("ALTER TABLE shops RENAME TO shops_old"))
+                create_sql = """
+                CREATE TABLE shops (
+                    id INTEGER PRIMARY KEY,
+                    platform TEXT,
+                    name TEXT NOT NULL,
+                    created_at TEXT
+                )
+                """ if has_created_at else """
+                CREATE TABLE shops (
+                    id INTEGER PRIMARY KEY,
+                    platform TEXT,
+                    name TEXT NOT NULL
+                )
+                """
+                con.execute(text(create_sql))
+                copy_cols = "id, platform, name" + (", created_at" if has_created_at else "")
+                con.execute(text(f"INSERT INTO shops ({copy_cols}) SELECT {copy_cols} FROM shops_old"))
+                con.execute(text("DROP TABLE shops_old"))
+            else:
+                con.execute(text(f"DROP INDEX IF EXISTS {idx_name}"))
+        con.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_shops_platform_name ON shops(platform, name)"))
     # ========== [/NEW] ==========
 
-    # =========[ NEW ]=========
-    def _ensure_issue_table():
-        try:
-            IssuedOrder.__table__.create(bind=db.engine, checkfirst=True)
-        except Exception as e:
-            app.logger.warning(f"[issued_orders] ensure table failed: {e}")
-    # =========[ /NEW ]=========
-
-    # =========[ NEW ]=========  ตารางเก็บ Order ที่ถูกลบ
-    def _ensure_deleted_table():
-        try:
-            DeletedOrder.__table__.create(bind=db.engine, checkfirst=True)
-        except Exception as e:
-            app.logger.warning(f"[deleted_orders] ensure table failed: {e}")
-    # =========[ /NEW ]=========
-
-    # =========[ NEW ]=========  ตารางเก็บประวัติการนำเข้า (Import Log)
-    def _ensure_import_log_table():
-        try:
-            ImportLog.__table__.create(bind=db.engine, checkfirst=True)
-        except Exception as e:
-            app.logger.warning(f"[import_logs] ensure table failed: {e}")
+    # =========[ NEW ]=========  ตารางตาม model ทั้งหมด (issued/deleted/cancelled_orders, import_logs ฯลฯ)
+    def _create_model_tables(con):
+        db.metadata.create_all(bind=con)
     # =========[ /NEW ]=========
 
     # =========[ NEW ]=========  ตาราง dedupe กัน request ซ้ำ (Idempotency)
-    def _ensure_action_dedupe_table():
+    def _ensure_action_dedupe_table(con):
         """Create a minimal dedupe table used to make actions idempotent (e.g., picking print)."""
-        try:
-            with db.engine.begin() as con:
-                con.execute(
-                    text(
-                        """
-                        CREATE TABLE IF NOT EXISTS action_dedupe (
-                            token TEXT PRIMARY KEY,
-                            kind TEXT NOT NULL,
-                            created_at TEXT NOT NULL,
-                            user_id INTEGER
-                        )
-                        """
-                    )
+        con.execute(
+            text(
+                """
+                CREATE TABLE IF NOT EXISTS action_dedupe (
+                    token TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    user_id INTEGER
                 )
-        except Exception as e:
-            app.logger.warning(f"[action_dedupe] ensure table failed: {e}")
+                """
+            )
+        )
     # =========[ /NEW ]=========
 
     # =========[ NEW ]=========  เพิ่มคอลัมน์ใหม่ให้ตาราง Shop และ ImportLog
-    def _ensure_shop_url_and_log_batch_columns():
-        """Auto-migrate: เพิ่มคอลัมน์ google_sheet_url ให้ Shop และ batch_data, shop_name, duplicates_same_day ให้ ImportLog"""
-        with db.engine.connect() as con:
-            # เพิ่ม google_sheet_url ให้ Shop
-            cols_shop = {row[1] for row in con.execute(text("PRAGMA table_info(shops)")).fetchall()}
-            if "google_sheet_url" not in cols_shop:
-                con.execute(text("ALTER TABLE shops ADD COLUMN google_sheet_url TEXT"))
-            
-            # เพิ่มคอลัมน์ให้ ImportLog
-            cols_log = {row[1] for row in con.execute(text("PRAGMA table_info(import_logs)")).fetchall()}
-            if "batch_data" not in cols_log:
-                con.execute(text("ALTER TABLE import_logs ADD COLUMN batch_data TEXT"))
-            if "shop_name" not in cols_log:
-                con.execute(text("ALTER TABLE import_logs ADD COLUMN shop_name TEXT"))
-            if "duplicates_same_day" not in cols_log:
-                con.execute(text("ALTER TABLE import_logs ADD COLUMN duplicates_same_day INTEGER DEFAULT 0"))
-            con.commit()
+    def _ensure_shop_url_and_log_batch_columns(con):
+        """Auto-migrate: เพิ่มคอลัมน์ google_sheet_url, google_sheet_cursor ให้ Shop และ batch_data, shop_name, duplicates_same_day, content_hash ให้ ImportLog"""
+        # เพิ่ม google_sheet_url ให้ Shop
+        cols_shop = _columns(con, "shops")
+        if "google_sheet_url" not in cols_shop:
+            con.execute(text("ALTER TABLE shops ADD COLUMN google_sheet_url TEXT"))
+        if "google_sheet_cursor" not in cols_shop:
+            # cursor ของการดึงออเดอร์จาก Sheet แบบเพิ่มเฉพาะแถวใหม่ (gsheet_sync)
+            con.execute(text("ALTER TABLE shops ADD COLUMN google_sheet_cursor TEXT"))
+        
+        # เพิ่มคอลัมน์ให้ ImportLog
+        cols_log = _columns(con, "import_logs")
+        if "batch_data" not in cols_log:
+            con.execute(text("ALTER TABLE import_logs ADD COLUMN batch_data TEXT"))
+        if "shop_name" not in cols_log:
+            con.execute(text("ALTER TABLE import_logs ADD COLUMN shop_name TEXT"))
+        if "duplicates_same_day" not in cols_log:
+            con.execute(text("ALTER TABLE import_logs ADD COLUMN duplicates_same_day INTEGER DEFAULT 0"))
+        if "content_hash" not in cols_log:
+            con.execute(text("ALTER TABLE import_logs ADD COLUMN content_hash VARCHAR(64)"))
+        con.execute(text("CREATE INDEX IF NOT EXISTS ix_import_logs_content_hash ON import_logs (content_hash)"))
+    # =========[ /NEW ]=========
+
+    # =========[ NEW ]=========  สถานะใบขายแบบ normalize (Sales.status_class)
+    def _ensure_sales_status_class(con):
+        """Auto-migrate: เพิ่มคอลัมน์ status_class ให้ sales + index แล้ว backfill แถวเก่าด้วย classify_sales_status"""
+        cols = _columns(con, "sales")
+        if "status_class" not in cols:
+            con.execute(text("ALTER TABLE sales ADD COLUMN status_class VARCHAR(16)"))
+        con.execute(text("CREATE INDEX IF NOT EXISTS ix_sales_status_class ON sales (status_class)"))
+        pending = con.execute(text("SELECT id, status FROM sales WHERE status_class IS NULL")).fetchall()
+        if pending:
+            con.execute(
+                text("UPDATE sales SET status_class = :c WHERE id = :id"),
+                [{"id": sid, "c": classify_sales_status(st)} for sid, st in pending],
+            )
+            app.logger.info(f"[sales] backfilled status_class for {len(pending)} rows")
+    # =========[ /NEW ]=========
+
+    # =========[ NEW ]=========  stocks.sku ต้องไม่ซ้ำ (import_stock ใช้ INSERT ... ON CONFLICT(sku))
+    def _ensure_stocks_sku_unique(con):
+        """Auto-migrate: ลบแถว SKU ซ้ำ (เก็บแถวแรกที่ import_stock เดิมอัปเดต) แล้วเปลี่ยน ix_stocks_sku เป็น UNIQUE"""
+        indexes = {ix["name"]: ix["unique"] for ix in sa_inspect(con).get_indexes("stocks")}
+        if indexes.get("ix_stocks_sku"):
+            return
+        dup = con.execute(text(
+            "DELETE FROM stocks WHERE id NOT IN (SELECT MIN(id) FROM stocks GROUP BY sku)"
+        )).rowcount
+        if dup:
+            app.logger.warning(f"[stocks] removed {dup} duplicate SKU rows")
+        con.execute(text("DROP INDEX IF EXISTS ix_stocks_sku"))
+        con.execute(text("CREATE UNIQUE INDEX ix_stocks_sku ON stocks (sku)"))
+    # =========[ /NEW ]=========
+
+    # =========[ NEW ]=========  index ของ query ที่ใช้บ่อย (order_id / sku / import_date / วันที่พิมพ์)
+    def _ensure_hot_query_indexes(con):
+        created = db_indexes.ensure_indexes(con)
+        if created:
+            app.logger.info(f"[indexes] created {', '.join(created)}")
+    # =========[ /NEW ]=========
+
+    # =========[ NEW ]=========  สถานะบิลเปล่า (เดิม ALTER ใน loop ของการนำเข้าบิลเปล่าทุกออเดอร์)
+    def _ensure_orderline_allocation_status(con):
+        tbl = _ol_table_name()
+        cols = _columns(con, tbl)
+        if "allocation_status" not in cols:
+            con.execute(text(f"ALTER TABLE {tbl} ADD COLUMN allocation_status TEXT"))
+    # =========[ /NEW ]=========
+
+    # =========[ NEW ]=========  คลัง Order ที่จบงานแล้ว (order_archive.py) คอลัมน์ครบเหมือน order_lines
+    def _create_order_lines_archive(con):
+        OrderLineArchive.__table__.create(bind=con, checkfirst=True)
+        order_archive.ensure_columns(con)
+    # =========[ /NEW ]=========
+
+    # =========[ NEW ]=========  migration แบบมีเวอร์ชัน: รันครั้งเดียวต่อฐานข้อมูล บันทึกใน schema_version
+    # ห้ามแก้/สลับขั้นที่ปล่อยไปแล้ว ให้เพิ่มขั้นใหม่ต่อท้าย (ฐานข้อมูลเดิมที่ไม่มี schema_version จะรันทุกขั้นหนึ่งรอบ)
+    SCHEMA_MIGRATIONS = (
+        migrations.Migration(1, "model_tables", _create_model_tables),
+        migrations.Migration(2, "orderline_print_columns", _ensure_orderline_print_columns),
+        migrations.Migration(3, "shops_unique_platform_name", _migrate_shops_unique_to_platform_name),
+        migrations.Migration(4, "action_dedupe_table", _ensure_action_dedupe_table),
+        migrations.Migration(5, "shop_url_and_log_batch_columns", _ensure_shop_url_and_log_batch_columns),
+        migrations.Migration(6, "sales_status_class", _ensure_sales_status_class),
+        migrations.Migration(7, "stocks_sku_unique", _ensure_stocks_sku_unique),
+        migrations.Migration(8, "hot_query_indexes", _ensure_hot_query_indexes),
+        migrations.Migration(9, "orderline_allocation_status", _ensure_orderline_allocation_status),
+        migrations.Migration(10, "order_lines_archive", _create_order_lines_archive),
+    )
     # =========[ /NEW ]=========
 
     with app.app_context():
-        db.create_all()
-        _ensure_orderline_print_columns()
-        _migrate_shops_unique_to_platform_name()
-        _ensure_issue_table()  # <<< NEW
-        _ensure_deleted_table()  # <<< NEW สำหรับ Soft Delete
-        _ensure_import_log_table()  # <<< NEW สำหรับ Import Dashboard
-        _ensure_action_dedupe_table()  # <<< NEW กันกด/ส่งซ้ำ
-        _ensure_shop_url_and_log_batch_columns()  # <<< NEW สำหรับบันทึก URL และ Batch Data
+        applied = migrations.run(db.engine, SCHEMA_MIGRATIONS)
+        if applied:
+            app.logger.info(f"[migrations] applied {applied}")
+        import_jobs.recover_interrupted()  # <<< NEW งานนำเข้าที่ค้างจากรอบก่อน
         # bootstrap admin
         if User.query.count() == 0:
             admin = User(
@@ -392,6 +503,15 @@ def create_app():
             "CURRENT_USER": current_user()
         }
 
+    # =========[ NEW ]=========
+    # Request ที่เขียนข้อมูล (POST/PUT/PATCH/DELETE) -> ทำให้แคชผลจัดสรรหมดอายุ
+    # (กันพลาด route ที่แก้ข้อมูลโดยไม่ได้เรียก mark_*_dirty)
+    @app.after_request
+    def _invalidate_allocation_cache(resp):
+        if request.method not in ("GET", "HEAD", "OPTIONS"):
+            bump_data_version()
+        return resp
+
     # ให้ template ตรวจ endpoint ได้ (กันพังค่า has_endpoint)
     @app.template_global()
     def has_endpoint(endpoint: str) -> bool:
@@ -464,6 +584,25 @@ def create_app():
         except Exception:
             return 0
 
+    # =========[ NEW ]=========
+    # Snapshot ผลจัดสรรต่อ Request: คำนวณ compute_allocation ครั้งเดียว (all_time ของ platform/shop)
+    # แล้วให้ทุก Branch / Helper ในหน้าเดียวกันกรองจาก Snapshot ใน memory
+    # ใช้กับทางอ่านอย่างเดียว (Dashboard / Report / Export) ส่วนกดรับ / พิมพ์ ใช้ compute_allocation(fresh=True)
+    def _allocation_snapshot(base_filters: dict) -> AllocationSnapshot:
+        snaps = g.setdefault("_alloc_snapshots", {})
+        key = (base_filters.get("platform") or None, base_filters.get("shop_id") or None)
+        snap = snaps.get(key)
+        if snap is None:
+            # ALLOC_MATERIALIZED=1: อ่านจากตาราง allocation_results ถ้าสดพอ ไม่งั้นคำนวณสด
+            snap = allocation_store.report_snapshot(db.session, base_filters)
+            snaps[key] = snap
+        return snap
+
+    def _request_snapshots() -> list[AllocationSnapshot]:
+        if not has_request_context():
+            return []
+        return list(g.get("_alloc_snapshots", {}).values())
+
     # ========== [NEW] Performance Optimization: Batch Stock Lookup ==========
     def _batch_stock_lookup(skus: set[str]) -> dict[str, int]:
         """
@@ -481,9 +620,17 @@ def create_app():
 
         stock_map: dict[str, int] = {}
 
+        # ใช้ Stock จาก Snapshot ของ Request นี้ก่อน (ถ้ามี)
+        for snap in _request_snapshots():
+            for sku in skus - set(stock_map.keys()):
+                if sku in snap.stock_map:
+                    stock_map[sku] = snap.stock_map[sku]
+        if len(stock_map) == len(skus):
+            return stock_map
+
         # Try Product table first (if it has stock_qty column)
         try:
-            products = Product.query.filter(Product.sku.in_(skus)).all()
+            products = Product.query.filter(Product.sku.in_(skus - set(stock_map.keys()))).all()
             for prod in products:
                 if prod and hasattr(prod, "stock_qty"):
                     try:
@@ -783,17 +930,25 @@ def create_app():
     # Packed helpers — จาก "เปิดใบขายครบตามจำนวนแล้ว"
     # ===========================================================
     def _is_line_opened_full(r: dict) -> bool:
-        text_pool = [
-            str(r.get("sale_status") or ""),
-            str(r.get("sale_text") or ""),
-            str(r.get("sales_status") or ""),
-            str(r.get("sales_note") or ""),
-        ]
-        norm = " ".join(s.strip() for s in text_pool if s).lower()
-        flag = bool(r.get("sale_open_full") or r.get("opened_full") or r.get("is_opened_full"))
-        return flag or ("เปิดใบขายครบตามจำนวนแล้ว" in norm) or ("opened_full" in norm)
-
-    def _orders_packed_set(rows: list[dict]) -> set[str]:
+        """บรรทัดที่ใบขายเปิดครบ/แพ็คแล้ว (Sales.status_class = packed ที่ compute_allocation ใส่ไว้ใน sales_class)
+        แถวที่ไม่มี sales_class จัดกลุ่มจาก sales_status ด้วยกติกาเดียวกับตอนนำเข้า"""
+        if r.get("is_not_in_sbs"):
+            return False
+        return (r.get("sales_class") or classify_sales_status(r.get("sales_status"))) == SALES_PACKED
+
+    def _order_is_packed(order_id: str) -> bool:
+        """Order ที่ Sales.status_class = packed (ใช้กับ write path ที่มีแค่ OrderLine)"""
+        return db.session.query(Sales.id).filter(
+            Sales.order_id == order_id, Sales.status_class == SALES_PACKED
+        ).first() is not None
+
+    def _orders_packed_set(rows: list[dict], snap: AllocationSnapshot | None = None) -> set[str]:
+        if snap is not None:
+            # ทุกบรรทัดของ Order เดียวกันใช้สถานะใบขายเดียวกัน -> คำนวณครั้งเดียวจาก Snapshot แล้วตัดเฉพาะ Order ใน rows
+            if "packed_oids" not in snap.memo:
+                snap.memo["packed_oids"] = _orders_packed_set(snap.rows)
+            oids = {(r.get("order_id") or "").strip() for r in rows}
+            return snap.memo["packed_oids"] & oids
         by_oid: dict[str, list[dict]] = {}
         for r in rows:
             oid = (r.get("order_id") or "").strip()
@@ -858,11 +1013,12 @@ def create_app():
     # --------------------------
     # Print count helpers (ใหม่)
     # --------------------------
-    def _get_print_counts_local(oids: list[str], kind: str) -> dict[str, int]:
-        """คืน dict: {order_id: count} อ่านจำนวนครั้งที่พิมพ์จากคอลัมน์ printed_warehouse หรือ printed_picking หรือ printed_lowstock"""
+    def _get_print_counts_local(oids: list[str], kind: str, archive: bool = False) -> dict[str, int]:
+        """คืน dict: {order_id: count} อ่านจำนวนครั้งที่พิมพ์จากคอลัมน์ printed_warehouse หรือ printed_picking หรือ printed_lowstock
+        archive=True -> รวม Order ในคลัง order_lines_archive (หน้าประวัติ)"""
         if not oids:
             return {}
-        tbl = _ol_table_name()
+        tbl = _ol_source(archive)
         if kind == "lowstock":
             col = "printed_lowstock"
         elif kind == "nostock":  # <<< เพิ่มสำหรับรายงานไม่มีสินค้า
@@ -998,32 +1154,38 @@ def create_app():
 
         return result
 
-    def _inject_scan_status(rows: list[dict]):
-        """ดึงข้อมูลว่าออเดอร์ไหนสแกนแล้วบ้าง"""
+    def _inject_scan_status(rows: list[dict], archive: bool = False):
+        """ดึงข้อมูลว่าออเดอร์ไหนสแกนแล้วบ้าง (แคชต่อ Request: Query เฉพาะ Order ที่ยังไม่เคยดึง)"""
         oids = sorted({(r.get("order_id") or "").strip() for r in rows if r.get("order_id")})
         if not oids:
             return
-        
-        tbl = _ol_table_name()
-        sql = text(f"SELECT order_id, MAX(scanned_at) FROM {tbl} WHERE order_id IN :oids GROUP BY order_id")
-        sql = sql.bindparams(bindparam("oids", expanding=True))
-        res = db.session.execute(sql, {"oids": oids}).fetchall()
-        scan_map = {r[0]: r[1] for r in res if r[0]}
+
+        cache_key = "_scan_map_archive" if archive else "_scan_map"
+        scan_map = g.setdefault(cache_key, {}) if has_request_context() else {}
+        missing = [oid for oid in oids if oid not in scan_map]
+        if missing:
+            tbl = _ol_source(archive)
+            sql = text(f"SELECT order_id, MAX(scanned_at) FROM {tbl} WHERE order_id IN :oids GROUP BY order_id")
+            sql = sql.bindparams(bindparam("oids", expanding=True))
+            res = db.session.execute(sql, {"oids": missing}).fetchall()
+            for oid in missing:
+                scan_map[oid] = None
+            scan_map.update({r[0]: r[1] for r in res if r[0]})
         
         for r in rows:
             oid = (r.get("order_id") or "").strip()
             r["scanned_at"] = scan_map.get(oid)
 
-    def _inject_print_counts_to_rows(rows: list[dict], kind: str):
+    def _inject_print_counts_to_rows(rows: list[dict], kind: str, archive: bool = False):
         """ฝัง printed_*_count และ printed_*_at ลงในแต่ละแถว (ใช้กับ Warehouse report)"""
         oids = sorted({(r.get("order_id") or "").strip() for r in rows if r.get("order_id")})
-        counts = _get_print_counts_local(oids, kind)
+        counts = _get_print_counts_local(oids, kind, archive)
         
         # Also get the timestamp of last print
         if not oids:
             return
         
-        tbl = _ol_table_name()
+        tbl = _ol_source(archive)
         col_at = "printed_warehouse_at" if kind == "warehouse" else "printed_picking_at"
         sql = text(f"SELECT order_id, MAX({col_at}) AS last_printed_at FROM {tbl} WHERE order_id IN :oids GROUP BY order_id")
         sql = sql.bindparams(bindparam("oids", expanding=True))
@@ -1035,7 +1197,7 @@ def create_app():
             if r_sql and r_sql[0] and r_sql[1]:
                 try:
                     # Parse ISO datetime string
-                    dt = datetime.fromisoformat(r_sql[1])
+                    dt = _db_datetime(r_sql[1])
                     if dt.tzinfo is None:
                         dt = TH_TZ.localize(dt)
                     timestamps[str(r_sql[0])] = dt
@@ -1063,26 +1225,25 @@ def create_app():
     except Exception:
         _OPENPYXL_OK = False
 
-    def _ensure_cancel_table():
-        try:
-            CancelledOrder.__table__.create(bind=db.engine, checkfirst=True)
-        except Exception as e:
-            app.logger.warning(f"[cancelled_orders] ensure table failed: {e}")
-
     def _cancelled_oids_set() -> set[str]:
         """คืนค่า set ของ order_id ที่ถูกยกเลิก (สำหรับ backward compatibility)"""
         rows = db.session.query(CancelledOrder.order_id).all()
         return {r[0] for r in rows if r and r[0]}
 
     def _cancelled_oids_map() -> dict[str, dict]:
-        """คืนค่า dict ของ {order_id: {'note': note, 'at': timestamp}}"""
+        """คืนค่า dict ของ {order_id: {'note': note, 'at': timestamp}} (แคชต่อ Request)"""
+        if has_request_context() and "_cancelled_map" in g:
+            return g._cancelled_map
         rows = db.session.query(
             CancelledOrder.order_id, 
             CancelledOrder.note, 
             CancelledOrder.imported_at
         ).all()
         # เก็บทั้ง Note และ เวลา
-        return {r[0]: {'note': (r[1] or ""), 'at': r[2]} for r in rows if r and r[0]}
+        result = {r[0]: {'note': (r[1] or ""), 'at': r[2]} for r in rows if r and r[0]}
+        if has_request_context():
+            g._cancelled_map = result
+        return result
 
     def _filter_out_cancelled_rows(rows: list[dict]) -> list[dict]:
         canc = _cancelled_oids_set()
@@ -1183,6 +1344,7 @@ def create_app():
             inserted += 1
         if commit:
             db.session.commit()
+            mark_orders_dirty(oids)
         return inserted
 
     def _unissue(oids: list[str]) -> int:
@@ -1190,6 +1352,7 @@ def create_app():
             return 0
         n = db.session.query(IssuedOrder).filter(IssuedOrder.order_id.in_(oids)).delete(synchronize_session=False)
         db.session.commit()
+        mark_orders_dirty(oids)
         return n
 
     # ให้ import "จ่ายงานแล้ว" ตั้งค่า counter ขั้นต่ำเป็น 1
@@ -1213,12 +1376,8 @@ def create_app():
 
         db.session.commit()
 
-    def _ensure_shops_from_df(df, platform: str, default_shop_name: str = None):
-        """สร้างหรือใช้ Shop ที่มีอยู่แล้ว ก่อนที่จะ import orders (กัน UNIQUE constraint พัง)"""
-        from utils import normalize_platform
-        platform = normalize_platform(platform)
-        
-        # รวบรวม shop names ที่มีใน df (ลองดูหลายคอลัมน์ที่อาจมีชื่อร้าน)
+    def _shop_names_from_df(df) -> set[str]:
+        """ชื่อร้านที่มีใน df (ลองดูหลายคอลัมน์ที่อาจมีชื่อร้าน)"""
         shop_names = set()
         for col in df.columns:
             col_lower = str(col).lower()
@@ -1227,7 +1386,14 @@ def create_app():
                     name = str(val).strip()
                     if name:
                         shop_names.add(name)
-        
+        return shop_names
+
+    def _ensure_shops(shop_names: set[str], platform: str, default_shop_name: str = None):
+        """สร้างหรือใช้ Shop ที่มีอยู่แล้ว ก่อนที่จะ import orders (กัน UNIQUE constraint พัง)"""
+        from utils import normalize_platform
+        platform = normalize_platform(platform)
+        shop_names = set(shop_names)
+
         # ถ้าไม่เจอใน df ให้ใช้ default_shop_name
         if not shop_names and default_shop_name:
             shop_names.add(default_shop_name.strip())
@@ -1240,6 +1406,10 @@ def create_app():
                 db.session.add(new_shop)
         db.session.commit()
 
+    def _ensure_shops_from_df(df, platform: str, default_shop_name: str = None):
+        """_ensure_shops จากชื่อร้านใน df"""
+        _ensure_shops(_shop_names_from_df(df), platform=platform, default_shop_name=default_shop_name)
+
     def _parse_order_ids_from_upload(file_storage) -> list[str]:
         filename = (file_storage.filename or "").lower()
         data = file_storage.read()
@@ -1518,7 +1688,7 @@ def create_app():
             filters = base_filters.copy()
             filters["active_only"] = False 
             filters["all_time"] = True
-            rows, _ = compute_allocation(db.session, filters)
+            rows, _ = _allocation_snapshot(base_filters).select(filters)
 
         elif mode == 'today':
             # [NEW] CASE 1.5: Order ปัจจุบัน (วันนี้)
@@ -1530,22 +1700,18 @@ def create_app():
             filters["active_only"] = False
             filters["import_from"] = today
             filters["import_to"] = today
-            rows_import, _ = compute_allocation(db.session, filters)
+            rows_import, _ = _allocation_snapshot(base_filters).select(filters)
             
             # 2. ดึง Order ที่ "ยกเลิกวันนี้" (บวก 7 ชม. เพื่อให้ตรงกับเวลาไทย)
             cancel_today_oids = [
                 r[0] for r in db.session.query(CancelledOrder.order_id)
-                .filter(func.date(CancelledOrder.imported_at, '+7 hours') == today).all()
+                .filter(db_backend.thai_date(CancelledOrder.imported_at) == today).all()
             ]
             
             rows_cancel = []
             if cancel_today_oids:
-                # ดึงข้อมูลของ Order ที่ cancel วันนี้ (ใช้ all_time แล้ว filter เอาเฉพาะ ID)
-                f_cancel = base_filters.copy()
-                f_cancel["all_time"] = True
-                f_cancel["active_only"] = False
-                temp_rows, _ = compute_allocation(db.session, f_cancel)
-                rows_cancel = [r for r in temp_rows if r.get("order_id") in cancel_today_oids]
+                # ดึงข้อมูลของ Order ที่ cancel วันนี้ (เลือกจาก Snapshot เฉพาะ ID)
+                rows_cancel = _allocation_snapshot(base_filters).rows_for_orders(cancel_today_oids)
             
             # 3. รวมรายการ (ตัดตัวซ้ำด้วย id)
             seen_ids = set()
@@ -1569,7 +1735,7 @@ def create_app():
             app.logger.info(f"📅 Date Filter Applied: date_from={d_from}, date_to={d_to}, imp_from={imp_from}, imp_to={imp_to}")
             app.logger.info(f"🔍 Filter Dictionary: {filters}")
 
-            rows, _ = compute_allocation(db.session, filters)
+            rows, _ = _allocation_snapshot(base_filters).select(filters)
             app.logger.info(f"📊 Date Filter Results: {len(rows)} rows returned")
             
         else:
@@ -1579,7 +1745,7 @@ def create_app():
             # 3.1 ดึง Order ค้างทั้งหมด (Active Orders - All Time)
             f_active = base_filters.copy()
             f_active["active_only"] = True
-            rows_active, _ = compute_allocation(db.session, f_active)
+            rows_active, _ = _allocation_snapshot(base_filters).select(f_active)
             
             # 3.2 ดึง Order จบแล้ว (Packed/Cancelled) ของ "วันนี้" เท่านั้น
             today = now_thai().date()
@@ -1588,7 +1754,7 @@ def create_app():
             f_inactive["import_from"] = today  # เฉพาะวันนี้
             f_inactive["import_to"] = today
             
-            rows_today_all, _ = compute_allocation(db.session, f_inactive)
+            rows_today_all, _ = _allocation_snapshot(base_filters).select(f_inactive)
             
             # คัดเฉพาะ Packed/Cancelled จากของวันนี้
             existing_ids = set(r["id"] for r in rows_active)
@@ -1603,7 +1769,7 @@ def create_app():
         # --- Post-Processing Rows ---
         # ดึงเซ็ต/แมป Order ยกเลิก/จ่ายแล้ว/แพ็คแล้ว
         cancelled_map = _cancelled_oids_map()  # dict: order_id -> note
-        packed_oids = _orders_packed_set(rows)
+        packed_oids = _orders_packed_set(rows, _allocation_snapshot(base_filters))
         orders_not_in_sbs = _orders_not_in_sbs_set(rows)
         orders_no_sales = _orders_no_sales_set(rows)
         
@@ -2545,6 +2711,7 @@ def create_app():
                 ol.accepted_by_user_id = cu.id
                 ol.accepted_by_username = cu.username
                 db.session.commit()
+                mark_skus_dirty([ol.sku])
                 flash(f"รับออเดอร์ {order_id} (SKU: {sku}) สำเร็จ", "success")
             else:
                 flash("ไม่พบรายการที่ต้องการรับ", "warning")
@@ -2560,6 +2727,133 @@ def create_app():
     # -----------------------
     # Import endpoints
     # -----------------------
+    # =========[ NEW ]========= นำเข้าไฟล์ (ใช้ทั้ง Route แบบ Synchronous และงานเบื้องหลัง services/import_jobs)
+    IMPORT_UPLOAD_DIR = os.path.join(
+        os.environ.get("RAILWAY_VOLUME_MOUNT_PATH") or os.path.dirname(__file__), "import_uploads"
+    )
+
+    def _submit_import_job(kind: str, f, key: tuple, handler, platform: str = None, shop_name: str = None) -> int:
+        """เก็บไฟล์ที่อัปโหลด + สร้างงานนำเข้าเบื้องหลัง คืน job id"""
+        cu = current_user()
+        job_id = import_jobs.submit(
+            app, kind, key, handler,
+            file_path=import_jobs.store_upload(f, IMPORT_UPLOAD_DIR),
+            filename=f.filename or "uploaded_file.xlsx",
+            platform=platform,
+            shop_name=shop_name,
+            user_id=cu.id if cu else None,
+        )
+        flash(f"⏳ กำลังนำเข้าไฟล์ {f.filename or ''} เบื้องหลัง (งาน #{job_id})", "info")
+        return job_id
+
+    def _run_orders_import(load_chunks, platform: str, shop_name: str | None, filename: str,
+                           progress=None, content_hash: str | None = None):
+        """นำเข้าออเดอร์แล้วบันทึก ImportLog คืน (stats, log_entry)
+        load_chunks() = DataFrame ทีละ chunk (เรียกเฉพาะเมื่อต้องอ่านข้อมูลจริง)
+        content_hash = ลายนิ้วมือไฟล์ (import_cache) -> ไฟล์เดิมใช้ผลครั้งก่อน / ไฟล์คล้ายเดิมข้ามแถวที่นำเข้าแล้ว"""
+        current_import_date = now_thai().date()
+        use_cache = bool(content_hash) and import_cache.enabled()
+        fingerprint = import_cache.lookup(platform, shop_name, current_import_date) if use_cache else None
+        diff = None
+
+        if fingerprint is not None and fingerprint.content_hash == content_hash:
+            # ไฟล์เดิมทุกไบต์ (และ Order ครั้งก่อนยังอยู่ครบ) -> ไม่ต้องอ่านไฟล์/ตรวจซ้ำใหม่
+            stats = import_cache.cached_stats(fingerprint)
+            if progress:
+                progress(duplicates=stats["duplicates"], failed=stats["failed"])
+        else:
+            shop_names: set[str] = set()
+            chunks = load_chunks()
+            if progress:
+                chunks = import_jobs.track_rows(chunks, progress)
+            if use_cache:
+                diff = import_cache.RowDiff(fingerprint)
+                chunks = diff.filter(chunks)
+
+            def _order_chunks():
+                for chunk in chunks:
+                    # >>> สร้าง/ใช้ร้านเดิมก่อนเสมอ (กัน UNIQUE พัง)
+                    # importer insert ทีละ chunk -> สร้างร้านใหม่ของ chunk นี้ก่อนส่งต่อ
+                    new_names = _shop_names_from_df(chunk) - shop_names
+                    if new_names:
+                        _ensure_shops(new_names, platform=platform, default_shop_name=shop_name)
+                        shop_names.update(new_names)
+                    yield chunk
+                if not shop_names:
+                    # ไฟล์ไม่มีชื่อร้านเลย -> ใช้ร้านที่เลือกในฟอร์ม
+                    _ensure_shops(shop_names, platform=platform, default_shop_name=shop_name)
+
+            # เรียก Importer ใหม่
+            stats = import_orders_chunks(
+                _order_chunks(), platform=platform, shop_name=shop_name, import_date=current_import_date, progress=progress
+            )
+            if diff is not None:
+                diff.merge(stats)
+                if progress:
+                    progress(added=stats["added"], duplicates=stats["duplicates"], failed=stats["failed"])
+
+        # เก็บ Batch Data (IDs) ลง Log
+        batch_data = json.dumps({
+            "added_ids": stats.get("added_ids", []),
+            "duplicate_ids": stats.get("duplicate_ids", []),
+            "duplicate_old_ids": stats.get("duplicate_old_ids", []),
+            "duplicate_today_ids": stats.get("duplicate_today_ids", []),
+            "failed_ids": stats.get("failed_ids", [])
+        }, ensure_ascii=False)
+
+        # บันทึก Log ลง DB
+        log_entry = ImportLog(
+            import_date=current_import_date,
+            platform=platform,
+            filename=filename,
+            added_count=stats["added"],
+            duplicates_count=stats["duplicates"],
+            failed_count=stats["failed"],
+            error_details=json.dumps(stats["errors"], ensure_ascii=False) if stats["errors"] else "[]"
+        )
+        # เพิ่ม batch_data และ shop_name ถ้าคอลัมน์มีอยู่
+        if hasattr(log_entry, 'batch_data'):
+            log_entry.batch_data = batch_data
+        if hasattr(log_entry, 'shop_name'):
+            log_entry.shop_name = shop_name or ""
+        if hasattr(log_entry, 'duplicates_same_day'):
+            log_entry.duplicates_same_day = stats.get("duplicates_today", 0)
+        log_entry.content_hash = content_hash
+        db.session.add(log_entry)
+        db.session.commit()
+        if use_cache:
+            import_cache.save(platform, shop_name, current_import_date, content_hash, stats, diff, log_entry.id)
+        return stats, log_entry
+
+    def _orders_import_message(stats: dict) -> tuple[str, str]:
+        """ข้อความแจ้งผลนำเข้าออเดอร์ (แยกประเภทซ้ำ) คืน (message, category)"""
+        dup_old = stats.get('duplicates_old', 0)
+        dup_today = stats.get('duplicates_today', 0)
+        dup_msg = f"ซ้ำข้ามวัน {dup_old}"
+        if dup_today > 0:
+            dup_msg += f" (ซ้ำวันนี้ {dup_today} - ไม่นับ)"
+        msg = f"นำเข้า: เพิ่ม {stats['added']} | {dup_msg} | ไม่สำเร็จ {stats['failed']}"
+        if stats.get("cached"):
+            msg += " (ไฟล์เดิมที่นำเข้าแล้ว: ใช้ผลจากครั้งก่อน)"
+        return msg, "success" if stats['failed'] == 0 else "warning"
+
+    def _orders_import_job(job):
+        stats, log_entry = _run_orders_import(
+            lambda: read_upload_chunks(job.file_path).chunks(), job.platform, job.shop_name, job.filename,
+            progress=job.progress, content_hash=import_cache.file_digest(job.file_path),
+        )
+        return {"message": _orders_import_message(stats)[0], "import_log_id": log_entry.id}
+
+    @app.route("/api/import/jobs/<int:job_id>", methods=["GET"])
+    @login_required
+    def api_import_job(job_id: int):
+        """สถานะ/ความคืบหน้าของงานนำเข้าเบื้องหลัง"""
+        job = import_jobs.get_job(job_id)
+        if job is None:
+            return jsonify({"success": False, "error": "ไม่พบงานนำเข้า"}), 404
+        return jsonify({"success": True, "job": job})
+    # =========[ /NEW ]=========
+
     @app.route("/import/orders", methods=["GET", "POST"])
     @login_required
     def import_orders_view():
@@ -2611,55 +2905,19 @@ def create_app():
                 flash("กรุณาเลือกแพลตฟอร์ม และเลือกไฟล์", "danger")
                 return redirect(url_for("import_orders_view"))
             try:
-                df = pd.read_excel(f)
-                # >>> สร้าง/ใช้ร้านเดิมก่อนเสมอ (กัน UNIQUE พัง)
-                _ensure_shops_from_df(df, platform=platform, default_shop_name=shop_name)
-                
-                # เรียก Importer ใหม่
-                stats = import_orders(
-                    df, platform=platform, shop_name=shop_name, import_date=current_import_date
-                )
-                
-                # เก็บ Batch Data (IDs) ลง Log
-                batch_data = json.dumps({
-                    "added_ids": stats.get("added_ids", []),
-                    "duplicate_ids": stats.get("duplicate_ids", []),
-                    "duplicate_old_ids": stats.get("duplicate_old_ids", []),
-                    "duplicate_today_ids": stats.get("duplicate_today_ids", []),
-                    "failed_ids": stats.get("failed_ids", [])
-                }, ensure_ascii=False)
-                
-                # บันทึก Log ลง DB
-                log_entry = ImportLog(
-                    import_date=current_import_date,
-                    platform=platform,
-                    filename=f.filename or "uploaded_file.xlsx",
-                    added_count=stats["added"],
-                    duplicates_count=stats["duplicates"],
-                    failed_count=stats["failed"],
-                    error_details=json.dumps(stats["errors"], ensure_ascii=False) if stats["errors"] else "[]"
-                )
-                # เพิ่ม batch_data และ shop_name ถ้าคอลัมน์มีอยู่
-                if hasattr(log_entry, 'batch_data'):
-                    log_entry.batch_data = batch_data
-                if hasattr(log_entry, 'shop_name'):
-                    log_entry.shop_name = shop_name or ""
-                if hasattr(log_entry, 'duplicates_same_day'):
-                    log_entry.duplicates_same_day = stats.get("duplicates_today", 0)
-                db.session.add(log_entry)
-                db.session.commit()
+                # =========[ NEW ]========= นำเข้าเบื้องหลัง (ร้านเดียวกันทำทีละไฟล์, ต่างร้านทำขนานกัน)
+                if import_jobs.enabled():
+                    job_id = _submit_import_job(
+                        "orders", f, ("orders", normalize_platform(platform), (shop_name or "").strip()),
+                        _orders_import_job, platform=platform, shop_name=shop_name,
+                    )
+                    return redirect(url_for("import_orders_view", import_job=job_id))
 
-                # สร้างข้อความแจ้งเตือนแยกประเภทซ้ำ
-                dup_old = stats.get('duplicates_old', 0)
-                dup_today = stats.get('duplicates_today', 0)
-                dup_msg = f"ซ้ำข้ามวัน {dup_old}"
-                if dup_today > 0:
-                    dup_msg += f" (ซ้ำวันนี้ {dup_today} - ไม่นับ)"
-                
-                flash(
-                    f"นำเข้า: เพิ่ม {stats['added']} | {dup_msg} | ไม่สำเร็จ {stats['failed']}", 
-                    "success" if stats['failed'] == 0 else "warning"
+                stats, _ = _run_orders_import(
+                    lambda: read_upload_chunks(f).chunks(), platform, shop_name, f.filename or "uploaded_file.xlsx",
+                    content_hash=import_cache.file_digest(f),
                 )
+                flash(*_orders_import_message(stats))
                 # Redirect กลับมาหน้า Dashboard ของวันที่นำเข้า
                 return redirect(url_for('import_orders_view', date_from=current_import_date.isoformat(), date_to=current_import_date.isoformat()))
 
@@ -2781,6 +3039,37 @@ def create_app():
         )
 
     # =========[ NEW ]=========
+    def _orders_sheet_tab(platform: str) -> str:
+        """ชื่อ Tab ออเดอร์ใน Google Sheet ตามแพลตฟอร์ม"""
+        if platform == "Shopee":
+            return "Import_Shopee"
+        if platform == "Lazada":
+            return "Import_Lazada"
+        if platform == "TikTok":
+            return "Import_Tiktok"
+        return "Import_Order_other"
+
+    def _import_sheet_pull(shop_id: int, platform: str, shop_name: str | None, tab: str, pull) -> dict:
+        """นำเข้า records ที่ดึงจาก Sheet (gsheet_sync.pull_records) แล้วเลื่อน cursor ของร้าน คืน stats"""
+        df = pd.DataFrame(pull.records)
+        stats, _ = _run_orders_import(
+            lambda: [df], platform, shop_name, f"Google Sheet ({tab})",
+            content_hash=import_cache.frame_digest(df),
+        )
+        # แถวของ Order ที่ไม่สำเร็จ (ไม่มี Order ID / SKU / ร้าน) -> pending ใน cursor ให้ดึงใหม่เมื่อถูกแก้ใน Sheet
+        # (Order ที่บางบรรทัดนำเข้าได้ = มีในระบบแล้ว แก้บรรทัดที่เหลือก็เป็นซ้ำ ไม่ต้องดึงใหม่)
+        failed_oids = set(stats.get("failed_ids", [])) - set(stats.get("added_ids", [])) - set(stats.get("duplicate_ids", []))
+        order_col = first_existing(df, COMMON_ORDER_ID)
+        oids = [str(v).strip() for v in df[order_col]] if order_col else [""] * len(df)
+        cursor = gsheet_sync.settle_cursor(pull, [i for i, oid in enumerate(oids) if not oid or oid in failed_oids])
+        # เลื่อน cursor หลังนำเข้าสำเร็จเท่านั้น (ล้มเหลว = ครั้งหน้าดึงแถวชุดเดิมอีกครั้ง)
+        db.session.execute(
+            text("UPDATE shops SET google_sheet_cursor = :c WHERE id = :id"),
+            {"c": json.dumps(cursor), "id": shop_id}
+        )
+        db.session.commit()
+        return stats
+
     # Import Orders จาก Google Sheet
     @app.route("/import/orders/gsheet", methods=["POST"])
     @login_required
@@ -2821,20 +3110,11 @@ def create_app():
                 db.session.commit()
 
         # กำหนดชื่อ Tab ตามแพลตฟอร์ม
-        target_tab_name = ""
-        if platform == "Shopee":
-            target_tab_name = "Import_Shopee"
-        elif platform == "Lazada":
-            target_tab_name = "Import_Lazada"
-        elif platform == "TikTok":
-            target_tab_name = "Import_Tiktok"
-        else:
-            target_tab_name = "Import_Order_other"
+        target_tab_name = _orders_sheet_tab(platform)
 
         try:
             # 1. เชื่อมต่อ Google API
-            creds = get_google_credentials()
-            client = gspread.authorize(creds)
+            client = gsheet_sync.open_client(get_google_credentials)
 
             # 2. เปิด Google Sheet
             sheet = client.open_by_url(sheet_url)
@@ -2846,54 +3126,23 @@ def create_app():
                 flash(f"❌ ไม่พบ Tab ชื่อ '{target_tab_name}' ใน Google Sheet นี้", "danger")
                 return redirect(url_for("import_orders_view"))
             
-            # 4. ดึงข้อมูล
-            data = worksheet.get_all_records()
+            # 4. ดึงข้อมูล (เฉพาะแถวใหม่ตั้งแต่ครั้งก่อน ถ้า cursor ของร้านยังตรงกับแท็บ / ติ๊ก full_pull = ทั้งแท็บ)
+            cursor = None if request.form.get("full_pull") else gsheet_sync.load_cursor(db.session.execute(
+                text("SELECT google_sheet_cursor FROM shops WHERE id = :id"), {"id": s.id}
+            ).scalar())
+            pull = gsheet_sync.pull_records(worksheet, cursor, sheet_url)
+            data = pull.records
             if not data:
-                flash(f"Tab '{target_tab_name}' ไม่มีข้อมูล", "warning")
+                if pull.incremental:
+                    flash(f"Tab '{target_tab_name}' ไม่มีแถวใหม่ตั้งแต่ดึงครั้งก่อน", "info")
+                else:
+                    flash(f"Tab '{target_tab_name}' ไม่มีข้อมูล", "warning")
                 return redirect(url_for("import_orders_view"))
 
-            # 5. แปลงเป็น DataFrame และนำเข้า
-            df = pd.DataFrame(data)
-            
-            # สร้าง/เช็คชื่อร้าน
-            _ensure_shops_from_df(df, platform=platform, default_shop_name=shop_name)
-            
+            # 5. แปลงเป็น DataFrame และนำเข้า (สร้างร้าน + บันทึก ImportLog แบบเดียวกับนำเข้าไฟล์)
             # วันที่นำเข้า = วันปัจจุบันเสมอ
             current_import_date = now_thai().date()
-            
-            # เรียก Importer ใหม่
-            stats = import_orders(
-                df, platform=platform, shop_name=shop_name, import_date=current_import_date
-            )
-            
-            # เก็บ Batch Data (IDs) ลง Log
-            batch_data = json.dumps({
-                "added_ids": stats.get("added_ids", []),
-                "duplicate_ids": stats.get("duplicate_ids", []),
-                "duplicate_old_ids": stats.get("duplicate_old_ids", []),
-                "duplicate_today_ids": stats.get("duplicate_today_ids", []),
-                "failed_ids": stats.get("failed_ids", [])
-            }, ensure_ascii=False)
-            
-            # บันทึก Log ลง DB
-            log_entry = ImportLog(
-                import_date=current_import_date,
-                platform=platform,
-                filename=f"Google Sheet ({target_tab_name})",
-                added_count=stats["added"],
-                duplicates_count=stats["duplicates"],
-                failed_count=stats["failed"],
-                error_details=json.dumps(stats["errors"], ensure_ascii=False) if stats["errors"] else "[]"
-            )
-            # เพิ่ม batch_data, shop_name และ duplicates_same_day ถ้าคอลัมน์มีอยู่
-            if hasattr(log_entry, 'batch_data'):
-                log_entry.batch_data = batch_data
-            if hasattr(log_entry, 'shop_name'):
-                log_entry.shop_name = shop_name or ""
-            if hasattr(log_entry, 'duplicates_same_day'):
-                log_entry.duplicates_same_day = stats.get("duplicates_today", 0)
-            db.session.add(log_entry)
-            db.session.commit()
+            stats = _import_sheet_pull(s.id, platform, shop_name, target_tab_name, pull)
             
             # สร้างข้อความแจ้งเตือนแยกประเภทซ้ำ
             dup_old = stats.get('duplicates_old', 0)
@@ -2902,8 +3151,9 @@ def create_app():
             if dup_today > 0:
                 dup_msg += f" (ซ้ำวันนี้ {dup_today} - ไม่นับ)"
             
+            new_rows = f" ({len(data)} แถวใหม่)" if pull.incremental else ""
             flash(
-                f"✅ ดึงข้อมูลจาก {target_tab_name}: เพิ่ม {stats['added']} | {dup_msg} | ไม่สำเร็จ {stats['failed']}", 
+                f"✅ ดึงข้อมูลจาก {target_tab_name}{new_rows}: เพิ่ม {stats['added']} | {dup_msg} | ไม่สำเร็จ {stats['failed']}", 
                 "success" if stats['failed'] == 0 else "warning"
             )
             return redirect(url_for('import_orders_view', date_from=current_import_date.isoformat(), date_to=current_import_date.isoformat()))
@@ -2917,6 +3167,76 @@ def create_app():
                 flash(f"เกิดข้อผิดพลาด: {str(e)}", "danger")
             return redirect(url_for("import_orders_view"))
 
+    # =========[ NEW ]=========
+    # ดึงออเดอร์จาก Google Sheet ของทุกร้านที่บันทึก URL ไว้ (ดึงพร้อมกัน แล้วนำเข้าทีละร้าน)
+    @app.route("/import/orders/gsheet/sync_all", methods=["POST"])
+    @login_required
+    def import_orders_gsheet_sync_all():
+        started = time.perf_counter()
+        rows = db.session.execute(text(
+            "SELECT id, platform, name, google_sheet_url, google_sheet_cursor FROM shops "
+            "WHERE google_sheet_url IS NOT NULL AND google_sheet_url != '' ORDER BY id"
+        )).fetchall()
+        # ไม่รวมแถวตั้งค่าของหน้าอื่น (CANCEL_SYSTEM, STOCK_SYSTEM, ...)
+        rows = [r for r in rows if r.platform and not r.platform.endswith("_SYSTEM")]
+        if not rows:
+            flash("ยังไม่มีร้านที่บันทึกลิงก์ Google Sheet ไว้", "warning")
+            return redirect(url_for("import_orders_view"))
+
+        try:
+            client = gsheet_sync.open_client(get_google_credentials)
+        except Exception as e:
+            app.logger.exception("Google Sheet Sync-All Error")
+            flash(f"เชื่อมต่อ Google Sheet ไม่สำเร็จ: {e}", "danger")
+            return redirect(url_for("import_orders_view"))
+
+        full_pull = bool(request.form.get("full_pull"))
+        fetched = gsheet_sync.fetch_all(client, [
+            (r, r.google_sheet_url, _orders_sheet_tab(r.platform),
+             None if full_pull else gsheet_sync.load_cursor(r.google_sheet_cursor))
+            for r in rows
+        ])
+
+        # นำเข้าทีละร้านบน thread นี้ (SQLite เขียนได้ทีละ connection)
+        lines, added, errors = [], 0, 0
+        for res in fetched:
+            r = res.key
+            label = escape(f"{r.name} ({r.platform})")
+            timing = f"ดึง {res.seconds:.1f}s"
+            if res.error:
+                errors += 1
+                lines.append(f"❌ {label}: {escape(res.error)} ({timing})")
+                continue
+            if not res.pull.records:
+                lines.append(f"➖ {label}: ไม่มีแถวใหม่ ({timing})")
+                continue
+            import_started = time.perf_counter()
+            try:
+                # URL ระดับแพลตฟอร์มบันทึกด้วยชื่อแพลตฟอร์ม -> ไม่มีชื่อร้าน fallback
+                shop_name = None if r.name == r.platform else r.name
+                stats = _import_sheet_pull(r.id, r.platform, shop_name, _orders_sheet_tab(r.platform), res.pull)
+            except Exception as e:
+                db.session.rollback()
+                errors += 1
+                app.logger.exception(f"Google Sheet Sync-All import failed: {r.name}")
+                lines.append(f"❌ {label}: {escape(str(e))} ({timing})")
+                continue
+            added += stats["added"]
+            lines.append(
+                f"✅ {label}: {len(res.pull.records)} แถว | เพิ่ม {stats['added']} | ซ้ำ {stats['duplicates']} | "
+                f"ไม่สำเร็จ {stats['failed']} ({timing}, นำเข้า {time.perf_counter() - import_started:.1f}s)"
+            )
+            app.logger.info(f"[gsheet sync-all] {r.name}: {lines[-1]}")
+
+        flash(
+            f"ดึงข้อมูล {len(rows)} ร้าน ใน {time.perf_counter() - started:.1f}s: เพิ่ม {added} Order"
+            + (f" | ผิดพลาด {errors} ร้าน" if errors else "")
+            + "<br>" + "<br>".join(lines),
+            "success" if not errors else "warning",
+        )
+        today = now_thai().date().isoformat()
+        return redirect(url_for("import_orders_view", date_from=today, date_to=today))
+
     # =========[ NEW ]=========
     # ล้างประวัติ Import Log (พร้อมออปชั่นลบข้อมูลออเดอร์จริง)
     @app.route("/import/orders/clear_log", methods=["POST"])
@@ -2937,8 +3257,8 @@ def create_app():
             if mode == 'all':
                 # 1. ถ้าเลือกติ๊กลบข้อมูล -> ลบออเดอร์ทั้งหมด
                 if delete_data == 'yes':
-                    # ลบ OrderLines ทั้งหมด
-                    order_deleted_count = OrderLine.query.delete()
+                    # ลบ OrderLines ทั้งหมด (รวมคลัง ไม่งั้นนำเข้าใหม่จะถูกนับเป็น Order ซ้ำกับคลัง)
+                    order_deleted_count = OrderLine.query.delete() + OrderLineArchive.query.delete()
                     # ลบ DeletedOrder ถังขยะด้วย
                     try:
                         db.session.query(DeletedOrder).delete()
@@ -2967,10 +3287,13 @@ def create_app():
                 
                 # 1. ถ้าเลือกติ๊กลบข้อมูล -> ลบออเดอร์ในช่วงวันที่นำเข้านั้น
                 if delete_data == 'yes':
-                    order_deleted_count = OrderLine.query.filter(
-                        OrderLine.import_date >= d_from,
-                        OrderLine.import_date <= d_to
-                    ).delete(synchronize_session=False)
+                    order_deleted_count = sum(
+                        line.query.filter(
+                            line.import_date >= d_from,
+                            line.import_date <= d_to
+                        ).delete(synchronize_session=False)
+                        for line in (OrderLine, OrderLineArchive)
+                    )
                 
                 # 2. ลบ Log ในช่วงวันที่
                 log_deleted_count = ImportLog.query.filter(
@@ -3041,7 +3364,7 @@ def create_app():
         """
         # 1. ยอด Success: นับจาก DB โดยตรง (บวก 7 ชม. เพื่อให้ตรงกับเวลาไทย)
         success_count = CancelledOrder.query.filter(
-            func.date(CancelledOrder.imported_at, '+7 hours') == view_date
+            db_backend.thai_date(CancelledOrder.imported_at) == view_date
         ).count()
 
         # 2. ยอด Unique Input: ดึง ID ทั้งหมดที่เคยนำเข้าวันนี้จาก Log มาทำ Unique Set
@@ -3083,7 +3406,7 @@ def create_app():
             if s: unique_input_ids.add(s)
         
         if not unique_input_ids:
-            return 0, 0
+            return 0, 0, None
 
         # 2. หา ID ที่มีอยู่แล้วใน DB (เช็คซ้ำทั้งหมด ไม่สนวันที่)
         existing_query = db.session.query(CancelledOrder.order_id).filter(
@@ -3107,6 +3430,7 @@ def create_app():
                 ))
             db.session.bulk_save_objects(new_entries)
             db.session.commit()
+            mark_orders_dirty(new_ids)
 
         # 5. บันทึก Log พร้อม batch_data (สำคัญสำหรับคำนวณหน้าเว็บ)
         log = ImportLog(
@@ -3123,19 +3447,23 @@ def create_app():
         db.session.add(log)
         db.session.commit()
 
-        return len(new_ids), len(existing_ids)
+        return len(new_ids), len(existing_ids), log
+
+    # =========[ NEW ]========= งานนำเข้า Order ยกเลิกเบื้องหลัง
+    def _cancel_import_job(job):
+        with open(job.file_path, "rb") as fh:
+            order_ids = _parse_order_ids_from_upload(FileStorage(stream=fh, filename=job.filename))
+        job.progress(rows=len(order_ids))
+        if not order_ids:
+            return {"message": "ไม่พบข้อมูล Order ID"}
+        added, dups, log = _process_cancel_import(order_ids, job.filename, job.user_id)
+        job.progress(added=added, duplicates=dups)
+        return {"message": f"✅ นำเข้าสำเร็จ: เพิ่มใหม่ {added}, ซ้ำ {dups} รายการ", "import_log_id": log.id if log else None}
+    # =========[ /NEW ]=========
 
     @app.route("/import/cancel", methods=["GET"])
     @login_required
     def import_cancel_view():
-        _ensure_cancel_table()
-        
-        # ตรวจสอบให้ ImportLog table มีอยู่
-        try:
-            ImportLog.__table__.create(bind=db.engine, checkfirst=True)
-        except Exception:
-            pass
-
         # [แก้ไข] รับค่าเป็นช่วงวันที่
         date_from_str = request.args.get("date_from")
         date_to_str = request.args.get("date_to")
@@ -3158,8 +3486,8 @@ def create_app():
 
         # 2. คำนวณ Success (นับจาก DB จริงที่สร้างในช่วงเวลานั้น + ปรับ Timezone ไทย UTC+7)
         success_count = CancelledOrder.query.filter(
-            func.date(CancelledOrder.imported_at, '+7 hours') >= d_from,
-            func.date(CancelledOrder.imported_at, '+7 hours') <= d_to
+            db_backend.thai_date(CancelledOrder.imported_at) >= d_from,
+            db_backend.thai_date(CancelledOrder.imported_at) <= d_to
         ).count()
 
         # 3. [แก้ตรงนี้] คำนวณ Duplicate แบบไม่นับเบิ้ล (Unique ID)
@@ -3216,14 +3544,6 @@ def create_app():
     @app.route("/import/cancel/action", methods=["POST"])
     @login_required
     def import_cancel_action():
-        _ensure_cancel_table()
-        
-        # ตรวจสอบให้ ImportLog table มีอยู่
-        try:
-            ImportLog.__table__.create(bind=db.engine, checkfirst=True)
-        except Exception:
-            pass
-
         cu = current_user()
         if not cu or cu.role not in {"admin", "staff"}:
             flash("ต้องเป็นผู้ดูแลระบบหรือพนักงานเท่านั้น", "danger")
@@ -3243,8 +3563,7 @@ def create_app():
                     return redirect(url_for("import_cancel_view"))
                     
                 # Connect Google Sheet
-                creds = get_google_credentials()
-                client = gspread.authorize(creds)
+                client = gsheet_sync.open_client(get_google_credentials)
                 sh = client.open_by_url(url)
                 source_name = f"GSheet: {sh.title}"
                 
@@ -3275,6 +3594,10 @@ def create_app():
             elif mode == "file":
                 f = request.files.get("file")
                 if f and f.filename:
+                    # =========[ NEW ]========= นำเข้าเบื้องหลัง
+                    if import_jobs.enabled():
+                        job_id = _submit_import_job("cancel", f, ("cancel",), _cancel_import_job)
+                        return redirect(url_for("import_cancel_view", import_job=job_id))
                     order_ids = _parse_order_ids_from_upload(f)
                     source_name = f.filename
                 else:
@@ -3283,7 +3606,7 @@ def create_app():
 
             # ประมวลผล
             if order_ids:
-                added, dups = _process_cancel_import(order_ids, source_name, cu.id)
+                added, dups, _ = _process_cancel_import(order_ids, source_name, cu.id)
 
                 # บันทึก URL อัตโนมัติ (เฉพาะกรณี Google Sheet)
                 if mode == "gsheet":
@@ -3332,9 +3655,11 @@ def create_app():
             data_deleted_count = 0
             log_deleted_count = 0
             
+            uncancelled_ids: list[str] = []
             if mode == 'all':
                 # 1. ถ้าเลือกติ๊กลบข้อมูล -> ลบข้อมูลใน CancelledOrder ทั้งหมด
                 if delete_data == 'yes':
+                    uncancelled_ids = [r[0] for r in db.session.query(CancelledOrder.order_id)]
                     data_deleted_count = db.session.query(CancelledOrder).delete()
                 
                 # 2. ลบ Log ทั้งหมดที่เป็นของ CANCEL_SYSTEM
@@ -3363,10 +3688,12 @@ def create_app():
                     dt_start = datetime.combine(d_from, datetime.min.time())
                     dt_end = datetime.combine(d_to, datetime.max.time())
                     
-                    data_deleted_count = CancelledOrder.query.filter(
+                    cancel_q = CancelledOrder.query.filter(
                         CancelledOrder.imported_at >= dt_start,
                         CancelledOrder.imported_at <= dt_end
-                    ).delete(synchronize_session=False)
+                    )
+                    uncancelled_ids = [r[0] for r in cancel_q.with_entities(CancelledOrder.order_id)]
+                    data_deleted_count = cancel_q.delete(synchronize_session=False)
                 
                 # 2. ลบ Log ในช่วงวันที่ (เฉพาะ CANCEL_SYSTEM)
                 log_deleted_count = ImportLog.query.filter(
@@ -3380,7 +3707,10 @@ def create_app():
                 else:
                     msg = f"ล้างประวัติช่วง {to_be_date_str(d_from)} - {to_be_date_str(d_to)} เรียบร้อย ({log_deleted_count} รายการ)"
                 
+            # Order ที่ยกเลิกคืนและอยู่ในคลังแล้ว -> ย้ายกลับ order_lines (ถ้ายังไม่แพ็ค)
+            order_archive.restore_unfinished(db.session.connection(), uncancelled_ids)
             db.session.commit()
+            mark_orders_dirty(uncancelled_ids)
             flash(msg, "success")
             
         except Exception as e:
@@ -3704,7 +4034,11 @@ def create_app():
 
         # 1. Database Path Information
         volume_path = os.environ.get("RAILWAY_VOLUME_MOUNT_PATH")
-        if volume_path:
+        db_dialect = db.engine.dialect.name
+        if db_dialect != "sqlite":
+            db_location = "PostgreSQL (DATABASE_URL)"
+            db_path_full = db_backend.describe(app.config["SQLALCHEMY_DATABASE_URI"])
+        elif volume_path:
             db_location = "Railway Volume (Production)"
             db_path_full = os.path.join(volume_path, "data.db")
         else:
@@ -3716,7 +4050,11 @@ def create_app():
         db_exists = False
         db_modified = None
         try:
-            if os.path.exists(db_path_full):
+            if db_dialect == "postgresql":
+                size_bytes = db.session.execute(text("SELECT pg_database_size(current_database())")).scalar() or 0
+                db_exists = True
+                db_size = f"{size_bytes / (1024 * 1024):.2f} MB"
+            elif os.path.exists(db_path_full):
                 db_exists = True
                 size_bytes = os.path.getsize(db_path_full)
                 db_size = f"{size_bytes / (1024 * 1024):.2f} MB"
@@ -3737,6 +4075,13 @@ def create_app():
         except:
             total_orders = total_products = total_shops = total_users = 0
 
+        # 3.1 SQLite PRAGMA (db_tuning): ค่าที่ตั้งจาก env เทียบกับค่าที่ใช้อยู่จริง
+        sqlite_configured = getattr(db.engine, "_sqlite_tuning", None)
+        try:
+            sqlite_active = db_tuning.current(db.session.connection()) if db.engine.dialect.name == "sqlite" else {}
+        except Exception:
+            sqlite_active = {}
+
         # 4. System Information
         python_version = f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}"
         flask_version = flask.__version__
@@ -3749,6 +4094,11 @@ def create_app():
             "SECRET_KEY": "***" if os.environ.get("SECRET_KEY") else "Default (vnix-secret)",
             "APP_NAME": os.environ.get("APP_NAME", "VNIX Order Management"),
         }
+        env_vars["DATABASE_URL"] = "***" if os.environ.get("DATABASE_URL") else "Not Set (SQLite)"
+        for key in ("DB_POOL_SIZE", "DB_MAX_OVERFLOW", "DB_POOL_TIMEOUT", "DB_POOL_RECYCLE", "DB_TIMEZONE",
+                    "SQLITE_TUNING", "SQLITE_JOURNAL_MODE", "SQLITE_SYNCHRONOUS", "SQLITE_BUSY_TIMEOUT_MS",
+                    "SQLITE_CACHE_SIZE_KB", "SQLITE_MMAP_SIZE_MB", "SQLITE_TEMP_STORE"):
+            env_vars[key] = os.environ.get(key, "Default")
 
         status_info = {
             "db_path": db_path_full,
@@ -3766,6 +4116,13 @@ def create_app():
             "sqlalchemy_version": sqlalchemy_version,
             "os_info": os_info,
             "env_vars": env_vars,
+            "sqlite_pragmas": [
+                (name, (sqlite_configured or {}).get(name, "-"), sqlite_active.get(name, "-"))
+                for name in db_tuning.PRAGMAS
+            ],
+            "sqlite_tuning": sqlite_configured is not None,
+            "db_backend": db_dialect,
+            "db_pool": db.engine.pool.status() if db_dialect != "sqlite" else "",
         }
 
         return render_template("system_status.html", status=status_info)
@@ -3792,6 +4149,7 @@ def create_app():
         if request.method == "POST":
             mode = request.form.get("mode")
             df = None
+            chunks = None  # ไฟล์ Excel -> อ่านทีละ chunk
             source_name = "Unknown"
 
             try:
@@ -3802,8 +4160,7 @@ def create_app():
                         flash("กรุณาระบุ Google Sheet URL", "danger")
                         return redirect(url_for("import_products_view"))
 
-                    creds = get_google_credentials()
-                    client = gspread.authorize(creds)
+                    client = gsheet_sync.open_client(get_google_credentials)
 
                     try:
                         sh = client.open_by_url(sheet_url)
@@ -3842,15 +4199,18 @@ def create_app():
                     if not f:
                         flash("กรุณาเลือกไฟล์", "danger")
                         return redirect(url_for("import_products_view"))
-                    df = pd.read_excel(f)
+                    # ลบแถวว่างทิ้งระหว่างอ่าน (drop_blank)
+                    chunks = read_upload_chunks(f, drop_blank=True).chunks()
                     source_name = f.filename
 
                 # >>>> Process Import
                 if df is not None:
                     # ลบแถวว่างท้ายไฟล์ทิ้ง
                     df.dropna(how='all', inplace=True)
+                    chunks = [df]
 
-                    cnt = import_products(df)
+                if chunks is not None:
+                    cnt = import_products_chunks(chunks)
 
                     flash(f"✅ นำเข้าสินค้าสำเร็จ {cnt} รายการ (จาก {source_name})", "success")
                     return redirect(url_for("import_products_view"))
@@ -3870,6 +4230,16 @@ def create_app():
 
         return render_template("import_products.html", saved_url=saved_url, total_skus=total_skus)
 
+    # =========[ NEW ]========= งานนำเข้าสต็อกเบื้องหลัง
+    def _stock_import_message(cnt: int, source_text: str) -> str:
+        return f"✅ นำเข้าสต็อกสำเร็จ {cnt} SKU (Full Sync: SKU ที่ไม่อยู่ในไฟล์จะถูกตั้งเป็น 0) [จาก {source_text}]"
+
+    def _stock_import_job(job):
+        chunks = import_jobs.track_rows(read_upload_chunks(job.file_path).chunks(), job.progress)
+        cnt = import_stock_chunks(chunks, full_replace=True, progress=job.progress)
+        return {"message": _stock_import_message(cnt, "ไฟล์")}
+    # =========[ /NEW ]=========
+
     @app.route("/import/stock", methods=["GET", "POST"])
     @login_required
     def import_stock_view():
@@ -3891,6 +4261,7 @@ def create_app():
             
             try:
                 df = None
+                chunks = None  # ไฟล์ Excel -> อ่านทีละ chunk
                 
                 # ==== กรณีนำเข้าผ่าน Google Sheet ====
                 if mode == "gsheet":
@@ -3900,8 +4271,7 @@ def create_app():
                         return redirect(url_for("import_stock_view"))
                     
                     # 1. เชื่อมต่อ Google API
-                    creds = get_google_credentials()
-                    client = gspread.authorize(creds)
+                    client = gsheet_sync.open_client(get_google_credentials)
                     
                     # 2. เปิด Sheet และ Tab
                     try:
@@ -3946,13 +4316,20 @@ def create_app():
                     if not f:
                         flash("กรุณาเลือกไฟล์สต็อก", "danger")
                         return redirect(url_for("import_stock_view"))
-                    df = pd.read_excel(f)
+                    # =========[ NEW ]========= นำเข้าเบื้องหลัง (Full Sync สต็อกทำทีละไฟล์)
+                    if import_jobs.enabled():
+                        job_id = _submit_import_job("stock", f, ("stock",), _stock_import_job)
+                        return redirect(url_for("import_stock_view", import_job=job_id))
+                    # อ่านทีละ chunk แล้วรวมยอดใน temp table ก่อน sync ครั้งเดียว
+                    chunks = read_upload_chunks(f).chunks()
 
                 # ==== ส่ง DataFrame ไปเข้าฟังก์ชัน import_stock (Full Sync Mode) ====
                 if df is not None:
-                    cnt = import_stock(df, full_replace=True)
+                    chunks = [df]
+                if chunks is not None:
+                    cnt = import_stock_chunks(chunks, full_replace=True)
                     source_text = "Google Sheet" if mode == "gsheet" else "ไฟล์"
-                    flash(f"✅ นำเข้าสต็อกสำเร็จ {cnt} SKU (Full Sync: SKU ที่ไม่อยู่ในไฟล์จะถูกตั้งเป็น 0) [จาก {source_text}]", "success")
+                    flash(_stock_import_message(cnt, source_text), "success")
                     return redirect(url_for("import_stock_view"))
 
             except Exception as e:
@@ -3963,6 +4340,85 @@ def create_app():
 
         return render_template("import_stock.html", saved_url=saved_url)
 
+    # =========[ NEW ]========= นำเข้าใบสั่งขาย (ใช้ทั้ง Route และงานเบื้องหลัง)
+    def _run_sales_import(chunks, source_name: str, progress=None) -> tuple[str, str, ImportLog]:
+        """นำเข้า Sales จาก chunks + บันทึก ImportLog คืน (message, category, log)"""
+        if progress:
+            chunks = import_jobs.track_rows(chunks, progress)
+        # [แก้จุด B] เรียก Importer และรับ Dict กลับมา
+        result = import_sales_chunks(chunks, progress=progress)
+        success_ids = result.get('ids', [])
+        skipped_rows = result.get('skipped', [])
+
+        # นับจำนวนบรรทัดที่มีข้อมูล (Total) = สำเร็จ + ถูกข้าม (ทุกแถวถูกนับเป็นอย่างใดอย่างหนึ่ง)
+        total_rows = len(success_ids) + len(skipped_rows)
+
+        cnt = len(success_ids)
+        failed_cnt = len(skipped_rows)
+        app.logger.info(
+            f"[Import Sales] {len(result.get('changed_ids', []))} orders changed, "
+            f"{result.get('status_changed', 0)} status changes"
+        )
+
+        # Logging: บันทึกรายละเอียด error ลง application log
+        if failed_cnt > 0:
+            app.logger.warning(f"[Import Sales] พบ {failed_cnt} รายการที่ไม่สำเร็จจากทั้งหมด {total_rows} รายการ")
+
+            # แสดง error สูงสุด 5 รายการแรกใน log
+            error_summary = {}
+            for skip in skipped_rows[:5]:
+                reason = skip.get('reason', 'ไม่ทราบสาเหตุ')
+                error_summary[reason] = error_summary.get(reason, 0) + 1
+                app.logger.warning(
+                    f"  - Row {skip.get('row_number', 'N/A')}: {reason} "
+                    f"(Order ID: {skip.get('order_id', 'N/A')}, PO: {skip.get('po_no', 'N/A')})"
+                )
+
+            if failed_cnt > 5:
+                app.logger.warning(f"  ... และอีก {failed_cnt - 5} รายการ (ดูรายละเอียดใน batch_data)")
+
+        # [แก้จุด C] บันทึก Log พร้อมรายชื่อ ID และข้อมูล Failed
+        log = ImportLog(
+            import_date=now_thai().date(),
+            platform="SALES_SYSTEM",
+            shop_name="-",
+            filename=source_name,
+            added_count=cnt,
+            duplicates_count=0,
+            failed_count=failed_cnt,
+            batch_data=json.dumps({
+                "ids": success_ids,
+                "skipped": skipped_rows  # เก็บรายละเอียด failed items
+            })
+        )
+        db.session.add(log)
+        db.session.commit()
+
+        # สร้างข้อความแจ้งเตือนที่มีรายละเอียดมากขึ้น
+        msg = f"✅ อัปเดตข้อมูลสั่งขายสำเร็จ {cnt} รายการ"
+        if failed_cnt > 0:
+            # นับประเภทของ error
+            error_reasons = {}
+            for skip in skipped_rows:
+                reason = skip.get('reason', 'ไม่ทราบสาเหตุ')
+                error_reasons[reason] = error_reasons.get(reason, 0) + 1
+
+            msg += f" (ไม่สำเร็จ {failed_cnt} รายการ)"
+
+            # แสดงสาเหตุหลักๆ (สูงสุด 3 ประเภท)
+            if error_reasons:
+                top_errors = sorted(error_reasons.items(), key=lambda x: x[1], reverse=True)[:3]
+                error_detail = ", ".join([f"{reason}: {count}" for reason, count in top_errors])
+                msg += f" | สาเหตุหลัก: {error_detail}"
+
+        return msg, ("success" if failed_cnt == 0 else "warning"), log
+
+    def _sales_import_job(job):
+        chunks = read_upload_chunks(job.file_path, drop_blank=True).chunks()
+        msg, _, log = _run_sales_import(chunks, job.filename, progress=job.progress)
+        return {"message": msg, "import_log_id": log.id}
+    # =========[ /NEW ]=========
+
     @app.route("/import/sales", methods=["GET", "POST"])
     @login_required
     def import_sales_view():
@@ -3992,6 +4448,7 @@ def create_app():
         if request.method == "POST":
             mode = request.form.get("mode")
             df = None
+            chunks = None  # ไฟล์ Excel -> อ่านทีละ chunk
             source_name = "Unknown"
             
             try:
@@ -4002,8 +4459,7 @@ def create_app():
                         flash("กรุณาระบุ URL", "danger")
                         return redirect(url_for("import_sales_view"))
                     
-                    creds = get_google_credentials()
-                    client = gspread.authorize(creds)
+                    client = gsheet_sync.open_client(get_google_credentials)
                     
                     try:
                         sh = client.open_by_url(sheet_url)
@@ -4042,77 +4498,23 @@ def create_app():
                     if not f:
                         flash("กรุณาเลือกไฟล์", "danger")
                         return redirect(url_for("import_sales_view"))
-                    df = pd.read_excel(f)
+                    # =========[ NEW ]========= นำเข้าเบื้องหลัง (ใบสั่งขายทำทีละไฟล์)
+                    if import_jobs.enabled():
+                        job_id = _submit_import_job("sales", f, ("sales",), _sales_import_job)
+                        return redirect(url_for("import_sales_view", import_job=job_id))
+                    # ลบแถวว่างทิ้งระหว่างอ่าน (drop_blank)
+                    chunks = read_upload_chunks(f, drop_blank=True).chunks()
                     source_name = f.filename
 
                 # >>>> Process Import
                 if df is not None:
                     # [แก้จุด A] ลบแถวว่างท้ายไฟล์ทิ้ง (Clean Empty Rows)
                     df.dropna(how='all', inplace=True)
+                    chunks = [df]
 
-                    # นับจำนวนบรรทัดที่มีข้อมูล (Total)
-                    total_rows = len(df)
-
-                    # [แก้จุด B] เรียก Importer และรับ Dict กลับมา
-                    result = import_sales(df)
-                    success_ids = result.get('ids', [])
-                    skipped_rows = result.get('skipped', [])
-
-                    cnt = len(success_ids)
-                    failed_cnt = len(skipped_rows)
-
-                    # Logging: บันทึกรายละเอียด error ลง application log
-                    if failed_cnt > 0:
-                        app.logger.warning(f"[Import Sales] พบ {failed_cnt} รายการที่ไม่สำเร็จจากทั้งหมด {total_rows} รายการ")
-
-                        # แสดง error สูงสุด 5 รายการแรกใน log
-                        error_summary = {}
-                        for skip in skipped_rows[:5]:
-                            reason = skip.get('reason', 'ไม่ทราบสาเหตุ')
-                            error_summary[reason] = error_summary.get(reason, 0) + 1
-                            app.logger.warning(
-                                f"  - Row {skip.get('row_number', 'N/A')}: {reason} "
-                                f"(Order ID: {skip.get('order_id', 'N/A')}, PO: {skip.get('po_no', 'N/A')})"
-                            )
-
-                        if failed_cnt > 5:
-                            app.logger.warning(f"  ... และอีก {failed_cnt - 5} รายการ (ดูรายละเอียดใน batch_data)")
-
-                    # [แก้จุด C] บันทึก Log พร้อมรายชื่อ ID และข้อมูล Failed
-                    log = ImportLog(
-                        import_date=now_thai().date(),
-                        platform="SALES_SYSTEM",
-                        shop_name="-",
-                        filename=source_name,
-                        added_count=cnt,
-                        duplicates_count=0,
-                        failed_count=failed_cnt,
-                        batch_data=json.dumps({
-                            "ids": success_ids,
-                            "skipped": skipped_rows  # เก็บรายละเอียด failed items
-                        })
-                    )
-                    db.session.add(log)
-                    db.session.commit()
-
-                    # สร้างข้อความแจ้งเตือนที่มีรายละเอียดมากขึ้น
-                    msg = f"✅ อัปเดตข้อมูลสั่งขายสำเร็จ {cnt} รายการ"
-                    if failed_cnt > 0:
-                        # นับประเภทของ error
-                        error_reasons = {}
-                        for skip in skipped_rows:
-                            reason = skip.get('reason', 'ไม่ทราบสาเหตุ')
-                            error_reasons[reason] = error_reasons.get(reason, 0) + 1
-
-                        msg += f" (ไม่สำเร็จ {failed_cnt} รายการ)"
-
-                        # แสดงสาเหตุหลักๆ (สูงสุด 3 ประเภท)
-                        if error_reasons:
-                            top_errors = sorted(error_reasons.items(), key=lambda x: x[1], reverse=True)[:3]
-                            error_detail = ", ".join([f"{reason}: {count}" for reason, count in top_errors])
-                            msg += f" | สาเหตุหลัก: {error_detail}"
-
-                    flash(msg, "success" if failed_cnt == 0 else "warning")
+                if chunks is not None:
+                    msg, category, _ = _run_sales_import(chunks, source_name)
+                    flash(msg, category)
                     return redirect(url_for("import_sales_view"))
 
             except Exception as e:
@@ -4242,19 +4644,10 @@ def create_app():
         issued_subq = db.session.query(IssuedOrder.order_id)
         cancelled_subq = db.session.query(CancelledOrder.order_id)
 
-        sales_status_norm = func.lower(func.coalesce(Sales.status, ""))
+        # status_class จัดกลุ่มไว้ตอนนำเข้า (ใช้ index แทน LIKE หลายเงื่อนไข)
         packed_oids_subq = (
             db.session.query(Sales.order_id)
-            .filter(
-                or_(
-                    func.upper(func.coalesce(Sales.status, "")) == "PACKED",
-                    sales_status_norm.like("%packed%"),
-                    sales_status_norm.like("%แพ็ค%"),
-                    sales_status_norm.like("%ครบตามจำนวน%"),
-                    sales_status_norm.like("%เปิดใบขายครบตามจำนวนแล้ว%"),
-                    sales_status_norm.like("%opened_full%"),
-                )
-            )
+            .filter(Sales.status_class == SALES_PACKED)
             .distinct()
         )
 
@@ -4280,8 +4673,7 @@ def create_app():
             return redirect(url_for("dashboard", **request.args))
 
         cu = current_user()
-        sales_status = (getattr(ol, "sales_status", "") or "").upper()
-        if sales_status == "PACKED" or bool(getattr(ol, "packed", False)):
+        if _order_is_packed(ol.order_id):
             flash("รายการนี้ถูกแพ็คแล้ว (PACKED) — ไม่สามารถกดรับได้", "warning")
             return redirect(url_for("dashboard", **request.args))
 
@@ -4311,6 +4703,7 @@ def create_app():
         ol.accepted_by_user_id = cu.id if cu else None
         ol.accepted_by_username = cu.username if cu else None
         db.session.commit()
+        mark_skus_dirty([sku])
         flash(f"ทำเครื่องหมายกดรับ Order {ol.order_id} • SKU {sku} แล้ว", "success")
         return redirect(url_for("dashboard", **request.args))
 
@@ -4323,6 +4716,7 @@ def create_app():
         ol.accepted_by_user_id = None
         ol.accepted_by_username = None
         db.session.commit()
+        mark_skus_dirty([ol.sku])
         flash(f"ยกเลิกการกดรับ Order {ol.order_id} • SKU {getattr(ol, 'sku', '')}", "warning")
         return redirect(url_for("dashboard", **request.args))
 
@@ -4361,6 +4755,7 @@ def create_app():
             flash(f"ยกเลิก Order {order_id} สำเร็จ (เหตุผล: {reason})", "success")
 
         db.session.commit()
+        mark_orders_dirty([order_id])
         return redirect(url_for("dashboard", **request.args))
     # =========[ /NEW ]=========
 
@@ -4374,6 +4769,7 @@ def create_app():
             return redirect(url_for("dashboard", **request.args))
         success_count = 0
         error_messages = []
+        accepted_skus = set()
         for ol_id in order_line_ids:
             try:
                 ol = db.session.get(OrderLine, int(ol_id))
@@ -4387,8 +4783,7 @@ def create_app():
                 if db.session.query(CancelledOrder.id).filter_by(order_id=ol.order_id).first():
                     error_messages.append(f"Order {ol.order_id} ถูกยกเลิก")
                     continue
-                sales_status = (getattr(ol, "sales_status", "") or "").upper()
-                if sales_status == "PACKED" or bool(getattr(ol, "packed", False)):
+                if _order_is_packed(ol.order_id):
                     error_messages.append(f"Order {ol.order_id} ถูกแพ็คแล้ว")
                     continue
                 stock_qty = _calc_stock_qty_for_line(ol)
@@ -4416,11 +4811,13 @@ def create_app():
                 ol.accepted_at = now_thai()
                 ol.accepted_by_user_id = cu.id if cu else None
                 ol.accepted_by_username = cu.username if cu else None
+                accepted_skus.add(sku)
                 success_count += 1
             except Exception as e:
                 error_messages.append(f"Order ID {ol_id}: {str(e)}")
                 continue
         db.session.commit()
+        mark_skus_dirty(accepted_skus)
         if success_count > 0:
             flash(f"✅ กดรับสำเร็จ {success_count} รายการ", "success")
         if error_messages:
@@ -4438,6 +4835,7 @@ def create_app():
             flash("กรุณาเลือกรายการที่ต้องการยกเลิก", "warning")
             return redirect(url_for("dashboard", **request.args))
         success_count = 0
+        touched_skus = set()
         for ol_id in order_line_ids:
             try:
                 ol = db.session.get(OrderLine, int(ol_id))
@@ -4446,10 +4844,12 @@ def create_app():
                     ol.accepted_at = None
                     ol.accepted_by_user_id = None
                     ol.accepted_by_username = None
+                    touched_skus.add(ol.sku)
                     success_count += 1
             except Exception:
                 continue
         db.session.commit()
+        mark_skus_dirty(touched_skus)
         if success_count > 0:
             flash(f"✅ ยกเลิกสำเร็จ {success_count} รายการ", "success")
         return redirect(url_for("dashboard", **request.args))
@@ -4644,8 +5044,7 @@ def create_app():
             if not sale:
                 found_statuses.append("NOT_IN_SBS")
             else:
-                s_status = (sale.status or "").upper()
-                if "PACKED" in s_status or "แพ็คแล้ว" in s_status or "ครบตามจำนวน" in s_status:
+                if (sale.status_class or classify_sales_status(sale.status)) == SALES_PACKED:
                     found_statuses.append("PACKED")
 
             # 4. เช็ค Stock รายสินค้า
@@ -4798,7 +5197,7 @@ def create_app():
             filters = base_filters.copy()
             filters["active_only"] = False 
             filters["all_time"] = True
-            rows, _ = compute_allocation(db.session, filters)
+            rows, _ = _allocation_snapshot(base_filters).select(filters)
 
         elif mode == 'today':
             # Order ปัจจุบัน (วันนี้) + Order ที่ยกเลิกวันนี้
@@ -4809,21 +5208,17 @@ def create_app():
             filters["active_only"] = False
             filters["import_from"] = today
             filters["import_to"] = today
-            rows_import, _ = compute_allocation(db.session, filters)
+            rows_import, _ = _allocation_snapshot(base_filters).select(filters)
             
             # 2. ดึง Order ที่ "ยกเลิกวันนี้" (บวก 7 ชม. เพื่อให้ตรงกับเวลาไทย)
             cancel_today_oids = [
                 r[0] for r in db.session.query(CancelledOrder.order_id)
-                .filter(func.date(CancelledOrder.imported_at, '+7 hours') == today).all()
+                .filter(db_backend.thai_date(CancelledOrder.imported_at) == today).all()
             ]
             
             rows_cancel = []
             if cancel_today_oids:
-                f_cancel = base_filters.copy()
-                f_cancel["all_time"] = True
-                f_cancel["active_only"] = False
-                temp_rows, _ = compute_allocation(db.session, f_cancel)
-                rows_cancel = [r for r in temp_rows if r.get("order_id") in cancel_today_oids]
+                rows_cancel = _allocation_snapshot(base_filters).rows_for_orders(cancel_today_oids)
             
             # 3. รวมรายการ (ตัดตัวซ้ำด้วย id)
             seen_ids = set()
@@ -4842,13 +5237,13 @@ def create_app():
             filters["import_to"] = imp_to
             filters["date_from"] = d_from
             filters["date_to"] = d_to
-            rows, _ = compute_allocation(db.session, filters)
+            rows, _ = _allocation_snapshot(base_filters).select(filters)
             
         else:
             # Default View (Order ค้าง + จบงานวันนี้)
             f_active = base_filters.copy()
             f_active["active_only"] = True
-            rows_active, _ = compute_allocation(db.session, f_active)
+            rows_active, _ = _allocation_snapshot(base_filters).select(f_active)
             
             today = now_thai().date()
             f_inactive = base_filters.copy()
@@ -4856,7 +5251,7 @@ def create_app():
             f_inactive["import_from"] = today
             f_inactive["import_to"] = today
             
-            rows_today_all, _ = compute_allocation(db.session, f_inactive)
+            rows_today_all, _ = _allocation_snapshot(base_filters).select(f_inactive)
             
             existing_ids = set(r["id"] for r in rows_active)
             rows = list(rows_active)
@@ -4868,7 +5263,7 @@ def create_app():
         # --- 2. Post-Processing Rows ---
         # [แก้ไข] ใช้ _cancelled_oids_map แทน set เพื่อดึงเหตุผล (note) มาด้วย
         cancelled_map = _cancelled_oids_map()
-        packed_oids = _orders_packed_set(rows)
+        packed_oids = _orders_packed_set(rows, _allocation_snapshot(base_filters))
         orders_not_in_sbs = _orders_not_in_sbs_set(rows)
         orders_no_sales = _orders_no_sales_set(rows)
 
@@ -5213,7 +5608,7 @@ def create_app():
             "accepted_from": datetime.combine(acc_from, datetime.min.time(), tzinfo=TH_TZ) if acc_from else None,
             "accepted_to": datetime.combine(acc_to + timedelta(days=1), datetime.min.time(), tzinfo=TH_TZ) if acc_to else None,
         }
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = _allocation_snapshot(filters).select(filters)
         rows = _filter_out_cancelled_rows(rows)
         rows = [r for r in rows if r.get("accepted") and r.get("allocation_status") in ("ACCEPTED", "READY_ACCEPT")]
 
@@ -5301,7 +5696,7 @@ def create_app():
         selected_order_ids = [oid.strip() for oid in selected_order_ids.split(",") if oid.strip()]
 
         filters = {"platform": platform, "shop_id": int(shop_id) if shop_id else None, "import_date": None}
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = compute_allocation(db.session, filters, fresh=True)
         rows = _filter_out_cancelled_rows(rows)
         rows = [r for r in rows if r.get("accepted") and r.get("allocation_status") in ("ACCEPTED", "READY_ACCEPT")]
 
@@ -5433,6 +5828,9 @@ def create_app():
         
         # Get all orders that have been printed
         tbl = _ol_table_name()
+        # รวมคลัง order_lines_archive เฉพาะเมื่อช่วงวันที่พิมพ์ไปถึงวันที่พิมพ์ล่าสุดในคลัง
+        archive = _archive_needed("warehouse", None if q else (target_date or print_date_from or None))
+        src = _ol_source(archive)
         
         # Build query to get orders with print history
         if q:
@@ -5440,7 +5838,7 @@ def create_app():
             # ไม่สนวันที่พิมพ์ (Global Search in History)
             sql = text(f"""
                 SELECT DISTINCT order_id 
-                FROM {tbl} 
+                FROM {src} 
                 WHERE printed_warehouse > 0 
                 AND order_id LIKE :q
             """)
@@ -5450,9 +5848,9 @@ def create_app():
             # หมายเหตุ: printed_warehouse_at ถูกบันทึกเป็นเวลาไทยอยู่แล้ว (ไม่ต้อง +7)
             sql = text(f"""
                 SELECT DISTINCT order_id 
-                FROM {tbl} 
+                FROM {src} 
                 WHERE printed_warehouse > 0 
-                AND DATE(printed_warehouse_at) = :target_date
+                AND {_sql_date('printed_warehouse_at')} = :target_date
             """)
             result = db.session.execute(sql, {"target_date": target_date.isoformat()}).fetchall()
         elif print_date_from or print_date_to:
@@ -5461,16 +5859,16 @@ def create_app():
             sql_where = "WHERE printed_warehouse > 0"
             params = {}
             if print_date_from:
-                sql_where += " AND DATE(printed_warehouse_at) >= :pf"
+                sql_where += f" AND {_sql_date('printed_warehouse_at')} >= :pf"
                 params["pf"] = print_date_from
             if print_date_to:
-                sql_where += " AND DATE(printed_warehouse_at) <= :pt"
+                sql_where += f" AND {_sql_date('printed_warehouse_at')} <= :pt"
                 params["pt"] = print_date_to
-            sql = text(f"SELECT DISTINCT order_id FROM {tbl} {sql_where}")
+            sql = text(f"SELECT DISTINCT order_id FROM {src} {sql_where}")
             result = db.session.execute(sql, params).fetchall()
         else:
             # Get all printed orders
-            sql = text(f"SELECT DISTINCT order_id FROM {tbl} WHERE printed_warehouse > 0")
+            sql = text(f"SELECT DISTINCT order_id FROM {src} WHERE printed_warehouse > 0")
             result = db.session.execute(sql).fetchall()
         
         printed_order_ids = [row[0] for row in result if row[0]]
@@ -5506,7 +5904,9 @@ def create_app():
             "accepted_from": datetime.combine(acc_from, datetime.min.time(), tzinfo=TH_TZ) if acc_from else None,
             "accepted_to": datetime.combine(acc_to + timedelta(days=1), datetime.min.time(), tzinfo=TH_TZ) if acc_to else None,
         }
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = _allocation_snapshot(filters).select(filters)
+        if archive:
+            rows += _archived_allocation_rows(printed_order_ids, filters, rows)
         rows = _filter_out_cancelled_rows(rows)
         
         # Filter to only printed orders
@@ -5515,8 +5915,8 @@ def create_app():
         if logistic:
             rows = [r for r in rows if (r.get("logistic") or "").lower().find(logistic.lower()) >= 0]
         
-        _inject_print_counts_to_rows(rows, kind="warehouse")
-        _inject_scan_status(rows)  # Inject scan data before grouping
+        _inject_print_counts_to_rows(rows, kind="warehouse", archive=archive)
+        _inject_scan_status(rows, archive)  # Inject scan data before grouping
         rows = _group_rows_for_warehouse_report(rows)
         
         # [NEW] กรอง Round และ Print Count หลังจากจัดกลุ่มแล้ว
@@ -5549,12 +5949,12 @@ def create_app():
         # Get available print dates for dropdown
         # หมายเหตุ: printed_warehouse_at ถูกบันทึกเป็นเวลาไทยอยู่แล้ว (ไม่ต้อง +7)
         sql_dates = text(f"""
-            SELECT DISTINCT DATE(printed_warehouse_at) as print_date 
+            SELECT DISTINCT {_sql_date('printed_warehouse_at')} as print_date 
             FROM {tbl} 
             WHERE printed_warehouse > 0 AND printed_warehouse_at IS NOT NULL
             ORDER BY print_date DESC
         """)
-        available_dates = [row[0] for row in db.session.execute(sql_dates).fetchall()]
+        available_dates = _with_archived_print_days([row[0] for row in db.session.execute(sql_dates).fetchall()], "warehouse")
         
         return render_template(
             "report.html",
@@ -5611,7 +6011,7 @@ def create_app():
             "accepted_to": datetime.combine(acc_to + timedelta(days=1), datetime.min.time(), tzinfo=TH_TZ) if acc_to else None,
         }
         
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = _allocation_snapshot(filters).select(filters)
         rows = _filter_out_cancelled_rows(rows)
         rows = [r for r in rows if r.get("accepted") and r.get("allocation_status") in ("ACCEPTED", "READY_ACCEPT")]
 
@@ -5693,7 +6093,7 @@ def create_app():
                 SELECT DISTINCT order_id 
                 FROM {tbl} 
                 WHERE printed_warehouse > 0 
-                AND DATE(printed_warehouse_at) = :target_date
+                AND {_sql_date('printed_warehouse_at')} = :target_date
             """)
             result = db.session.execute(sql, {"target_date": target_date.isoformat()}).fetchall()
         else:
@@ -5720,7 +6120,7 @@ def create_app():
             "accepted_from": datetime.combine(acc_from, datetime.min.time(), tzinfo=TH_TZ) if acc_from else None,
             "accepted_to": datetime.combine(acc_to + timedelta(days=1), datetime.min.time(), tzinfo=TH_TZ) if acc_to else None,
         }
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = _allocation_snapshot(filters).select(filters)
         rows = _filter_out_cancelled_rows(rows)
         rows = [r for r in rows if (r.get("order_id") or "").strip() in printed_order_ids]
         
@@ -5795,7 +6195,7 @@ def create_app():
             "shop_id": int(shop_id) if shop_id else None,
             "import_date": None
         }
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = _allocation_snapshot(filters).select(filters)
         rows = _filter_out_cancelled_rows(rows)
         rows = _filter_out_issued_rows(rows)
         rows = _filter_out_lowstock_printed_rows(rows)  # <<<< NEW (ข้อ 2): ตัดออเดอร์ที่พิมพ์รายงานสินค้าน้อยออก
@@ -5811,18 +6211,17 @@ def create_app():
             for r in rows
             if "stock_qty" not in r and r.get("sku")
             and (r.get("order_id") or "").strip() not in packed_oids
-            and (str(r.get("sales_status") or "")).upper() != "PACKED"
+            and not _is_line_opened_full(r)
             and not bool(r.get("packed", False))
         }
         stock_map = _batch_stock_lookup(skus_to_lookup)
 
         for r in rows:
-            r = dict(r)
+            r = r.copy()
             # กรองออเดอร์ที่อยู่ในลิสต์แพ็คแล้วออก
             if (r.get("order_id") or "").strip() in packed_oids:
                 continue
-            sales_status = (str(r.get("sales_status") or "")).upper()
-            if sales_status == "PACKED" or bool(r.get("packed", False)):
+            if _is_line_opened_full(r) or bool(r.get("packed", False)):
                 continue
             if "stock_qty" not in r:
                 sku = (r.get("sku") or "").strip()
@@ -6107,13 +6506,17 @@ def create_app():
         # ถ้ามี action (กดปุ่มกรอง) หรือ q หรือ reset='all' แต่ไม่มีวันที่ -> ค้นหาทั้งหมด
 
         tbl = _ol_table_name()
+        # รวมคลัง order_lines_archive เฉพาะเมื่อช่วงวันที่พิมพ์ไปถึงวันที่พิมพ์ล่าสุดในคลัง
+        archive = bool(q or print_date_from or print_date_to) and \
+            _archive_needed("lowstock", None if q else (print_date_from or None))
+        src = _ol_source(archive)
         
         # ========================================================
         # [FIX] ดึงข้อมูลเฉพาะเมื่อ: มีคำค้นหา หรือ มีการเลือกวันที่
         # ========================================================
         if q:
             # กรณี 1: มีคำค้นหา -> ค้นหาทั้งหมด (Global Search)
-            sql = text(f"SELECT DISTINCT order_id FROM {tbl} WHERE printed_lowstock > 0")
+            sql = text(f"SELECT DISTINCT order_id FROM {src} WHERE printed_lowstock > 0")
             result = db.session.execute(sql).fetchall()
             printed_oids = [r[0] for r in result if r and r[0]]
         elif print_date_from or print_date_to:
@@ -6121,12 +6524,12 @@ def create_app():
             sql_where = "printed_lowstock > 0"
             params = {}
             if print_date_from:
-                sql_where += " AND DATE(printed_lowstock_at) >= :pf"
+                sql_where += f" AND {_sql_date('printed_lowstock_at')} >= :pf"
                 params["pf"] = print_date_from
             if print_date_to:
-                sql_where += " AND DATE(printed_lowstock_at) <= :pt"
+                sql_where += f" AND {_sql_date('printed_lowstock_at')} <= :pt"
                 params["pt"] = print_date_to
-            sql = text(f"SELECT DISTINCT order_id FROM {tbl} WHERE {sql_where}")
+            sql = text(f"SELECT DISTINCT order_id FROM {src} WHERE {sql_where}")
             result = db.session.execute(sql, params).fetchall()
             printed_oids = [r[0] for r in result if r and r[0]]
         else:
@@ -6134,8 +6537,8 @@ def create_app():
             printed_oids = []
 
         def _available_dates():
-            sql = text(f"SELECT DISTINCT DATE(printed_lowstock_at) as d FROM {tbl} WHERE printed_lowstock > 0 AND printed_lowstock_at IS NOT NULL ORDER BY d DESC")
-            return [r[0] for r in db.session.execute(sql).fetchall()]
+            sql = text(f"SELECT DISTINCT {_sql_date('printed_lowstock_at')} as d FROM {tbl} WHERE printed_lowstock > 0 AND printed_lowstock_at IS NOT NULL ORDER BY d DESC")
+            return _with_archived_print_days([r[0] for r in db.session.execute(sql).fetchall()], "lowstock")
 
         shops = Shop.query.order_by(Shop.name.asc()).all()
         
@@ -6184,7 +6587,9 @@ def create_app():
             "date_from": date_from_dt,
             "date_to": date_to_dt
         }
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = _allocation_snapshot(filters).select(filters)
+        if archive:
+            rows += _archived_allocation_rows(printed_oids, filters, rows)
         rows = _filter_out_cancelled_rows(rows)
         rows = [r for r in rows if (r.get("order_id") or "").strip() in printed_oids]
         
@@ -6215,7 +6620,7 @@ def create_app():
 
         safe = []
         for r in rows:
-            r = dict(r)
+            r = r.copy()
             r["logistic"] = r.get("logistic") or r.get("logistic_type") or "-"
             if "stock_qty" not in r:
                 sku = (r.get("sku") or "").strip()
@@ -6335,16 +6740,15 @@ def create_app():
         out.sort(key=_key, reverse=rev)
 
         order_ids = sorted({(r["order_no"] or "").strip() for r in out if r.get("order_no")})
-        counts_low = _get_print_counts_local(order_ids, "lowstock")
+        counts_low = _get_print_counts_local(order_ids, "lowstock", archive)
         for r in out:
             oid = (r.get("order_no") or "").strip()
             r["printed_count"] = int(counts_low.get(oid, 0))
 
         # ข้อ 1: ดึงเวลา printed_lowstock_at ต่อ order_id จาก DB
-        tbl = _ol_table_name()
         sql_ts = text(f"""
             SELECT order_id, MAX(printed_lowstock_at) AS ts
-            FROM {tbl}
+            FROM {src}
             WHERE order_id IN :oids AND printed_lowstock_at IS NOT NULL
             GROUP BY order_id
         """).bindparams(bindparam("oids", expanding=True))
@@ -6354,7 +6758,7 @@ def create_app():
             if not ts:
                 continue
             try:
-                dt = datetime.fromisoformat(ts)
+                dt = _db_datetime(ts)
                 if dt.tzinfo is None:
                     dt = TH_TZ.localize(dt)
                 ts_map[str(oid)] = dt
@@ -6370,10 +6774,9 @@ def create_app():
 
         # ดึงค่า lowstock_round จาก DB เพื่อให้แน่ใจว่าหน้าประวัติแสดงเลขรอบ (แก้ปัญหาเลขหาย)
         if order_ids:
-            tbl = _ol_table_name()
             sql = text(f"""
                 SELECT order_id, MAX(lowstock_round) AS r
-                  FROM {tbl}
+                  FROM {src}
                  WHERE order_id IN :oids
                  GROUP BY order_id
             """).bindparams(bindparam("oids", expanding=True))
@@ -6401,8 +6804,7 @@ def create_app():
 
         # [SCAN] ดึงข้อมูลการ Scan Order เพื่อส่งไปหน้าเว็บ
         if order_ids:
-            tbl = _ol_table_name()
-            sql_scan = text(f"SELECT order_id, MAX(scanned_at) FROM {tbl} WHERE order_id IN :oids GROUP BY order_id")
+            sql_scan = text(f"SELECT order_id, MAX(scanned_at) FROM {src} WHERE order_id IN :oids GROUP BY order_id")
             sql_scan = sql_scan.bindparams(bindparam("oids", expanding=True))
             res_scan = db.session.execute(sql_scan, {"oids": order_ids}).fetchall()
             scan_map = {str(r[0]): r[1] for r in res_scan if r[0]}
@@ -6460,7 +6862,7 @@ def create_app():
             "shop_id": int(shop_id) if shop_id else None,
             "import_date": None
         }
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = _allocation_snapshot(filters).select(filters)
         rows = _filter_out_cancelled_rows(rows)
         rows = _filter_out_issued_rows(rows)
         
@@ -6470,12 +6872,11 @@ def create_app():
         # ข้อ 4: กรอง PACKED
         safe = []
         for r in rows:
-            r = dict(r)
+            r = r.copy()
             # กรองออเดอร์ที่อยู่ในลิสต์แพ็คแล้วออก
             if (r.get("order_id") or "").strip() in packed_oids:
                 continue
-            sales_status = (str(r.get("sales_status") or "")).upper()
-            if sales_status == "PACKED" or bool(r.get("packed", False)):
+            if _is_line_opened_full(r) or bool(r.get("packed", False)):
                 continue
             if "stock_qty" not in r:
                 sku = (r.get("sku") or "").strip()
@@ -6694,7 +7095,7 @@ def create_app():
 
         # 1) ดึง allocation rows
         filters = {"platform": platform or None, "shop_id": int(shop_id) if shop_id else None, "import_date": None}
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = _allocation_snapshot(filters).select(filters)
         rows = _filter_out_cancelled_rows(rows)
         rows = _filter_out_issued_rows(rows)
 
@@ -6709,17 +7110,17 @@ def create_app():
             for r in rows
             if "stock_qty" not in r and r.get("sku")
             and (r.get("order_id") or "").strip() not in packed_oids
-            and (str(r.get("sales_status") or "")).upper() != "PACKED"
+            and not _is_line_opened_full(r)
             and not bool(r.get("packed", False))
         }
         stock_map = _batch_stock_lookup(skus_to_lookup)
 
         for r in rows:
-            r = dict(r)
+            r = r.copy()
             # กรองออเดอร์ที่อยู่ในลิสต์แพ็คแล้วออก
             if (r.get("order_id") or "").strip() in packed_oids:
                 continue
-            if (str(r.get("sales_status") or "")).upper() == "PACKED" or bool(r.get("packed", False)):
+            if _is_line_opened_full(r) or bool(r.get("packed", False)):
                 continue
             if "stock_qty" not in r:
                 sku = (r.get("sku") or "").strip()
@@ -7006,10 +7407,10 @@ def create_app():
             sql_where = "printed_nostock > 0"
             params = {}
             if print_date_from:
-                sql_where += " AND DATE(printed_nostock_at) >= :pf"
+                sql_where += f" AND {_sql_date('printed_nostock_at')} >= :pf"
                 params["pf"] = print_date_from
             if print_date_to:
-                sql_where += " AND DATE(printed_nostock_at) <= :pt"
+                sql_where += f" AND {_sql_date('printed_nostock_at')} <= :pt"
                 params["pt"] = print_date_to
             sql = text(f"SELECT DISTINCT order_id FROM {tbl} WHERE {sql_where}")
             result = db.session.execute(sql, params).fetchall()
@@ -7019,7 +7420,7 @@ def create_app():
             printed_oids = []
 
         def _available_dates():
-            sql = text(f"SELECT DISTINCT DATE(printed_nostock_at) as d FROM {tbl} WHERE printed_nostock > 0 AND printed_nostock_at IS NOT NULL ORDER BY d DESC")
+            sql = text(f"SELECT DISTINCT {_sql_date('printed_nostock_at')} as d FROM {tbl} WHERE printed_nostock > 0 AND printed_nostock_at IS NOT NULL ORDER BY d DESC")
             return [r[0] for r in db.session.execute(sql).fetchall()]
 
         shops = Shop.query.order_by(Shop.name.asc()).all()
@@ -7069,7 +7470,7 @@ def create_app():
             "date_from": date_from_dt,
             "date_to": date_to_dt
         }
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = _allocation_snapshot(filters).select(filters)
         rows = _filter_out_cancelled_rows(rows)
         rows = [r for r in rows if (r.get("order_id") or "").strip() in printed_oids]
         
@@ -7109,7 +7510,7 @@ def create_app():
         stock_map = _batch_stock_lookup(skus_to_lookup)
 
         for r in rows:
-            r = dict(r)
+            r = r.copy()
             r["logistic"] = r.get("logistic") or r.get("logistic_type") or "-"
             if "stock_qty" not in r:
                 sku = (r.get("sku") or "").strip()
@@ -7257,7 +7658,7 @@ def create_app():
             oid_str = str(row_ts[0]).strip()
             ts_str = row_ts[1]
             try:
-                dt = datetime.fromisoformat(ts_str)
+                dt = _db_datetime(ts_str)
                 if dt.tzinfo is None:
                     dt = TH_TZ.localize(dt)
                 ts_map[oid_str] = dt
@@ -7350,7 +7751,7 @@ def create_app():
         import_to_str = request.args.get("import_to")
         
         filters = {"platform": platform or None, "shop_id": int(shop_id) if shop_id else None, "import_date": None}
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = _allocation_snapshot(filters).select(filters)
         rows = _filter_out_cancelled_rows(rows)
         rows = _filter_out_issued_rows(rows)
         
@@ -7359,11 +7760,11 @@ def create_app():
         
         safe = []
         for r in rows:
-            r = dict(r)
+            r = r.copy()
             # กรองออเดอร์ที่อยู่ในลิสต์แพ็คแล้วออก
             if (r.get("order_id") or "").strip() in packed_oids:
                 continue
-            if (str(r.get("sales_status") or "")).upper() == "PACKED":
+            if _is_line_opened_full(r):
                 continue
             if "stock_qty" not in r:
                 sku = (r.get("sku") or "").strip()
@@ -7524,7 +7925,7 @@ def create_app():
 
         # 1) ดึง allocation rows
         filters = {"platform": platform or None, "shop_id": int(shop_id) if shop_id else None, "import_date": None}
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = _allocation_snapshot(filters).select(filters)
         rows = _filter_out_cancelled_rows(rows)
         rows = _filter_out_issued_rows(rows)
 
@@ -7538,18 +7939,18 @@ def create_app():
             for r in rows
             if "stock_qty" not in r and r.get("sku")
             and (r.get("order_id") or "").strip() not in packed_oids
-            and (str(r.get("sales_status") or "")).upper() != "PACKED"
+            and not _is_line_opened_full(r)
             and not bool(r.get("packed", False))
         }
         stock_map = _batch_stock_lookup(skus_to_lookup)
 
         for r in rows:
-            r = dict(r)
+            r = r.copy()
             # กรองออเดอร์ที่อยู่ในลิสต์แพ็คแล้วออก
             if (r.get("order_id") or "").strip() in packed_oids:
                 continue
             # หรือถ้า sales_status เป็น 'PACKED' ก็ข้ามไป
-            if (str(r.get("sales_status") or "")).upper() == "PACKED":
+            if _is_line_opened_full(r):
                 continue
             if bool(r.get("packed", False)):
                 continue
@@ -7742,7 +8143,7 @@ def create_app():
                 res_ts = db.session.execute(sql_ts, {"oids": oids}).fetchall()
                 for row in res_ts:
                     if row[1]:
-                        dt = datetime.fromisoformat(row[1])
+                        dt = _db_datetime(row[1])
                         if dt.tzinfo is None: dt = TH_TZ.localize(dt)
                         ts_map[str(row[0])] = dt
             except: pass
@@ -7873,10 +8274,10 @@ def create_app():
             sql_where = "printed_notenough > 0"
             params = {}
             if print_date_from:
-                sql_where += " AND DATE(printed_notenough_at) >= :pf"
+                sql_where += f" AND {_sql_date('printed_notenough_at')} >= :pf"
                 params["pf"] = print_date_from
             if print_date_to:
-                sql_where += " AND DATE(printed_notenough_at) <= :pt"
+                sql_where += f" AND {_sql_date('printed_notenough_at')} <= :pt"
                 params["pt"] = print_date_to
             sql = text(f"SELECT DISTINCT order_id FROM {tbl} WHERE {sql_where}")
             result = db.session.execute(sql, params).fetchall()
@@ -7886,7 +8287,7 @@ def create_app():
             printed_oids = []
 
         def _available_dates():
-            sql = text(f"SELECT DISTINCT DATE(printed_notenough_at) as d FROM {tbl} WHERE printed_notenough > 0 AND printed_notenough_at IS NOT NULL ORDER BY d DESC")
+            sql = text(f"SELECT DISTINCT {_sql_date('printed_notenough_at')} as d FROM {tbl} WHERE printed_notenough > 0 AND printed_notenough_at IS NOT NULL ORDER BY d DESC")
             return [r[0] for r in db.session.execute(sql).fetchall()]
 
         shops = Shop.query.order_by(Shop.name.asc()).all()
@@ -7937,7 +8338,7 @@ def create_app():
             "date_from": date_from_dt,
             "date_to": date_to_dt
         }
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = _allocation_snapshot(filters).select(filters)
         rows = _filter_out_cancelled_rows(rows)
         # [FIX] ในหน้าประวัติ (printed) ไม่กรอง Issued ออก เพราะเราเพิ่ง mark Issued ไป
         rows = [r for r in rows if (r.get("order_id") or "").strip() in printed_oids]
@@ -7972,13 +8373,13 @@ def create_app():
         
         safe = []
         for r in rows:
-            r = dict(r)
+            r = r.copy()
             oid = (r.get("order_id") or "").strip()
             if oid not in printed_oids:
                 continue
             if oid in packed_oids:
                 continue
-            if (str(r.get("sales_status") or "")).upper() == "PACKED":
+            if _is_line_opened_full(r):
                 continue
             if bool(r.get("packed", False)):
                 continue
@@ -8137,7 +8538,7 @@ def create_app():
                     oid_str = str(row_ts[0]).strip()
                     ts_str = row_ts[1]
                     try:
-                        dt = datetime.fromisoformat(ts_str)
+                        dt = _db_datetime(ts_str)
                         if dt.tzinfo is None:
                             dt = TH_TZ.localize(dt)
                         ts_map[oid_str] = dt
@@ -8240,7 +8641,7 @@ def create_app():
         import_to_str = request.args.get("import_to")
         
         filters = {"platform": platform or None, "shop_id": int(shop_id) if shop_id else None, "import_date": None}
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = _allocation_snapshot(filters).select(filters)
         rows = _filter_out_cancelled_rows(rows)
         rows = _filter_out_issued_rows(rows)
         
@@ -8248,10 +8649,10 @@ def create_app():
         
         safe = []
         for r in rows:
-            r = dict(r)
+            r = r.copy()
             if (r.get("order_id") or "").strip() in packed_oids:
                 continue
-            if (str(r.get("sales_status") or "")).upper() == "PACKED":
+            if _is_line_opened_full(r):
                 continue
             if "stock_qty" not in r:
                 sku = (r.get("sku") or "").strip()
@@ -8485,7 +8886,7 @@ def create_app():
             "accepted_from": None,  # ไม่กรองตรงนี้
             "accepted_to": None,    # ไม่กรองตรงนี้
         }
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = _allocation_snapshot(filters).select(filters)
         rows = _filter_out_cancelled_rows(rows)
 
         # ========================================================
@@ -8539,7 +8940,7 @@ def create_app():
                             pass_date = False  # ไม่มีวันที่พิมพ์ = ไม่ผ่าน
                         else:
                             try:
-                                dt_print = datetime.fromisoformat(wh_at_str)
+                                dt_print = _db_datetime(wh_at_str)
                                 if dt_print.tzinfo is None:
                                     dt_print = TH_TZ.localize(dt_print)
                                 if f_start and dt_print < f_start:
@@ -8557,7 +8958,7 @@ def create_app():
         # เตรียมข้อมูลปลอดภัย + ใส่ stock_qty ให้ครบ
         safe_rows = []
         for r in rows:
-            r = dict(r)
+            r = r.copy()
             if "stock_qty" not in r:
                 sku = (r.get("sku") or "").strip()
                 stock_qty = 0
@@ -8642,7 +9043,7 @@ def create_app():
             result = db.session.execute(sql, {"oids": order_ids}).first()
             if result:
                 try:
-                    dt = datetime.fromisoformat(result[0])
+                    dt = _db_datetime(result[0])
                     if dt.tzinfo is None:
                         dt = TH_TZ.localize(dt)
                     print_timestamp_overall = dt
@@ -8680,7 +9081,7 @@ def create_app():
             result = db.session.execute(sql, {"oids": order_ids}).first()
             if result and result[0]:
                 try:
-                    dt = datetime.fromisoformat(result[0])
+                    dt = _db_datetime(result[0])
                     if dt.tzinfo is None:
                         dt = TH_TZ.localize(dt)
                     warehouse_print_info = {
@@ -8748,12 +9149,12 @@ def create_app():
             [oid.strip() for oid in order_ids_raw.split(",") if oid.strip()]
 
         filters = {"platform": platform if platform else None, "shop_id": int(shop_id) if shop_id else None, "import_date": None}
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = compute_allocation(db.session, filters, fresh=True)
         rows = _filter_out_cancelled_rows(rows)
 
         safe_rows = []
         for r in rows:
-            r = dict(r)
+            r = r.copy()
             if "stock_qty" not in r:
                 sku = (r.get("sku") or "").strip()
                 stock_qty = 0
@@ -8803,8 +9204,9 @@ def create_app():
             try:
                 ins = text(
                     """
-                    INSERT OR IGNORE INTO action_dedupe(token, kind, created_at, user_id)
+                    INSERT INTO action_dedupe(token, kind, created_at, user_id)
                     VALUES (:t, :k, :at, :uid)
+                    ON CONFLICT (token) DO NOTHING
                     """
                 )
                 res = db.session.execute(
@@ -8850,6 +9252,7 @@ def create_app():
                 )
 
             db.session.commit()
+            mark_orders_dirty(oids)
         else:
             flash("ตรวจพบการส่งซ้ำ ระบบจึงไม่บวกจำนวนครั้งพิมพ์เพิ่ม", "warning")
 
@@ -9031,6 +9434,9 @@ def create_app():
         
         # Get all orders that have been printed for picking
         tbl = _ol_table_name()
+        # รวมคลัง order_lines_archive เฉพาะเมื่อวันที่พิมพ์ไปถึงวันที่พิมพ์ล่าสุดในคลัง
+        archive = _archive_needed("picking", target_date)
+        src = _ol_source(archive)
         
         # Build query to get orders with print history
         if target_date:
@@ -9038,14 +9444,14 @@ def create_app():
             # หมายเหตุ: printed_picking_at ถูกบันทึกเป็นเวลาไทยอยู่แล้ว (ไม่ต้อง +7)
             sql = text(f"""
                 SELECT DISTINCT order_id 
-                FROM {tbl} 
+                FROM {src} 
                 WHERE printed_picking > 0 
-                AND DATE(printed_picking_at) = :target_date
+                AND {_sql_date('printed_picking_at')} = :target_date
             """)
             result = db.session.execute(sql, {"target_date": target_date.isoformat()}).fetchall()
         else:
             # Get all printed orders
-            sql = text(f"SELECT DISTINCT order_id FROM {tbl} WHERE printed_picking > 0")
+            sql = text(f"SELECT DISTINCT order_id FROM {src} WHERE printed_picking > 0")
             result = db.session.execute(sql).fetchall()
         
         printed_order_ids = [row[0] for row in result if row[0]]
@@ -9087,7 +9493,9 @@ def create_app():
             "accepted_from": None,  # ไม่กรองตรงนี้
             "accepted_to": None,    # ไม่กรองตรงนี้
         }
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = _allocation_snapshot(filters).select(filters)
+        if archive:
+            rows += _archived_allocation_rows(printed_order_ids, filters, rows)
         rows = _filter_out_cancelled_rows(rows)
         
         # [แก้ไข] ดึงเวลาพิมพ์ Warehouse มาเพื่อกรองด้วย printed_warehouse_at
@@ -9095,14 +9503,14 @@ def create_app():
         wh_print_map = {}
         dispatch_round_map = {}  # [NEW] เก็บ dispatch_round ของแต่ละ order+sku
         if all_oids:
-            sql = text(f"SELECT order_id, MAX(printed_warehouse_at) FROM {tbl} WHERE order_id IN :oids GROUP BY order_id")
+            sql = text(f"SELECT order_id, MAX(printed_warehouse_at) FROM {src} WHERE order_id IN :oids GROUP BY order_id")
             sql = sql.bindparams(bindparam("oids", expanding=True))
             res = db.session.execute(sql, {"oids": all_oids}).fetchall()
             for row in res:
                 wh_print_map[row[0]] = row[1]
             
             # [NEW] ดึง dispatch_round แยกตาม order_id + sku (ระดับบรรทัด)
-            sql_dr = text(f"SELECT order_id, sku, dispatch_round FROM {tbl} WHERE order_id IN :oids AND dispatch_round IS NOT NULL")
+            sql_dr = text(f"SELECT order_id, sku, dispatch_round FROM {src} WHERE order_id IN :oids AND dispatch_round IS NOT NULL")
             sql_dr = sql_dr.bindparams(bindparam("oids", expanding=True))
             res_dr = db.session.execute(sql_dr, {"oids": all_oids}).fetchall()
             for row_dr in res_dr:
@@ -9126,7 +9534,7 @@ def create_app():
                 if not wh_at_str:
                     continue  # ไม่มีวันที่พิมพ์ Warehouse -> ข้าม
                 try:
-                    dt_print = datetime.fromisoformat(wh_at_str)
+                    dt_print = _db_datetime(wh_at_str)
                     if dt_print.tzinfo is None:
                         dt_print = TH_TZ.localize(dt_print)
                     if f_start and dt_print < f_start:
@@ -9136,7 +9544,7 @@ def create_app():
                 except Exception:
                     continue
             
-            r = dict(r)
+            r = r.copy()
             if "stock_qty" not in r:
                 sku = (r.get("sku") or "").strip()
                 stock_qty = 0
@@ -9180,7 +9588,7 @@ def create_app():
                 # ดึง order_ids ที่มี print count ตามเงื่อนไข
                 temp_oids = sorted({(r.get("order_id") or "").strip() for r in safe_rows if r.get("order_id")})
                 if temp_oids:
-                    pc_map = _get_print_counts_local(temp_oids, "picking")
+                    pc_map = _get_print_counts_local(temp_oids, "picking", archive)
                     # กรองเฉพาะ order ที่มี print count ตรงกับที่ระบุ
                     valid_oids = {oid for oid, cnt in pc_map.items() if cnt == target_pc}
                     safe_rows = [r for r in safe_rows if (r.get("order_id") or "").strip() in valid_oids]
@@ -9199,6 +9607,10 @@ def create_app():
             """)
             rounds_result = db.session.execute(rounds_sql).fetchall()
             available_rounds = [r[0] for r in rounds_result if r[0] is not None]
+            archived_rounds = order_archive.distinct_values(
+                db.session.connection(), "dispatch_round", "printed_picking > 0 AND dispatch_round IS NOT NULL")
+            if archived_rounds:
+                available_rounds = sorted(set(available_rounds) | archived_rounds)
         except Exception:
             pass
         
@@ -9210,19 +9622,19 @@ def create_app():
         # [แก้ไข] เพิ่ม "ISSUED" เพื่อให้หน้าประวัติ (ที่จ่ายงานแล้ว) นับ order ได้ถูกต้อง
         valid_rows = [r for r in safe_rows if r.get("accepted") and r.get("allocation_status") in ("ACCEPTED", "READY_ACCEPT", "ISSUED")]
         order_ids = sorted({(r.get("order_id") or "").strip() for r in valid_rows if r.get("order_id")})
-        print_counts_pick = _get_print_counts_local(order_ids, "picking")
+        print_counts_pick = _get_print_counts_local(order_ids, "picking", archive)
         print_count_overall = max(print_counts_pick.values()) if print_counts_pick else 0
         
         # Get the latest print timestamp and user
         print_timestamp_overall = None
         print_user_overall = None
         if order_ids:
-            sql = text(f"SELECT printed_picking_at, printed_picking_by FROM {tbl} WHERE order_id IN :oids AND printed_picking_at IS NOT NULL ORDER BY printed_picking_at DESC LIMIT 1")
+            sql = text(f"SELECT printed_picking_at, printed_picking_by FROM {src} WHERE order_id IN :oids AND printed_picking_at IS NOT NULL ORDER BY printed_picking_at DESC LIMIT 1")
             sql = sql.bindparams(bindparam("oids", expanding=True))
             result = db.session.execute(sql, {"oids": order_ids}).first()
             if result:
                 try:
-                    dt = datetime.fromisoformat(result[0])
+                    dt = _db_datetime(result[0])
                     if dt.tzinfo is None:
                         dt = TH_TZ.localize(dt)
                     print_timestamp_overall = dt
@@ -9274,12 +9686,12 @@ def create_app():
         # Get available print dates for dropdown
         # หมายเหตุ: printed_picking_at ถูกบันทึกเป็นเวลาไทยอยู่แล้ว (ไม่ต้อง +7)
         sql_dates = text(f"""
-            SELECT DISTINCT DATE(printed_picking_at) as print_date 
+            SELECT DISTINCT {_sql_date('printed_picking_at')} as print_date 
             FROM {tbl} 
             WHERE printed_picking > 0 AND printed_picking_at IS NOT NULL
             ORDER BY print_date DESC
         """)
-        available_dates = [row[0] for row in db.session.execute(sql_dates).fetchall()]
+        available_dates = _with_archived_print_days([row[0] for row in db.session.execute(sql_dates).fetchall()], "picking")
         
         return render_template(
             "picking.html",
@@ -9335,7 +9747,7 @@ def create_app():
             "accepted_from": datetime.combine(acc_from, datetime.min.time(), tzinfo=TH_TZ) if acc_from else None,
             "accepted_to": datetime.combine(acc_to + timedelta(days=1), datetime.min.time(), tzinfo=TH_TZ) if acc_to else None,
         }
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = _allocation_snapshot(filters).select(filters)
         rows = _filter_out_cancelled_rows(rows)
         
         # *** [NEW LOGIC] กรองเฉพาะ Order ที่พิมพ์คลังแล้ว แต่ยังไม่พิมพ์หยิบ ***
@@ -9355,7 +9767,7 @@ def create_app():
 
         safe_rows = []
         for r in rows:
-            r = dict(r)
+            r = r.copy()
             if "stock_qty" not in r:
                 sku = (r.get("sku") or "").strip()
                 stock_qty = 0
@@ -9470,7 +9882,7 @@ def create_app():
                 SELECT DISTINCT order_id 
                 FROM {tbl} 
                 WHERE printed_picking > 0 
-                AND DATE(printed_picking_at) = :target_date
+                AND {_sql_date('printed_picking_at')} = :target_date
             """)
             result = db.session.execute(sql, {"target_date": target_date.isoformat()}).fetchall()
         else:
@@ -9496,7 +9908,7 @@ def create_app():
             "accepted_from": datetime.combine(acc_from, datetime.min.time(), tzinfo=TH_TZ) if acc_from else None,
             "accepted_to": datetime.combine(acc_to + timedelta(days=1), datetime.min.time(), tzinfo=TH_TZ) if acc_to else None,
         }
-        rows, _ = compute_allocation(db.session, filters)
+        rows, _ = _allocation_snapshot(filters).select(filters)
         rows = _filter_out_cancelled_rows(rows)
         
         # Filter to only printed orders
@@ -9504,7 +9916,7 @@ def create_app():
         for r in rows:
             if (r.get("order_id") or "").strip() not in printed_order_ids:
                 continue
-            r = dict(r)
+            r = r.copy()
             if "stock_qty" not in r:
                 sku = (r.get("sku") or "").strip()
                 stock_qty = 0
@@ -9620,8 +10032,11 @@ def create_app():
                 today_lines = db.session.query(OrderLine.order_id).filter(OrderLine.import_date == today).all()
                 today_oids = list(set(r[0] for r in today_lines if r[0]))
                 
-                # ลบข้อมูลจริง
-                deleted = OrderLine.query.filter(OrderLine.import_date == today).delete(synchronize_session=False)
+                # ลบข้อมูลจริง (รวมคลัง)
+                deleted = sum(
+                    line.query.filter(line.import_date == today).delete(synchronize_session=False)
+                    for line in (OrderLine, OrderLineArchive)
+                )
                 
                 # [เพิ่ม] ลบข้อมูลในถังขยะที่เกี่ยวข้องกับ ID พวกนี้
                 del_bin = 0
@@ -9657,16 +10072,16 @@ def create_app():
                         # 2. เช็คว่าติ๊ก "ออเดอร์" ไหม
                         if "orders" in targets:
                             # [แก้ไข] หา order_id ก่อนลบ เพื่อตามไปลบในถังขยะด้วย
-                            lines_q = db.session.query(OrderLine.order_id).filter(
-                                OrderLine.import_date >= d_from,
-                                OrderLine.import_date <= d_to
-                            )
-                            target_oids = list(set(r[0] for r in lines_q.all() if r[0]))
-                            
-                            del_orders = OrderLine.query.filter(
-                                OrderLine.import_date >= d_from,
-                                OrderLine.import_date <= d_to
-                            ).delete(synchronize_session=False)
+                            # ลบทั้ง order_lines และคลัง (ไม่งั้นนำเข้าใหม่จะถูกนับเป็น Order ซ้ำกับคลัง)
+                            target_oids, del_orders = set(), 0
+                            for line in (OrderLine, OrderLineArchive):
+                                lines_q = line.query.filter(
+                                    line.import_date >= d_from,
+                                    line.import_date <= d_to
+                                )
+                                target_oids.update(r[0] for r in lines_q.with_entities(line.order_id) if r[0])
+                                del_orders += lines_q.delete(synchronize_session=False)
+                            target_oids = list(target_oids)
                             
                             # ลบในถังขยะด้วย (Cascading delete logic)
                             del_bin = 0
@@ -9701,10 +10116,14 @@ def create_app():
                             dt_start_utc = dt_start - timedelta(hours=7)
                             dt_end_utc = dt_end - timedelta(hours=7)
                             
-                            del_cancelled = CancelledOrder.query.filter(
+                            cancel_q = CancelledOrder.query.filter(
                                 CancelledOrder.imported_at >= dt_start_utc,
                                 CancelledOrder.imported_at <= dt_end_utc
-                            ).delete(synchronize_session=False)
+                            )
+                            uncancelled_ids = [r[0] for r in cancel_q.with_entities(CancelledOrder.order_id)]
+                            del_cancelled = cancel_q.delete(synchronize_session=False)
+                            # Order ที่ยกเลิกคืนและอยู่ในคลังแล้ว -> ย้ายกลับ order_lines (ถ้ายังไม่แพ็ค)
+                            order_archive.restore_unfinished(db.session.connection(), uncancelled_ids)
                             msg_parts.append(f"ยกเลิก {del_cancelled} รายการ")
                         
                         # [เพิ่ม] 6. เช็คว่าติ๊ก "ประวัติการลบ" ไหม
@@ -9728,8 +10147,8 @@ def create_app():
                         flash(f"เกิดข้อผิดพลาดในการลบ: {e}", "danger")
                 
             elif scope == "all":
-                # 1. ลบรายการสินค้า
-                deleted = OrderLine.query.delete()
+                # 1. ลบรายการสินค้า (รวมคลัง)
+                deleted = OrderLine.query.delete() + OrderLineArchive.query.delete()
                 # 2. ลบถังขยะ
                 del_bin = db.session.query(DeletedOrder).delete()
                 # 3. [เพิ่ม] ลบประวัติการจ่ายงาน (Issued)
@@ -9752,10 +10171,11 @@ def create_app():
                 cancelled_order_ids = [co.order_id for co in cancelled_orders]
                 
                 if cancelled_order_ids:
-                    # Delete OrderLine records
-                    deleted_lines = OrderLine.query.filter(
-                        OrderLine.order_id.in_(cancelled_order_ids)
-                    ).delete(synchronize_session=False)
+                    # Delete OrderLine records (รวมคลัง)
+                    deleted_lines = sum(
+                        line.query.filter(line.order_id.in_(cancelled_order_ids)).delete(synchronize_session=False)
+                        for line in (OrderLine, OrderLineArchive)
+                    )
                     
                     # Delete CancelledOrder records
                     deleted_cancelled = CancelledOrder.query.delete()
@@ -9771,10 +10191,11 @@ def create_app():
                 issued_order_ids = [io.order_id for io in issued_orders]
                 
                 if issued_order_ids:
-                    # Delete OrderLine records
-                    deleted_lines = OrderLine.query.filter(
-                        OrderLine.order_id.in_(issued_order_ids)
-                    ).delete(synchronize_session=False)
+                    # Delete OrderLine records (รวมคลัง)
+                    deleted_lines = sum(
+                        line.query.filter(line.order_id.in_(issued_order_ids)).delete(synchronize_session=False)
+                        for line in (OrderLine, OrderLineArchive)
+                    )
                     
                     # Delete IssuedOrder records
                     deleted_issued = IssuedOrder.query.delete()
@@ -9815,6 +10236,8 @@ def create_app():
                 db.session.commit()
                 flash(f"ยกเลิกสถานะบิลเปล่าวันนี้แล้ว ({affected_lines} รายการ, ลบ log {deleted_logs} รายการ)", "success")
 
+            # การล้างข้อมูลกระทบหลาย SKU/หลายตาราง -> ให้คำนวณจัดสรรใหม่ทั้งหมด
+            mark_all_dirty()
             return redirect(url_for("admin_clear"))
         
         # GET request - show stats
@@ -9860,6 +10283,7 @@ def create_app():
         new_order_ids = []
         duplicate_order_ids = []
         failed_order_ids = []
+        seen_new, seen_dup = set(), set()  # เช็คซ้ำด้วย set, list ไว้คืนผลตามลำดับ
 
         for idx, row in df.iterrows():
             order_id = str(row.get(order_col, "")).strip()
@@ -9869,18 +10293,9 @@ def create_app():
 
             try:
                 # อัพเดต OrderLine ทั้งหมดที่มี order_id นี้
-                # เนื่องจาก allocation_status อาจไม่มีคอลัมน์ใน DB
-                # เราจะใช้วิธีเพิ่มคอลัมน์ถ้ายังไม่มี (SQLite รองรับ)
+                # (คอลัมน์ allocation_status เพิ่มโดย migration ตอนบูต)
                 lines = OrderLine.query.filter_by(order_id=order_id).all()
                 if lines:
-                    # ลองเพิ่มคอลัมน์ถ้ายังไม่มี (SQLite จะ ignore ถ้ามีอยู่แล้ว)
-                    try:
-                        db.session.execute(text("ALTER TABLE order_lines ADD COLUMN allocation_status TEXT"))
-                        db.session.commit()
-                    except Exception:
-                        db.session.rollback()
-                        pass  # คอลัมน์มีอยู่แล้ว หรือ error อื่น
-
                     # ตรวจสอบว่า Order นี้เป็น BILL_EMPTY อยู่แล้วหรือไม่
                     # ถ้า OrderLine ใดๆ ใน Order นี้มี allocation_status = 'BILL_EMPTY' อยู่แล้ว = Duplicate
                     is_already_bill_empty = any(
@@ -9900,11 +10315,13 @@ def create_app():
 
                     # นับแยก new กับ duplicate
                     if is_already_bill_empty:
-                        if order_id not in duplicate_order_ids:
+                        if order_id not in seen_dup:
+                            seen_dup.add(order_id)
                             duplicate_order_ids.append(order_id)
                             duplicate_count += 1
                     else:
-                        if order_id not in new_order_ids:
+                        if order_id not in seen_new:
+                            seen_new.add(order_id)
                             new_order_ids.append(order_id)
                             new_count += 1
                 else:
@@ -9913,7 +10330,72 @@ def create_app():
                 failed_order_ids.append(f"Order {order_id}: {str(e)}")
 
         db.session.commit()
+        mark_orders_dirty(new_order_ids + duplicate_order_ids)
         return new_count, duplicate_count, new_order_ids, duplicate_order_ids, failed_order_ids
+
+    def _update_bill_empty_status_from_chunks(chunks, progress=None) -> tuple[int, int, list[str], list[str], list[str]]:
+        """_update_bill_empty_status_from_df ทีละ chunk (ingest.read_upload_chunks) แล้วรวมผล"""
+        new_order_ids: list[str] = []
+        duplicate_order_ids: list[str] = []
+        failed_order_ids: list[str] = []
+        # set คู่กับ list ไว้เช็คซ้ำ (list เก็บลำดับไว้คืนผล)
+        seen_new: set[str] = set()
+        seen_dup: set[str] = set()
+        for chunk in chunks:
+            _, _, new_ids, dup_ids, failed_ids = _update_bill_empty_status_from_df(chunk)
+            for oid in new_ids:
+                if oid not in seen_new:
+                    seen_new.add(oid)
+                    new_order_ids.append(oid)
+            # Order ที่ chunk ก่อนหน้าของไฟล์เดียวกันเพิ่งตั้งเป็นบิลเปล่า ไม่นับเป็นซ้ำ
+            for oid in dup_ids:
+                if oid not in seen_dup and oid not in seen_new:
+                    seen_dup.add(oid)
+                    duplicate_order_ids.append(oid)
+            failed_order_ids.extend(failed_ids)
+            if progress:
+                progress(added=len(new_order_ids), duplicates=len(duplicate_order_ids), failed=len(failed_order_ids))
+        return len(new_order_ids), len(duplicate_order_ids), new_order_ids, duplicate_order_ids, failed_order_ids
+
+    def _run_bill_empty_import(chunks, filename: str, progress=None):
+        """อัพเดตบิลเปล่าจาก chunks + บันทึก ImportLog
+        Returns: (new_count, duplicate_count, new_order_ids, duplicate_order_ids, failed_order_ids, log_entry)"""
+        if progress:
+            chunks = import_jobs.track_rows(chunks, progress)
+        new_count, duplicate_count, new_ids, duplicate_ids, failed_ids = _update_bill_empty_status_from_chunks(
+            chunks, progress=progress
+        )
+
+        # บันทึก ImportLog (นับเฉพาะ new orders, ไม่นับ duplicate)
+        log_entry = ImportLog(
+            import_date=now_thai().date(),
+            platform='EMPTY_BILL_SYSTEM',
+            filename=filename,
+            added_count=new_count,
+            duplicates_count=duplicate_count,
+            failed_count=len(failed_ids),
+            error_details=json.dumps(failed_ids[:10], ensure_ascii=False) if failed_ids else "[]"
+        )
+        if hasattr(log_entry, 'shop_name'):
+            log_entry.shop_name = ""
+        if hasattr(log_entry, 'batch_data'):
+            log_entry.batch_data = json.dumps({
+                "new_ids": new_ids,
+                "duplicate_ids": duplicate_ids,
+                "failed_ids": failed_ids[:50]  # จำกัดจำนวน
+            }, ensure_ascii=False)
+        db.session.add(log_entry)
+        db.session.commit()
+        return new_count, duplicate_count, new_ids, duplicate_ids, failed_ids, log_entry
+
+    def _bill_empty_import_job(job):
+        new_count, duplicate_count, _, _, failed_ids, log_entry = _run_bill_empty_import(
+            read_upload_chunks(job.file_path).chunks(), job.filename, progress=job.progress
+        )
+        return {
+            "message": f"อัพเดตสถานะบิลเปล่า: ใหม่ {new_count} | ซ้ำ {duplicate_count} | ไม่สำเร็จ {len(failed_ids)} Order",
+            "import_log_id": log_entry.id,
+        }
     
     @app.route("/import/bill_empty", methods=["GET", "POST"])
     @login_required
@@ -9922,12 +10404,6 @@ def create_app():
         หน้าสำหรับนำเข้าบิลเปล่า (Empty Bill)
         ใช้สำหรับกรณีที่ต้องการนำเข้าข้อมูลออเดอร์ที่ไม่มีสินค้า
         """
-        # ตรวจสอบให้ ImportLog table มีอยู่
-        try:
-            ImportLog.__table__.create(bind=db.engine, checkfirst=True)
-        except Exception:
-            pass
-
         if request.method == "POST":
             mode = request.form.get("mode")  # "excel" or "gsheet"
             platform = request.form.get("platform")
@@ -9941,32 +10417,15 @@ def create_app():
                     return redirect(url_for("import_bill_empty_view"))
                 
                 try:
-                    df = pd.read_excel(f)
-                    new_count, duplicate_count, new_ids, duplicate_ids, failed_ids = _update_bill_empty_status_from_df(df)
+                    # =========[ NEW ]========= นำเข้าเบื้องหลัง
+                    if import_jobs.enabled():
+                        job_id = _submit_import_job("bill_empty", f, ("bill_empty",), _bill_empty_import_job)
+                        return redirect(url_for("import_bill_empty_view", import_job=job_id))
 
-                    # บันทึก ImportLog (นับเฉพาะ new orders, ไม่นับ duplicate)
-                    current_import_date = now_thai().date()
                     filename = f.filename if hasattr(f, 'filename') else "Excel File"
-
-                    log_entry = ImportLog(
-                        import_date=current_import_date,
-                        platform='EMPTY_BILL_SYSTEM',
-                        filename=filename,
-                        added_count=new_count,
-                        duplicates_count=duplicate_count,
-                        failed_count=len(failed_ids),
-                        error_details=json.dumps(failed_ids[:10], ensure_ascii=False) if failed_ids else "[]"
+                    new_count, duplicate_count, new_ids, duplicate_ids, failed_ids, _ = _run_bill_empty_import(
+                        read_upload_chunks(f).chunks(), filename
                     )
-                    if hasattr(log_entry, 'shop_name'):
-                        log_entry.shop_name = ""
-                    if hasattr(log_entry, 'batch_data'):
-                        log_entry.batch_data = json.dumps({
-                            "new_ids": new_ids,
-                            "duplicate_ids": duplicate_ids,
-                            "failed_ids": failed_ids[:50]  # จำกัดจำนวน
-                        }, ensure_ascii=False)
-                    db.session.add(log_entry)
-                    db.session.commit()
 
                     # Flash messages แสดงผลแยก new/duplicate/failed
                     if new_count > 0:
@@ -9992,8 +10451,7 @@ def create_app():
                 
                 try:
                     # 1. เชื่อมต่อ Google API
-                    creds = get_google_credentials()
-                    client = gspread.authorize(creds)
+                    client = gsheet_sync.open_client(get_google_credentials)
                     
                     # 2. เปิด Google Sheet
                     sheet = client.open_by_url(sheet_url)
@@ -10219,16 +10677,23 @@ def create_app():
     BACKUP_DIR.mkdir(exist_ok=True)
 
     def get_db_path():
-        """Get the current database file path"""
-        volume_path = os.getenv('RAILWAY_VOLUME_MOUNT_PATH')
-        if volume_path:
-            return os.path.join(volume_path, 'data.db')
-        return 'data.db'
+        """Get the current database file path (None when DATABASE_URL points to PostgreSQL)"""
+        return db_backend.sqlite_path(app.config["SQLALCHEMY_DATABASE_URI"])
+
+    PG_BACKUP_MESSAGE = 'File backup is only available for SQLite; back up PostgreSQL with pg_dump or the provider snapshots'
+
+    def write_db_snapshot(db_path, zipf):
+        """Add a consistent copy of the database (including WAL content) to an open zip"""
+        import tempfile
+
+        with tempfile.TemporaryDirectory(dir=BACKUP_DIR) as tmp:
+            snapshot = db_tuning.backup_copy(db_path, os.path.join(tmp, 'data.db'))
+            zipf.write(snapshot, arcname='data.db')
 
     def create_backup_zip(db_path, output_path):
         """Create a zip file of the database"""
         with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            zipf.write(db_path, arcname='data.db')
+            write_db_snapshot(db_path, zipf)
         return output_path
 
     def cleanup_old_backups(max_backups=7):
@@ -10250,6 +10715,9 @@ def create_app():
         """Auto backup function to be called by scheduler"""
         try:
             db_path = get_db_path()
+            if not db_path:
+                app.logger.info(f"Auto backup skipped: {PG_BACKUP_MESSAGE}")
+                return
             if not os.path.exists(db_path):
                 app.logger.error("Database file not found for auto backup")
                 return
@@ -10272,13 +10740,15 @@ def create_app():
             import io
 
             db_path = get_db_path()
+            if not db_path:
+                return jsonify({'error': PG_BACKUP_MESSAGE}), 400
             if not os.path.exists(db_path):
                 return jsonify({'error': 'Database file not found'}), 404
 
             # Create zip file in memory
             memory_file = io.BytesIO()
             with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                zipf.write(db_path, arcname='data.db')
+                write_db_snapshot(db_path, zipf)
 
             # Seek to beginning of stream
             memory_file.seek(0)
@@ -10300,6 +10770,8 @@ def create_app():
         """Create a manual backup"""
         try:
             db_path = get_db_path()
+            if not db_path:
+                return jsonify({'error': PG_BACKUP_MESSAGE}), 400
             if not os.path.exists(db_path):
                 return jsonify({'error': 'Database file not found'}), 404
 
@@ -10401,6 +10873,27 @@ def create_app():
         name='Auto Database Backup',
         replace_existing=True
     )
+    # =========[ NEW ]=========  ย้าย Order ที่จบงานแล้วไป order_lines_archive ทุกคืน (ARCHIVE_AFTER_DAYS=0 ปิด)
+    def scheduled_order_archive():
+        days = order_archive.after_days()
+        if days <= 0:
+            return
+        try:
+            with app.app_context():
+                moved = order_archive.archive_finished_orders(db.engine, days, order_archive.batch_size())
+            if moved:
+                app.logger.info(f"[archive] moved {len(moved)} finished orders older than {days} days")
+        except Exception as e:
+            app.logger.exception(f"Order archive failed: {e}")
+
+    scheduler.add_job(
+        func=scheduled_order_archive,
+        trigger=CronTrigger(hour=2, minute=30),  # Every day at 02:30
+        id='order_archive_job',
+        name='Archive finished orders',
+        replace_existing=True
+    )
+    # =========[ /NEW ]=========
     scheduler.start()
     app.logger.info("Auto backup scheduler started (daily at 19:00)")
 
@@ -10408,6 +10901,14 @@ def create_app():
     import atexit
     atexit.register(lambda: scheduler.shutdown())
 
+    # =========[ NEW ]=========  Refresher ของตาราง allocation_results (ALLOC_MATERIALIZED=1)
+    if allocation_store.enabled():
+        refresher = allocation_store.AllocationRefresher(app)
+        refresher.start()
+        atexit.register(refresher.stop)
+        app.logger.info("Allocation results refresher started")
+    # =========[ /NEW ]=========
+
     return app
 
 
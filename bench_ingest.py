@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark: เวลาอ่านไฟล์ออเดอร์ชุดเดียวกันแบบ XLSX / CSV / Parquet (ingest.read_upload_chunks)
+
+วิธีใช้:
+    python bench_ingest.py                 # 100,000 บรรทัด อ่านอย่างเดียว
+    python bench_ingest.py --rows 20000 --import   # รวมเวลา import_orders_chunks (SQLite ในหน่วยความจำ)
+
+หมายเหตุ:
+    - สร้างไฟล์ทดสอบใน temp directory แล้วลบทิ้งเมื่อจบ
+    - Parquet ต้องติดตั้ง pyarrow (ถ้าไม่มีจะข้าม)
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from datetime import date
+
+import pandas as pd
+from openpyxl import Workbook
+
+from ingest import read_upload_chunks
+
+HEADER = ["orderNumber", "sellerSku", "quantity", "Shop", "createTime", "ชื่อสินค้า"]
+
+
+def _orders(rows: int) -> pd.DataFrame:
+    return pd.DataFrame(
+        [(f"2410{i // 3:012d}", f"SKU-{i % 500:04d}", 1 + i % 3, f"ร้าน {i % 8}",
+          f"2026-10-{1 + i % 28:02d} {i % 24:02d}:{i % 60:02d}", f"สินค้า {i % 500}") for i in range(rows)],
+        columns=HEADER,
+    )
+
+
+def _write(df: pd.DataFrame, folder: str) -> dict:
+    paths = {}
+    paths["xlsx"] = os.path.join(folder, "orders.xlsx")
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(HEADER)
+    for row in df.itertuples(index=False):
+        ws.append(list(row))
+    wb.save(paths["xlsx"])
+
+    paths["csv"] = os.path.join(folder, "orders.csv")
+    df.to_csv(paths["csv"], index=False, encoding="utf-8-sig")
+    try:
+        import pyarrow  # noqa: F401
+
+        paths["parquet"] = os.path.join(folder, "orders.parquet")
+        df.to_parquet(paths["parquet"], index=False)
+    except ImportError:
+        print("⚠️  ไม่พบ pyarrow: ข้าม Parquet")
+    return paths
+
+
+def _import_orders(chunks) -> int:
+    from flask import Flask
+
+    import importers
+    from models import db
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        return importers.import_orders_chunks(chunks, "Shopee", None, date.today())["added"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--import", dest="do_import", action="store_true", help="นำเข้าออเดอร์หลังอ่านไฟล์ด้วย")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths = _write(_orders(args.rows), folder)
+        print(f"{'ไฟล์':<8} {'ขนาด (MB)':>10} {'อ่าน (s)':>9} {'บรรทัด':>8}" + (f" {'นำเข้า (s)':>11}" if args.do_import else ""))
+        for kind, path in paths.items():
+            started = time.perf_counter()
+            rows = sum(len(df) for df in read_upload_chunks(path).chunks())
+            read_s = time.perf_counter() - started
+            line = f"{kind:<8} {os.path.getsize(path) / 1e6:>10.1f} {read_s:>9.2f} {rows:>8}"
+            if args.do_import:
+                started = time.perf_counter()
+                _import_orders(read_upload_chunks(path).chunks())
+                line += f" {time.perf_counter() - started:>11.2f}"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark: เวลาตอบของผู้อ่าน (query แบบหน้าสแกน/หน้ารายงาน) ระหว่างนำเข้าออเดอร์ก้อนใหญ่
+เทียบ SQLite ค่าเริ่มต้น (rollback journal) กับ db_tuning (WAL + busy_timeout + cache)
+
+วิธีใช้:
+    python bench_sqlite.py                     # 30,000 บรรทัด, ผู้อ่าน 4 thread
+    python bench_sqlite.py --rows 20000 --readers 8
+
+หมายเหตุ:
+    - สร้างฐานข้อมูลใน temp directory แยกต่อโหมด แล้วลบทิ้งเมื่อจบ
+    - ผู้อ่านที่รอ lock เกิน timeout จะนับเป็น error ("database is locked")
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from datetime import date
+
+import pandas as pd
+from flask import Flask
+from sqlalchemy import func, select
+
+import db_tuning
+import importers
+from models import db, OrderLine
+
+
+def _orders(rows: int, prefix: str) -> pd.DataFrame:
+    return pd.DataFrame(
+        [(f"{prefix}{i // 2}", f"SKU-{i % 300}", 1, f"ร้าน {i % 4}", "2026-10-18 10:00") for i in range(rows)],
+        columns=["orderNumber", "sellerSku", "quantity", "Shop", "createTime"],
+    )
+
+
+def _run(folder: str, tuned: bool, rows: int, readers: int) -> dict:
+    os.environ["SQLITE_TUNING"] = "1" if tuned else "0"
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(folder, 'tuned.db' if tuned else 'default.db')}"
+    db.init_app(app)
+    with app.app_context():
+        db_tuning.install(db.engine)
+        db.create_all()
+        importers.import_orders(_orders(rows // 4, "SEED"), "Shopee", None, date(2026, 10, 17))
+
+    latencies: list[float] = []
+    errors: list[str] = []
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def reader(n: int):
+        with app.app_context():
+            i = 0
+            while not done.is_set():
+                started = time.perf_counter()
+                try:
+                    # lookup ผ่าน index (แบบหน้าสแกน) + หน้ารายการล่าสุด
+                    db.session.execute(select(func.count()).select_from(OrderLine).where(
+                        OrderLine.platform == "Shopee", OrderLine.shop_id == 1 + (i + n) % 4,
+                        OrderLine.order_id == f"SEED{(i * 37 + n) % (rows // 8)}")).scalar()
+                    db.session.execute(select(OrderLine.order_id, OrderLine.sku, OrderLine.qty)
+                                       .order_by(OrderLine.id.desc()).limit(50)).all()
+                    db.session.rollback()
+                    with lock:
+                        latencies.append(time.perf_counter() - started)
+                except Exception as e:
+                    db.session.rollback()
+                    with lock:
+                        errors.append(str(e).splitlines()[0])
+                i += 1
+                time.sleep(0.02)
+            db.session.remove()
+
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(0.2)
+    with app.app_context():
+        started = time.perf_counter()
+        importers.import_orders(_orders(rows, "NEW"), "Shopee", None, date(2026, 10, 18))
+        import_s = time.perf_counter() - started
+        db.session.remove()
+    time.sleep(0.2)
+    done.set()
+    for t in threads:
+        t.join()
+    with app.app_context():
+        db.engine.dispose()
+
+    lat = sorted(latencies) or [0.0]
+    return {
+        "import_s": import_s,
+        "reads": len(latencies),
+        "p50_ms": statistics.median(lat) * 1000,
+        "p99_ms": lat[min(len(lat) - 1, int(len(lat) * 0.99))] * 1000,
+        "max_ms": lat[-1] * 1000,
+        "errors": len(errors),
+        "error": errors[0] if errors else "",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=30_000)
+    parser.add_argument("--readers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        print(f"{'โหมด':<10} {'นำเข้า (s)':>10} {'อ่าน (ครั้ง)':>12} {'p50 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9} {'error':>6}")
+        for tuned in (False, True):
+            r = _run(folder, tuned, args.rows, args.readers)
+            print(f"{'tuned' if tuned else 'default':<10} {r['import_s']:>10.2f} {r['reads']:>12} {r['p50_ms']:>9.1f} "
+                  f"{r['p99_ms']:>9.1f} {r['max_ms']:>9.1f} {r['errors']:>6}  {r['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# conftest.py
+"""
+ฐานข้อมูลของเทสต์: SQLite (ค่าเริ่มต้น) หรือ PostgreSQL จาก TEST_DATABASE_URL
+
+    python -m pytest -q                                                            # SQLite
+    TEST_DATABASE_URL=postgresql://postgres@localhost/oms_test python -m pytest -q  # PostgreSQL
+
+ฐาน PostgreSQL ที่ใช้ทดสอบจะถูกล้าง (DROP SCHEMA public) ก่อนทุกเทสต์ที่ใช้ fixture ด้านล่าง ห้ามชี้ไปที่ฐานจริง
+เทสต์ที่ผูกกับ SQLite โดยตรง (PRAGMA / EXPLAIN QUERY PLAN) ใช้ SQLite เสมอ
+"""
+
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL", "")
+
+
+def _reset_postgres(url: str) -> None:
+    engine = create_engine(url)
+    try:
+        with engine.begin() as con:
+            # connection ของเทสต์ก่อนหน้าที่ค้าง transaction ไว้จะบล็อก DROP SCHEMA
+            con.execute(text(
+                "SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+                "WHERE datname = current_database() AND pid <> pg_backend_pid()"
+            ))
+            con.execute(text("DROP SCHEMA public CASCADE"))
+            con.execute(text("CREATE SCHEMA public"))
+    finally:
+        engine.dispose()
+
+
+@pytest.fixture
+def database_uri():
+    """ฐานว่างต่อเทสต์ (SQLite: in-memory ใช้ได้เฉพาะ connection เดียวของ Flask-SQLAlchemy)"""
+    if TEST_DATABASE_URL:
+        _reset_postgres(TEST_DATABASE_URL)
+        return TEST_DATABASE_URL
+    return "sqlite:///:memory:"
+
+
+@pytest.fixture
+def shared_database_uri(tmp_path):
+    """ฐานว่างต่อเทสต์ที่หลาย connection/thread มองเห็นตารางเดียวกัน (SQLite: ไฟล์ใน tmp_path)"""
+    if TEST_DATABASE_URL:
+        _reset_postgres(TEST_DATABASE_URL)
+        return TEST_DATABASE_URL
+    return f"sqlite:///{tmp_path / 'test.db'}"
@@ -0,0 +1,98 @@
+# db_backend.py
+"""
+เลือกฐานข้อมูล (SQLite ไฟล์ data.db / PostgreSQL ผ่าน DATABASE_URL) และชิ้นส่วน SQL ที่เขียนต่างกันตาม dialect
+
+- ไม่ตั้ง DATABASE_URL -> SQLite ไฟล์เหมือนเดิม (db_tuning ตั้ง PRAGMA ให้)
+- postgres://... (รูปแบบของ Railway/Heroku) ถูกแปลงเป็น postgresql://... (SQLAlchemy ไม่รับ postgres://)
+- PostgreSQL ใช้ connection pool: DB_POOL_SIZE (5), DB_MAX_OVERFLOW (10), DB_POOL_TIMEOUT (30 วินาที),
+  DB_POOL_RECYCLE (1800 วินาที) + pool_pre_ping (connection ที่ถูกตัดตอน idle จะถูกเปิดใหม่แทนการ error)
+- session ของ PostgreSQL ใช้ timezone Asia/Bangkok (DB_TIMEZONE): datetime(TH) ที่ ORM เขียนลงคอลัมน์
+  DateTime จึงเก็บเวลาไทยเหมือนที่ SQLite เก็บ
+
+SQL ที่ต่างกันตาม dialect:
+- thai_date(col): วันที่ไทยของคอลัมน์ DateTime ที่เก็บเป็น UTC (เดิม func.date(col, '+7 hours'))
+- iso_date_sql(col, dialect): ข้อความ 'YYYY-MM-DD' ของคอลัมน์ printed_*_at ที่เขียนด้วย isoformat() (เดิม DATE(col))
+  SQLite แปลงเวลาที่มี offset (+07:00) เป็น UTC ก่อนตัดวันที่ PostgreSQL ทำแบบเดียวกัน
+"""
+
+from __future__ import annotations
+
+import os
+
+from sqlalchemy import Date
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+
+def _int(env: str, default: int) -> int:
+    try:
+        return int(os.environ.get(env) or default)
+    except ValueError:
+        return default
+
+
+def database_uri(sqlite_path: str) -> str:
+    """DATABASE_URL (ถ้าตั้ง) หรือ SQLite ไฟล์ที่ sqlite_path  อ่าน env ทุกครั้ง (.env ถูกโหลดหลัง import)"""
+    url = (os.environ.get("DATABASE_URL") or "").strip()
+    if not url:
+        return f"sqlite:///{sqlite_path}"
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+def engine_options(uri: str) -> dict:
+    """SQLALCHEMY_ENGINE_OPTIONS ตาม backend (SQLite ใช้ค่าเริ่มต้นของ Flask-SQLAlchemy)"""
+    if make_url(uri).get_backend_name() != "postgresql":
+        return {}
+    return {
+        "pool_size": max(_int("DB_POOL_SIZE", 5), 1),
+        "max_overflow": max(_int("DB_MAX_OVERFLOW", 10), 0),
+        "pool_timeout": max(_int("DB_POOL_TIMEOUT", 30), 1),
+        "pool_recycle": _int("DB_POOL_RECYCLE", 1800),
+        "pool_pre_ping": True,
+        "connect_args": {"options": f"-c timezone={os.environ.get('DB_TIMEZONE') or 'Asia/Bangkok'}"},
+    }
+
+
+def sqlite_path(uri: str) -> str | None:
+    """path ไฟล์ของ SQLite (สำหรับสำรองข้อมูล) หรือ None ถ้าไม่ใช่ SQLite ไฟล์"""
+    url = make_url(uri)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        return None
+    return url.database
+
+
+def describe(uri: str) -> str:
+    """URI สำหรับแสดงผล (ซ่อนรหัสผ่าน)"""
+    return make_url(uri).render_as_string(hide_password=True)
+
+
+class thai_date(FunctionElement):
+    """วันที่ไทย (UTC+7) ของคอลัมน์ DateTime ที่เก็บเวลาเป็น UTC แบบไม่มี timezone"""
+    type = Date()
+    name = "thai_date"
+    inherit_cache = True
+
+
+@compiles(thai_date)
+def _thai_date_default(element, compiler, **kw):
+    return f"CAST(({compiler.process(element.clauses, **kw)}) + INTERVAL '7 hours' AS DATE)"
+
+
+@compiles(thai_date, "sqlite")
+def _thai_date_sqlite(element, compiler, **kw):
+    return f"date({compiler.process(element.clauses, **kw)}, '+7 hours')"
+
+
+def iso_date_sql(column: str, dialect: str) -> str:
+    """นิพจน์ SQL (ข้อความ) ของวันที่ 'YYYY-MM-DD' จากคอลัมน์ที่เขียนด้วย isoformat() ของเวลาไทย
+
+    SQLite คงรูป DATE(col) ไว้ให้ตรงกับ index ของ db_indexes (expression index ต้องเขียนเหมือนกันทุกตัวอักษร)
+    PostgreSQL: printed_warehouse_at / printed_picking_at เป็น TIMESTAMP (ตาม model) ส่วน printed_*_at อื่นเป็น TEXT
+    -> แปลงเป็นข้อความก่อน ค่าที่ไม่มี offset ถือเป็นเวลาใน timezone ของ session (Asia/Bangkok)
+    """
+    if dialect == "sqlite":
+        return f"DATE({column})"
+    return f"TO_CHAR(CAST(NULLIF(CAST({column} AS TEXT), '') AS TIMESTAMPTZ) AT TIME ZONE 'UTC', 'YYYY-MM-DD')"
@@ -0,0 +1,79 @@
+# db_indexes.py
+"""
+ชุด index สำหรับ query ที่ใช้บ่อย (order_lines / sales) — สร้างด้วย CREATE INDEX IF NOT EXISTS ตอนบูต
+
+order_lines มีแค่ uq_orderline(platform, shop_id, order_id, sku) แต่โค้ดค้นด้วย:
+- order_id อย่างเดียว: _mark_printed, _inject_scan_status, api_scan_order, api_check_order_status, bill-empty
+- sku: _reserved_qty_for_sku
+- import_date: admin_clear, Dashboard "วันนี้", ช่วงวันที่นำเข้า
+- DATE(printed_*_at) + printed_* > 0: หน้าประวัติการพิมพ์ / รายงาน (partial + expression index
+  ใช้ได้เฉพาะเมื่อ query เขียน DATE(printed_x_at) และ printed_x > 0 ตรงตามนี้)
+sales: subquery Order ที่แพ็คแล้ว (status_class = 'packed' -> order_id) อ่านจาก index อย่างเดียว
+
+index ที่คอลัมน์ยังไม่มีในตาราง (ฐานข้อมูลเก่าก่อน auto-migrate) จะข้ามไป
+index วันที่พิมพ์สร้างเฉพาะ SQLite: บน PostgreSQL การแปลง TEXT -> วันที่ไม่ใช่ IMMUTABLE จึงทำ expression index ไม่ได้
+"""
+
+from __future__ import annotations
+
+from typing import NamedTuple
+
+from sqlalchemy import inspect, text
+
+
+class IndexDef(NamedTuple):
+    name: str
+    table: str
+    columns: tuple[str, ...]  # คอลัมน์ที่ต้องมีในตารางก่อนสร้าง
+    sql: str
+    sqlite_only: bool = False
+
+
+def _printed_day(kind: str) -> IndexDef:
+    return IndexDef(
+        f"ix_order_lines_printed_{kind}_day", "order_lines", (f"printed_{kind}", f"printed_{kind}_at"),
+        f"CREATE INDEX IF NOT EXISTS ix_order_lines_printed_{kind}_day "
+        f"ON order_lines (DATE(printed_{kind}_at), order_id) WHERE printed_{kind} > 0",
+        sqlite_only=True,
+    )
+
+
+INDEXES: tuple[IndexDef, ...] = (
+    IndexDef("ix_order_lines_order_id", "order_lines", ("order_id",),
+             "CREATE INDEX IF NOT EXISTS ix_order_lines_order_id ON order_lines (order_id)"),
+    IndexDef("ix_order_lines_sku", "order_lines", ("sku",),
+             "CREATE INDEX IF NOT EXISTS ix_order_lines_sku ON order_lines (sku)"),
+    IndexDef("ix_order_lines_import_date", "order_lines", ("import_date",),
+             "CREATE INDEX IF NOT EXISTS ix_order_lines_import_date ON order_lines (import_date)"),
+    *(_printed_day(kind) for kind in ("warehouse", "picking", "lowstock", "nostock", "notenough")),
+    IndexDef("ix_sales_status_class_order_id", "sales", ("status_class", "order_id"),
+             "CREATE INDEX IF NOT EXISTS ix_sales_status_class_order_id ON sales (status_class, order_id)"),
+)
+
+
+def _index_names(connection, insp, table: str) -> set[str]:
+    if connection.dialect.name == "sqlite":
+        # reflection ของ SQLAlchemy ข้าม expression index (DATE(...)) -> อ่านจาก sqlite_master
+        rows = connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :t"), {"t": table})
+        return {row[0] for row in rows}
+    return {ix["name"] for ix in insp.get_indexes(table)}
+
+
+def ensure_indexes(connection) -> list[str]:
+    """สร้าง index ที่ยังไม่มี คืนชื่อ index ที่สร้างใหม่ ผู้เรียก commit เอง"""
+    sqlite = connection.dialect.name == "sqlite"
+    insp = inspect(connection)
+    existing: dict[str, set] = {}
+    columns: dict[str, set] = {}
+    created = []
+    for index in INDEXES:
+        if index.sqlite_only and not sqlite:
+            continue
+        if index.table not in columns:
+            columns[index.table] = {c["name"] for c in insp.get_columns(index.table)}
+            existing[index.table] = _index_names(connection, insp, index.table)
+        if index.name in existing[index.table] or not set(index.columns) <= columns[index.table]:
+            continue
+        connection.execute(text(index.sql))
+        created.append(index.name)
+    return created
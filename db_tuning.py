@@ -0,0 +1,120 @@
+# db_tuning.py
+"""
+ปรับแต่ง SQLite ทุก connection (PRAGMA ตอน connect)
+
+ค่าเริ่มต้นของ SQLite = rollback journal: ระหว่างมีคนเขียน (สแกน / รับงาน / นำเข้า) ทุกคนที่อ่านต้องรอ
+ใต้ thread pool ของ waitress จึงเจอ "database is locked" ระหว่างนำเข้าไฟล์ใหญ่
+- journal_mode=WAL: ผู้อ่านไม่ถูกบล็อกโดยผู้เขียน (เขียนได้ทีละคนเหมือนเดิม)
+- synchronous=NORMAL: ปลอดภัยกับ WAL (ไฟดับอาจเสียเฉพาะ transaction ล่าสุด ไม่ทำให้ไฟล์เสีย)
+- busy_timeout: ผู้เขียนรอ lock แทนการ error ทันที
+- cache_size / mmap_size / temp_store=MEMORY: ลด I/O ของ query รายงาน
+
+ตั้งค่าผ่าน env (อ่านตอน install): SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT_MS,
+SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE_MB, SQLITE_TEMP_STORE  ปิดทั้งหมดได้ด้วย SQLITE_TUNING=0
+
+WAL เก็บ commit ล่าสุดไว้ในไฟล์ data.db-wal จนกว่าจะ checkpoint -> สำรองข้อมูลด้วย backup_copy (SQLite backup API)
+แทนการคัดลอกไฟล์ data.db ตรงๆ
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+
+from sqlalchemy import event
+
+_CHOICES = {
+    "journal_mode": ("WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY", "OFF"),
+    "synchronous": ("OFF", "NORMAL", "FULL", "EXTRA"),
+    "temp_store": ("DEFAULT", "FILE", "MEMORY"),
+}
+# ค่าที่ PRAGMA อ่านกลับเป็นตัวเลข
+_SYNCHRONOUS_NAMES = {0: "OFF", 1: "NORMAL", 2: "FULL", 3: "EXTRA"}
+_TEMP_STORE_NAMES = {0: "DEFAULT", 1: "FILE", 2: "MEMORY"}
+
+PRAGMAS = ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size", "temp_store")
+
+
+def enabled() -> bool:
+    """อ่านจาก env ทุกครั้ง (ค่าจาก .env ถูกโหลดหลัง import โมดูลนี้)"""
+    return (os.environ.get("SQLITE_TUNING") or "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _choice(name: str, env: str, default: str) -> str:
+    value = (os.environ.get(env) or default).strip().upper()
+    return value if value in _CHOICES[name] else default
+
+
+def _int(env: str, default: int) -> int:
+    try:
+        return int(os.environ.get(env) or default)
+    except ValueError:
+        return default
+
+
+def settings() -> dict:
+    """PRAGMA -> ค่าที่จะตั้งให้ทุก connection (ตามหน่วยของ SQLite)"""
+    return {
+        "journal_mode": _choice("journal_mode", "SQLITE_JOURNAL_MODE", "WAL"),
+        "synchronous": _choice("synchronous", "SQLITE_SYNCHRONOUS", "NORMAL"),
+        "busy_timeout": max(_int("SQLITE_BUSY_TIMEOUT_MS", 15000), 0),
+        "cache_size": -max(_int("SQLITE_CACHE_SIZE_KB", 65536), 0),  # ค่าลบ = KiB
+        "mmap_size": max(_int("SQLITE_MMAP_SIZE_MB", 256), 0) * 1024 * 1024,
+        "temp_store": _choice("temp_store", "SQLITE_TEMP_STORE", "MEMORY"),
+    }
+
+
+def _listener(pragmas: dict):
+    statements = [f"PRAGMA {name}={value}" for name, value in pragmas.items()]
+
+    def _on_connect(dbapi_connection, _record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+    return _on_connect
+
+
+def install(engine) -> dict | None:
+    """ตั้ง PRAGMA ให้ทุก connection ใหม่ของ engine (เฉพาะ SQLite) คืนค่าที่ตั้ง หรือ None ถ้าไม่ได้ตั้ง
+    ต้องเรียกก่อน engine เปิด connection แรก (connection ใน pool เดิมไม่ถูกปรับ)"""
+    if engine.dialect.name != "sqlite" or not enabled():
+        return None
+    if getattr(engine, "_sqlite_tuning", None) is not None:
+        return engine._sqlite_tuning
+    pragmas = settings()
+    event.listen(engine, "connect", _listener(pragmas))
+    engine._sqlite_tuning = pragmas
+    return pragmas
+
+
+def current(connection) -> dict:
+    """ค่า PRAGMA ที่ใช้อยู่จริงของ connection (SQLAlchemy Connection) สำหรับหน้า system-status"""
+    out = {}
+    for name in PRAGMAS:
+        value = connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+        if name == "journal_mode":
+            value = str(value).upper()
+        elif name == "synchronous":
+            value = _SYNCHRONOUS_NAMES.get(value, value)
+        elif name == "temp_store":
+            value = _TEMP_STORE_NAMES.get(value, value)
+        out[name] = value
+    return out
+
+
+def backup_copy(db_path: str, dest_path: str) -> str:
+    """สำเนาฐานข้อมูลที่สอดคล้องกัน (รวมข้อมูลใน -wal) ด้วย SQLite online backup API"""
+    src = sqlite3.connect(db_path)
+    try:
+        dst = sqlite3.connect(dest_path)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    return dest_path
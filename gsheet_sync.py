@@ -0,0 +1,306 @@
+# gsheet_sync.py
+"""
+ดึงออเดอร์จาก Google Sheet แบบเพิ่มเฉพาะแถวใหม่ (Incremental pull)
+
+แท็บ Import_Shopee / Import_Lazada / Import_Tiktok มีแต่แถวเพิ่มต่อท้ายระหว่างวัน
+จึงเก็บ cursor ต่อร้าน (shops.google_sheet_cursor, JSON ข้างๆ google_sheet_url):
+  url / tab / rows (จำนวนแถวข้อมูลที่อ่านแล้ว) / width / hash ของหัวคอลัมน์, แถวข้อมูลแรก และแถวสุดท้ายที่อ่าน
+  / pending = {เลขแถว: hash} ของแถวที่อ่านแล้วแต่นำเข้าไม่สำเร็จ (ดู settle_cursor)
+- ดึงครั้งถัดไป: batch_get ครั้งเดียว = หัวคอลัมน์ + แถวแรก + แถวสุดท้ายเดิม (ตรวจว่า cursor ยังตรง) + แถวใหม่ต่อท้าย
+  + แถว pending (แถวที่ hash เปลี่ยน = แก้แล้ว -> ส่งไปนำเข้าอีกครั้ง, ไม่เปลี่ยน -> ค้างไว้ใน pending)
+- cursor ไม่ตรง (ล้างแท็บ / แก้แถวแรกหรือแถวสุดท้าย / เปลี่ยนหัวคอลัมน์ / เปลี่ยน URL) หรือ pending กระจายเกิน
+  _PENDING_RANGES ช่วง -> อ่านทั้งแท็บใหม่ (เหมือน get_all_records)
+- แถวอื่นที่นำเข้าสำเร็จแล้วไม่ถูกอ่านซ้ำ: แก้ข้อมูลแถวเหล่านั้น (นำเข้าแบบ insert-only อยู่แล้ว -> เป็น Order ซ้ำ)
+  ยกเว้นแก้ Order ID ให้เป็น Order ใหม่ ต้องดึงทั้งแท็บเอง (ส่ง cursor=None / ติ๊ก "ดึงทั้งแท็บใหม่" ในหน้านำเข้า)
+
+ทดสอบแบบ offline ได้ด้วย FakeSheetsClient (ตั้ง GSHEETS_FAKE_FILE=<json> ให้ open_client ใช้ข้อมูลจากไฟล์)
+
+client ที่ authorize แล้วถูกเก็บไว้ใช้ซ้ำทั้ง process (token ต่ออายุเองใน session ของ gspread)
+fetch_all ดึงหลายร้านพร้อมกันด้วย thread pool จำกัดจำนวน (GSHEETS_SYNC_WORKERS, ค่าเริ่มต้น 4)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import gspread
+from gspread.utils import a1_range_to_grid_range, numericise_all, rowcol_to_a1, to_records
+
+_SYNC_WORKERS = int(os.environ.get("GSHEETS_SYNC_WORKERS", "4") or 4)
+_CLIENT_TTL = float(os.environ.get("GSHEETS_CLIENT_TTL", "3000") or 3000)  # วินาที ก่อน authorize ใหม่
+_PENDING_RANGES = 50  # จำนวนช่วงแถว pending สูงสุดที่อ่านซ้ำใน batch_get (เกิน -> อ่านทั้งแท็บ)
+
+_client_lock = threading.Lock()
+_client = None
+_client_at = 0.0
+
+
+class SheetPull(NamedTuple):
+    records: list[dict]  # แบบเดียวกับ worksheet.get_all_records()
+    cursor: dict
+    incremental: bool  # True = อ่านเฉพาะแถวใหม่ (+ แถว pending ที่แก้แล้ว)
+    rows: list[tuple[int, str]] = []  # (เลขแถวใน Sheet, hash) ของแต่ละ record ตามลำดับ
+
+
+class SheetFetch(NamedTuple):
+    key: object  # ค่าที่ผู้เรียกส่งมากับ target (เช่นแถวร้าน)
+    pull: SheetPull | None
+    seconds: float
+    error: str | None
+
+
+def _trim(row) -> list:
+    row = list(row or [])
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+def _row_hash(row) -> str:
+    return hashlib.sha1(json.dumps(_trim(row), ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _first(value_range) -> list:
+    return list(value_range[0]) if value_range else []
+
+
+def _records(header, rows) -> list[dict]:
+    """แปลงแถวดิบเป็น records แบบ get_all_records (pad_values + numericise_all + to_records)"""
+    rows = [list(r) for r in rows]
+    width = max([len(header)] + [len(r) for r in rows])
+    header = list(header) + [""] * (width - len(header))
+    dupes = [name for name, n in Counter(header).items() if n > 1]
+    if dupes:
+        raise gspread.exceptions.GSpreadException(f"the header row in the worksheet contains duplicates: {dupes}")
+    values = [numericise_all(r + [""] * (width - len(r)), False, "", False, None) for r in rows]
+    return to_records(header, values)
+
+
+def _cursor(url, tab, header, first, last, rows: int, pending: dict | None = None) -> dict:
+    header = _trim(header)
+    return {
+        "url": url,
+        "tab": tab,
+        "rows": rows,
+        "width": len(header),
+        "header": _row_hash(header),
+        "first": _row_hash(first),
+        "last": _row_hash(last),
+        "pending": pending or {},
+    }
+
+
+def _runs(numbers) -> list[tuple[int, int]]:
+    """เลขแถวเรียงแล้ว -> ช่วงแถวติดกัน [(เริ่ม, จบ)]"""
+    runs: list[list[int]] = []
+    for n in sorted(numbers):
+        if runs and n == runs[-1][1] + 1:
+            runs[-1][1] = n
+        else:
+            runs.append([n, n])
+    return [(a, b) for a, b in runs]
+
+
+def settle_cursor(pull: SheetPull, failed) -> dict:
+    """cursor ที่จะบันทึกหลังนำเข้า pull แล้ว: failed = index ของ record ที่นำเข้าไม่สำเร็จ
+    -> เก็บเลขแถว + hash ไว้ใน pending ให้ดึงครั้งหน้าอ่านแถวนั้นซ้ำถ้าถูกแก้"""
+    pending = dict(pull.cursor.get("pending") or {})
+    for row, _ in pull.rows:
+        pending.pop(str(row), None)
+    for i in failed:
+        row, digest = pull.rows[i]
+        pending[str(row)] = digest
+    return {**pull.cursor, "pending": pending}
+
+
+def load_cursor(raw) -> dict | None:
+    try:
+        return json.loads(raw) if raw else None
+    except (TypeError, ValueError):
+        return None
+
+
+def pull_records(worksheet, cursor: dict | None, url: str) -> SheetPull:
+    """records ของแถวที่ยังไม่เคยดึง + แถว pending ที่ถูกแก้ (ถ้า cursor ใช้ได้) หรือทั้งแท็บ + cursor ใหม่
+    cursor ที่คืนมายังไม่รู้ผลนำเข้า (แถว pending เดิมที่ไม่ถูกแก้ยังค้างอยู่) -> ใช้ settle_cursor ก่อนบันทึก"""
+    tab = worksheet.title
+    pending = {int(n): h for n, h in ((cursor or {}).get("pending") or {}).items()}
+    runs = _runs(pending)
+    if (cursor and cursor.get("url") == url and cursor.get("tab") == tab and cursor.get("rows", 0) > 0
+            and cursor.get("width") and len(runs) <= _PENDING_RANGES):
+        last = cursor["rows"] + 1  # เลขแถวใน Sheet ของแถวสุดท้ายที่อ่านแล้ว (แถว 1 = หัวคอลัมน์)
+        col = rowcol_to_a1(1, cursor["width"]).rstrip("0123456789")
+        header, first, anchor, new, *again = worksheet.batch_get(
+            ["1:1", "2:2", f"{last}:{last}", f"A{last + 1}:{col}"] + [f"A{a}:{col}{b}" for a, b in runs]
+        )
+        header, first, anchor = _first(header), _first(first), _first(anchor)
+        if (_row_hash(header), _row_hash(first), _row_hash(anchor)) == (cursor["header"], cursor["first"], cursor["last"]):
+            rows, numbers = [], []
+            for (a, b), values in zip(runs, again):
+                for n, row in enumerate(values, a):
+                    if _row_hash(row) != pending[n]:
+                        rows.append(list(row))
+                        numbers.append(n)
+                for n in range(a + len(values), b + 1):  # แถวท้ายช่วงที่ว่าง (Sheets API ตัดทิ้ง)
+                    if _row_hash([]) != pending[n]:
+                        rows.append([])
+                        numbers.append(n)
+            new = [list(r) for r in new]
+            rows += new
+            numbers += range(last + 1, last + 1 + len(new))
+            if not rows:
+                return SheetPull([], cursor, True)
+            next_cursor = cursor if not new else _cursor(
+                url, tab, header, first, new[-1], cursor["rows"] + len(new), cursor.get("pending"),
+            )
+            return SheetPull(
+                _records(_trim(header), rows),
+                next_cursor,
+                True,
+                [(n, _row_hash(r)) for n, r in zip(numbers, rows)],
+            )
+
+    values = worksheet.get(pad_values=True)
+    if not values or values == [[]]:
+        return SheetPull([], _cursor(url, tab, [], [], [], 0), False)
+    header, rows = values[0], values[1:]
+    width = len(_trim(header))  # hash เฉพาะคอลัมน์ที่ดึงแบบ incremental อ่าน (A:width) ให้เทียบกันได้
+    return SheetPull(
+        _records(header, rows),
+        _cursor(url, tab, header, rows[0] if rows else [], rows[-1] if rows else [], len(rows)),
+        False,
+        [(n, _row_hash(r[:width])) for n, r in enumerate(rows, 2)],
+    )
+
+
+# ---------- Fake client (offline) ----------
+class FakeWorksheet:
+    """แท็บในหน่วยความจำ ตอบ get / batch_get แบบ Sheets API (ตัดเซลล์ว่างท้ายแถวและแถวว่างท้ายแท็บ)"""
+
+    def __init__(self, title: str, rows=None):
+        self.title = title
+        self.rows = [[("" if v is None else str(v)) for v in r] for r in (rows or [])]
+        self.calls: list[str] = []
+
+    def append_rows(self, rows):
+        self.rows.extend([("" if v is None else str(v)) for v in r] for r in rows)
+
+    def _values(self, start=0, end=None, col_start=0, col_end=None) -> list[list]:
+        values = [_trim(r[col_start:col_end]) for r in self.rows[start:end]]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def get(self, pad_values=False):
+        self.calls.append("get")
+        values = self._values()
+        if not values:
+            return [[]]
+        if pad_values:
+            width = max(len(r) for r in values)
+            values = [r + [""] * (width - len(r)) for r in values]
+        return values
+
+    def batch_get(self, ranges):
+        self.calls.append("batch_get")
+        out = []
+        for name in ranges:
+            grid = a1_range_to_grid_range(name)
+            out.append(self._values(
+                grid.get("startRowIndex", 0), grid.get("endRowIndex"),
+                grid.get("startColumnIndex", 0), grid.get("endColumnIndex"),
+            ))
+        return out
+
+    def get_all_values(self):
+        return self.get(pad_values=True)
+
+    def get_all_records(self):
+        values = self.get(pad_values=True)
+        return [] if values == [[]] else _records(values[0], values[1:])
+
+
+class FakeSpreadsheet:
+    def __init__(self, tabs: dict, title: str = "Fake Sheet"):
+        self.title = title
+        self.tabs = {name: FakeWorksheet(name, rows) for name, rows in tabs.items()}
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        if title not in self.tabs:
+            raise gspread.WorksheetNotFound(title)
+        return self.tabs[title]
+
+
+class FakeSheetsClient:
+    """แทน gspread client: {url: {ชื่อแท็บ: [[แถว], ...]}}"""
+
+    def __init__(self, sheets: dict | None = None):
+        self.sheets = {url: FakeSpreadsheet(tabs) for url, tabs in (sheets or {}).items()}
+
+    @classmethod
+    def load(cls, path: str) -> "FakeSheetsClient":
+        with open(path, encoding="utf-8") as fh:
+            return cls(json.load(fh))
+
+    def open_by_url(self, url: str) -> FakeSpreadsheet:
+        if url not in self.sheets:
+            raise gspread.SpreadsheetNotFound(url)
+        return self.sheets[url]
+
+
+def open_client(get_credentials):
+    """gspread client ที่ authorize แล้ว (ใช้ซ้ำ) หรือ FakeSheetsClient ถ้าตั้ง GSHEETS_FAKE_FILE"""
+    global _client, _client_at
+    fake = os.environ.get("GSHEETS_FAKE_FILE")
+    if fake:
+        return FakeSheetsClient.load(fake)
+    with _client_lock:
+        if _client is None or time.monotonic() - _client_at > _CLIENT_TTL:
+            _client = gspread.authorize(get_credentials())
+            _client_at = time.monotonic()
+        return _client
+
+
+def reset_client() -> None:
+    """ทิ้ง client ที่เก็บไว้ (เช่นเปลี่ยน credentials) ครั้งถัดไปจะ authorize ใหม่"""
+    global _client
+    with _client_lock:
+        _client = None
+
+
+def _fetch_error(e: Exception) -> str:
+    if isinstance(e, gspread.WorksheetNotFound):
+        return f"ไม่พบ Tab ชื่อ '{e}'"
+    if isinstance(e, gspread.SpreadsheetNotFound):
+        return "ไม่พบไฟล์ Google Sheet (ตรวจสอบลิงก์)"
+    if "PERMISSION_DENIED" in str(e):
+        return "บอทเข้าถึงไฟล์ไม่ได้ (ตรวจสอบสิทธิ์การแชร์)"
+    return str(e) or e.__class__.__name__
+
+
+def fetch_all(client, targets, workers: int | None = None) -> list[SheetFetch]:
+    """ดึงหลายแท็บพร้อมกัน: targets = [(key, url, tab, cursor)] คืนผลตามลำดับ targets
+    (เฉพาะดึงข้อมูลผ่านเครือข่าย ไม่แตะ DB ใน thread)"""
+    targets = list(targets)
+
+    def _one(target) -> SheetFetch:
+        key, url, tab, cursor = target
+        started = time.perf_counter()
+        try:
+            worksheet = client.open_by_url(url).worksheet(tab)
+            return SheetFetch(key, pull_records(worksheet, cursor, url), time.perf_counter() - started, None)
+        except Exception as e:
+            return SheetFetch(key, None, time.perf_counter() - started, _fetch_error(e))
+
+    if not targets:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers or _SYNC_WORKERS, len(targets))),
+                            thread_name_prefix="gsheet-sync") as pool:
+        return list(pool.map(_one, targets))
@@ -0,0 +1,205 @@
+# import_cache.py
+"""
+ลายนิ้วมือไฟล์นำเข้าออเดอร์ (Content-hash dedupe)
+
+ร้านเดียวกันมักอัปโหลดไฟล์ Shopee/Lazada เดิมซ้ำหลายรอบต่อวัน ซึ่งผลลัพธ์คือ "ซ้ำวันนี้" ทั้งไฟล์
+- file_digest / frame_digest = sha256 ของไฟล์ (ไบต์) หรือ DataFrame (hash รายแถว) -> บันทึกใน ImportLog.content_hash
+- ตาราง import_fingerprints เก็บผลการนำเข้าล่าสุดของวันต่อ (แพลตฟอร์ม, ร้านที่เลือกในฟอร์ม):
+  content_hash + hash รายแถวของ Order ที่อยู่ในระบบแล้ว + รายชื่อ Order ID ตามผลลัพธ์
+- ไฟล์เดิมทุกไบต์ -> ไม่ต้องอ่านไฟล์ สร้างผลจากครั้งก่อน (cached_stats) ได้ผลเหมือนนำเข้าซ้ำจริง
+- ไฟล์คล้ายเดิม -> RowDiff ตัดแถวที่เหมือนครั้งก่อนก่อนเข้า importer แล้วนับ Order ของแถวที่ตัดเป็น "ซ้ำ" (merge)
+ใช้ผลเดิมเฉพาะเมื่อ Order จากครั้งก่อนยังอยู่ใน order_lines ครบ (ถ้ามีการลบ -> นำเข้าเต็มตามปกติ)
+
+ปิดได้ด้วย IMPORT_DEDUPE=0
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+
+from importers import COMMON_ORDER_ID, first_existing
+from models import db, ImportFingerprint, OrderLine
+from utils import normalize_platform, now_thai
+
+_IN_CHUNK = 500
+_EMPTY = np.empty(0, dtype=np.uint64)
+
+# รายชื่อ Order ID ใน stats ที่เก็บไว้ใช้ซ้ำ
+_RESULT_KEYS = ("added_ids", "duplicate_ids", "duplicate_old_ids", "duplicate_today_ids", "failed_ids", "errors")
+
+
+def enabled() -> bool:
+    """อ่านจาก env ทุกครั้ง (ค่าจาก .env ถูกโหลดหลัง import โมดูลนี้)"""
+    return (os.environ.get("IMPORT_DEDUPE") or "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def file_digest(file) -> str:
+    """sha256 ของไฟล์อัปโหลด (werkzeug FileStorage / path / file object) แล้ว seek กลับที่เดิม"""
+    h = hashlib.sha256()
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as fh:
+            for block in iter(lambda: fh.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+    stream = getattr(file, "stream", file)
+    pos = stream.tell()
+    for block in iter(lambda: stream.read(1 << 20), b""):
+        h.update(block)
+    stream.seek(pos)
+    return h.hexdigest()
+
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """hash (uint64) รายแถว ผูกกับชื่อคอลัมน์ (หัวคอลัมน์ต่างกัน = แถวต่างกัน)"""
+    if df.empty:
+        return _EMPTY
+    key = hashlib.sha256(repr(list(df.columns)).encode("utf-8")).hexdigest()[:16]
+    return pd.util.hash_pandas_object(df, index=False, hash_key=key).to_numpy(dtype=np.uint64)
+
+
+def frame_digest(df: pd.DataFrame) -> str:
+    """sha256 ของข้อมูลใน DataFrame (เช่นข้อมูลจาก Google Sheet ที่ไม่มีไฟล์ให้ hash)"""
+    h = hashlib.sha256(repr(list(df.columns)).encode("utf-8"))
+    h.update(row_hashes(df).tobytes())
+    return h.hexdigest()
+
+
+def _source(platform, shop_name) -> tuple[str, str]:
+    return normalize_platform(platform), (shop_name or "").strip()
+
+
+def _existing_count(platform: str, order_ids) -> int:
+    found = 0
+    ids = sorted(order_ids)
+    for i in range(0, len(ids), _IN_CHUNK):
+        found += db.session.execute(
+            select(func.count(func.distinct(OrderLine.order_id)))
+            .where(OrderLine.platform == platform, OrderLine.order_id.in_(ids[i:i + _IN_CHUNK]))
+        ).scalar() or 0
+    return found
+
+
+def lookup(platform, shop_name, import_date) -> ImportFingerprint | None:
+    """ลายนิ้วมือของการนำเข้าครั้งก่อน (วันเดียวกัน) ที่ยังใช้ได้ หรือ None"""
+    platform_std, shop = _source(platform, shop_name)
+    fp = ImportFingerprint.query.filter_by(platform=platform_std, shop_name=shop).first()
+    if fp is None or fp.import_date != import_date or not fp.result:
+        return None
+    result = json.loads(fp.result)
+    known = set(result["added_ids"]) | set(result["duplicate_ids"])
+    if _existing_count(platform_std, known) != len(known):
+        return None  # Order จากครั้งก่อนถูกลบไปแล้วบางส่วน
+    return fp
+
+
+def cached_stats(fp: ImportFingerprint) -> dict:
+    """stats ของการนำเข้าไฟล์เดิมซ้ำ: ทุก Order ที่เคยเพิ่ม/ซ้ำ = ซ้ำ (วันนี้ / ข้ามวันตามเดิม), ไม่สำเร็จเหมือนเดิม"""
+    prev = json.loads(fp.result)
+    old_ids = list(prev["duplicate_old_ids"])
+    old_set = set(old_ids)
+    today_ids = [oid for oid in dict.fromkeys(prev["duplicate_today_ids"] + prev["added_ids"]) if oid not in old_set]
+    return {
+        "added": 0,
+        "duplicates": len(old_ids) + len(today_ids),
+        "duplicates_old": len(old_ids),
+        "duplicates_today": len(today_ids),
+        "failed": prev["failed"],
+        "errors": list(prev["errors"]),
+        "added_ids": [],
+        "duplicate_ids": list(dict.fromkeys(prev["duplicate_ids"] + prev["added_ids"])),
+        "duplicate_old_ids": old_ids,
+        "duplicate_today_ids": today_ids,
+        "failed_ids": list(prev["failed_ids"]),
+        "cached": True,
+    }
+
+
+class RowDiff:
+    """ตัดแถวที่เหมือนการนำเข้าครั้งก่อนออกก่อนส่งเข้า importer (ไฟล์ที่ต่างจากเดิมแค่บางแถว)
+
+    แถวจะถูกตัดเมื่อ hash ตรงกับแถวของครั้งก่อน และ Order ของแถวนั้นอยู่ในระบบแล้ว
+    (ร้าน/Order เดียวกันทุกคอลัมน์ -> importer จะนับเป็น "ซ้ำ" อยู่ดี)
+    """
+
+    def __init__(self, fp: ImportFingerprint | None = None):
+        prev = json.loads(fp.result) if fp is not None and fp.result else {}
+        self._known = np.frombuffer(fp.row_hashes, dtype=np.uint64) if fp is not None and fp.row_hashes else _EMPTY
+        self._known_ids = (set(prev.get("added_ids", [])) | set(prev.get("duplicate_ids", []))) - set(prev.get("failed_ids", []))
+        self._old_ids = set(prev.get("duplicate_old_ids", []))
+        self._hashes: list[np.ndarray] = []
+        self._oids: list[list[str]] = []
+        self.skipped_ids: dict[str, None] = {}  # Order ID ของแถวที่ถูกตัด (เรียงตามลำดับในไฟล์)
+        self.skipped_rows = 0
+
+    def filter(self, chunks):
+        for df in chunks:
+            order_col = first_existing(df, COMMON_ORDER_ID)
+            if order_col is None or df.empty:
+                yield df
+                continue
+            hashes = row_hashes(df)
+            oids = [str(v).strip() for v in df[order_col].tolist()]
+            self._hashes.append(hashes)
+            self._oids.append(oids)
+            if not len(self._known):
+                yield df
+                continue
+            drop = np.isin(hashes, self._known) & np.fromiter((o in self._known_ids for o in oids), bool, len(oids))
+            if drop.any():
+                self.skipped_rows += int(drop.sum())
+                self.skipped_ids.update((o, None) for o, d in zip(oids, drop) if d)
+                df = df[~drop]
+            yield df
+
+    def merge(self, stats: dict) -> dict:
+        """นับ Order ของแถวที่ถูกตัด (ที่ importer ไม่เห็น) เป็นซ้ำ แบบเดียวกับที่ importer จะนับ"""
+        seen = set(stats["duplicate_ids"])
+        for oid in self.skipped_ids:
+            if oid in seen:
+                continue
+            seen.add(oid)
+            stats["duplicates"] += 1
+            stats["duplicate_ids"].append(oid)
+            if oid in self._old_ids:
+                stats["duplicates_old"] += 1
+                stats["duplicate_old_ids"].append(oid)
+            else:
+                stats["duplicates_today"] += 1
+                stats["duplicate_today_ids"].append(oid)
+        stats["rows_skipped"] = self.skipped_rows
+        return stats
+
+    def known_hashes(self, stats: dict) -> np.ndarray:
+        """hash ของแถวที่ Order อยู่ในระบบแล้วหลังนำเข้า (ใช้ตัดแถวในครั้งถัดไป)"""
+        known_ids = (set(stats["added_ids"]) | set(stats["duplicate_ids"])) - set(stats["failed_ids"])
+        parts = []
+        for hashes, oids in zip(self._hashes, self._oids):
+            mask = np.fromiter((o in known_ids for o in oids), bool, len(oids))
+            parts.append(hashes[mask])
+        return np.unique(np.concatenate(parts)) if parts else _EMPTY
+
+
+def save(platform, shop_name, import_date, content_hash: str, stats: dict,
+         diff: RowDiff | None, import_log_id: int | None) -> None:
+    """บันทึกผลการนำเข้าล่าสุดของต้นทางนี้ (diff=None = ใช้ผลเดิม -> hash รายแถวคงเดิม)"""
+    platform_std, shop = _source(platform, shop_name)
+    fp = ImportFingerprint.query.filter_by(platform=platform_std, shop_name=shop).first()
+    if fp is None:
+        fp = ImportFingerprint(platform=platform_std, shop_name=shop)
+        db.session.add(fp)
+    result = {key: stats.get(key, []) for key in _RESULT_KEYS}
+    result["failed"] = stats.get("failed", 0)
+    fp.import_date = import_date
+    fp.content_hash = content_hash
+    fp.result = json.dumps(result, ensure_ascii=False)
+    if diff is not None:
+        fp.row_hashes = diff.known_hashes(stats).tobytes()
+    fp.import_log_id = import_log_id
+    fp.updated_at = now_thai()
+    db.session.commit()
@@ -5,10 +5,16 @@ from __future__ import annotations
 import pandas as pd
 from datetime import datetime, date
 from flask import flash
+from sqlalchemy import (
+    Column, DateTime, Integer, MetaData, String, Table,
+    bindparam, exists, func, insert, literal, select, true, update,
+)
 from sqlalchemy.exc import IntegrityError
 
-from utils import parse_datetime_guess, normalize_platform, TH_TZ
-from models import db, Shop, Product, Stock, Sales, OrderLine
+from utils import parse_datetime_guess, parse_datetime_texts, normalize_platform, TH_TZ, classify_sales_status, SALES_PACKED
+from models import db, Shop, Product, Stock, Sales, OrderLine, OrderLineArchive
+from allocation import mark_all_dirty, mark_skus_dirty, mark_orders_dirty
+import order_archive
 
 # ===== Column dictionaries =====
 COMMON_ORDER_ID   = ["orderNumber","Order Number","order_id","Order ID","order_sn","Order No","เลข Order","No.","OrderNo"]
@@ -73,6 +79,79 @@ def get_or_create_shop(platform, shop_name):
         db.session.commit()
     return shop
 
+# ===== bulk helpers =====
+_IN_CHUNK = 500  # จำนวนค่าสูงสุดต่อ IN (...) หนึ่งครั้ง
+
+
+def _chunks(values, size: int = _IN_CHUNK):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _column_values(df: pd.DataFrame, col, default=None) -> list:
+    """ค่าทั้งคอลัมน์เป็น list (ถ้าไม่มีคอลัมน์ = default ทุกแถว)"""
+    if col is None or col not in df.columns:
+        return [default] * len(df)
+    return df[col].tolist()
+
+
+def _resolve_shop_ids(platform, shop_names) -> dict[str, int]:
+    """เหมือน get_or_create_shop หลายร้านพร้อมกัน: {ชื่อร้าน: shop_id}
+    ร้านที่ยังไม่มีจะถูกสร้าง (flush เพื่อให้ได้ id แต่ยังไม่ commit)"""
+    names = list(dict.fromkeys(clean_shop_name(n) for n in shop_names))
+    ids: dict[str, int] = {}
+    for chunk in _chunks(names):
+        for shop_id, name in db.session.execute(
+            select(Shop.id, Shop.name).where(Shop.name.in_(chunk)).order_by(Shop.id)
+        ):
+            ids.setdefault(name, shop_id)
+    created = [Shop(platform=platform, name=name) for name in names if name not in ids]
+    if created:
+        db.session.add_all(created)
+        db.session.flush()
+        ids.update((shop.name, shop.id) for shop in created)
+    return ids
+
+
+def _existing_order_import_dates(order_ids) -> dict[tuple[int, str], date | None]:
+    """{(shop_id, order_id): import_date ของบรรทัดแรก} ของ Order ที่มีอยู่แล้ว (รวม Order ที่ย้ายไปคลังแล้ว)"""
+    found: dict[tuple[int, str], date | None] = {}
+    for line in (OrderLine, OrderLineArchive):
+        for chunk in _chunks(sorted(order_ids)):
+            q = (
+                select(line.shop_id, line.order_id, line.import_date)
+                .where(line.order_id.in_(chunk))
+                .order_by(line.id)
+            )
+            for shop_id, oid, imp in db.session.execute(q):
+                found.setdefault((shop_id, oid), imp)
+    return found
+
+
+def _product_ids(skus) -> dict[str, int]:
+    ids: dict[str, int] = {}
+    for chunk in _chunks(sorted(skus)):
+        ids.update(db.session.execute(select(Product.sku, Product.id).where(Product.sku.in_(chunk))).all())
+    return ids
+
+def _upsert_insert(table):
+    """INSERT ที่รองรับ on_conflict_do_update ตาม Dialect ของ DB ปัจจุบัน"""
+    if db.session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(table)
+
+
+# temp table สำหรับ sync สต็อกแบบ set-based (สร้าง/ลบภายใน import_stock)
+_STOCK_IMPORT = Table(
+    "stock_import", MetaData(),
+    Column("sku", String(64), primary_key=True),
+    Column("qty", Integer),
+    prefixes=["TEMPORARY"],
+)
+
 # ===== Importers =====
 def import_products(df: pd.DataFrame) -> int:
     sku_col   = first_existing(df, COMMON_PRODUCT_SKU)   or "รหัสสินค้า"
@@ -92,16 +171,12 @@ def import_products(df: pd.DataFrame) -> int:
     db.session.commit()
     return cnt
 
-# >>> ฟังก์ชันนี้ถูกแพตช์ใหม่ให้ทน NaN/หัวคอลัมน์หลายแบบ + Full Sync Mode
-def import_stock(df: pd.DataFrame, full_replace: bool = True) -> int:
-    """
-    นำเข้าสต็อกจาก DataFrame:
-    - รองรับหัวคอลัมน์หลายแบบ (ไทย/อังกฤษ)
-    - Qty ว่าง/NaN จะถูกมองเป็น 0
-    - รวมยอดเมื่อไฟล์มี SKU ซ้ำหลายบรรทัด
-    - โหมด full_replace=True: SKU ที่ไม่อยู่ในไฟล์/ชีต ให้ถือว่าเป็น 0 (SabuySoft)
-    คืนค่าจำนวน SKU ที่บันทึก (insert/update)
-    """
+def import_products_chunks(chunks) -> int:
+    """import_products ทีละ chunk (commit ทีละ chunk) คืนจำนวนแถวรวม"""
+    return sum(import_products(df) for df in chunks)
+
+def _stock_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """DataFrame สต็อก (ไฟล์ทั้งไฟล์หรือ 1 chunk) -> ยอดรวมต่อ SKU คอลัมน์ sku/qty"""
     sku_col = first_existing(df, COMMON_STOCK_SKU)
     qty_col = first_existing(df, COMMON_STOCK_QTY)
     if not sku_col:
@@ -118,56 +193,113 @@ def import_stock(df: pd.DataFrame, full_replace: bool = True) -> int:
     # คัดแถวที่ไม่มี SKU
     df = df[df["sku"] != ""]
 
-    # ✅ SabuySoft rule: ถ้า SKU หายไป ต้องถือว่าเป็น 0
-    # ทำ full sync โดย reset ทั้งตารางเป็น 0 ก่อน แล้วค่อย update ตามไฟล์
-    if full_replace:
-        reset_data = {Stock.qty: 0, Stock.updated_at: datetime.now(TH_TZ)}
-        Stock.query.update(reset_data, synchronize_session=False)
-
-        # ถ้าไฟล์ว่างจริง ๆ = แปลว่าไม่มี SKU ไหนเหลือเลย → ทั้งหมดเป็น 0
-        if df.empty:
-            db.session.commit()
-            return 0
-    else:
-        if df.empty:
-            return 0
-
     # รวมยอดตาม SKU (กันไฟล์ซ้ำแถว)
-    agg = df.groupby("sku", as_index=False)["qty"].sum()
+    return df.groupby("sku", as_index=False)["qty"].sum()
 
-    saved = 0
-    for _, row in agg.iterrows():
-        sku = row["sku"]
-        qty = int(row["qty"] or 0)
+# >>> ฟังก์ชันนี้ถูกแพตช์ใหม่ให้ทน NaN/หัวคอลัมน์หลายแบบ + Full Sync Mode
+def import_stock(df: pd.DataFrame, full_replace: bool = True) -> int:
+    """
+    นำเข้าสต็อกจาก DataFrame:
+    - รองรับหัวคอลัมน์หลายแบบ (ไทย/อังกฤษ)
+    - Qty ว่าง/NaN จะถูกมองเป็น 0
+    - รวมยอดเมื่อไฟล์มี SKU ซ้ำหลายบรรทัด
+    - โหมด full_replace=True: SKU ที่ไม่อยู่ในไฟล์/ชีต ให้ถือว่าเป็น 0 (SabuySoft)
+    คืนค่าจำนวน SKU ที่บันทึก (insert/update)
+    """
+    return import_stock_chunks([df], full_replace=full_replace)
 
-        st = Stock.query.filter_by(sku=sku).first()
-        if not st:
-            st = Stock(sku=sku, qty=qty)
-            db.session.add(st)
-        else:
-            st.qty = qty
-            st.updated_at = datetime.now(TH_TZ)
+def import_stock_chunks(chunks, full_replace: bool = True, progress=None) -> int:
+    """
+    เหมือน import_stock แต่รับ DataFrame ทีละก้อนของไฟล์เดียวกัน (ingest.read_excel_chunks)
+    ทุก chunk ถูกรวมยอดลง temp table ก่อน แล้ว sync กับตาราง stocks ครั้งเดียวใน Transaction เดียว
+    (full_replace ต้องรู้ SKU ของทั้งไฟล์ก่อนจึงจะตั้ง SKU ที่ไม่อยู่ในไฟล์เป็น 0 ได้)
+    progress(added=...) ถูกเรียกเมื่อ sync เสร็จ (services.import_jobs)
+    """
+    # โหลดไฟล์ลง temp table แล้ว sync แบบ set-based:
+    # 1) INSERT ... ON CONFLICT(sku) DO UPDATE เฉพาะแถวที่ qty เปลี่ยนจริง (updated_at จึงยังมีความหมาย)
+    # 2) ✅ SabuySoft rule (full_replace): SKU ที่ไม่อยู่ในไฟล์ -> ตั้งเป็น 0 (anti-join, เฉพาะที่ยังไม่เป็น 0)
+    now = datetime.now(TH_TZ)
+    con = db.session.connection()
+    returning = con.dialect.insert_returning and con.dialect.update_returning
+    stocks = Stock.__table__
+    changed: set[str] = set()
+
+    _STOCK_IMPORT.drop(con, checkfirst=True)
+    _STOCK_IMPORT.create(con)
+    try:
+        # SKU ที่อยู่หลาย chunk -> รวมยอดใน temp table
+        load = _upsert_insert(_STOCK_IMPORT)
+        load = load.on_conflict_do_update(
+            index_elements=[_STOCK_IMPORT.c.sku],
+            set_={"qty": _STOCK_IMPORT.c.qty + load.excluded.qty},
+        )
+        for df in chunks:
+            agg = _stock_frame(df)
+            rows = [{"sku": sku, "qty": int(qty or 0)} for sku, qty in zip(agg["sku"].tolist(), agg["qty"].tolist())]
+            if rows:
+                con.execute(load, rows)
+
+        count = con.execute(select(func.count()).select_from(_STOCK_IMPORT)).scalar_one()
+        if not count and not full_replace:
+            return 0
 
-        # ถ้ามีฟิลด์ product.stock_qty ให้ sync ด้วย
-        prod = Product.query.filter_by(sku=sku).first()
-        if prod is not None and hasattr(prod, "stock_qty"):
-            try:
-                prod.stock_qty = qty
-            except Exception:
-                # กันชนิดคอลัมน์ไม่ใช่ int
-                pass
+        if count:
+            ins = _upsert_insert(stocks).from_select(
+                ["sku", "qty", "updated_at"],
+                # SQLite ต้องมี WHERE ใน INSERT ... SELECT ... ON CONFLICT
+                select(_STOCK_IMPORT.c.sku, _STOCK_IMPORT.c.qty, literal(now, DateTime())).where(true()),
+            )
+            ins = ins.on_conflict_do_update(
+                index_elements=[stocks.c.sku],
+                set_={"qty": ins.excluded.qty, "updated_at": ins.excluded.updated_at},
+                where=stocks.c.qty.is_distinct_from(ins.excluded.qty),
+            )
+            if returning:
+                changed.update(con.execute(ins.returning(stocks.c.sku)).scalars())
+            else:
+                con.execute(ins)
+
+            # ถ้ามีฟิลด์ product.stock_qty ให้ sync ด้วย
+            if hasattr(Product, "stock_qty"):
+                in_file = select(_STOCK_IMPORT.c.qty).where(_STOCK_IMPORT.c.sku == Product.sku)
+                con.execute(
+                    update(Product.__table__)
+                    .where(exists(in_file))
+                    .values(stock_qty=in_file.scalar_subquery())
+                )
 
-        saved += 1
+        if full_replace:
+            zero = (
+                update(stocks)
+                .where(stocks.c.qty.is_distinct_from(0))
+                .where(~exists().where(_STOCK_IMPORT.c.sku == stocks.c.sku))
+                .values(qty=0, updated_at=now)
+            )
+            if returning:
+                changed.update(con.execute(zero.returning(stocks.c.sku)).scalars())
+            else:
+                con.execute(zero)
+    finally:
+        _STOCK_IMPORT.drop(con, checkfirst=True)
 
     db.session.commit()
-    return saved
+    # คำนวณใหม่เฉพาะ SKU ที่สต็อกเปลี่ยนจริง (DB ที่ไม่รองรับ RETURNING -> ทั้งหมด)
+    if returning:
+        mark_skus_dirty(sorted(changed))
+    else:
+        mark_all_dirty()
+    if progress:
+        progress(added=count)
+    return count
 
 def import_sales(df: pd.DataFrame) -> dict:
     """
     นำเข้าข้อมูลใบสั่งขาย (Sales)
-    Returns: Dict ที่มี {'ids': [...], 'skipped': [...]}
+    Returns: Dict ที่มี {'ids': [...], 'skipped': [...], 'changed_ids': [...], 'status_changed': int}
         - ids: List ของ Order ID ที่ทำการ Create/Update สำเร็จ
         - skipped: List ของ Dict ที่มีข้อมูลแถวที่ถูกข้าม
+        - changed_ids: Order ID ที่ข้อมูลใน DB เปลี่ยนจริง (ใช้ invalidate เฉพาะ Order เหล่านี้)
+        - status_changed: จำนวน Order ที่สถานะเปลี่ยน
     """
     # 1. หาชื่อคอลัมน์
     col_oid = first_existing(df, ["เลข Order", "Order ID", "order_id", "Order No", "เลขที่คำสั่งซื้อ", "orderNumber", "Order Number"])
@@ -179,12 +311,18 @@ def import_sales(df: pd.DataFrame) -> dict:
 
     processed_ids = []  # เก็บ Order ID ที่ทำสำเร็จ
     skipped_rows = []   # เก็บข้อมูลแถวที่ถูกข้าม
-
-    # 2. แปลงข้อมูลให้สะอาด
-    for idx, row in df.iterrows():
+    # ค่าใหม่จากไฟล์ต่อ Order (แถวหลังทับแถวก่อน เฉพาะค่าที่ไม่ว่าง): oid -> [po_no, status]
+    incoming: dict[str, list] = {}
+
+    # 2. แปลงข้อมูลให้สะอาด (อ่านทีละคอลัมน์แทน iterrows)
+    columns = zip(
+        df.index,
+        _column_values(df, col_oid, ""),
+        _column_values(df, col_po, ""),
+        _column_values(df, col_st, ""),
+    )
+    for idx, raw_oid, raw_po, raw_st in columns:
         # แปลง Order ID ให้ปลอดภัย (รองรับตัวเลขขนาดใหญ่)
-        raw_oid = row.get(col_oid, "")
-
         # กรณี Order ID เป็นตัวเลขขนาดใหญ่ (scientific notation)
         if pd.notna(raw_oid):
             try:
@@ -204,30 +342,24 @@ def import_sales(df: pd.DataFrame) -> dict:
                 "row_number": idx + 2,  # +2 เพราะ index เริ่มที่ 0 และมี header row
                 "reason": "Order ID ว่างเปล่า",
                 "order_id": raw_oid if pd.notna(raw_oid) else "(ว่าง)",
-                "po_no": row.get(col_po, "") if col_po else "",
-                "status": row.get(col_st, "") if col_st else ""
+                "po_no": raw_po if col_po else "",
+                "status": raw_st if col_st else ""
             })
             continue
 
         try:
-            # หาข้อมูล Sales เดิม (ถ้ามี)
-            sale = Sales.query.filter_by(order_id=oid).first()
-
-            # ถ้าไม่มี ให้สร้างใหม่
-            if not sale:
-                sale = Sales(order_id=oid)
-                db.session.add(sale)
+            values = incoming.setdefault(oid, [None, None])
 
-            # อัปเดตข้อมูล
-            if col_po and pd.notna(row.get(col_po)):
-                val_po = str(row.get(col_po)).strip()
+            # อัปเดตข้อมูล (เฉพาะค่าที่ไม่ว่าง)
+            if col_po and pd.notna(raw_po):
+                val_po = str(raw_po).strip()
                 if val_po:
-                    sale.po_no = val_po
+                    values[0] = val_po
 
-            if col_st and pd.notna(row.get(col_st)):
-                val_st = str(row.get(col_st)).strip()
+            if col_st and pd.notna(raw_st):
+                val_st = str(raw_st).strip()
                 if val_st:
-                    sale.status = val_st
+                    values[1] = val_st
 
             # เก็บ ID เข้า List
             processed_ids.append(oid)
@@ -238,39 +370,96 @@ def import_sales(df: pd.DataFrame) -> dict:
                 "row_number": idx + 2,
                 "reason": f"เกิดข้อผิดพลาด: {str(e)}",
                 "order_id": oid,
-                "po_no": row.get(col_po, "") if col_po else "",
-                "status": row.get(col_st, "") if col_st else ""
+                "po_no": raw_po if col_po else "",
+                "status": raw_st if col_st else ""
             })
             continue
 
+    # 3. ดึง Sales เดิมเป็นชุด (order_id IN ...) แล้วเขียนเฉพาะแถวที่ค่าเปลี่ยนจริง
+    inserts: list[dict] = []
+    updates: list[dict] = []
+    changed_ids: list[str] = []
+    unpacked_ids: list[str] = []  # เคยแพ็คแล้ว -> สถานะอื่น
+    status_changed = 0
+    oids = list(incoming)
+    for chunk in _chunks(oids):
+        existing: dict[str, tuple] = {}
+        q = (
+            select(Sales.id, Sales.order_id, Sales.po_no, Sales.status, Sales.status_class)
+            .where(Sales.order_id.in_(chunk))
+            .order_by(Sales.id)
+        )
+        for rec in db.session.execute(q):
+            existing.setdefault(rec.order_id, rec)  # Order ซ้ำในตาราง -> แถวแรกเหมือน .first()
+
+        for oid in chunk:
+            po_no, status = incoming[oid]
+            old = existing.get(oid)
+            if old is None:
+                status_class = classify_sales_status(status)
+                inserts.append({"order_id": oid, "po_no": po_no, "status": status, "status_class": status_class})
+                changed_ids.append(oid)
+                status_changed += status is not None
+                continue
+            po_no = po_no or old.po_no
+            status = status or old.status
+            status_class = classify_sales_status(status)
+            if (po_no, status, status_class) != (old.po_no, old.status, old.status_class):
+                updates.append({"_id": old.id, "po_no": po_no, "status": status, "status_class": status_class})
+                changed_ids.append(oid)
+                if old.status_class == SALES_PACKED and status_class != SALES_PACKED:
+                    unpacked_ids.append(oid)
+                status_changed += status != old.status
+
+    if inserts:
+        db.session.execute(insert(Sales), inserts)
+    if updates:
+        sales = Sales.__table__
+        db.session.execute(
+            update(sales).where(sales.c.id == bindparam("_id")).values(
+                po_no=bindparam("po_no"), status=bindparam("status"), status_class=bindparam("status_class"),
+            ),
+            updates,
+        )
+    if unpacked_ids:
+        # Order ในคลังที่ใบขายไม่ใช่แพ็คแล้ว (และไม่ได้ยกเลิก) -> ย้ายกลับ order_lines
+        order_archive.restore_unfinished(db.session.connection(), unpacked_ids)
     db.session.commit()
+    # คำนวณผลจัดสรรใหม่เฉพาะ Order ที่ข้อมูลใบขายเปลี่ยนจริง
+    mark_orders_dirty(changed_ids)
 
     return {
         "ids": processed_ids,
-        "skipped": skipped_rows
+        "skipped": skipped_rows,
+        "changed_ids": changed_ids,        # Order ที่ถูกเพิ่ม/แก้ไขจริงในรอบนี้
+        "status_changed": status_changed,  # จำนวน Order ที่สถานะเปลี่ยน (รวม Order ใหม่ที่มีสถานะ)
     }
 
+def import_sales_chunks(chunks, progress=None) -> dict:
+    """import_sales ทีละ chunk (commit ทีละ chunk) แล้วรวมผลเป็นรูปแบบเดียวกับ import_sales
+    progress(added=..., failed=...) ถูกเรียกหลังแต่ละ chunk (ค่าสะสม)"""
+    result = {"ids": [], "skipped": [], "changed_ids": [], "status_changed": 0}
+    seen_changed: set[str] = set()
+    for df in chunks:
+        res = import_sales(df)
+        result["ids"].extend(res["ids"])
+        result["skipped"].extend(res["skipped"])
+        result["status_changed"] += res["status_changed"]
+        for oid in res["changed_ids"]:
+            if oid not in seen_changed:
+                seen_changed.add(oid)
+                result["changed_ids"].append(oid)
+        if progress:
+            progress(added=len(result["ids"]), failed=len(result["skipped"]))
+    return result
+
 # ============================
 # INSERT-ONLY ORDER IMPORTER
 # ============================
-def import_orders(df: pd.DataFrame, platform: str, shop_name: str | None, import_date: date) -> dict:
-    """
-    นำเข้าออเดอร์แบบ INSERT-ONLY พร้อมส่งคืนสถิติละเอียด
-    
-    Returns dict:
-        {
-            'added': int,           # จำนวน Order ID ที่เพิ่มสำเร็จ (ไม่ซ้ำ)
-            'duplicates': int,      # จำนวน Order ID ที่ซ้ำ (ข้าม)
-            'failed': int,          # จำนวน Order ID ที่ไม่สำเร็จ
-            'errors': list,         # รายการสาเหตุที่ไม่สำเร็จ (สูงสุด 10 รายการ)
-            'added_ids': list,      # รายชื่อ Order ID ที่เพิ่มสำเร็จ
-            'duplicate_ids': list,  # รายชื่อ Order ID ที่ซ้ำ
-            'failed_ids': list      # รายชื่อ Order ID ที่ไม่สำเร็จ
-        }
-    นับยอดตาม Order ID ไม่ซ้ำ (Unique Order IDs)
-    """
-    platform_std = normalize_platform(platform)
-
+def _group_order_rows(df: pd.DataFrame, fallback_shop: str, grouped: dict, failed_oids_in_parsing: set, stats: dict) -> bool:
+    """อ่านแถวของ DataFrame (ไฟล์ทั้งไฟล์หรือ 1 chunk) เข้ากลุ่ม grouped[(shop, order_id)]
+    failed_oids_in_parsing = set คู่กับ stats["failed_ids"] (เช็คซ้ำด้วย set, list ไว้คืนผลตามลำดับ)
+    คืน False ถ้าไม่พบคอลัมน์ Order ID / SKU"""
     # --- หา columns จากหลายแพลตฟอร์ม ---
     shop_col  = first_existing(df, COMMON_SHOP)
     order_col = first_existing(df, COMMON_ORDER_ID)
@@ -280,43 +469,31 @@ def import_orders(df: pd.DataFrame, platform: str, shop_name: str | None, import
     time_col  = first_existing(df, COMMON_ORDER_TIME)
     logi_col  = first_existing(df, COMMON_LOGISTICS)
 
-    stats = {
-        "added": 0,
-        "duplicates": 0,           # รวมซ้ำทั้งหมด (old + today)
-        "duplicates_old": 0,       # ซ้ำข้ามวัน (แสดงในการ์ด)
-        "duplicates_today": 0,     # ซ้ำในวันเดียวกัน (ไม่แสดงในการ์ด)
-        "failed": 0,
-        "errors": [],  # เก็บสาเหตุที่ไม่สำเร็จ (สูงสุด 10 รายการ)
-        "added_ids": [],
-        "duplicate_ids": [],
-        "duplicate_old_ids": [],   # รายการ Order ID ที่ซ้ำข้ามวัน
-        "duplicate_today_ids": [], # รายการ Order ID ที่ซ้ำในวัน
-        "failed_ids": []
-    }
-
     if not order_col or not sku_col:
         stats["errors"].append("ไม่พบคอลัมน์ Order ID หรือ SKU ในไฟล์")
-        return stats
-
-    # fallback ชื่อร้านจากฟอร์ม (ถ้ามี)
-    fallback_shop = clean_shop_name(shop_name) if shop_name else ""
-
-    # Group ข้อมูลตาม Order ID ก่อน (เพื่อจัดการเป็นราย Order)
-    # key = (shop, order_id), value = list of items
-    grouped: dict[tuple[str, str], list[dict]] = {}
-    failed_oids_in_parsing: set[str] = set()
-    
-    for idx, row in df.iterrows():
-        oid = str(row.get(order_col, "")).strip()
-        sku = str(row.get(sku_col, "")).strip()
+        return False
+
+    # อ่านทีละคอลัมน์ (แทน iterrows ที่สร้าง Series ทุกแถว)
+    columns = zip(
+        df.index,
+        _column_values(df, order_col, ""),
+        _column_values(df, sku_col, ""),
+        _column_values(df, shop_col),
+        _column_values(df, qty_col),
+        _column_values(df, name_col, ""),
+        _column_values(df, time_col),
+        _column_values(df, logi_col, ""),
+    )
+    for idx, raw_oid, raw_sku, raw_shop, raw_qty, raw_name, raw_time, raw_logi in columns:
+        oid = str(raw_oid).strip()
+        sku = str(raw_sku).strip()
         
         # เช็คข้อมูลสำคัญ
         if not oid or not sku:
             if oid and oid not in failed_oids_in_parsing:
                 failed_oids_in_parsing.add(oid)
-                if oid not in stats["failed_ids"]:
-                    stats["failed_ids"].append(oid)
-                    stats["failed"] += 1
+                stats["failed_ids"].append(oid)
+                stats["failed"] += 1
             elif not oid:
                 # ไม่มี OID เลย นับ failed แบบไม่มี ID
                 stats["failed"] += 1
@@ -324,18 +501,17 @@ def import_orders(df: pd.DataFrame, platform: str, shop_name: str | None, import
                 stats["errors"].append(f"แถว {idx+2}: ไม่มี Order ID หรือ SKU")
             continue
 
-        sname = clean_shop_name(row.get(shop_col)) if shop_col else fallback_shop
+        sname = clean_shop_name(raw_shop) if shop_col else fallback_shop
         if not sname:
             if oid not in failed_oids_in_parsing:
                 failed_oids_in_parsing.add(oid)
-                if oid not in stats["failed_ids"]:
-                    stats["failed_ids"].append(oid)
-                    stats["failed"] += 1
+                stats["failed_ids"].append(oid)
+                stats["failed"] += 1
             if len(stats["errors"]) < 10:
                 stats["errors"].append(f"Order {oid}: ไม่ระบุชื่อร้าน")
             continue
 
-        qty = pd.to_numeric(row.get(qty_col), errors="coerce") if qty_col else None
+        qty = pd.to_numeric(raw_qty, errors="coerce") if qty_col else None
         qty = int(qty) if pd.notnull(qty) else 1
 
         key = (sname, oid)
@@ -345,98 +521,248 @@ def import_orders(df: pd.DataFrame, platform: str, shop_name: str | None, import
         grouped[key].append({
             "sku": sku,
             "qty": max(qty, 0),
-            "name": str(row.get(name_col, "") or ""),
-            "time": row.get(time_col) if time_col else None,
-            "logi": str(row.get(logi_col, "") or "") if logi_col else "",
+            "name": str(raw_name or ""),
+            "time": raw_time,
+            "logi": str(raw_logi or "") if logi_col else "",
         })
 
-    if not grouped and stats["failed"] == 0:
-        return stats  # Empty but valid file structure
+    return True
+
+def _merge_order_lines(lines: list[dict], import_date: date) -> list[dict]:
+    """บรรทัดต่อของ Order ที่ insert ไปแล้วในไฟล์เดียวกัน (คนละ chunk)
+    SKU ที่มีอยู่แล้ว -> บวก qty เข้าแถวเดิม (UPDATE) เหมือนรวม SKU ซ้ำใน Order; คืนบรรทัด SKU ใหม่ไว้ insert"""
+    rows: dict[tuple[int, str, str], tuple] = {}
+    for chunk in _chunks({line["order_id"] for line in lines}):
+        q = (
+            select(OrderLine.id, OrderLine.shop_id, OrderLine.order_id, OrderLine.sku, OrderLine.qty,
+                   OrderLine.item_name, OrderLine.order_time, OrderLine.logistic_type)
+            .where(OrderLine.order_id.in_(chunk), OrderLine.import_date == import_date)
+            .order_by(OrderLine.id)
+        )
+        for rec in db.session.execute(q):
+            rows.setdefault((rec.shop_id, rec.order_id, rec.sku), rec)
+
+    inserts: list[dict] = []
+    updates: list[dict] = []
+    for line in lines:
+        old = rows.get((line["shop_id"], line["order_id"], line["sku"]))
+        if old is None:
+            inserts.append(line)
+            continue
+        updates.append({
+            "_id": old.id,
+            "qty": (old.qty or 0) + line["qty"],
+            "item_name": old.item_name or line["item_name"],
+            "order_time": line["order_time"] or old.order_time,
+            "logistic_type": line["logistic_type"] or old.logistic_type,
+        })
+    if updates:
+        lines_t = OrderLine.__table__
+        db.session.execute(
+            update(lines_t).where(lines_t.c.id == bindparam("_id")).values(
+                qty=bindparam("qty"), item_name=bindparam("item_name"),
+                order_time=bindparam("order_time"), logistic_type=bindparam("logistic_type"),
+            ),
+            updates,
+        )
+    return inserts
 
-    has_product_fk = hasattr(OrderLine, "product_id")
+def import_orders(df: pd.DataFrame, platform: str, shop_name: str | None, import_date: date) -> dict:
+    """นำเข้าออเดอร์จาก DataFrame เดียว (ดู import_orders_chunks)"""
+    return import_orders_chunks([df], platform, shop_name, import_date)
 
-    # Process แต่ละ Order (ระดับ Transaction)
-    for (sname, oid), items in grouped.items():
-        try:
-            shop = get_or_create_shop(platform_std, sname)
-
-            # เช็คว่า Order นี้เคยมีในระบบแล้วหรือยัง (เช็คระดับ Order)
-            exists = OrderLine.query.filter_by(shop_id=shop.id, order_id=oid).first()
-            if exists:
-                if oid not in stats["duplicate_ids"]:
-                    stats["duplicates"] += 1
-                    stats["duplicate_ids"].append(oid)
-                    
-                    # [NEW] เช็คว่าซ้ำข้ามวันหรือซ้ำในวันเดียวกัน
-                    is_old_duplicate = True
-                    if exists.import_date and exists.import_date == import_date:
-                        is_old_duplicate = False
-                    
-                    if is_old_duplicate:
-                        stats["duplicates_old"] += 1
-                        stats["duplicate_old_ids"].append(oid)
-                    else:
-                        stats["duplicates_today"] += 1
-                        stats["duplicate_today_ids"].append(oid)
-                continue
+def import_orders_chunks(chunks, platform: str, shop_name: str | None, import_date: date, progress=None) -> dict:
+    """
+    นำเข้าออเดอร์แบบ INSERT-ONLY พร้อมส่งคืนสถิติละเอียด
+    
+    Returns dict:
+        {
+            'added': int,           # จำนวน Order ID ที่เพิ่มสำเร็จ (ไม่ซ้ำ)
+            'duplicates': int,      # จำนวน Order ID ที่ซ้ำ (ข้าม)
+            'failed': int,          # จำนวน Order ID ที่ไม่สำเร็จ
+            'errors': list,         # รายการสาเหตุที่ไม่สำเร็จ (สูงสุด 10 รายการ)
+            'added_ids': list,      # รายชื่อ Order ID ที่เพิ่มสำเร็จ
+            'duplicate_ids': list,  # รายชื่อ Order ID ที่ซ้ำ
+            'failed_ids': list      # รายชื่อ Order ID ที่ไม่สำเร็จ
+        }
+    นับยอดตาม Order ID ไม่ซ้ำ (Unique Order IDs)
+    chunks = DataFrame ทีละก้อนของไฟล์เดียวกัน (ingest.read_excel_chunks) -> ตรวจซ้ำ/insert/commit ทีละ chunk
+    ยกเว้น Order ของแถวสุดท้ายใน chunk ที่ค้างไว้รวมกับ chunk ถัดไป (หน่วยความจำไม่โตตามขนาดไฟล์
+    เก็บข้ามรอบแค่ set ของ Order ID); Order ที่บรรทัดอยู่คนละ chunk ยังนับเป็น Order เดียว (ดู _merge_order_lines)
+    progress(added=..., duplicates=..., failed=...) ถูกเรียกหลังแต่ละ chunk insert เสร็จ (ค่าสะสม)
+    """
+    platform_std = normalize_platform(platform)
 
-            # ถ้ายังไม่มี -> เพิ่มสินค้าลง DB
-            # รวม SKU ซ้ำใน Order เดียวกัน
-            sku_agg: dict[str, dict] = {}
-            for item in items:
-                sku = item["sku"]
-                if sku not in sku_agg:
-                    sku_agg[sku] = {
-                        "qty": 0,
-                        "name": item.get("name", ""),
-                        "time": item.get("time"),
-                        "logi": item.get("logi", ""),
-                    }
-                sku_agg[sku]["qty"] += item.get("qty", 0)
-                if not sku_agg[sku].get("name"):
-                    sku_agg[sku]["name"] = item.get("name", "")
-                if item.get("time"):
-                    sku_agg[sku]["time"] = item.get("time")
-                if item.get("logi"):
-                    sku_agg[sku]["logi"] = item.get("logi")
-
-            items_added_count = 0
-            for sku, rec in sku_agg.items():
-                order_time = parse_datetime_guess(rec.get("time")) if rec.get("time") is not None else None
-
-                ol_kwargs = dict(
-                    platform=platform_std,
-                    shop_id=shop.id,
-                    order_id=oid,
-                    sku=sku,
-                    item_name=rec.get("name", "")[:255],
-                    qty=int(rec.get("qty") or 0) or 1,
-                    order_time=order_time,
-                    logistic_type=(rec.get("logi") or "")[:60],
-                    import_date=import_date,
-                )
+    stats = {
+        "added": 0,
+        "duplicates": 0,           # รวมซ้ำทั้งหมด (old + today)
+        "duplicates_old": 0,       # ซ้ำข้ามวัน (แสดงในการ์ด)
+        "duplicates_today": 0,     # ซ้ำในวันเดียวกัน (ไม่แสดงในการ์ด)
+        "failed": 0,
+        "errors": [],  # เก็บสาเหตุที่ไม่สำเร็จ (สูงสุด 10 รายการ)
+        "added_ids": [],
+        "duplicate_ids": [],
+        "duplicate_old_ids": [],   # รายการ Order ID ที่ซ้ำข้ามวัน
+        "duplicate_today_ids": [], # รายการ Order ID ที่ซ้ำในวัน
+        "failed_ids": []
+    }
 
-                # ผูก product ถ้าตารางมีและเจอสินค้า
-                if has_product_fk:
-                    prod = Product.query.filter_by(sku=sku).first()
-                    if prod:
-                        ol_kwargs["product_id"] = prod.id
-
-                line = OrderLine(**ol_kwargs)
-                db.session.add(line)
-                items_added_count += 1
-            
-            # นับยอด Added (เฉพาะถ้ายังไม่เคยนับ)
-            if items_added_count > 0 and oid not in stats["added_ids"]:
-                stats["added"] += 1
-                stats["added_ids"].append(oid)
+    # fallback ชื่อร้านจากฟอร์ม (ถ้ามี)
+    fallback_shop = clean_shop_name(shop_name) if shop_name else ""
 
-        except Exception as e:
-            if oid not in stats["failed_ids"]:
-                stats["failed"] += 1
-                stats["failed_ids"].append(oid)
-            if len(stats["errors"]) < 10:
-                stats["errors"].append(f"Order {oid}: {str(e)}")
+    # Group ข้อมูลตาม Order ID ทีละ chunk (เพื่อจัดการเป็นราย Order)
+    # key = (shop, order_id), value = list of items (เฉพาะ Order ที่ยังไม่ได้ insert)
+    grouped: dict[tuple[str, str], list[dict]] = {}
+    # set คู่กับ list ใน stats ไว้เช็คซ้ำ (list เก็บไว้คืนผลตามลำดับเท่านั้น)
+    failed_oids_in_parsing: set[str] = set()
+    seen_duplicate: set[str] = set()
+    seen_added: set[str] = set()
+    # (shop, order_id) ที่ insert ไปแล้วในไฟล์นี้ -> บรรทัดที่โผล่อีกใน chunk หลัง ๆ รวมเข้า Order เดิม
+    added_keys: set[tuple[str, str]] = set()
+    header: tuple = ()
+    has_product_fk = hasattr(OrderLine, "product_id")
 
-    db.session.commit()
+    def flush(keys) -> None:
+        """ตรวจซ้ำ/insert Order ตาม keys (ดึงออกจาก grouped) แล้ว commit"""
+        batch = {k: grouped.pop(k) for k in keys}
+
+        # --- ดึงร้าน / Order เดิม / สินค้า ด้วย IN query ไม่กี่ครั้ง (แทน query ราย Order) ---
+        shop_ids = _resolve_shop_ids(platform_std, [sname for sname, _ in batch])
+        # (shop_id, order_id) -> import_date ของบรรทัดแรกที่มีอยู่แล้ว
+        existing = _existing_order_import_dates({oid for sname, oid in batch if (sname, oid) not in added_keys})
+        product_ids = _product_ids({item["sku"] for items in batch.values() for item in items}) if has_product_fk else {}
+        # เวลาสั่งซื้อ (สตริง) ของ Order ใหม่ แปลงทั้งคอลัมน์ทีเดียว; ค่าที่ไม่อยู่ใน dict -> parse_datetime_guess ทีละค่า
+        order_times = parse_datetime_texts(
+            (item["time"] for (sname, oid), items in batch.items()
+             if (sname, oid) in added_keys or (shop_ids.get(clean_shop_name(sname)), oid) not in existing
+             for item in items),
+            cache_key=(platform_std, header),
+        )
+
+        new_lines: list[dict] = []
+        more_lines: list[dict] = []  # บรรทัดต่อของ Order ที่ insert ไปแล้วใน chunk ก่อน
+        dirty_ids: list[str] = []
+
+        # Process แต่ละ Order (ตรวจซ้ำ/รวม SKU ใน memory แล้ว insert ทีเดียวตอนท้าย)
+        for (sname, oid), items in batch.items():
+            try:
+                key = (shop_ids[clean_shop_name(sname)], oid)
+                continued = (sname, oid) in added_keys
+
+                # เช็คว่า Order นี้เคยมีในระบบแล้วหรือยัง (เช็คระดับ Order)
+                if not continued and key in existing:
+                    if oid not in seen_duplicate:
+                        seen_duplicate.add(oid)
+                        stats["duplicates"] += 1
+                        stats["duplicate_ids"].append(oid)
+
+                        # [NEW] เช็คว่าซ้ำข้ามวันหรือซ้ำในวันเดียวกัน
+                        exists_import_date = existing[key]
+                        is_old_duplicate = True
+                        if exists_import_date and exists_import_date == import_date:
+                            is_old_duplicate = False
+
+                        if is_old_duplicate:
+                            stats["duplicates_old"] += 1
+                            stats["duplicate_old_ids"].append(oid)
+                        else:
+                            stats["duplicates_today"] += 1
+                            stats["duplicate_today_ids"].append(oid)
+                    continue
+
+                # ถ้ายังไม่มี -> เพิ่มสินค้าลง DB
+                # รวม SKU ซ้ำใน Order เดียวกัน
+                sku_agg: dict[str, dict] = {}
+                for item in items:
+                    sku = item["sku"]
+                    if sku not in sku_agg:
+                        sku_agg[sku] = {
+                            "qty": 0,
+                            "name": item.get("name", ""),
+                            "time": item.get("time"),
+                            "logi": item.get("logi", ""),
+                        }
+                    sku_agg[sku]["qty"] += item.get("qty", 0)
+                    if not sku_agg[sku].get("name"):
+                        sku_agg[sku]["name"] = item.get("name", "")
+                    if item.get("time"):
+                        sku_agg[sku]["time"] = item.get("time")
+                    if item.get("logi"):
+                        sku_agg[sku]["logi"] = item.get("logi")
+
+                order_lines = []
+                for sku, rec in sku_agg.items():
+                    raw_time = rec.get("time")
+                    if isinstance(raw_time, str) and raw_time in order_times:
+                        order_time = order_times[raw_time]
+                    else:
+                        order_time = parse_datetime_guess(raw_time) if raw_time is not None else None
+
+                    ol_kwargs = dict(
+                        platform=platform_std,
+                        shop_id=key[0],
+                        order_id=oid,
+                        sku=sku,
+                        item_name=rec.get("name", "")[:255],
+                        qty=int(rec.get("qty") or 0) or 1,
+                        order_time=order_time,
+                        logistic_type=(rec.get("logi") or "")[:60],
+                        import_date=import_date,
+                    )
+
+                    # ผูก product ถ้าตารางมีและเจอสินค้า
+                    if has_product_fk:
+                        ol_kwargs["product_id"] = product_ids.get(sku)
+
+                    order_lines.append(ol_kwargs)
+
+                if continued:
+                    more_lines.extend(order_lines)
+                    dirty_ids.append(oid)
+                    continue
+
+                new_lines.extend(order_lines)
+                # Order เดียวกันที่โผล่อีกครั้งในไฟล์เดียวกัน (คนละชื่อร้านแต่ร้านเดียวกัน) = ซ้ำวันนี้
+                existing[key] = import_date
+                added_keys.add((sname, oid))
+
+                # นับยอด Added (เฉพาะถ้ายังไม่เคยนับ)
+                if order_lines and oid not in seen_added:
+                    seen_added.add(oid)
+                    stats["added"] += 1
+                    stats["added_ids"].append(oid)
+                    dirty_ids.append(oid)
+
+            except Exception as e:
+                if oid not in failed_oids_in_parsing:
+                    failed_oids_in_parsing.add(oid)
+                    stats["failed"] += 1
+                    stats["failed_ids"].append(oid)
+                if len(stats["errors"]) < 10:
+                    stats["errors"].append(f"Order {oid}: {str(e)}")
+
+        if more_lines:
+            new_lines.extend(_merge_order_lines(more_lines, import_date))
+        # Insert บรรทัดใหม่ของ batch ครั้งเดียว (executemany) ใน Transaction เดียวกับร้านที่สร้างใหม่
+        if new_lines:
+            db.session.execute(insert(OrderLine), new_lines)
+        db.session.commit()
+        mark_orders_dirty(dirty_ids)
+
+    # อ่าน chunk ถัดไปไว้ก่อน 1 ก้อน เพื่อรู้ว่า chunk ไหนเป็นก้อนสุดท้าย
+    chunks = iter(chunks)
+    df = next(chunks, None)
+    while df is not None:
+        header = header or tuple(str(c) for c in df.columns)
+        if not _group_order_rows(df, fallback_shop, grouped, failed_oids_in_parsing, stats):
+            return stats
+        nxt = next(chunks, None)
+        # Order ของแถวสุดท้ายอาจมีบรรทัดต่อใน chunk ถัดไป -> ค้างไว้ insert รอบหน้า (chunk สุดท้าย insert ทั้งหมด)
+        tail = str(df[first_existing(df, COMMON_ORDER_ID)].iloc[-1]).strip() if nxt is not None and len(df) else None
+        closed = [key for key in grouped if key[1] != tail]
+        if closed:
+            flush(closed)
+        if progress:
+            progress(added=stats["added"], duplicates=stats["duplicates"], failed=stats["failed"])
+        df = nxt
     return stats
\ No newline at end of file
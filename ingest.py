@@ -0,0 +1,252 @@
+# ingest.py
+"""
+อ่านไฟล์นำเข้า (Excel / CSV / Parquet) แบบ Streaming เป็นก้อนๆ (chunk) แทน pd.read_excel ทั้งไฟล์
+
+- .xlsx อ่านด้วย openpyxl read_only=True + iter_rows(values_only=True) ทีละแถว
+  หน่วยความจำสูงสุด ~ 1 chunk ไม่ขึ้นกับขนาดไฟล์
+- แต่ละ chunk เป็น DataFrame หัวคอลัมน์เดียวกันทั้งไฟล์ และ index = ลำดับแถวในไฟล์ (0 = แถวแรกหลัง header)
+  importer เดิมที่ใช้ first_existing / idx+2 เป็นเลขแถวจึงใช้กับ chunk ได้ทันที
+- ไฟล์ที่ openpyxl เปิดไม่ได้ (.xls ฯลฯ) ใช้ pd.read_excel แล้วแบ่ง chunk ให้แทน
+- .csv อ่านด้วย parser ภาษา C ของ pandas (chunksize) ทุกคอลัมน์เป็นข้อความ (dtype=str) ช่องว่างเป็น NaN
+  (ไม่เดาชนิดต่อ chunk: SKU/เลข Order ที่ขึ้นต้นด้วย 0 ไม่ถูกตัด และชนิดไม่สลับระหว่าง chunk
+  จำนวน/วันที่ importer แปลงเองด้วย pd.to_numeric / pd.to_datetime อยู่แล้ว)
+  (ไม่ใช้ engine="pyarrow": เลข Order ยาว 19 หลักกลายเป็น float และอ่านทีละ chunk ไม่ได้)
+- .parquet อ่านด้วย pyarrow (iter_batches) ถ้าติดตั้งไว้
+read_upload_chunks เลือกตัวอ่านตามนามสกุลไฟล์ (ค่าเริ่มต้น = Excel)
+"""
+
+from __future__ import annotations
+
+import codecs
+import os
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+DEFAULT_CHUNK_ROWS = int(os.environ.get("IMPORT_CHUNK_ROWS", "5000") or 5000)
+
+def _cell(v):
+    """แปลงค่าจาก openpyxl แบบเดียวกับ pd.read_excel (ว่าง -> "", ทศนิยมที่เป็นจำนวนเต็ม -> int)"""
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    return v
+
+
+def _header_names(raw_header) -> list:
+    """ตั้งชื่อหัวคอลัมน์แบบเดียวกับ pandas: ว่าง -> 'Unnamed: i', ซ้ำ -> 'X.1', 'X.2'"""
+    names, seen = [], {}
+    for i, h in enumerate(raw_header):
+        name = f"Unnamed: {i}" if h is None or (isinstance(h, str) and not h.strip()) else h
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+class _TableStream:
+    columns: list
+
+    def find(self, candidates):
+        """first_existing(df, candidates) โดยใช้แค่หัวคอลัมน์ (ไม่ต้องมีข้อมูล)"""
+        from importers import first_existing
+
+        return first_existing(pd.DataFrame(columns=self.columns), candidates)
+
+    def close(self):
+        pass
+
+
+class SheetStream(_TableStream):
+    """ชีตแรกของไฟล์ Excel ที่อ่านทีละ chunk (ใช้ได้ครั้งเดียว)
+
+    columns = หัวคอลัมน์ (อ่านครั้งเดียวตอนเปิดไฟล์)
+    find(candidates) = first_existing กับหัวคอลัมน์ของไฟล์
+    chunks() = DataFrame ทีละไม่เกิน chunk_rows แถว
+    """
+
+    def __init__(self, file, chunk_rows: int = DEFAULT_CHUNK_ROWS, drop_blank: bool = False):
+        self.chunk_rows = max(int(chunk_rows), 1)
+        self.drop_blank = drop_blank
+        self._workbook = None
+        self._frame = None
+        try:
+            from openpyxl import load_workbook
+
+            self._workbook = load_workbook(file, read_only=True, data_only=True)
+            ws = self._workbook.worksheets[0]
+            self._rows = ws.iter_rows(values_only=True)
+            header = next(self._rows, None) or ()
+            # ตัดหัวคอลัมน์ว่างด้านท้าย (เหมือน pandas)
+            while header and header[-1] is None:
+                header = header[:-1]
+            self.columns = _header_names(header)
+        except Exception:
+            # ไม่ใช่ .xlsx -> ให้ pandas อ่านทั้งไฟล์ (พฤติกรรมเดิม)
+            self.close()
+            if hasattr(file, "seek"):
+                file.seek(0)
+            self._frame = pd.read_excel(file)
+            self.columns = list(self._frame.columns)
+
+    def chunks(self) -> Iterator[pd.DataFrame]:
+        if self._frame is not None:
+            df, self._frame = self._frame, None
+            if self.drop_blank:
+                df = df.dropna(how="all")
+            for start in range(0, max(len(df), 1), self.chunk_rows):
+                yield df.iloc[start:start + self.chunk_rows]
+            return
+
+        width = len(self.columns)
+        index, records = [], []
+        pending_blank: list[int] = []  # แถวว่างที่ยังไม่รู้ว่าเป็นแถวท้ายไฟล์หรือไม่
+        emitted = False
+        try:
+            for pos, values in enumerate(self._rows):
+                values = [_cell(v) for v in values[:width]]
+                if len(values) < width:
+                    values += [""] * (width - len(values))
+                if all(v == "" for v in values):
+                    # drop_blank ก็ยังส่งแถวว่างเข้า parser (ชนิดข้อมูลเหมือน read_excel แล้ว dropna) แล้วค่อยตัดใน _to_frame
+                    pending_blank.append(pos)
+                    continue
+                # แถวว่างคั่นกลางไฟล์ยังนับเป็นแถวข้อมูล (pandas ตัดเฉพาะแถวว่างท้ายไฟล์)
+                for blank_pos in pending_blank:
+                    index.append(blank_pos)
+                    records.append([""] * width)
+                pending_blank.clear()
+                index.append(pos)
+                records.append(values)
+                if len(records) >= self.chunk_rows:
+                    emitted = True
+                    yield self._to_frame(records, index)
+                    index, records = [], []
+            if records or not emitted:
+                # ไฟล์ที่มีแต่ header ก็ได้ 1 chunk ว่าง (importer ยังตรวจหัวคอลัมน์ได้เหมือนเดิม)
+                yield self._to_frame(records, index)
+        finally:
+            self.close()
+
+    def _to_frame(self, records: list, index: list) -> pd.DataFrame:
+        # ใช้ TextParser ตัวเดียวกับ pd.read_excel (แปลงชนิดข้อมูล/ค่าว่างเหมือนเดิม แต่ทำทีละ chunk)
+        df = TextParser(records, names=self.columns, header=None, skip_blank_lines=False).read()
+        df.index = pd.Index(index)
+        return df.dropna(how="all") if self.drop_blank else df
+
+    def close(self):
+        if self._workbook is not None:
+            self._workbook.close()
+            self._workbook = None
+
+
+def _csv_encoding(stream) -> str:
+    """utf-8 (ตัด BOM) ถ้าถอดรหัสได้ทั้งไฟล์ ไม่งั้น cp874 (CSV ภาษาไทยที่ Save จาก Excel)"""
+    pos = stream.tell()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        for block in iter(lambda: stream.read(1 << 20), b""):
+            decoder.decode(block)
+        decoder.decode(b"", final=True)
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "cp874"
+    finally:
+        stream.seek(pos)
+
+
+class CsvStream(_TableStream):
+    """ไฟล์ CSV ที่อ่านทีละ chunk ด้วย pd.read_csv(chunksize=...) (ใช้ได้ครั้งเดียว)"""
+
+    def __init__(self, file, chunk_rows: int = DEFAULT_CHUNK_ROWS, drop_blank: bool = False):
+        self.chunk_rows = max(int(chunk_rows), 1)
+        self.drop_blank = drop_blank
+        self._fh = open(file, "rb") if isinstance(file, (str, os.PathLike)) else None
+        stream = self._fh or file
+        self._reader = pd.read_csv(stream, encoding=_csv_encoding(stream), chunksize=self.chunk_rows,
+                                   dtype=str, keep_default_na=True)
+        # อ่าน chunk แรกไว้เลยเพื่อได้หัวคอลัมน์ (ตั้งชื่อซ้ำ/ว่างแบบเดียวกับ Excel)
+        self._first = next(self._reader, None)
+        self.columns = list(self._first.columns) if self._first is not None else []
+
+    def chunks(self) -> Iterator[pd.DataFrame]:
+        try:
+            # ไฟล์ที่มีแต่ header ก็ได้ 1 chunk ว่าง (เหมือน SheetStream)
+            first, self._first = self._first, None
+            for df in ([first] if first is not None else []):
+                yield df.dropna(how="all") if self.drop_blank else df
+            for df in self._reader:
+                yield df.dropna(how="all") if self.drop_blank else df
+        finally:
+            self.close()
+
+    def close(self):
+        self._reader.close()
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+def _nulls_as_nan(df: pd.DataFrame) -> pd.DataFrame:
+    """None ในคอลัมน์ข้อความ -> NaN (แบบเดียวกับค่าว่างจาก Excel/CSV)"""
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].where(df[col].notna(), np.nan)
+    return df
+
+
+class ParquetStream(_TableStream):
+    """ไฟล์ Parquet ที่อ่านทีละ batch ด้วย pyarrow (ใช้ได้ครั้งเดียว)"""
+
+    def __init__(self, file, chunk_rows: int = DEFAULT_CHUNK_ROWS, drop_blank: bool = False):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("อ่านไฟล์ .parquet ต้องติดตั้ง pyarrow ก่อน: pip install pyarrow") from None
+        self.chunk_rows = max(int(chunk_rows), 1)
+        self.drop_blank = drop_blank
+        self._file = pq.ParquetFile(file)
+        self.columns = list(self._file.schema_arrow.names)
+
+    def chunks(self) -> Iterator[pd.DataFrame]:
+        pos = 0
+        emitted = False
+        try:
+            for batch in self._file.iter_batches(batch_size=self.chunk_rows):
+                df = _nulls_as_nan(batch.to_pandas())
+                df.index = pd.RangeIndex(pos, pos + len(df))
+                pos += len(df)
+                emitted = True
+                yield df.dropna(how="all") if self.drop_blank else df
+            if not emitted:
+                yield _nulls_as_nan(self._file.schema_arrow.empty_table().to_pandas())
+        finally:
+            self.close()
+
+    def close(self):
+        self._file.close()
+
+
+def read_excel_chunks(file, chunk_rows: int = DEFAULT_CHUNK_ROWS, drop_blank: bool = False) -> SheetStream:
+    """เปิดไฟล์อัปโหลด (werkzeug FileStorage / path / file object) เป็น SheetStream"""
+    stream = getattr(file, "stream", file)
+    return SheetStream(stream, chunk_rows=chunk_rows, drop_blank=drop_blank)
+
+
+def read_upload_chunks(file, chunk_rows: int = DEFAULT_CHUNK_ROWS, drop_blank: bool = False,
+                       filename: str | None = None) -> _TableStream:
+    """เปิดไฟล์อัปโหลดตามนามสกุล (.csv / .parquet / อื่นๆ = Excel)
+    filename ใช้เมื่อ file ไม่มีชื่อในตัว (เช่น BytesIO)"""
+    name = filename or getattr(file, "filename", None) or (file if isinstance(file, (str, os.PathLike)) else "")
+    ext = os.path.splitext(str(name))[1].lower()
+    stream = getattr(file, "stream", file)
+    if ext == ".csv":
+        return CsvStream(stream, chunk_rows=chunk_rows, drop_blank=drop_blank)
+    if ext == ".parquet":
+        return ParquetStream(stream, chunk_rows=chunk_rows, drop_blank=drop_blank)
+    return SheetStream(stream, chunk_rows=chunk_rows, drop_blank=drop_blank)
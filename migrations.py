@@ -0,0 +1,72 @@
+# migrations.py
+"""
+ตัวรัน migration แบบมีเวอร์ชัน (schema_version) แทนการตรวจ PRAGMA / ALTER ทุกครั้งที่บูต
+
+- migration แต่ละขั้นเป็น Migration(version, name, apply) เรียงตาม version (ห้ามแก้ขั้นที่ปล่อยไปแล้ว ให้เพิ่มขั้นใหม่)
+- ตาราง schema_version เก็บขั้นที่ทำแล้ว (version, name, applied_at)
+- บูตปกติ (ฐานข้อมูลเป็นปัจจุบัน) อ่านแค่ MAX(version) ครั้งเดียว ไม่ probe ตาราง/คอลัมน์ใด ๆ
+- ขั้นที่ค้างรันทีละขั้นใน transaction ของตัวเอง (apply + บันทึกเวอร์ชัน) ถ้าล้มจะ rollback และไม่บันทึก
+- ฐานข้อมูลเดิมที่ยังไม่มี schema_version จะรันทุกขั้นหนึ่งรอบ -> ทุกขั้นต้องทำซ้ำได้ (ตรวจก่อนเพิ่มคอลัมน์/ตาราง)
+"""
+
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Callable, NamedTuple, Sequence
+
+from sqlalchemy import inspect, text
+
+TABLE = "schema_version"
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable  # apply(connection) -> None ทำงานใน transaction ที่ตัวรันเปิดให้ ห้าม commit เอง
+
+
+def current_version(connection) -> int:
+    """เวอร์ชันล่าสุดที่บันทึกไว้ (0 = ยังไม่มีตาราง schema_version)"""
+    if not inspect(connection).has_table(TABLE):
+        return 0
+    return connection.execute(text(f"SELECT COALESCE(MAX(version), 0) FROM {TABLE}")).scalar() or 0
+
+
+def _check_order(steps: Sequence[Migration]) -> None:
+    versions = [m.version for m in steps]
+    if versions != sorted(set(versions)) or (versions and versions[0] < 1):
+        raise ValueError(f"migration versions must be unique, ascending and >= 1: {versions}")
+
+
+def run(engine, steps: Sequence[Migration]) -> list[int]:
+    """รันขั้นที่ version มากกว่าเวอร์ชันปัจจุบัน คืนรายการ version ที่รันในรอบนี้"""
+    _check_order(steps)
+    target = steps[-1].version if steps else 0
+    with engine.connect() as con:
+        if current_version(con) >= target:
+            return []
+
+    with engine.begin() as con:
+        con.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {TABLE} ("
+            "version INTEGER PRIMARY KEY, name VARCHAR(128) NOT NULL, applied_at VARCHAR(32) NOT NULL)"
+        ))
+
+    applied = []
+    for step in steps:
+        with engine.begin() as con:
+            if con.dialect.name == "sqlite":
+                # pysqlite ไม่เปิด transaction ให้ DDL เอง -> เปิดเองเพื่อให้ ALTER/CREATE rollback ได้
+                # และ IMMEDIATE กัน process อื่นรัน migration พร้อมกัน
+                con.exec_driver_sql("BEGIN IMMEDIATE")
+            # ตรวจซ้ำใน transaction: อีก process อาจรันขั้นนี้ไปแล้ว
+            if con.execute(text(f"SELECT 1 FROM {TABLE} WHERE version = :v"), {"v": step.version}).first():
+                continue
+            started = datetime.now(timezone.utc)
+            step.apply(con)
+            con.execute(
+                text(f"INSERT INTO {TABLE} (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": step.version, "n": step.name, "t": started.isoformat(timespec="seconds")},
+            )
+        applied.append(step.version)
+    return applied
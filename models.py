@@ -27,7 +27,7 @@ class Product(db.Model):
 class Stock(db.Model):
     __tablename__ = "stocks"
     id = db.Column(db.Integer, primary_key=True)
-    sku = db.Column(db.String(64), nullable=False, index=True)
+    sku = db.Column(db.String(64), nullable=False, unique=True, index=True)  # unique: ใช้กับ upsert ใน import_stock
     qty = db.Column(db.Integer, default=0)
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(TH_TZ), onupdate=lambda: datetime.now(TH_TZ))
 
@@ -37,6 +37,7 @@ class Sales(db.Model):
     order_id = db.Column(db.String(128), nullable=False, index=True)
     po_no = db.Column(db.String(128))
     status = db.Column(db.String(64))  # เปิดใบขายครบตามจำนวนแล้ว / ยังไม่มีการเปิดใบขาย
+    status_class = db.Column(db.String(16), index=True)  # packed / opened / empty (utils.classify_sales_status)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(TH_TZ))
 
 class User(db.Model):
@@ -91,6 +92,35 @@ class OrderLine(db.Model):
         """ตรวจสอบว่าพิมพ์ Picking แล้วหรือยัง"""
         return self.printed_picking and self.printed_picking > 0
 
+class OrderLineArchive(db.Model):
+    """บรรทัดของ Order ที่จบงานแล้ว (แพ็ค/ยกเลิก) และเก่ากว่า N วัน ย้ายออกจาก order_lines โดย order_archive.py
+    คอลัมน์เหมือน OrderLine (+ คอลัมน์ที่ auto-migrate เพิ่มให้ order_lines) id = order_lines.id เดิม"""
+    __tablename__ = "order_lines_archive"
+    archive_id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(db.Integer, nullable=False)
+    platform = db.Column(db.String(20), nullable=False)
+    shop_id = db.Column(db.Integer, nullable=False)
+    order_id = db.Column(db.String(128), nullable=False, index=True)
+    sku = db.Column(db.String(64), nullable=False)
+    qty = db.Column(db.Integer, default=1)
+    item_name = db.Column(db.String(512))
+    order_time = db.Column(db.DateTime)
+    logistic_type = db.Column(db.String(255))
+    imported_at = db.Column(db.DateTime)
+    import_date = db.Column(db.Date)
+    accepted = db.Column(db.Boolean, default=False)
+    accepted_at = db.Column(db.DateTime)
+    accepted_by_user_id = db.Column(db.Integer)
+    accepted_by_username = db.Column(db.String(64))
+    dispatch_round = db.Column(db.Integer)
+    printed_warehouse = db.Column(db.Integer, default=0)
+    printed_warehouse_at = db.Column(db.DateTime)
+    printed_warehouse_by = db.Column(db.String(64))
+    printed_picking = db.Column(db.Integer, default=0)
+    printed_picking_at = db.Column(db.DateTime)
+    printed_picking_by = db.Column(db.String(64))
+    archived_at = db.Column(db.DateTime, index=True)  # เวลาที่ย้ายเข้าคลัง
+
 class SkuPrintHistory(db.Model):
     """เก็บประวัติการพิมพ์แยกตาม SKU สำหรับ Picking List"""
     __tablename__ = "sku_print_history"
@@ -106,3 +136,94 @@ class SkuPrintHistory(db.Model):
     __table_args__ = (
         db.Index('idx_sku_print_lookup', 'sku', 'platform', 'shop_id', 'logistic'),
     )
+
+class AllocationResult(db.Model):
+    """ผลจัดสรรแบบ Materialized (allocation_store.py) — 1 แถวต่อ OrderLine ต่อ Scope (platform/shop)
+    คอลัมน์ตรงกับ allocation_row.FIELDS (id -> line_id) อัปเดตโดย Refresher เบื้องหลัง"""
+    __tablename__ = "allocation_results"
+    scope_platform = db.Column(db.String(64), primary_key=True, default="")  # "" = ทุกแพลตฟอร์ม
+    scope_shop_id = db.Column(db.Integer, primary_key=True, default=0)      # 0 = ทุกร้าน
+    line_id = db.Column(db.Integer, primary_key=True)                       # order_lines.id
+    seq = db.Column(db.Integer, nullable=False)                             # ลำดับเดียวกับผล compute_allocation
+
+    platform = db.Column(db.String(20))
+    shop = db.Column(db.String(128))
+    shop_id = db.Column(db.Integer)
+    order_id = db.Column(db.String(128), index=True)
+    sku = db.Column(db.String(64), index=True)
+    brand = db.Column(db.String(120))
+    model = db.Column(db.String(255))
+    stock_qty = db.Column(db.Integer)
+    qty = db.Column(db.Integer)
+    order_time = db.Column(db.DateTime, index=True)
+    order_time_iso = db.Column(db.String(64))
+    import_date = db.Column(db.Date, index=True)
+    due_date = db.Column(db.Date)
+    sla = db.Column(db.String(64))
+    logistic = db.Column(db.String(255))
+    sales_status = db.Column(db.String(64))
+    sales_class = db.Column(db.String(16))
+    is_not_in_sbs = db.Column(db.Boolean)
+    accepted = db.Column(db.Boolean)
+    accepted_by = db.Column(db.String(64))
+    accepted_at = db.Column(db.DateTime, index=True)
+    dispatch_round = db.Column(db.Integer)
+    printed_warehouse = db.Column(db.Integer)
+    printed_warehouse_at = db.Column(db.DateTime)
+    printed_warehouse_by = db.Column(db.String(64))
+    printed_picking = db.Column(db.Integer)
+    printed_picking_at = db.Column(db.DateTime)
+    printed_picking_by = db.Column(db.String(64))
+    is_packed = db.Column(db.Boolean)
+    is_cancelled = db.Column(db.Boolean)
+    is_issued = db.Column(db.Boolean)
+    allocation_status = db.Column(db.String(32), index=True)
+    show_in_view = db.Column(db.Boolean)
+    allqty = db.Column(db.Integer)
+
+    computed_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index("ix_allocation_results_scope_seq", "scope_platform", "scope_shop_id", "seq"),
+    )
+
+class ImportJob(db.Model):
+    """งานนำเข้าไฟล์เบื้องหลัง (services/import_jobs.py) — 1 แถวต่อไฟล์ที่อัปโหลด"""
+    __tablename__ = "import_jobs"
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False, index=True)  # orders / stock / sales / cancel / bill_empty
+    platform = db.Column(db.String(64))
+    shop_name = db.Column(db.String(128))
+    filename = db.Column(db.String(255))
+    file_path = db.Column(db.String(512))  # ไฟล์ที่เก็บไว้รอ worker (ลบทิ้งเมื่อเสร็จ)
+    status = db.Column(db.String(16), nullable=False, default="queued", index=True)  # queued / running / done / failed
+
+    # ความคืบหน้า (ระหว่างทำงานอ่านจากหน่วยความจำ, บันทึกลงตารางเมื่อจบงาน)
+    rows_processed = db.Column(db.Integer, default=0)
+    added_count = db.Column(db.Integer, default=0)
+    duplicates_count = db.Column(db.Integer, default=0)
+    failed_count = db.Column(db.Integer, default=0)
+
+    message = db.Column(db.Text)  # ข้อความสรุป / ข้อผิดพลาด
+    import_log_id = db.Column(db.Integer)  # import_logs.id ที่เขียนตอนจบงาน
+    created_by_user_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(TH_TZ))
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+class ImportFingerprint(db.Model):
+    """ผลการนำเข้าออเดอร์ล่าสุดของวันต่อ (แพลตฟอร์ม, ร้านในฟอร์ม) สำหรับข้ามไฟล์/แถวที่นำเข้าแล้ว (import_cache.py)"""
+    __tablename__ = "import_fingerprints"
+    id = db.Column(db.Integer, primary_key=True)
+    platform = db.Column(db.String(64), nullable=False)
+    shop_name = db.Column(db.String(128), nullable=False, default="")
+    import_date = db.Column(db.Date)
+    content_hash = db.Column(db.String(64))  # sha256 ของไฟล์ล่าสุด
+    row_hashes = db.Column(db.LargeBinary)  # uint64 ต่อแถว (เฉพาะแถวของ Order ที่อยู่ในระบบแล้ว)
+    result = db.Column(db.Text)  # JSON รายชื่อ Order ID ตามผลลัพธ์ (added/duplicate/failed)
+    import_log_id = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(TH_TZ))
+
+    __table_args__ = (
+        db.UniqueConstraint("platform", "shop_name", name="uq_import_fingerprints_source"),
+    )
@@ -0,0 +1,215 @@
+# order_archive.py
+"""
+คลังบรรทัด Order ที่จบงานแล้ว: order_lines -> order_lines_archive (hot/cold split)
+
+- Order ที่แพ็คแล้ว (sales.status_class = 'packed') หรือยกเลิก (cancelled_orders) และนำเข้า (import_date)
+  ก่อน ARCHIVE_AFTER_DAYS วัน (ค่าเริ่มต้น 90, 0 = ปิด) ถูกย้ายไปคลังทั้ง Order
+  (Order ที่ไม่มี import_date เลยอยู่ใน order_lines ต่อ)
+- ย้ายทีละ ARCHIVE_BATCH_SIZE Order (ค่าเริ่มต้น 500) ต่อ transaction: ตรวจเงื่อนไขซ้ำ -> INSERT ... SELECT -> DELETE
+  batch ที่ล้มถูก rollback ทั้งก้อน (ไม่มีบรรทัดหายหรือซ้ำ) batch ก่อนหน้าที่ commit แล้วคงอยู่
+- order_lines จึงโตตามงานค้าง ไม่ใช่ตามประวัติทั้งหมด -> compute_allocation ไม่ต้องวนข้าม Packed/Cancelled ในอดีต
+- คลังมีคอลัมน์ครบเหมือน order_lines (ensure_columns เพิ่มคอลัมน์ที่ auto-migrate เพิ่มให้ order_lines)
+  ข้อมูลในคลังไม่ถูกแก้หลังย้ายเข้า (พิมพ์/สแกน/จ่ายงานเขียนที่ order_lines) มีแต่ถูกลบ/ย้ายกลับ
+  -> ค่าที่อ่านจากคลัง (วันที่พิมพ์, รอบ) แคชไว้จนกว่าคลังเปลี่ยน (archive_id ล่าสุด / จำนวนแถว เปลี่ยน)
+- Order ในคลังที่ไม่จบงานแล้วถูกย้ายกลับ order_lines ด้วย restore_unfinished: ตอนลบ cancelled_orders (ยกเลิกคืน)
+  และตอนนำเข้าใบขายที่เปลี่ยนจากแพ็คแล้วเป็นสถานะอื่น (ล้างตาราง Sales ทั้งชุด/ตามช่วงวันที่ ไม่ย้ายกลับ)
+- จุดที่ลบบรรทัด Order (ล้างข้อมูล / ลบพร้อมประวัตินำเข้า) ลบแถวในคลังด้วย
+  (ไม่งั้นนำเข้าใหม่จะถูกนับเป็น Order ซ้ำกับคลัง)
+- หน้าประวัติการพิมพ์รวมคลังด้วย source() เฉพาะเมื่อช่วงวันที่ไปถึงวันที่พิมพ์ล่าสุดในคลัง (needs_archive)
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from datetime import timedelta
+
+from sqlalchemy import DateTime, column, delete, func, insert, inspect, literal, or_, select, table, text
+
+import db_backend
+from allocation import mark_orders_dirty
+from models import OrderLine, OrderLineArchive, Sales
+from utils import SALES_PACKED, now_thai
+
+LIVE = OrderLine.__table__
+ARCHIVE = OrderLineArchive.__table__
+_CANCELLED = table("cancelled_orders", column("order_id"))
+
+# แคชต่อ process: คอลัมน์ที่มีทั้งสองตาราง / ค่าที่อ่านจากคลัง {(url, key): (archive version, value)}
+_lock = threading.Lock()
+_shared_cols: dict[str, list[str]] = {}
+_memo: dict[tuple, tuple] = {}
+
+
+def _int(env: str, default: int) -> int:
+    try:
+        return int(os.environ.get(env) or default)
+    except ValueError:
+        return default
+
+
+def after_days() -> int:
+    """อ่านจาก env ทุกครั้ง (.env ถูกโหลดหลัง import) 0 = ปิดการย้าย"""
+    return max(_int("ARCHIVE_AFTER_DAYS", 90), 0)
+
+
+def batch_size() -> int:
+    return max(_int("ARCHIVE_BATCH_SIZE", 500), 1)
+
+
+def ensure_columns(connection) -> list[str]:
+    """เพิ่มคอลัมน์ของ order_lines ที่คลังยังไม่มี (ชนิดเดียวกัน) คืนชื่อคอลัมน์ที่เพิ่ม ผู้เรียก commit เอง"""
+    insp = inspect(connection)
+    have = {c["name"] for c in insp.get_columns(ARCHIVE.name)}
+    added = []
+    for col in insp.get_columns(LIVE.name):
+        if col["name"] not in have:
+            ddl = col["type"].compile(dialect=connection.dialect)
+            connection.execute(text(f"ALTER TABLE {ARCHIVE.name} ADD COLUMN {col['name']} {ddl}"))
+            added.append(col["name"])
+    with _lock:
+        _shared_cols.clear()
+    return added
+
+
+def shared_columns(connection) -> list[str]:
+    """คอลัมน์ของ order_lines ที่คลังมีด้วย (ลำดับตาม order_lines)"""
+    key = str(connection.engine.url)
+    cols = _shared_cols.get(key)
+    if cols is None:
+        insp = inspect(connection)
+        archived = {c["name"] for c in insp.get_columns(ARCHIVE.name)}
+        cols = [c["name"] for c in insp.get_columns(LIVE.name) if c["name"] in archived]
+        with _lock:
+            _shared_cols[key] = cols
+    return cols
+
+
+def _finished(cutoff, order_ids=None):
+    """order_id ที่แพ็ค/ยกเลิกแล้ว และบรรทัดล่าสุดนำเข้าก่อน cutoff"""
+    packed = select(Sales.order_id).where(Sales.status_class == SALES_PACKED)
+    cancelled = select(_CANCELLED.c.order_id)
+    q = select(LIVE.c.order_id).where(or_(LIVE.c.order_id.in_(packed), LIVE.c.order_id.in_(cancelled)))
+    if order_ids is not None:
+        q = q.where(LIVE.c.order_id.in_(order_ids))
+    return q.group_by(LIVE.c.order_id).having(func.max(LIVE.c.import_date) < cutoff)
+
+
+def archive_finished_orders(engine, days: int, batch: int = 500, now=None) -> list[str]:
+    """ย้าย Order ที่จบงานและนำเข้าก่อน days วัน ไป order_lines_archive คืน order_id ที่ย้าย"""
+    now = now or now_thai()
+    cutoff = now.date() - timedelta(days=days)
+    with engine.begin() as con:
+        ensure_columns(con)
+    with engine.connect() as con:
+        cols = shared_columns(con)
+        candidates = con.execute(_finished(cutoff)).scalars().all()
+
+    src = table(LIVE.name, *(column(c) for c in cols))
+    dst = table(ARCHIVE.name, *(column(c) for c in cols), column("archived_at"))
+    moved: list[str] = []
+    for i in range(0, len(candidates), batch):
+        with engine.begin() as con:
+            if con.dialect.name == "sqlite":
+                # เหมือน migrations: จอง write lock ตั้งแต่ต้น batch
+                con.exec_driver_sql("BEGIN IMMEDIATE")
+            # ตรวจซ้ำใน transaction: ระหว่างนั้นอาจมีการยกเลิกคืน / Sales เปลี่ยนสถานะ
+            ids = con.execute(_finished(cutoff, candidates[i:i + batch])).scalars().all()
+            if not ids:
+                continue
+            con.execute(insert(dst).from_select(
+                [*cols, "archived_at"],
+                select(*src.c, literal(now, DateTime())).where(src.c.order_id.in_(ids)),
+            ))
+            con.execute(delete(LIVE).where(LIVE.c.order_id.in_(ids)))
+        moved.extend(ids)
+        mark_orders_dirty(ids)
+    return moved
+
+
+def _unfinished(order_ids=None):
+    """order_id ในคลังที่ไม่ได้แพ็คแล้วและไม่ได้ยกเลิกแล้ว"""
+    packed = select(Sales.order_id).where(Sales.status_class == SALES_PACKED, Sales.order_id.is_not(None))
+    cancelled = select(_CANCELLED.c.order_id).where(_CANCELLED.c.order_id.is_not(None))
+    q = select(ARCHIVE.c.order_id).where(ARCHIVE.c.order_id.not_in(packed), ARCHIVE.c.order_id.not_in(cancelled))
+    if order_ids is not None:
+        q = q.where(ARCHIVE.c.order_id.in_(order_ids))
+    return q.distinct()
+
+
+def restore_unfinished(connection, order_ids=None, batch: int = 500) -> list[str]:
+    """ย้าย Order ในคลังที่ไม่จบงานแล้วกลับ order_lines (ใน transaction ของผู้เรียก) คืน order_id ที่ย้ายกลับ
+    order_ids = ตรวจเฉพาะ Order เหล่านี้ (None = ทั้งคลัง) ผู้เรียก commit แล้ว mark_orders_dirty เอง"""
+    if order_ids is None:
+        ids = connection.execute(_unfinished()).scalars().all()
+    else:
+        order_ids = list(dict.fromkeys(order_ids))
+        ids = [oid for i in range(0, len(order_ids), batch)
+               for oid in connection.execute(_unfinished(order_ids[i:i + batch])).scalars()]
+    if not ids:
+        return []
+
+    cols = shared_columns(connection)
+    rest = [c for c in cols if c != "id"]
+    src = table(ARCHIVE.name, *(column(c) for c in cols))
+    dst = table(LIVE.name, *(column(c) for c in cols))
+    for i in range(0, len(ids), batch):
+        chunk = ids[i:i + batch]
+        # id เดิมที่ order_lines ใช้ไปแล้ว (SQLite ใช้ rowid ที่ลบไปซ้ำได้) -> ให้ id ใหม่ หลังใส่แถวที่ใช้ id เดิมได้
+        taken = connection.execute(
+            select(src.c.id).where(src.c.order_id.in_(chunk), src.c.id.in_(select(LIVE.c.id)))
+        ).scalars().all()
+        connection.execute(insert(dst).from_select(
+            cols, select(*src.c).where(src.c.order_id.in_(chunk), src.c.id.not_in(taken)),
+        ))
+        if taken:
+            connection.execute(insert(dst).from_select(
+                rest, select(*(src.c[c] for c in rest)).where(src.c.order_id.in_(chunk), src.c.id.in_(taken)),
+            ))
+        connection.execute(delete(ARCHIVE).where(ARCHIVE.c.order_id.in_(chunk)))
+    return ids
+
+
+# ---------- อ่านคลัง ----------
+
+def source(connection, include_archive: bool) -> str:
+    """FROM ของ raw SQL บน order_lines: ชื่อตาราง หรือ order_lines UNION ALL คลัง (เฉพาะคอลัมน์ที่มีทั้งคู่)"""
+    if not include_archive:
+        return LIVE.name
+    cols = ", ".join(shared_columns(connection))
+    return f"(SELECT {cols} FROM {LIVE.name} UNION ALL SELECT {cols} FROM {ARCHIVE.name}) AS ol"
+
+
+def _memoized(connection, key, compute):
+    # ย้ายเข้า = archive_id ล่าสุดเพิ่ม, ลบ/ย้ายกลับ = จำนวนแถวลด
+    version = tuple(connection.execute(select(func.max(ARCHIVE.c.archive_id), func.count(ARCHIVE.c.archive_id))).one())
+    mkey = (str(connection.engine.url), key)
+    hit = _memo.get(mkey)
+    if hit is not None and hit[0] == version:
+        return hit[1]
+    value = compute() if version[1] else frozenset()
+    with _lock:
+        _memo[mkey] = (version, value)
+    return value
+
+
+def distinct_values(connection, expr: str, where: str) -> frozenset:
+    """SELECT DISTINCT expr FROM คลัง WHERE where (แคชจนกว่าจะย้ายรอบใหม่) ค่า NULL ถูกตัดออก"""
+    def compute():
+        rows = connection.execute(text(f"SELECT DISTINCT {expr} FROM {ARCHIVE.name} WHERE {where}"))
+        return frozenset(r[0] for r in rows if r[0] is not None)
+    return _memoized(connection, (expr, where), compute)
+
+
+def print_days(connection, kind: str) -> frozenset:
+    """วันที่พิมพ์ ('YYYY-MM-DD' แบบเดียวกับ iso_date_sql) ของ printed_{kind} ในคลัง"""
+    day = db_backend.iso_date_sql(f"printed_{kind}_at", connection.dialect.name)
+    return distinct_values(connection, day, f"printed_{kind} > 0 AND printed_{kind}_at IS NOT NULL")
+
+
+def needs_archive(connection, kind: str, day_from=None) -> bool:
+    """ช่วงวันที่พิมพ์ที่เริ่ม day_from (None = ทุกวัน) มีแถวในคลังได้หรือไม่"""
+    days = print_days(connection, kind)
+    if not days:
+        return False
+    return day_from is None or str(day_from) <= max(days)
@@ -0,0 +1,235 @@
+# services/import_jobs.py
+"""
+งานนำเข้าไฟล์เบื้องหลัง (Background import jobs)
+
+- Route เก็บไฟล์ที่อัปโหลดไว้ (store_upload) แล้วสร้างแถว import_jobs ด้วย submit() -> ตอบกลับทันที
+- Worker pool (IMPORT_JOB_WORKERS thread, ค่าเริ่มต้น 2) เรียก handler ของงานภายใน app context
+- งานที่ key เดียวกัน (เช่น แพลตฟอร์ม+ร้านเดียวกัน) ทำทีละงานตามลำดับที่ส่งเข้ามา
+  งานต่าง key ทำขนานกันได้ (ไม่มี thread ไหนนั่งรอ lock: งานที่รอจะถูกส่งเข้า pool เมื่องานก่อนหน้าจบ)
+- handler รายงานความคืบหน้าด้วย job.progress(rows=..., added=..., duplicates=..., failed=...) (ค่าสะสม)
+  เก็บไว้ในหน่วยความจำ (ไม่แย่ง write lock ของ SQLite กับ importer) และบันทึกลงตารางตอนจบงาน
+- handler คืน {"message": ..., "import_log_id": ...} -> บันทึกลงแถวงาน (ImportLog เขียนโดย handler ตอนจบ)
+
+ปิดได้ด้วย IMPORT_JOBS=0 (Route กลับไปนำเข้าแบบ Synchronous เหมือนเดิม)
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from models import db, ImportJob
+from utils import now_thai
+
+logger = logging.getLogger(__name__)
+
+_WORKERS = int(os.environ.get("IMPORT_JOB_WORKERS", "2") or 2)
+
+# ชื่อย่อที่ handler ใช้ -> คอลัมน์ใน import_jobs
+_COUNTERS = {
+    "rows": "rows_processed",
+    "added": "added_count",
+    "duplicates": "duplicates_count",
+    "failed": "failed_count",
+}
+
+_lock = threading.Lock()
+_executor: ThreadPoolExecutor | None = None
+_busy_keys: set = set()
+_waiting: dict[tuple, deque] = {}
+_live: dict[int, dict] = {}  # job_id -> ความคืบหน้าของงานที่ยังไม่จบ
+
+
+def enabled() -> bool:
+    """อ่านจาก env ทุกครั้ง (ค่าจาก .env ถูกโหลดหลัง import โมดูลนี้)"""
+    return (os.environ.get("IMPORT_JOBS") or "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def store_upload(file_storage, upload_dir: str) -> str:
+    """บันทึกไฟล์ที่อัปโหลดลง upload_dir (ชื่อสุ่ม + นามสกุลเดิม ชื่อจริงเก็บในแถวงาน) คืน path"""
+    os.makedirs(upload_dir, exist_ok=True)
+    ext = os.path.splitext(file_storage.filename or "")[1].lower()
+    if not ext[1:].isalnum():
+        ext = ""
+    path = os.path.join(upload_dir, f"{uuid.uuid4().hex}{ext}")
+    file_storage.save(path)
+    return path
+
+
+class JobContext:
+    """ข้อมูลงานที่ส่งให้ handler (อ่านค่าไว้ก่อน ไม่ผูกกับ session ของ importer)"""
+
+    def __init__(self, job: ImportJob):
+        self.id = job.id
+        self.kind = job.kind
+        self.platform = job.platform
+        self.shop_name = job.shop_name
+        self.filename = job.filename
+        self.file_path = job.file_path
+        self.user_id = job.created_by_user_id
+
+    def progress(self, **counts):
+        """อัปเดตความคืบหน้า (ค่าสะสม): rows / added / duplicates / failed"""
+        with _lock:
+            live = _live.setdefault(self.id, {})
+            for name, value in counts.items():
+                live[_COUNTERS[name]] = int(value or 0)
+
+
+def submit(app, kind: str, key: tuple, handler, *, file_path: str, filename: str,
+           platform: str | None = None, shop_name: str | None = None, user_id: int | None = None) -> int:
+    """สร้างแถวงาน (queued) แล้วส่งเข้าคิวของ key คืน job id"""
+    job = ImportJob(
+        kind=kind,
+        platform=platform,
+        shop_name=shop_name,
+        filename=filename,
+        file_path=file_path,
+        status="queued",
+        created_by_user_id=user_id,
+    )
+    db.session.add(job)
+    db.session.commit()
+    job_id = job.id
+
+    with _lock:
+        _live[job_id] = {}
+        if key in _busy_keys:
+            _waiting.setdefault(key, deque()).append((job_id, handler))
+            return job_id
+        _busy_keys.add(key)
+    _pool().submit(_run, app, key, job_id, handler)
+    return job_id
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(_WORKERS, 1), thread_name_prefix="import-job")
+        return _executor
+
+
+def _run(app, key: tuple, job_id: int, handler):
+    try:
+        with app.app_context():
+            try:
+                _execute(job_id, handler)
+            finally:
+                db.session.remove()
+    except Exception:
+        logger.exception(f"[import_jobs] job {job_id} crashed")
+    finally:
+        # งานถัดไปของ key เดียวกัน (ถ้ามี) ค่อยเริ่มตอนนี้
+        with _lock:
+            queue = _waiting.get(key)
+            nxt = queue.popleft() if queue else None
+            if queue is not None and not queue:
+                del _waiting[key]
+            if nxt is None:
+                _busy_keys.discard(key)
+        if nxt is not None:
+            _pool().submit(_run, app, key, *nxt)
+
+
+def _execute(job_id: int, handler):
+    job = db.session.get(ImportJob, job_id)
+    if job is None:
+        return
+    job.status = "running"
+    job.started_at = now_thai()
+    db.session.commit()
+    ctx = JobContext(job)
+
+    status, summary = "done", {}
+    try:
+        summary = handler(ctx) or {}
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f"[import_jobs] {ctx.kind} job {job_id} failed")
+        status, summary = "failed", {"message": f"เกิดข้อผิดพลาด: {e}"}
+    finally:
+        if ctx.file_path:
+            try:
+                os.remove(ctx.file_path)
+            except OSError:
+                pass
+
+    with _lock:
+        counts = _live.pop(job_id, {})
+    job = db.session.get(ImportJob, job_id)
+    for column, value in counts.items():
+        setattr(job, column, value)
+    job.status = status
+    job.message = summary.get("message")
+    job.import_log_id = summary.get("import_log_id")
+    job.finished_at = now_thai()
+    db.session.commit()
+
+
+def get_job(job_id: int) -> dict | None:
+    """สถานะงาน + ความคืบหน้าล่าสุด (สำหรับ /api/import/jobs/<id>)"""
+    job = db.session.get(ImportJob, job_id)
+    if job is None:
+        return None
+    data = {
+        "id": job.id,
+        "kind": job.kind,
+        "platform": job.platform,
+        "shop_name": job.shop_name,
+        "filename": job.filename,
+        "status": job.status,
+        "message": job.message,
+        "import_log_id": job.import_log_id,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    with _lock:
+        live = dict(_live.get(job_id) or {})
+    for column in _COUNTERS.values():
+        data[column] = live.get(column, getattr(job, column) or 0)
+    return data
+
+
+def recover_interrupted() -> int:
+    """งานที่ค้าง queued/running จากรอบก่อน (เซิร์ฟเวอร์ restart) -> failed พร้อมลบไฟล์ที่ค้าง"""
+    jobs = ImportJob.query.filter(ImportJob.status.in_(("queued", "running"))).all()
+    for job in jobs:
+        if job.file_path:
+            try:
+                os.remove(job.file_path)
+            except OSError:
+                pass
+        job.status = "failed"
+        job.message = "ระบบเริ่มทำงานใหม่ระหว่างนำเข้า กรุณานำเข้าไฟล์อีกครั้ง"
+        job.finished_at = now_thai()
+    if jobs:
+        db.session.commit()
+    return len(jobs)
+
+
+def wait_idle(timeout: float | None = None) -> bool:
+    """รอให้ทุกงานในคิวเสร็จ (ใช้ในเทสต์/ตอนปิดระบบ) คืน False ถ้าหมดเวลา"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        with _lock:
+            if not _busy_keys:
+                return True
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        time.sleep(0.02)
+
+
+def track_rows(chunks, progress):
+    """ส่ง chunk ต่อให้ importer แล้วรายงานจำนวนแถวสะสมเมื่อ importer ทำ chunk นั้นเสร็จ"""
+    total = 0
+    for chunk in chunks:
+        yield chunk
+        total += len(chunk)
+        progress(rows=total)
@@ -100,18 +100,18 @@ def _rename_to_canonical(df: pd.DataFrame) -> pd.DataFrame:
 # -----------------------------
 
 from sqlalchemy import text
-from allocation import compute_allocation
+from allocation_store import report_snapshot
 from models import db
 from services.lowstock_queue import get_lowstock_rows_from_allocation
 
 def get_low_stock_df_adapter() -> pd.DataFrame:
     """
-    ดึง "สินค้าน้อย" จากฟังก์ชันเดิมของโปรเจกต์ (compute_allocation -> get_lowstock_rows_from_allocation)
+    ดึง "สินค้าน้อย" จากฟังก์ชันเดิมของโปรเจกต์ (report_snapshot -> get_lowstock_rows_from_allocation)
     """
     try:
-        # 1. ดึงข้อมูลทั้งหมดจาก compute_allocation
+        # 1. ดึงข้อมูลทั้งหมดจากผลจัดสรร (ตาราง allocation_results ถ้าเปิดและสดพอ ไม่งั้นคำนวณสด)
         # filters={} หมายถึงดึงทั้งหมด (หรืออาจจะใส่ filter ตาม request ก็ได้ แต่ที่นี่เอาทั้งหมดก่อน)
-        rows, _ = compute_allocation(db.session, {})
+        rows, _ = report_snapshot(db.session, {}).select({})
         
         # 2. กรอง Cancelled / Issued (เลียนแบบ app.py)
         try:
@@ -151,7 +151,7 @@ def get_open_order_lines_df_adapter() -> pd.DataFrame:
     """
     try:
         # 1. ดึงข้อมูลทั้งหมด
-        rows, _ = compute_allocation(db.session, {})
+        rows, _ = report_snapshot(db.session, {}).select({})
         
         # 2. กรอง Cancelled / Issued
         try:
@@ -172,7 +172,8 @@ def get_open_order_lines_df_adapter() -> pd.DataFrame:
         if not active_rows:
              return pd.DataFrame(columns=["platform", "store", "order_no", "sku", "product_name", "qty"])
 
-        df = pd.DataFrame(active_rows)
+        # AllocationRow -> dict ก่อน (pd.DataFrame กับ Mapping ที่ไม่ใช่ dict เรียงคอลัมน์ตามตัวอักษร)
+        df = pd.DataFrame([dict(r) for r in active_rows])
         
         # 4. Rename columns to match canonical
         # compute_allocation returns: platform, shop, order_id, sku, brand, model, qty, order_time, due_date, sla, logistic
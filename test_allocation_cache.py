@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+แคชของ compute_allocation (ผลราย SKU / แผน 2 ขั้น / AllocationSnapshot / แคชตาม data version)
+ต้องให้ผลเหมือนคำนวณใหม่ทั้งหมดเสมอ ทั้งหลังการเขียนข้อมูลและหลัง version เปลี่ยน
+"""
+
+from datetime import date, datetime
+
+import pandas as pd
+import pytest
+from flask import Flask
+from sqlalchemy import text
+
+import allocation
+import importers
+from allocation import AllocationSnapshot, bump_data_version, compute_allocation, mark_all_dirty, mark_orders_dirty, mark_skus_dirty
+from models import db, OrderLine, Sales, Shop, Stock
+from utils import TH_TZ
+
+FILTERS = [
+    {"all_time": True},
+    {"active_only": True},
+    {"platform": "Shopee", "all_time": True},
+    {"import_from": date(2026, 9, 3), "import_to": date(2026, 9, 4)},
+    {"import_date": date(2026, 9, 5)},
+    {"date_from": datetime(2026, 9, 3, tzinfo=TH_TZ), "date_to": datetime(2026, 9, 5, tzinfo=TH_TZ)},
+    {"accepted_from": datetime(2026, 9, 2), "accepted_to": datetime(2026, 9, 3)},
+]
+
+# (order_id, platform, [(sku, qty)], order_time, accepted_at)
+ORDERS = [
+    ("O1", "Shopee", [("A", 1), ("B", 1)], datetime(2026, 9, 1, 8, 0), None),
+    ("O2", "TikTok", [("A", 2)], datetime(2026, 9, 2, 9, 0), datetime(2026, 9, 2, 10, 0)),
+    ("O3", "Shopee", [("A", 3), ("C", 1)], datetime(2026, 9, 3, 23, 30), None),
+    ("O4", "Lazada", [("B", 1)], datetime(2026, 9, 4, 8, 0), None),
+    ("O5", "Shopee", [("A", 1), ("D", 2)], datetime(2026, 9, 5, 8, 0), None),
+    ("O6", "TikTok", [("B", 1)], datetime(2026, 9, 5, 12, 0), None),
+]
+
+
+@pytest.fixture
+def app(database_uri):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(text("CREATE TABLE cancelled_orders (order_id VARCHAR(128) UNIQUE)"))
+        db.session.execute(text("CREATE TABLE issued_orders (order_id VARCHAR(128) UNIQUE)"))
+        db.session.execute(text("ALTER TABLE order_lines ADD COLUMN allocation_status TEXT"))
+        shops = {p: Shop(platform=p, name=p) for p in ("Shopee", "TikTok", "Lazada")}
+        db.session.add_all(shops.values())
+        db.session.add_all([Stock(sku="A", qty=5), Stock(sku="B", qty=1), Stock(sku="C", qty=0)])
+        db.session.flush()
+        for oid, platform, items, ot, acc in ORDERS:
+            for sku, qty in items:
+                db.session.add(OrderLine(platform=platform, shop_id=shops[platform].id, order_id=oid, sku=sku,
+                                         qty=qty, order_time=ot, import_date=ot.date(),
+                                         accepted=acc is not None, accepted_at=acc))
+        db.session.add(Sales(order_id="O4", status="PACKED", status_class="packed"))
+        db.session.add(Sales(order_id="O6", status="เปิดใบขายบางส่วน", status_class="opened"))
+        db.session.commit()
+        mark_all_dirty()  # ผลราย SKU / แคช เป็น state ระดับ module ไม่ให้ข้ามเทสต์
+        yield app
+        db.session.remove()
+
+
+def _plain(result):
+    rows, kpis = result
+    return [dict(r) for r in sorted(rows, key=lambda r: r["id"])], kpis
+
+
+def _reference(filters):
+    """คำนวณใหม่ทั้งหมด: โหลดทุกแถว ไม่ใช้ผลราย SKU เดิม ไม่ผ่านแคช"""
+    with pytest.MonkeyPatch.context() as m:
+        m.setattr(allocation, "_sku_state", {})
+        m.setattr(allocation, "_has_window_filter", lambda f: False)
+        return _plain(compute_allocation(db.session, filters, fresh=True))
+
+
+def _line(oid, sku):
+    return OrderLine.query.filter_by(order_id=oid, sku=sku).one()
+
+
+# ----- write path แบบเดียวกับ route / importer (commit แล้วค่อย mark) -----
+
+def _accept(oid, sku):
+    line = _line(oid, sku)
+    line.accepted, line.accepted_at = True, datetime(2026, 9, 2, 15, 0)
+    db.session.commit()
+    mark_skus_dirty([sku])
+
+
+def _cancel(oid):
+    db.session.execute(text("INSERT INTO cancelled_orders (order_id) VALUES (:o)"), {"o": oid})
+    db.session.commit()
+    mark_orders_dirty([oid])
+
+
+WRITES = [
+    lambda: _accept("O5", "A"),
+    lambda: importers.import_stock(pd.DataFrame({"SKU": ["A"], "Qty": [2]}), full_replace=False),
+    lambda: importers.import_sales(pd.DataFrame({"Order ID": ["O1"], "Status": ["PACKED"]})),
+    lambda: _cancel("O3"),
+    lambda: importers.import_stock(pd.DataFrame({"SKU": ["B"], "Qty": [4]}), full_replace=False),
+]
+
+
+def test_dirty_skus_match_full_recompute(app):
+    for f in FILTERS:
+        compute_allocation(db.session, f, fresh=True)  # เก็บผลราย SKU ไว้ก่อน
+    for write in WRITES:
+        write()
+        for f in FILTERS:
+            assert _plain(compute_allocation(db.session, f, fresh=True)) == _reference(f), f
+
+
+def test_mark_during_compute_is_not_lost(app, monkeypatch):
+    line_id = _line("O1", "A").id
+    statuses = lambda: {r["id"]: r["allocation_status"]
+                        for r in compute_allocation(db.session, {"all_time": True}, fresh=True)[0]}
+    assert statuses()[line_id] == "READY_ACCEPT"
+
+    # กดรับหลัง compute อ่านแถวจาก DB ไปแล้ว แต่ก่อนเก็บผลราย SKU (ลายเซ็น SKU ไม่เปลี่ยนจากการกดรับ)
+    original = allocation._allocate_incremental
+
+    def accept_mid_compute(*args):
+        monkeypatch.setattr(allocation, "_allocate_incremental", original)
+        _accept("O1", "A")
+        return original(*args)
+
+    mark_skus_dirty(["A"])
+    monkeypatch.setattr(allocation, "_allocate_incremental", accept_mid_compute)
+    assert statuses()[line_id] == "READY_ACCEPT"  # รอบนี้เห็นข้อมูลก่อนกดรับ
+    assert statuses()[line_id] == "ACCEPTED"
+
+
+def test_windowed_load_matches_full_load(app):
+    windowed = [f for f in FILTERS if allocation._has_window_filter(f)]
+    assert len(windowed) == 4
+    for write in [lambda: None, *WRITES]:
+        write()
+        for f in windowed:
+            with pytest.MonkeyPatch.context() as m:
+                m.setattr(allocation, "_sku_state", {})
+                got = _plain(compute_allocation(db.session, f, fresh=True))
+            assert got == _reference(f), f
+
+
+def test_snapshot_matches_compute_allocation(app):
+    for write in [lambda: None, *WRITES]:
+        write()
+        for base in ({}, {"platform": "Shopee"}):
+            snap = AllocationSnapshot(db.session, base)  # Snapshot ใหม่ต่อ Request หลังเขียนข้อมูล
+            for f in FILTERS:
+                if f.get("platform", base.get("platform")) != base.get("platform"):
+                    continue  # Snapshot ใช้ได้เฉพาะ Scope เดียวกัน
+                f = {**f, **base}
+                assert _plain(snap.select(f)) == _reference(f), f
+            assert sorted(r["id"] for r in snap.rows_for_orders(["O1", "O5"])) == \
+                sorted(l.id for l in OrderLine.query.filter(OrderLine.order_id.in_(["O1", "O5"]))
+                       if not base or l.platform == base["platform"])
+            # แก้แถวที่ได้ไปไม่กระทบ Snapshot
+            snap.select({"all_time": True})[0][0]["allocation_status"] = "X"
+            assert _plain(snap.select(f)) == _reference(f)
+
+
+def test_result_cache_follows_data_version(app, monkeypatch):
+    calls = []
+    uncached = allocation._compute_allocation_uncached
+    monkeypatch.setattr(allocation, "_compute_allocation_uncached", lambda *a: calls.append(1) or uncached(*a))
+
+    def cached(f):
+        return _plain(compute_allocation(db.session, f))
+
+    for write in [lambda: None, *WRITES]:
+        write()
+        for f in FILTERS:
+            expected = _reference(f)
+            assert cached(f) == expected, f
+            n = len(calls)
+            assert cached(f) == expected, f
+            assert len(calls) == n  # ครั้งที่สองมาจากแคช
+
+    # แก้แถวที่ได้จากแคชไม่กระทบครั้งถัดไป
+    compute_allocation(db.session, FILTERS[0])[0][0]["allocation_status"] = "X"
+    assert cached(FILTERS[0]) == _reference(FILTERS[0])
+
+    # เขียนตรงๆ โดยไม่ mark -> ผลเดิมจนกว่าจะ bump_data_version (after_request ของ route ที่เขียนข้อมูล)
+    before = cached(FILTERS[0])
+    db.session.execute(text("UPDATE stocks SET qty = 0"))
+    db.session.commit()
+    assert cached(FILTERS[0]) == before
+    bump_data_version()
+    assert cached(FILTERS[0]) == _reference(FILTERS[0]) != before
+
+    # version เปลี่ยนระหว่างคำนวณ -> ไม่เก็บผลนั้น
+    def bump_mid_compute(*a):
+        result = uncached(*a)
+        bump_data_version()
+        return result
+
+    monkeypatch.setattr(allocation, "_compute_allocation_uncached", bump_mid_compute)
+    compute_allocation(db.session, FILTERS[1])
+    assert not allocation._result_cache
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+AllocationRow ต้องใช้แทน dict เดิมได้ (Mapping + Attribute + extras)
+"""
+
+from allocation_row import AllocationRow, FIELDS
+
+
+def test_mapping_and_attribute_access():
+    r = AllocationRow({"id": 1, "sku": "A", "qty": 2})
+    assert r["sku"] == "A" and r.sku == "A" and r.get("qty") == 2
+    assert "sku" in r and "brand" not in r and r.get("brand", "-") == "-"
+
+    r["scanned_at"] = "x"          # ค่าเสริมรายหน้า -> extras
+    r.qty = 5
+    assert r["scanned_at"] == "x" and r.extras == {"scanned_at": "x"}
+    assert dict(r) == {"id": 1, "sku": "A", "qty": 5, "scanned_at": "x"}
+    assert list(r) == ["id", "sku", "qty", "scanned_at"]
+
+
+def test_copy_is_independent():
+    r = AllocationRow({name: None for name in FIELDS})
+    c = r.copy()
+    c["allocation_status"] = "CANCELLED"
+    c["is_deleted"] = True
+    assert r["allocation_status"] is None and "is_deleted" not in r
+    assert len(c) == len(FIELDS) + 1
+
+
+def test_delete():
+    r = AllocationRow(sku="A", note="n")
+    del r["sku"]
+    del r["note"]
+    assert len(r) == 0 and r == {}
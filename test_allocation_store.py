@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+MaterializedSnapshot (อ่านจากตาราง allocation_results) ต้องให้ผลเหมือน AllocationSnapshot (คำนวณสด)
+"""
+
+import importlib
+import io
+import random
+import re
+import sys
+from datetime import date, datetime, timedelta
+
+import pytest
+from flask import Flask
+from sqlalchemy import text
+
+import allocation_store
+from allocation import AllocationSnapshot, bump_data_version, mark_skus_dirty
+from allocation_row import FIELDS
+from models import db, AllocationResult, OrderLine, Product, Sales, Shop, Stock
+from utils import TH_TZ
+
+FILTERS = [
+    {"all_time": True, "active_only": False},
+    {"active_only": True},
+    {"import_from": date(2026, 9, 3), "import_to": date(2026, 9, 5)},
+    {"date_from": datetime(2026, 9, 2, tzinfo=TH_TZ), "date_to": datetime(2026, 9, 4, tzinfo=TH_TZ)},
+    {"accepted_from": datetime(2026, 9, 2), "accepted_to": datetime(2026, 9, 6)},
+]
+
+
+def _seed(rnd: random.Random):
+    db.create_all()
+    db.session.execute(text("CREATE TABLE IF NOT EXISTS cancelled_orders (order_id TEXT UNIQUE)"))
+    db.session.execute(text("CREATE TABLE IF NOT EXISTS issued_orders (order_id TEXT UNIQUE)"))
+    db.session.execute(text("ALTER TABLE order_lines ADD COLUMN allocation_status TEXT"))
+    shops = [Shop(platform=p, name=p) for p in ("Shopee", "TikTok", "Lazada")]
+    db.session.add_all(shops)
+    db.session.flush()
+    skus = [f"SKU{i}" for i in range(8)]
+    for sku in skus:
+        db.session.add(Product(sku=sku, brand="B", model=sku))
+        db.session.add(Stock(sku=sku, qty=rnd.choice([0, 2, 5, 10])))
+    base = datetime(2026, 9, 1, 8, 0)
+    for i in range(120):
+        shop = rnd.choice(shops)
+        oid = f"O{i:04d}"
+        ot = base + timedelta(hours=rnd.randrange(24 * 7))
+        for sku in rnd.sample(skus, rnd.randint(1, 2)):
+            acc = rnd.random() < 0.2
+            db.session.add(OrderLine(platform=shop.platform, shop_id=shop.id, order_id=oid, sku=sku,
+                                     qty=rnd.choice([1, 2, 3]), order_time=ot, import_date=ot.date(),
+                                     accepted=acc, accepted_at=ot + timedelta(hours=2) if acc else None))
+        if rnd.random() < 0.6:
+            db.session.add(Sales(order_id=oid, status=rnd.choice(["ยังไม่มีการเปิดใบขาย", "PACKED", "เปิดใบขายบางส่วน"])))
+        if rnd.random() < 0.05:
+            db.session.execute(text("INSERT INTO cancelled_orders(order_id) VALUES (:o)"), {"o": oid})
+    db.session.commit()
+    bump_data_version()
+
+
+def test_materialized_matches_live(monkeypatch, database_uri):
+    monkeypatch.setenv("ALLOC_MATERIALIZED", "1")
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri
+    db.init_app(app)
+    with app.app_context():
+        _seed(random.Random(7))
+        for base in ({}, {"platform": "Shopee"}):
+            scope = allocation_store._scope_key(base)
+            assert allocation_store.materialized_snapshot(db.session, base) is None  # ยังไม่ refresh
+            allocation_store.refresh_scope(db.session, scope)
+
+            mat = allocation_store.materialized_snapshot(db.session, base)
+            live = AllocationSnapshot(db.session, base)
+            assert isinstance(mat, allocation_store.MaterializedSnapshot)
+            for f in FILTERS:
+                assert mat.select({**base, **f}) == live.select({**base, **f}), f
+            oids = ["O0003", "O0050", "O0099"]
+            assert mat.rows_for_orders(oids) == live.rows_for_orders(oids)
+            assert mat.stock_map == live.stock_map
+
+        # version เปลี่ยนแต่ผลจัดสรรไม่เปลี่ยน (เช่นสแกน) -> ไม่เขียนตาราง / กดรับ 1 บรรทัด -> เขียนเฉพาะแถวที่เปลี่ยน
+        scope = allocation_store._scope_key({})
+        bump_data_version()
+        assert allocation_store.refresh_scope(db.session, scope) == 0
+        line = OrderLine.query.filter_by(accepted=False).order_by(OrderLine.id.desc()).first()
+        line.accepted, line.accepted_at = True, datetime(2026, 9, 4, 9, 0)
+        db.session.commit()
+        mark_skus_dirty([line.sku])
+        written = allocation_store.refresh_scope(db.session, scope)
+        assert 0 < written < db.session.query(AllocationResult).filter_by(scope_platform="").count()
+        mat = allocation_store.materialized_snapshot(db.session, {})
+        live = AllocationSnapshot(db.session, {})
+        for f in FILTERS:
+            assert mat.select(f) == live.select(f), f
+
+        # เขียนข้อมูลใหม่ -> version เปลี่ยน ผลในตารางยังใช้ได้ภายใน ALLOC_MAX_STALE เท่านั้น
+        monkeypatch.setattr(allocation_store, "_MAX_STALE", 0)
+        bump_data_version()
+        assert allocation_store.materialized_snapshot(db.session, {}) is None
+        assert allocation_store.refresh_stale(db.session) == 2
+        assert allocation_store.materialized_snapshot(db.session, {}) is not None
+
+
+def test_table_covers_row_fields():
+    cols = set(AllocationResult.__table__.c.keys())
+    assert {"line_id", "computed_at"} | set(FIELDS[1:]) <= cols
+
+
+REPORT_PAGES = [
+    "/report/warehouse", "/report/warehouse/printed", "/report/lowstock", "/report/nostock", "/report/notenough",
+    "/report/picking", "/report/picking/printed", "/report/lowstock.xlsx", "/report/nostock.xlsx",
+    "/report/notenough.xlsx", "/report/warehouse/export.xlsx",
+]
+
+
+@pytest.fixture
+def report_app(tmp_path, monkeypatch):
+    """app จริง (create_app) บน SQLite ไฟล์ใน tmp_path + ผู้ใช้ที่ล็อกอินแล้ว"""
+    monkeypatch.setenv("RAILWAY_VOLUME_MOUNT_PATH", str(tmp_path))
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    monkeypatch.delenv("ALLOC_MATERIALIZED", raising=False)
+    monkeypatch.setenv("IMPORT_JOBS", "0")
+    sys.modules.pop("app", None)
+    tables = set(db.metadata.tables)
+    appmod = importlib.import_module("app")
+    app = appmod.app
+    with app.app_context():
+        rnd = random.Random(11)
+        shops = [Shop(platform=p, name=p) for p in ("Shopee", "TikTok")]
+        user = appmod.User.query.filter_by(role="admin").first()  # create_app สร้างแอดมินเริ่มต้นให้
+        db.session.add_all(shops)
+        db.session.flush()
+        for i in range(6):
+            db.session.add(Product(sku=f"SKU{i}", brand="B", model=f"SKU{i}"))
+            db.session.add(Stock(sku=f"SKU{i}", qty=[0, 1, 3][i % 3]))
+        now = datetime.now(TH_TZ).replace(tzinfo=None)
+        for i in range(30):
+            shop = rnd.choice(shops)
+            for sku in rnd.sample([f"SKU{k}" for k in range(6)], 2):
+                printed = int(i % 5 == 0)
+                db.session.add(OrderLine(platform=shop.platform, shop_id=shop.id, order_id=f"R{i:03d}", sku=sku,
+                                         qty=rnd.choice([1, 2]), order_time=now - timedelta(hours=i),
+                                         import_date=now.date(), accepted=i % 3 == 0,
+                                         accepted_at=now if i % 3 == 0 else None,
+                                         printed_warehouse=printed, printed_warehouse_at=now if printed else None,
+                                         printed_picking=printed, printed_picking_at=now if printed else None))
+        db.session.commit()
+        uid = user.id
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["uid"] = s["user_id"] = uid
+    yield appmod, client
+    # ตารางที่ create_app ประกาศเพิ่มบน db เดียวกัน (cancelled_orders ฯลฯ) ไม่ให้ค้างไปถึงเทสต์อื่น
+    for name in set(db.metadata.tables) - tables:
+        db.metadata.remove(db.metadata.tables[name])
+    sys.modules.pop("app", None)
+
+
+def _pages(client) -> dict:
+    out = {}
+    for path in REPORT_PAGES:
+        r = client.get(path)
+        assert r.status_code == 200, path
+        body = r.get_data()
+        if path.endswith(".xlsx"):
+            import openpyxl
+            wb = openpyxl.load_workbook(io.BytesIO(body))
+            out[path] = [[c.value for c in row] for ws in wb.worksheets for row in ws.iter_rows()]
+        else:
+            out[path] = re.sub(rb'name="csrf_token" value="[^"]*"', b"", body)
+    return out
+
+
+def test_report_routes_read_materialized_table(report_app, monkeypatch):
+    appmod, client = report_app
+    live = _pages(client)
+
+    built = []
+    monkeypatch.setattr(allocation_store, "AllocationSnapshot",
+                        type("Counted", (AllocationSnapshot,), {"__init__": lambda self, *a: built.append(1) or AllocationSnapshot.__init__(self, *a)}))
+    monkeypatch.setattr(appmod, "compute_allocation", lambda *a, **k: pytest.fail("report ต้องไม่คำนวณสด"))
+    monkeypatch.setenv("ALLOC_MATERIALIZED", "1")
+    with appmod.app.app_context():
+        allocation_store.refresh_scope(db.session, ("", 0))
+    assert _pages(client) == live  # Scope สด -> ทุกหน้าอ่านจากตาราง ได้ผลเหมือนคำนวณสด
+    assert built == []
+
+    # ตารางไม่สด -> กลับไปคำนวณสด
+    monkeypatch.setattr(allocation_store, "_MAX_STALE", 0)
+    bump_data_version()
+    client.get("/report/nostock")
+    assert built
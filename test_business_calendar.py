@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+BusinessCalendar ต้องให้ผลเหมือนการวนนับวันทำการทีละวันแบบเดิม
+"""
+
+import random
+from datetime import date, datetime, timedelta
+
+import utils
+from utils import BusinessCalendar, TH_TZ, diff_business_days, sla_status
+
+
+def _diff_by_loop(d1: date, d2: date) -> int:
+    step = 1 if d2 >= d1 else -1
+    cur, cnt = d1, 0
+    while cur != d2:
+        cur += timedelta(days=step)
+        if utils.is_business_day(cur):
+            cnt += step
+    return cnt
+
+
+def test_diff_matches_loop_with_holidays():
+    rnd = random.Random(3)
+    holidays = {date(2026, 1, 1) + timedelta(days=rnd.randrange(365)) for _ in range(20)}
+    utils.TH_HOLIDAYS.update(holidays)
+    try:
+        for _ in range(500):
+            d1 = date(2026, 1, 1) + timedelta(days=rnd.randrange(400))
+            d2 = date(2026, 1, 1) + timedelta(days=rnd.randrange(400))
+            assert diff_business_days(d1, d2) == _diff_by_loop(d1, d2), (d1, d2)
+    finally:
+        utils.TH_HOLIDAYS.difference_update(holidays)
+
+
+def test_next_business_day_skips_weekend_and_holiday():
+    cal = BusinessCalendar({date(2026, 10, 19)}, date(2026, 10, 1), date(2026, 11, 30))
+    # ศุกร์ 16 -> (เสาร์/อาทิตย์ + จันทร์ 19 วันหยุด) -> อังคาร 20
+    assert cal.next_business_day(date(2026, 10, 16)) == date(2026, 10, 20)
+    assert cal.first_business_day_on_or_after(date(2026, 10, 17)) == date(2026, 10, 20)
+    assert cal.first_business_day_on_or_after(date(2026, 10, 16)) == date(2026, 10, 16)
+
+
+def test_sla_status_holiday_change_invalidates_memo():
+    order = TH_TZ.localize(datetime(2026, 10, 16, 9, 0))   # ศุกร์ ก่อน cutoff
+    ref = TH_TZ.localize(datetime(2026, 10, 20, 9, 0))     # อังคาร
+    assert sla_status("Shopee", order, ref) == ("เลยกำหนด (2 วัน)", date(2026, 10, 16))
+    utils.TH_HOLIDAYS.add(date(2026, 10, 19))
+    try:
+        assert sla_status("Shopee", order, ref) == ("เลยกำหนด (1 วัน)", date(2026, 10, 16))
+    finally:
+        utils.TH_HOLIDAYS.discard(date(2026, 10, 19))
+
+
+def test_outlier_dates_do_not_widen_calendar():
+    today = date.today()
+    cal = utils.business_calendar(today)
+    holiday = date(1990, 1, 3)  # พุธ
+    utils.TH_HOLIDAYS.add(holiday)
+    try:
+        for d in (date(1900, 1, 1), date(1989, 12, 25)):
+            assert diff_business_days(d, date(1990, 3, 1)) == _diff_by_loop(d, date(1990, 3, 1))
+            assert diff_business_days(date(1990, 3, 1), d) == _diff_by_loop(date(1990, 3, 1), d)
+        assert diff_business_days(date(1900, 1, 1), today) == _diff_by_loop(date(1900, 1, 1), today)
+        assert utils.add_business_days(date(1990, 1, 2), 1) == date(1990, 1, 4)
+        # ใกล้ date.max: ไม่ OverflowError
+        assert diff_business_days(today, date.max) > 0
+        assert sla_status("Shopee", datetime(9999, 12, 30, 20, 0, tzinfo=TH_TZ),
+                          datetime(9999, 12, 31, 9, 0, tzinfo=TH_TZ)) == ("วันนี้", date(9999, 12, 31))
+        cal = utils.business_calendar(today)
+        assert (cal.end - cal.start).days < 2 * utils._CALENDAR_LIMIT_DAYS + utils._CALENDAR_SPAN_DAYS + 100
+    finally:
+        utils.TH_HOLIDAYS.discard(holiday)
+
+
+def _add_by_loop(d: date, n: int) -> date:
+    while n:
+        d += timedelta(days=1)
+        n -= utils.is_business_day(d)
+    return d
+
+
+def test_add_business_days_past_calendar_end():
+    today = date.today()
+    cal = utils.business_calendar(today)
+    for d, n in [(date(2026, 10, 1), 500), (today, 5000), (cal.end - timedelta(days=3), 40), (cal.end, 1)]:
+        assert utils.add_business_days(d, n) == _add_by_loop(d, n), (d, n)
+    assert cal.add_business_days(cal.end - timedelta(days=3), 40) is None
+    near_edge = today + timedelta(days=utils._CALENDAR_LIMIT_DAYS - 1)
+    assert utils.add_business_days(near_edge, 300) == _add_by_loop(near_edge, 300)
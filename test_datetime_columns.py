@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+parse_datetime_texts: แปลงทั้งคอลัมน์ต้องได้ผลเหมือน parse_datetime_guess ทีละค่า
+"""
+
+import random
+
+import utils
+from utils import parse_datetime_guess, parse_datetime_texts
+
+TEMPLATES = [
+    "{y}-{m:02d}-{d:02d} {H:02d}:{M:02d}:{S:02d}", "{y}-{m}-{d}T{H}:{M:02d}", "{d} Oct {y} {H}:{M:02d}",
+    "{d:02d}/{m:02d}/{y} {H:02d}:{M:02d}", "{d}/{m}/{y}", "{m}/{d}/{y} {H}:{M:02d}", "{d}-{m}-{y} {H}:{M}",
+    "{y}/{m}/{d} {H}:{M}:{S}", "  {y}-{m:02d}-{d:02d}  {H:02d}:{M:02d} ", "{y}-{m:02d}-{d:02d} {H:02d}:{M:02d}:{S:02d}.5",
+    "45000.5", "", "-",
+]
+
+
+def _value(rnd, template):
+    return template.format(
+        y=rnd.choice([2025, 2026, 2026, 2567, 2569, 1900, 2300]), m=rnd.randint(1, 13), d=rnd.randint(1, 32),
+        H=rnd.randint(0, 24), M=rnd.randint(0, 59), S=rnd.randint(0, 59),
+    )
+
+
+def test_column_matches_per_value_guess():
+    rnd = random.Random(7)
+    for trial in range(80):
+        main = rnd.choice(TEMPLATES)   # ไฟล์ส่วนใหญ่ใช้รูปแบบเดียว มีค่าแปลกปนบ้าง
+        values = [_value(rnd, main if rnd.random() < 0.9 else rnd.choice(TEMPLATES)) for _ in range(rnd.randint(1, 80))]
+        got = parse_datetime_texts(values, cache_key=("test", trial % 3))
+        for v in values:
+            try:
+                expected = parse_datetime_guess(v)
+            except ValueError:
+                assert v not in got, v   # ให้ผู้เรียกได้ exception เดิม
+                continue
+            assert got[v] == expected, v
+            if expected is not None:
+                assert got[v].utcoffset() == expected.utcoffset(), v
+
+
+def test_day_first_wins_over_month_first():
+    # ไฟล์ mm/dd ส่วนใหญ่ แต่ 01/02 parse_datetime_guess อ่านเป็น dd/mm ก่อน
+    got = parse_datetime_texts(["12/25/2026 10:00", "12/31/2026 11:00", "01/02/2026 09:00"])
+    assert got["01/02/2026 09:00"] == parse_datetime_guess("01/02/2026 09:00")
+    assert got["01/02/2026 09:00"].month == 2
+
+
+def test_detected_format_cached_per_header():
+    key = ("Shopee", ("orderNumber", "createTime"))
+    utils._dt_formats.pop(key, None)
+    parse_datetime_texts(["2026-10-18 10:00", "2026-10-18 11:30"], cache_key=key)
+    assert utils._dt_formats[key] == "%Y-%m-%d %H:%M"
+
+    # ไฟล์ถัดไปหัวคอลัมน์เดิมแต่รูปแบบเปลี่ยน -> ตรวจใหม่
+    got = parse_datetime_texts(["18/10/2026 10:00:00"], cache_key=key)
+    assert utils._dt_formats[key] == "%d/%m/%Y %H:%M:%S"
+    assert got["18/10/2026 10:00:00"] == parse_datetime_guess("18/10/2026 10:00:00")
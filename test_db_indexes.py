@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+db_indexes: query ที่ใช้บ่อยต้องค้นผ่าน index (EXPLAIN QUERY PLAN ไม่มี SCAN ทั้งตาราง order_lines / sales)
+"""
+
+import re
+from datetime import date
+
+import pytest
+from flask import Flask
+from sqlalchemy import func, select, text
+
+import db_indexes
+from models import db, OrderLine, Sales
+
+FULL_SCAN = re.compile(r"^SCAN (order_lines|sales)\b(?! USING)")
+
+
+@pytest.fixture
+def con():
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        # คอลัมน์ที่ app.py เพิ่มด้วย auto-migrate (ไม่อยู่ใน model)
+        for kind in ("lowstock", "nostock", "notenough"):
+            db.session.execute(text(f"ALTER TABLE order_lines ADD COLUMN printed_{kind} INTEGER DEFAULT 0"))
+            db.session.execute(text(f"ALTER TABLE order_lines ADD COLUMN printed_{kind}_at TEXT"))
+        assert len(db_indexes.ensure_indexes(db.session.connection())) == len(db_indexes.INDEXES)
+        assert db_indexes.ensure_indexes(db.session.connection()) == []
+        yield db.session
+
+
+def _plan(con, stmt, params=None) -> list[str]:
+    if not isinstance(stmt, str):
+        stmt = str(stmt.compile(dialect=con.get_bind().dialect, compile_kwargs={"literal_binds": True}))
+    return [row[3] for row in con.execute(text(f"EXPLAIN QUERY PLAN {stmt}"), params or {})]
+
+
+def _assert_indexed(con, stmt, params=None):
+    plan = _plan(con, stmt, params)
+    assert not [step for step in plan if FULL_SCAN.search(step)], plan
+    return plan
+
+
+def test_order_id_sku_and_import_date_lookups(con):
+    _assert_indexed(con, select(OrderLine).filter_by(order_id="A1"))
+    _assert_indexed(con, "UPDATE order_lines SET printed_picking_by=:u WHERE order_id=:oid", {"u": "x", "oid": "A1"})
+    _assert_indexed(con, select(OrderLine.order_id, func.max(OrderLine.printed_picking_at))
+                    .where(OrderLine.order_id.in_(["A1", "A2"])).group_by(OrderLine.order_id))
+    _assert_indexed(con, select(OrderLine.order_id).where(OrderLine.import_date == date(2026, 10, 18)))
+    _assert_indexed(con, select(OrderLine.id).where(OrderLine.import_date >= date(2026, 10, 1),
+                                                    OrderLine.import_date <= date(2026, 10, 18)))
+
+    # _reserved_qty_for_sku: SKU + subquery Order ที่แพ็คแล้ว
+    packed = select(Sales.order_id).where(Sales.status_class == "packed")
+    plan = _assert_indexed(con, select(func.coalesce(func.sum(OrderLine.qty), 0))
+                           .where(OrderLine.sku == "SKU1", OrderLine.order_id.not_in(packed)))
+    assert any("ix_order_lines_sku" in step for step in plan)
+    assert any("COVERING INDEX ix_sales_status_class_order_id" in step for step in plan)
+
+
+@pytest.mark.parametrize("kind", ["warehouse", "picking", "lowstock", "nostock", "notenough"])
+def test_printed_history_by_day(con, kind):
+    plan = _assert_indexed(
+        con, f"SELECT DISTINCT order_id FROM order_lines WHERE printed_{kind} > 0 AND DATE(printed_{kind}_at) = :d",
+        {"d": "2026-10-18"},
+    )
+    assert any(f"ix_order_lines_printed_{kind}_day" in step for step in plan)
+    _assert_indexed(
+        con, f"SELECT DISTINCT order_id FROM order_lines WHERE printed_{kind} > 0 "
+             f"AND DATE(printed_{kind}_at) >= :pf AND DATE(printed_{kind}_at) <= :pt",
+        {"pf": "2026-10-01", "pt": "2026-10-18"},
+    )
+    # รายการวันที่ให้เลือก: อ่านจาก partial index (เฉพาะแถวที่พิมพ์แล้ว)
+    _assert_indexed(
+        con, f"SELECT DISTINCT DATE(printed_{kind}_at) AS d FROM order_lines "
+             f"WHERE printed_{kind} > 0 AND printed_{kind}_at IS NOT NULL ORDER BY d DESC",
+    )
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+db_tuning: PRAGMA ถูกตั้งทุก connection ตาม env และสำรองข้อมูลแล้วได้ข้อมูลที่ยังอยู่ในไฟล์ -wal ครบ
+"""
+
+import sqlite3
+
+from sqlalchemy import create_engine, text
+
+import db_tuning
+
+
+def test_pragmas_applied_on_every_connection(tmp_path, monkeypatch):
+    monkeypatch.setenv("SQLITE_BUSY_TIMEOUT_MS", "2500")
+    monkeypatch.setenv("SQLITE_SYNCHRONOUS", "full")
+    monkeypatch.setenv("SQLITE_TEMP_STORE", "bogus")   # ค่าไม่ถูกต้อง -> ค่าเริ่มต้น
+    engine = create_engine(f"sqlite:///{tmp_path / 'a.db'}")
+    configured = db_tuning.install(engine)
+    assert db_tuning.install(engine) is configured   # ติดตั้งซ้ำไม่เพิ่ม listener
+
+    for _ in range(2):
+        with engine.connect() as con:
+            active = db_tuning.current(con)
+            assert active["journal_mode"] == "WAL" and active["synchronous"] == "FULL"
+            assert active["busy_timeout"] == 2500 and active["temp_store"] == "MEMORY"
+            assert active["cache_size"] == configured["cache_size"] == -65536
+        engine.dispose()
+
+
+def test_disabled_by_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("SQLITE_TUNING", "0")
+    engine = create_engine(f"sqlite:///{tmp_path / 'b.db'}")
+    assert db_tuning.install(engine) is None
+    with engine.connect() as con:
+        assert db_tuning.current(con)["journal_mode"] == "DELETE"
+
+
+def test_backup_copy_includes_wal_content(tmp_path):
+    src = tmp_path / "data.db"
+    engine = create_engine(f"sqlite:///{src}")
+    db_tuning.install(engine)
+    with engine.connect() as con:
+        con.execute(text("PRAGMA wal_autocheckpoint=0"))
+        con.execute(text("CREATE TABLE t (x INTEGER)"))
+        con.execute(text("INSERT INTO t VALUES (1), (2), (3)"))
+        con.commit()
+        assert (tmp_path / "data.db-wal").stat().st_size > 0
+
+        db_tuning.backup_copy(str(src), str(tmp_path / "copy.db"))
+        assert sqlite3.connect(tmp_path / "copy.db").execute("SELECT COUNT(*) FROM t").fetchone() == (3,)
+    engine.dispose()
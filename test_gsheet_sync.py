@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+gsheet_sync: ดึงเฉพาะแถวใหม่ด้วย cursor ต้องได้ records เหมือน get_all_records และอ่านทั้งแท็บเมื่อ cursor ไม่ตรง
+"""
+
+import gsheet_sync
+from gsheet_sync import FakeSheetsClient
+
+URL = "https://docs.google.com/spreadsheets/d/fake"
+HEADER = ["orderNumber", "sellerSku", "quantity", "Shop"]
+
+
+def _tab(rows):
+    client = FakeSheetsClient({URL: {"Import_Shopee": [HEADER] + rows}})
+    return client.open_by_url(URL).worksheet("Import_Shopee")
+
+
+def test_incremental_pull_reads_only_new_rows():
+    ws = _tab([["A1", "S1", "1", "ร้าน"], [], ["A2", "S2", "002", "ร้าน"]])
+    pull = gsheet_sync.pull_records(ws, None, URL)
+    assert not pull.incremental and pull.records == ws.get_all_records()
+    assert pull.records[2] == {"orderNumber": "A2", "sellerSku": "S2", "quantity": 2, "Shop": "ร้าน"}
+
+    ws.append_rows([["A3", "S1", "1"], ["A4", "S9", "5", "ร้าน"]])
+    ws.calls.clear()
+    nxt = gsheet_sync.pull_records(ws, pull.cursor, URL)
+    assert nxt.incremental and ws.calls == ["batch_get"]
+    assert nxt.records == ws.get_all_records()[3:]
+    assert nxt.cursor["rows"] == 5
+
+    again = gsheet_sync.pull_records(ws, nxt.cursor, URL)
+    assert again.incremental and again.records == []
+
+
+def test_cursor_mismatch_falls_back_to_full_read():
+    ws = _tab([["A1", "S1", "1", "ร้าน"], ["A2", "S2", "1", "ร้าน"]])
+    cursor = gsheet_sync.pull_records(ws, None, URL).cursor
+
+    # ล้างแท็บแล้วเริ่มวันใหม่ (จำนวนแถวเท่าเดิม แต่ข้อมูลไม่ตรง)
+    ws.rows[1:] = [["B1", "S1", "1", "ร้าน"], ["B2", "S2", "1", "ร้าน"], ["B3", "S3", "1", "ร้าน"]]
+    pull = gsheet_sync.pull_records(ws, cursor, URL)
+    assert not pull.incremental and [r["orderNumber"] for r in pull.records] == ["B1", "B2", "B3"]
+
+    assert not gsheet_sync.pull_records(ws, pull.cursor, URL + "#other").incremental
+    ws.rows[0] = HEADER + ["note"]
+    assert not gsheet_sync.pull_records(ws, pull.cursor, URL).incremental
+
+
+def test_failed_rows_are_reread_when_fixed():
+    ws = _tab([["A1", "S1", "1", "ร้าน"], ["A2", "", "1", "ร้าน"], [], ["A4", "S1", "1", "ร้าน"], ["A5", "S1", "1", "ร้าน"]])
+    pull = gsheet_sync.pull_records(ws, None, URL)
+    assert [n for n, _ in pull.rows] == [2, 3, 4, 5, 6]
+    cursor = gsheet_sync.settle_cursor(pull, [1, 2])   # A2 ไม่มี SKU, แถว 4 ว่าง
+    assert sorted(cursor["pending"]) == ["3", "4"]
+
+    # ไม่มีอะไรเปลี่ยน -> ไม่มี record, pending ค้างเดิม
+    nxt = gsheet_sync.pull_records(ws, cursor, URL)
+    assert nxt.incremental and nxt.records == [] and nxt.cursor["pending"] == cursor["pending"]
+
+    # แก้แถวที่ไม่สำเร็จ + เพิ่มแถวใหม่ -> ได้เฉพาะแถวที่แก้และแถวใหม่ ใน batch_get ครั้งเดียว
+    ws.rows[2][1] = "S2"
+    ws.rows[3] = ["A3", "S1", "1", "ร้าน"]
+    ws.append_rows([["A7", "S1", "1", "ร้าน"]])
+    ws.calls.clear()
+    nxt = gsheet_sync.pull_records(ws, cursor, URL)
+    assert nxt.incremental and ws.calls == ["batch_get"]
+    assert [r["orderNumber"] for r in nxt.records] == ["A2", "A3", "A7"]
+    assert [n for n, _ in nxt.rows] == [3, 4, 7]
+    cursor = gsheet_sync.settle_cursor(nxt, [])
+    assert cursor["pending"] == {} and cursor["rows"] == 6
+    assert gsheet_sync.pull_records(ws, cursor, URL).records == []
+
+    # แก้แถวที่นำเข้าสำเร็จแล้ว (ไม่ใช่แถวแรก/แถวสุดท้าย) ไม่ถูกดึงซ้ำ ต้องดึงทั้งแท็บเอง (cursor=None)
+    ws.rows[4][0] = "A9"
+    assert gsheet_sync.pull_records(ws, cursor, URL).records == []
+    assert "A9" in [r["orderNumber"] for r in gsheet_sync.pull_records(ws, None, URL).records]
+
+
+def test_scattered_pending_rows_fall_back_to_full_read(monkeypatch):
+    ws = _tab([["A1", "S1", "1", "ร้าน"], ["A2", "", "1", "ร้าน"], ["A3", "S1", "1", "ร้าน"], ["A4", "", "1", "ร้าน"],
+               ["A5", "S1", "1", "ร้าน"]])
+    pull = gsheet_sync.pull_records(ws, None, URL)
+    cursor = gsheet_sync.settle_cursor(pull, [1, 3])
+    monkeypatch.setattr(gsheet_sync, "_PENDING_RANGES", 1)
+    nxt = gsheet_sync.pull_records(ws, cursor, URL)
+    assert not nxt.incremental and len(nxt.records) == 5
+
+
+def test_fetch_all_runs_concurrently_and_reports_errors():
+    import threading
+
+    client = FakeSheetsClient({f"{URL}/{i}": {"Import_Shopee": [HEADER, [f"O{i}", "S", "1", "ร้าน"]]} for i in range(4)})
+    barrier = threading.Barrier(4, timeout=5)   # ผ่านได้ก็ต่อเมื่อดึง 4 ร้านพร้อมกันจริง
+    for sheet in client.sheets.values():
+        ws = sheet.tabs["Import_Shopee"]
+        ws.get = (lambda get: lambda **kw: (barrier.wait(), get(**kw))[1])(ws.get)
+
+    targets = [(i, f"{URL}/{i}", "Import_Shopee", None) for i in range(4)] + [("x", URL, "Import_Shopee", None)]
+    results = gsheet_sync.fetch_all(client, targets, workers=4)
+    assert [r.key for r in results] == [0, 1, 2, 3, "x"]
+    assert [r.pull.records[0]["orderNumber"] for r in results[:4]] == ["O0", "O1", "O2", "O3"]
+    assert results[4].pull is None and results[4].error
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+import_cache: ไฟล์เดิม/ไฟล์คล้ายเดิมต้องได้ stats เหมือนนำเข้าซ้ำเต็มไฟล์
+"""
+
+import io
+from datetime import date
+
+import pandas as pd
+import pytest
+from flask import Flask
+
+import import_cache
+import importers
+from models import db, OrderLine
+
+DAY = date(2026, 9, 1)
+
+
+@pytest.fixture
+def app_ctx(database_uri):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield
+
+
+def _orders(*rows):
+    return pd.DataFrame(rows, columns=["orderNumber", "sellerSku", "quantity", "Shop"])
+
+
+def _run(df, digest):
+    """แบบเดียวกับ _run_orders_import ใน app.py (ไม่รวม ImportLog)"""
+    fp = import_cache.lookup("Shopee", "", DAY)
+    if fp is not None and fp.content_hash == digest:
+        stats, diff = import_cache.cached_stats(fp), None
+    else:
+        diff = import_cache.RowDiff(fp)
+        stats = diff.merge(importers.import_orders_chunks(diff.filter([df]), "Shopee", None, DAY))
+    import_cache.save("Shopee", "", DAY, digest, stats, diff, None)
+    return stats
+
+
+def _summary(st):
+    return (st["added"], st["duplicates_today"], st["failed"], sorted(st["duplicate_ids"]))
+
+
+def test_file_digest_rewinds_stream():
+    buf = io.BytesIO(b"abc")
+    assert import_cache.file_digest(buf) == import_cache.file_digest(buf)
+    assert buf.tell() == 0
+
+
+def test_same_and_near_identical_files_match_full_import(app_ctx):
+    base = [("A1", "S1", 1, "ร้าน 1"), ("A1", "S2", 1, "ร้าน 1"), ("A2", "S1", 1, "ร้าน 2"), ("A3", "", 1, "ร้าน 1")]
+    df1 = _orders(*base)
+    st = _run(df1, import_cache.frame_digest(df1))
+    assert (st["added_ids"], st["failed_ids"]) == (["A1", "A2"], ["A3"])
+
+    st = _run(df1, import_cache.frame_digest(df1))   # ไฟล์เดิม -> ไม่ผ่าน importer
+    assert st["cached"] and _summary(st) == (0, 2, 1, ["A1", "A2"])
+
+    # แถวเดิม + Order ใหม่ + Order เดิมแต่คนละร้าน (= Order ใหม่)
+    df2 = _orders(*base, ("A4", "S1", 1, "ร้าน 1"), ("A2", "S1", 1, "ร้าน 3"))
+    st = _run(df2, import_cache.frame_digest(df2))
+    assert st["rows_skipped"] == 3
+    assert st["added_ids"] == ["A4", "A2"] and _summary(st) == (2, 2, 1, ["A1", "A2"])
+
+    # Order ถูกลบ -> ผลเดิมใช้ไม่ได้ นำเข้าเต็มไฟล์
+    OrderLine.query.filter_by(order_id="A1").delete()
+    db.session.commit()
+    assert import_cache.lookup("Shopee", "", DAY) is None
+    st = _run(df2, import_cache.frame_digest(df2))
+    assert st["added_ids"] == ["A1"] and "A1" not in st["duplicate_ids"]
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+import_jobs: งานนำเข้าเบื้องหลัง key เดียวกันทำทีละงาน ต่าง key ทำขนานกัน และบันทึกผล/ลบไฟล์เมื่อจบ
+"""
+
+import threading
+
+import pytest
+from flask import Flask
+
+from models import db, ImportJob
+from services import import_jobs
+
+
+@pytest.fixture
+def app(shared_database_uri):
+    # ใช้ไฟล์ DB (in-memory SQLite แยกกันต่อ connection, worker thread จะมองไม่เห็นตาราง)
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = shared_database_uri
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+    assert import_jobs.wait_idle(5)
+
+
+def _upload(tmp_path, name):
+    path = tmp_path / name
+    path.write_text("x")
+    return str(path)
+
+
+def test_same_key_serialized_other_keys_parallel(app, tmp_path):
+    release = threading.Event()
+    started = []
+
+    def blocking(job):
+        started.append(job.shop_name)
+        assert release.wait(5)
+        job.progress(rows=10, added=7, duplicates=2, failed=1)
+        return {"message": f"ok {job.shop_name}"}
+
+    submit = lambda shop: import_jobs.submit(  # noqa: E731
+        app, "orders", ("orders", "Shopee", shop), blocking,
+        file_path=_upload(tmp_path, f"{shop}.xlsx"), filename=f"{shop}.xlsx", shop_name=shop,
+    )
+    a1, b1, a2 = submit("A"), submit("B"), submit("A")
+
+    # A กับ B เริ่มพร้อมกัน ส่วน A งานที่สองรอจน A งานแรกจบ
+    for _ in range(200):
+        if len(started) == 2:
+            break
+        threading.Event().wait(0.01)
+    assert sorted(started) == ["A", "B"]
+    assert import_jobs.get_job(a2)["status"] == "queued"
+
+    release.set()
+    assert import_jobs.wait_idle(5)
+    assert started[2] == "A"
+
+    db.session.expire_all()
+    for job_id in (a1, b1, a2):
+        job = import_jobs.get_job(job_id)
+        assert job["status"] == "done" and job["message"].startswith("ok")
+        assert (job["rows_processed"], job["added_count"], job["duplicates_count"], job["failed_count"]) == (10, 7, 2, 1)
+    assert not list(tmp_path.glob("*.xlsx"))   # ไฟล์ที่อัปโหลดถูกลบเมื่อจบงาน
+
+
+def test_failed_job_marked_failed(app, tmp_path):
+    def broken(job):
+        job.progress(rows=3)
+        raise ValueError("ไฟล์เสีย")
+
+    job_id = import_jobs.submit(app, "stock", ("stock",), broken,
+                                file_path=_upload(tmp_path, "s.xlsx"), filename="s.xlsx")
+    assert import_jobs.wait_idle(5)
+    db.session.expire_all()
+    job = db.session.get(ImportJob, job_id)
+    assert job.status == "failed" and "ไฟล์เสีย" in job.message
+    assert job.rows_processed == 3 and job.finished_at is not None
+    assert not (tmp_path / "s.xlsx").exists()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+importers: นำเข้าแบบ Bulk ต้องให้สถิติ/ผลใน DB เหมือนการนำเข้าทีละ Order แบบเดิม
+"""
+
+from datetime import date
+
+import pandas as pd
+import pytest
+from flask import Flask
+
+import importers
+from models import db, OrderLine, Sales, Shop, Stock
+
+
+@pytest.fixture
+def app_ctx(database_uri):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield
+
+
+def _orders(*rows):
+    return pd.DataFrame(rows, columns=["orderNumber", "sellerSku", "quantity", "Shop"])
+
+
+def test_import_orders_duplicate_stats(app_ctx):
+    day1, day2 = date(2026, 9, 1), date(2026, 9, 2)
+    st = importers.import_orders(_orders(
+        ("A1", "S1", 1, "ร้าน 1"), ("A1", "S1", 2, "ร้าน 1"), ("A2", "S2", 1, "ร้าน 2 (Shopee)"), ("", "S3", 1, "ร้าน 1"),
+    ), "Shopee", None, day1)
+    assert (st["added_ids"], st["failed"]) == (["A1", "A2"], 1)
+    assert {s.name for s in Shop.query.all()} == {"ร้าน 1", "ร้าน 2"}
+    assert OrderLine.query.filter_by(order_id="A1").one().qty == 3   # รวม SKU ซ้ำใน Order
+
+    st = importers.import_orders(_orders(
+        ("A1", "S1", 1, "ร้าน 1"), ("A3", "S1", 1, "ร้าน 1"), ("A3", "S2", 1, "ร้าน 1"),
+    ), "Shopee", None, day1)
+    assert st["added_ids"] == ["A3"] and st["duplicate_today_ids"] == ["A1"] and st["duplicate_old_ids"] == []
+
+    st = importers.import_orders(_orders(("A2", "S2", 1, "ร้าน 2"), ("A2", "S9", 1, "ร้าน 9")), "Shopee", None, day2)
+    assert st["duplicate_old_ids"] == ["A2"] and st["added_ids"] == ["A2"]   # คนละร้าน = Order ใหม่
+    assert OrderLine.query.count() == 5
+
+
+def test_import_orders_counts_each_order_id_once(app_ctx):
+    day = date(2026, 9, 1)
+    st = importers.import_orders(_orders(
+        ("B1", "", 1, "ร้าน 1"), ("B1", "", 1, "ร้าน 1"), ("B2", "S1", 1, ""),
+        ("B3", "S1", 1, "ร้าน 1"), ("B3", "S1", 1, "ร้าน 3"), ("B4", "S1", 1, "ร้าน 2"),
+    ), "Shopee", None, day)
+    assert (st["failed_ids"], st["failed"]) == (["B1", "B2"], 2)
+    assert (st["added_ids"], st["added"]) == (["B3", "B4"], 2)   # B3 สองร้าน นับ Order ID เดียว
+
+    st = importers.import_orders(_orders(("B3", "S1", 1, "ร้าน 1"), ("B3", "S1", 1, "ร้าน 3")), "Shopee", None, day)
+    assert (st["duplicate_ids"], st["duplicate_today_ids"], st["duplicates"]) == (["B3"], ["B3"], 1)
+
+
+def test_import_orders_chunks_commit_per_chunk(app_ctx):
+    day = date(2026, 9, 1)
+    rows = [(f"C{i // 3}", f"S{i % 4}", 1, "ร้าน 1") for i in range(20)] + [("C1", "S1", 2, "ร้าน 1")]
+    whole = importers.import_orders(_orders(*rows), "Shopee", None, day)
+    expected = sorted((l.order_id, l.sku, l.qty) for l in OrderLine.query)
+    OrderLine.query.delete()
+    db.session.commit()
+
+    # Order ที่บรรทัดคร่อม chunk (C1 แถว 3-5 กับ chunk ละ 4 แถว) และโผล่อีกทีท้ายไฟล์ ยังเป็น Order เดียว
+    added = []
+    frames = [_orders(*rows[i:i + 4]) for i in range(0, len(rows), 4)]
+    st = importers.import_orders_chunks(frames, "Shopee", None, day, progress=lambda **c: added.append(c["added"]))
+    assert st == whole
+    assert sorted((l.order_id, l.sku, l.qty) for l in OrderLine.query) == expected
+    assert added[:3] == [1, 2, 3]   # insert/commit ทีละ chunk ไม่รอจนจบไฟล์
+
+
+def test_import_stock_full_sync_touches_changed_rows_only(app_ctx):
+    importers.import_stock(pd.DataFrame({"SKU": ["A", "B", "C"], "Qty": [5, 2, 0]}))
+    before = {s.sku: s.updated_at for s in Stock.query.all()}
+
+    # A เท่าเดิม, B เปลี่ยน, C ไม่อยู่ในไฟล์แต่เป็น 0 อยู่แล้ว, D ใหม่ (ไฟล์มี SKU ซ้ำ -> รวมยอด)
+    cnt = importers.import_stock(pd.DataFrame({"SKU": ["A", "B", "D", "D"], "Qty": [5, 7, 1, 2]}))
+    db.session.expire_all()
+    stocks = {s.sku: s for s in Stock.query.all()}
+    assert cnt == 3
+    assert {sku: s.qty for sku, s in stocks.items()} == {"A": 5, "B": 7, "C": 0, "D": 3}
+    assert stocks["A"].updated_at == before["A"] and stocks["C"].updated_at == before["C"]
+    assert stocks["B"].updated_at != before["B"]
+
+    importers.import_stock(pd.DataFrame({"SKU": ["D"], "Qty": [3]}))   # SKU ที่ไม่อยู่ในไฟล์ -> 0
+    db.session.expire_all()
+    assert {s.sku: s.qty for s in Stock.query.all()} == {"A": 0, "B": 0, "C": 0, "D": 3}
+
+
+def test_import_sales_writes_changed_rows_only(app_ctx):
+    db.session.add(Sales(order_id="S1", po_no="P1", status="ยังไม่มีการเปิดใบขาย", status_class="empty"))
+    db.session.commit()
+    df = pd.DataFrame({
+        "เลข Order": ["S1", "S2", None, "S2"],
+        "PO": ["P1", "P2", "P9", None],
+        "สถานะ": ["ยังไม่มีการเปิดใบขาย", None, "PACKED", "PACKED"],
+    })
+    res = importers.import_sales(df)
+    assert res["ids"] == ["S1", "S2", "S2"] and len(res["skipped"]) == 1
+    assert res["changed_ids"] == ["S2"] and res["status_changed"] == 1
+    s2 = Sales.query.filter_by(order_id="S2").one()
+    assert (s2.po_no, s2.status, s2.status_class) == ("P2", "PACKED", "packed")
+
+    res = importers.import_sales(pd.DataFrame({"เลข Order": ["S1"], "สถานะ": ["เปิดใบขายครบตามจำนวนแล้ว"]}))
+    assert res["changed_ids"] == ["S1"] and res["status_changed"] == 1
+    s1 = Sales.query.filter_by(order_id="S1").one()
+    assert (s1.po_no, s1.status_class) == ("P1", "packed")
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+ingest: อ่าน Excel ทีละ chunk ต้องได้ข้อมูลเหมือน pd.read_excel และ importer แบบ chunk ให้ผลเหมือนทั้งไฟล์
+CSV อ่านเป็นข้อความ (เลข 0 นำหน้าไม่หาย) / Parquet เก็บชนิดตามต้นทาง
+"""
+
+import io
+from datetime import date
+
+import pandas as pd
+import pytest
+from flask import Flask
+from openpyxl import Workbook
+
+import importers
+from ingest import read_excel_chunks, read_upload_chunks
+from models import db, OrderLine, Stock
+
+
+def _xlsx(header, rows) -> io.BytesIO:
+    wb = Workbook()
+    ws = wb.active
+    ws.append(header)
+    for row in rows:
+        ws.append(row)
+    buf = io.BytesIO()
+    wb.save(buf)
+    buf.seek(0)
+    return buf
+
+
+@pytest.fixture
+def app_ctx(database_uri):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield
+
+
+def test_chunks_match_read_excel():
+    rows = [(f"A{i}", "x" if i % 3 else None, f"1234567890{i:03d}", "2026-09-01 10:00") for i in range(23)]
+    rows[5] = (None, None, None, None)   # แถวว่างกลางไฟล์ยังนับเป็นแถว
+    rows += [(None, None, None, None)] * 2  # แถวว่างท้ายไฟล์ถูกตัด
+    buf = _xlsx(["orderNumber", None, "SKU", "orderNumber"], rows)
+    expected = pd.read_excel(buf)
+
+    buf.seek(0)
+    chunks = list(read_excel_chunks(buf, chunk_rows=7).chunks())
+    assert [len(c) for c in chunks] == [7, 7, 7, 2]
+    pd.testing.assert_frame_equal(pd.concat(chunks), expected)
+
+    buf.seek(0)
+    sheet = read_excel_chunks(buf, chunk_rows=7, drop_blank=True)
+    assert sheet.find(["Order ID", "orderNumber"]) == "orderNumber"
+    assert [i for c in sheet.chunks() for i in c.index] == [i for i in range(23) if i != 5]
+
+
+def test_header_only_file_yields_empty_chunk():
+    chunks = list(read_excel_chunks(_xlsx(["SKU", "Qty"], []), chunk_rows=10).chunks())
+    assert len(chunks) == 1 and chunks[0].empty and list(chunks[0].columns) == ["SKU", "Qty"]
+
+
+def test_chunked_importers_match_whole_file(app_ctx):
+    buf = _xlsx(["SKU", "Qty"], [("A", 1), ("B", 2), ("A", 3), ("C", None), ("B", 4)])
+    cnt = importers.import_stock_chunks(read_excel_chunks(buf, chunk_rows=2).chunks())
+    assert cnt == 3
+    assert {s.sku: s.qty for s in Stock.query.all()} == {"A": 4, "B": 6, "C": 0}
+
+    # Order ที่บรรทัดอยู่คนละ chunk ยังเป็น Order เดียว (รวม SKU ซ้ำ)
+    buf = _xlsx(["orderNumber", "sellerSku", "quantity", "Shop"],
+                [("O1", "A", 1, "ร้าน"), ("O2", "B", 1, "ร้าน"), ("O1", "A", 2, "ร้าน"), ("O1", "C", 1, "ร้าน")])
+    st = importers.import_orders_chunks(read_excel_chunks(buf, chunk_rows=1).chunks(), "Shopee", None, date(2026, 9, 1))
+    assert (st["added_ids"], st["duplicates"], st["failed"]) == (["O1", "O2"], 0, 0)
+    assert {(l.sku, l.qty) for l in OrderLine.query.filter_by(order_id="O1")} == {("A", 3), ("C", 1)}
+
+
+ORDER_HEADER = ["orderNumber", "sellerSku", "quantity", "Shop", "createTime"]
+ORDER_ROWS = [(f"{5800000000000000000 + i}", f"00{i % 4}" if i % 5 else f"SKU{i}", i % 3, "ร้าน ก" if i % 2 else None,
+               "2026-10-18 10:00") for i in range(11)]
+
+
+def _frames(stream):
+    return pd.concat(list(stream.chunks()))
+
+
+def test_csv_reads_text_like_excel():
+    excel = _frames(read_excel_chunks(_xlsx(ORDER_HEADER, ORDER_ROWS), chunk_rows=4))
+    csv = pd.DataFrame(ORDER_ROWS, columns=ORDER_HEADER).to_csv(index=False).encode("utf-8-sig")
+
+    stream = read_upload_chunks(io.BytesIO(csv), chunk_rows=4, filename="orders.csv")
+    assert stream.find(importers.COMMON_ORDER_ID) == "orderNumber"
+    frame = _frames(stream)
+    # CSV เป็นข้อความทุกคอลัมน์ (ไม่เดาชนิดต่อ chunk) ช่องว่างเป็น NaN แบบเดียวกับ Excel
+    assert frame.index.equals(excel.index) and list(frame.columns) == ORDER_HEADER
+    assert frame.isna().equals(excel.isna())
+    assert frame["orderNumber"].tolist() == [r[0] for r in ORDER_ROWS]
+    assert frame["quantity"].tolist() == [str(r[2]) for r in ORDER_ROWS]
+
+    # chunk ที่ SKU / เลข Order เป็นตัวเลขล้วนทั้ง chunk ยังเก็บเลข 0 นำหน้า
+    zeros = "orderNumber,sellerSku,quantity\n000123,0045,2\n000124,0046,1\n000125,SKU9,1\n"
+    chunks = list(read_upload_chunks(io.BytesIO(zeros.encode()), chunk_rows=2, filename="z.csv").chunks())
+    assert chunks[0]["sellerSku"].tolist() == ["0045", "0046"]
+    assert pd.concat(chunks)["orderNumber"].tolist() == ["000123", "000124", "000125"]
+
+    # CSV ภาษาไทยที่ Save จาก Excel (cp874)
+    thai = "SKU,ร้าน\nA,ร้าน ข\n".encode("cp874")
+    assert _frames(read_upload_chunks(io.BytesIO(thai), filename="s.csv"))["ร้าน"].tolist() == ["ร้าน ข"]
+
+
+def test_parquet_matches_excel(tmp_path):
+    pytest.importorskip("pyarrow")
+    expected = _frames(read_excel_chunks(_xlsx(ORDER_HEADER, ORDER_ROWS), chunk_rows=4))
+    path = tmp_path / "orders.parquet"
+    pd.DataFrame(ORDER_ROWS, columns=ORDER_HEADER).to_parquet(path, index=False)
+
+    frame = _frames(read_upload_chunks(str(path), chunk_rows=4))
+    assert frame.index.tolist() == list(range(len(ORDER_ROWS)))
+    # Parquet เก็บชนิดตามต้นทาง (เลข Order เป็นข้อความ) ค่าว่างเป็น NaN แบบเดียวกับ Excel
+    assert frame["Shop"].isna().tolist() == expected["Shop"].isna().tolist()
+    assert frame["orderNumber"].tolist() == [str(v) for v in expected["orderNumber"]]
+
+
+def test_csv_orders_import_like_excel(app_ctx):
+    csv = pd.DataFrame(ORDER_ROWS, columns=ORDER_HEADER).to_csv(index=False).encode()
+    st = importers.import_orders_chunks(read_upload_chunks(io.BytesIO(csv), chunk_rows=3, filename="o.csv").chunks(),
+                                        "Shopee", "ร้าน ข", date(2026, 9, 1))
+    assert st["added"] == 11 and st["failed"] == 0
+    assert OrderLine.query.filter_by(order_id="5800000000000000010").one().sku == "SKU10"
+    assert OrderLine.query.filter_by(order_id="5800000000000000001").one().sku == "001"
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+migrations: แต่ละขั้นรันครั้งเดียว, ฐานข้อมูลที่เป็นปัจจุบันไม่รันอะไร, ขั้นที่ล้มถูก rollback และไม่บันทึกเวอร์ชัน
+"""
+
+import pytest
+from sqlalchemy import create_engine, event, inspect, text
+
+import migrations
+from migrations import Migration
+
+
+def _add_column(con):
+    cols = {c["name"] for c in inspect(con).get_columns("t")}
+    if "b" not in cols:
+        con.execute(text("ALTER TABLE t ADD COLUMN b INTEGER"))
+
+
+STEPS = [
+    Migration(1, "create_t", lambda con: con.execute(text("CREATE TABLE IF NOT EXISTS t (a INTEGER)"))),
+    Migration(2, "add_b", _add_column),
+]
+
+
+@pytest.fixture
+def engine(shared_database_uri):
+    engine = create_engine(shared_database_uri)
+    yield engine
+    engine.dispose()
+
+
+def test_steps_run_once_and_current_db_is_not_probed(engine):
+    assert migrations.run(engine, STEPS) == [1, 2]
+    with engine.connect() as con:
+        assert migrations.current_version(con) == 2
+        assert [r[0] for r in con.execute(text("SELECT name FROM schema_version ORDER BY version"))] == ["create_t", "add_b"]
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *a: statements.append(a[2]))
+    assert migrations.run(engine, STEPS) == []
+    assert not [s for s in statements if "PRAGMA table_info" in s or s.lstrip().upper().startswith(("ALTER", "CREATE"))]
+
+    # ขั้นใหม่ต่อท้าย -> รันเฉพาะขั้นนั้น
+    step3 = Migration(3, "fill", lambda con: con.execute(text("INSERT INTO t (a, b) VALUES (1, 2)")))
+    assert migrations.run(engine, STEPS + [step3]) == [3]
+    assert migrations.run(engine, STEPS + [step3]) == []
+    with engine.connect() as con:
+        assert con.execute(text("SELECT COUNT(*) FROM t")).scalar() == 1
+
+
+def test_legacy_database_without_schema_version(engine):
+    # ฐานข้อมูลเดิม (ก่อนมี schema_version) ที่มีตาราง/คอลัมน์อยู่แล้ว: ทุกขั้นทำซ้ำได้
+    with engine.begin() as con:
+        con.execute(text("CREATE TABLE t (a INTEGER, b INTEGER)"))
+    assert migrations.run(engine, STEPS) == [1, 2]
+
+
+def test_failed_step_rolls_back_and_is_retried(engine):
+    def broken(con):
+        con.execute(text("ALTER TABLE t ADD COLUMN c INTEGER"))
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        migrations.run(engine, STEPS + [Migration(3, "broken", broken)])
+    with engine.connect() as con:
+        assert migrations.current_version(con) == 2
+        assert "c" not in {c["name"] for c in inspect(con).get_columns("t")}
+
+    def fixed(con):
+        con.execute(text("ALTER TABLE t ADD COLUMN c INTEGER"))
+
+    assert migrations.run(engine, STEPS + [Migration(3, "fixed", fixed)]) == [3]
+
+
+def test_versions_must_be_ascending(engine):
+    with pytest.raises(ValueError):
+        migrations.run(engine, [STEPS[1], STEPS[0]])
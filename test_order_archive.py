@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+order_archive: ย้ายเฉพาะ Order ที่จบงานและเก่าพอ ทีละ batch ใน transaction และหน้าประวัติยังอ่านแถวที่ย้ายแล้วได้
+"""
+
+from datetime import date, datetime
+
+import pandas as pd
+import pytest
+from flask import Flask
+from sqlalchemy import text
+
+import db_backend
+import importers
+import order_archive
+from allocation import archived_rows, compute_allocation
+from models import db, OrderLine, OrderLineArchive, Sales, Shop, Stock
+from utils import TH_TZ
+
+NOW = datetime(2026, 10, 18, 9, 0, tzinfo=TH_TZ)
+
+
+@pytest.fixture
+def app(shared_database_uri):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = shared_database_uri
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(text("CREATE TABLE cancelled_orders (order_id VARCHAR(128) UNIQUE)"))
+        db.session.execute(text("CREATE TABLE issued_orders (order_id VARCHAR(128) UNIQUE)"))
+        # คอลัมน์ที่ auto-migrate เพิ่มให้ order_lines (ไม่อยู่ใน model) ต้องตามไปที่คลังด้วย
+        db.session.execute(text("ALTER TABLE order_lines ADD COLUMN printed_lowstock INTEGER DEFAULT 0"))
+        db.session.execute(text("ALTER TABLE order_lines ADD COLUMN printed_lowstock_at TEXT"))
+        db.session.execute(text("ALTER TABLE order_lines ADD COLUMN allocation_status TEXT"))
+        shop = Shop(platform="Shopee", name="S1")
+        db.session.add(shop)
+        db.session.add(Stock(sku="A", qty=5))
+        db.session.flush()
+        for oid, imported, sales in [
+            ("OLD_PACKED", date(2026, 6, 1), "packed"),
+            ("OLD_CANCEL", date(2026, 6, 1), None),
+            ("OLD_OPEN", date(2026, 6, 1), "opened"),
+            ("NEW_PACKED", date(2026, 10, 10), "packed"),
+        ]:
+            for sku in ("A", "B"):
+                db.session.add(OrderLine(
+                    platform="Shopee", shop_id=shop.id, order_id=oid, sku=sku, qty=1, import_date=imported,
+                    order_time=datetime(imported.year, imported.month, imported.day, 8, 0),
+                    printed_warehouse=1, printed_warehouse_at=datetime(imported.year, imported.month, imported.day + 1, 10, 0),
+                ))
+            if sales:
+                db.session.add(Sales(order_id=oid, status=sales, status_class=sales))
+        db.session.execute(text("INSERT INTO cancelled_orders (order_id) VALUES ('OLD_CANCEL')"))
+        db.session.execute(text("UPDATE order_lines SET printed_lowstock = 2, printed_lowstock_at = '2026-06-03 09:00:00' WHERE order_id = 'OLD_PACKED'"))
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+def _live_order_ids():
+    return {oid for (oid,) in db.session.query(OrderLine.order_id).distinct()}
+
+
+def test_moves_finished_old_orders_in_batches(app):
+    oids = ["OLD_CANCEL", "OLD_PACKED"]
+    before = [r for r in compute_allocation(db.session, {"all_time": True}, fresh=True)[0] if r["order_id"] in oids]
+
+    moved = order_archive.archive_finished_orders(db.engine, 90, batch=1, now=NOW)
+    assert sorted(moved) == oids
+    assert _live_order_ids() == {"OLD_OPEN", "NEW_PACKED"}
+    archived = db.session.query(OrderLineArchive).order_by(OrderLineArchive.id).all()
+    assert [a.order_id for a in archived] == ["OLD_PACKED", "OLD_PACKED", "OLD_CANCEL", "OLD_CANCEL"]
+    assert all(a.archived_at is not None for a in archived)
+    assert db.session.execute(text(
+        "SELECT printed_lowstock, printed_lowstock_at FROM order_lines_archive WHERE order_id = 'OLD_PACKED'"
+    )).all() == [(2, "2026-06-03 09:00:00")] * 2
+    assert order_archive.archive_finished_orders(db.engine, 90, now=NOW) == []
+
+    # แถวในคลังอยู่ในรูปเดียวกับผล compute_allocation ก่อนย้าย (ยกเว้น allqty)
+    after = archived_rows(db.session, {}, oids)
+    key = lambda r: r["id"]
+    strip = lambda rows: [{k: v for k, v in r.items() if k != "allqty"} for r in sorted(rows, key=key)]
+    assert strip(after) == strip(before)
+    assert {r["order_id"]: r["allocation_status"] for r in after} == {"OLD_PACKED": "PACKED", "OLD_CANCEL": "CANCELLED"}
+
+    # นำเข้าซ้ำ: Order ที่อยู่ในคลังยังนับเป็น Order เดิม
+    assert ("OLD_PACKED" in {oid for _, oid in importers._existing_order_import_dates({"OLD_PACKED"})})
+
+
+def test_history_reads_archive_only_when_range_reaches_it(app):
+    order_archive.archive_finished_orders(db.engine, 90, now=NOW)
+    con = db.session.connection()
+    assert order_archive.print_days(con, "warehouse") == {"2026-06-02"}
+    assert order_archive.needs_archive(con, "warehouse", "2026-06-01")
+    assert order_archive.needs_archive(con, "warehouse", None)
+    assert not order_archive.needs_archive(con, "warehouse", date(2026, 10, 11))
+    assert order_archive.print_days(con, "lowstock") == {"2026-06-03"}
+    assert not order_archive.needs_archive(con, "picking", None)  # ไม่มีงานที่พิมพ์ในคลัง
+
+    day = db_backend.iso_date_sql("printed_warehouse_at", con.dialect.name)
+    sql = "SELECT DISTINCT order_id FROM {src} WHERE printed_warehouse > 0 AND " + day + " = :d"
+    assert db.session.execute(text(sql.format(src=order_archive.source(con, False))), {"d": "2026-06-02"}).all() == [("OLD_OPEN",)]
+    got = db.session.execute(text(sql.format(src=order_archive.source(con, True))), {"d": "2026-06-02"}).scalars().all()
+    assert sorted(got) == ["OLD_CANCEL", "OLD_OPEN", "OLD_PACKED"]
+
+
+def test_failed_batch_rolls_back(app, monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(order_archive, "delete", broken)
+    with pytest.raises(RuntimeError):
+        order_archive.archive_finished_orders(db.engine, 90, now=NOW)
+    assert db.session.query(OrderLineArchive).count() == 0
+    assert db.session.query(OrderLine).count() == 8
+
+
+def test_unfinished_orders_move_back(app):
+    order_archive.archive_finished_orders(db.engine, 90, now=NOW)
+    con = db.session.connection()
+    assert order_archive.print_days(con, "warehouse") == {"2026-06-02"}
+    assert order_archive.restore_unfinished(con, ["OLD_CANCEL", "OLD_PACKED"]) == []  # ยังจบงานอยู่
+
+    # บรรทัดใหม่ได้ id ของบรรทัดที่ย้ายไป (SQLite ใช้ rowid ซ้ำได้) -> แถวที่ย้ายกลับชนได้ id ใหม่
+    top = db.session.query(OrderLineArchive).order_by(OrderLineArchive.id.desc()).first()
+    db.session.add(OrderLine(id=top.id, platform="Shopee", shop_id=1, order_id="NEW", sku="A", qty=1))
+    db.session.flush()
+
+    # ยกเลิกคืน
+    db.session.execute(text("DELETE FROM cancelled_orders WHERE order_id = 'OLD_CANCEL'"))
+    assert order_archive.restore_unfinished(db.session.connection(), ["OLD_CANCEL", "OLD_OPEN"]) == ["OLD_CANCEL"]
+    db.session.commit()
+    restored = OrderLine.query.filter_by(order_id="OLD_CANCEL").order_by(OrderLine.sku).all()
+    assert [(l.sku, l.printed_warehouse) for l in restored] == [("A", 1), ("B", 1)]
+    assert {a.order_id for a in db.session.query(OrderLineArchive)} == {"OLD_PACKED"}
+
+    # ใบขายเปลี่ยนจากแพ็คแล้ว -> ย้ายกลับตอนนำเข้า
+    res = importers.import_sales(pd.DataFrame({"Order ID": ["OLD_PACKED"], "Status": ["เปิดใบขายบางส่วน"]}))
+    assert res["changed_ids"] == ["OLD_PACKED"]
+    assert db.session.query(OrderLineArchive).count() == 0
+    assert _live_order_ids() == {"OLD_PACKED", "OLD_CANCEL", "OLD_OPEN", "NEW_PACKED", "NEW"}
+    assert db.session.execute(text(
+        "SELECT printed_lowstock, printed_lowstock_at FROM order_lines WHERE order_id = 'OLD_PACKED'"
+    )).all() == [(2, "2026-06-03 09:00:00")] * 2
+    assert {r["order_id"] for r in compute_allocation(db.session, {"all_time": True}, fresh=True)[0]} == _live_order_ids()
+
+    # ค่าที่อ่านจากคลังไม่ค้างหลังคลังว่าง
+    assert order_archive.print_days(db.session.connection(), "warehouse") == frozenset()
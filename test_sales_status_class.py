@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+"""
+classify_sales_status: สถานะใบขายแบบ normalize ที่เก็บใน Sales.status_class ตอนนำเข้า
+"""
+
+from utils import SALES_EMPTY, SALES_OPENED, SALES_PACKED, classify_sales_status
+
+
+def test_classify_sales_status():
+    assert classify_sales_status(None) == SALES_EMPTY
+    assert classify_sales_status("  ") == SALES_EMPTY
+    assert classify_sales_status("ยังไม่มีการเปิดใบขาย") == SALES_EMPTY
+    assert classify_sales_status("เปิดใบขายครบตามจำนวนแล้ว") == SALES_PACKED
+    assert classify_sales_status("PACKED") == SALES_PACKED
+    assert classify_sales_status("แพ็คแล้ว") == SALES_PACKED
+    assert classify_sales_status("เปิดใบขายบางส่วน") == SALES_OPENED
@@ -3,9 +3,13 @@
 from __future__ import annotations
 
 import re
+import threading
+from collections import Counter
 from datetime import datetime, date, time, timedelta
+from functools import lru_cache
 from typing import Optional, Iterable, Set, Dict, Tuple
 
+import pandas as pd
 import pytz
 
 # ===================== Timezone =====================
@@ -36,6 +40,25 @@ def normalize_platform(p: Optional[str]) -> Optional[str]:
     key = re.sub(r"[^a-zA-Zก-๙]", "", p).lower()
     return aliases.get(key, p)
 
+# ===================== Sales status class =====================
+# สถานะใบขาย (Sales.status) แบบ normalize เก็บไว้ที่ Sales.status_class ตอนนำเข้า
+SALES_PACKED = "packed"   # แพ็คแล้ว / เปิดใบขายครบตามจำนวน
+SALES_OPENED = "opened"   # มีใบขายแล้ว (ยังไม่ครบ/สถานะอื่น)
+SALES_EMPTY = "empty"     # ยังไม่มีการเปิดใบขาย / สถานะว่าง
+
+# คำใน Sales.status ที่ถือว่า "แพ็คแล้ว / เปิดใบขายครบ"
+SALES_PACKED_KEYWORDS = ("ครบตามจำนวน", "packed", "แพ็คแล้ว", "opened_full")
+
+def classify_sales_status(status: Optional[str]) -> str:
+    s = (status or "").strip().lower()
+    if not s:
+        return SALES_EMPTY
+    if any(keyword in s for keyword in SALES_PACKED_KEYWORDS):
+        return SALES_PACKED
+    if "ยังไม่มีการเปิดใบขาย" in s:
+        return SALES_EMPTY
+    return SALES_OPENED
+
 # ===================== Now/Format helpers =====================
 def now_thai() -> datetime:
     return datetime.now(TH_TZ)
@@ -57,6 +80,16 @@ def to_be_date_str(d: Optional[date]) -> str:
     return d.strftime(f"%d/%m/{y:04d}")
 
 # ===================== Robust datetime parsing (PATCHED) =====================
+# ลำดับมีผล: ค่าที่เข้าได้หลายรูปแบบ (เช่น 01/02/2025) ใช้รูปแบบแรกที่ตรง
+DATETIME_PATTERNS = (
+    "%d %b %Y %H:%M:%S", "%d %b %Y %H:%M",
+    "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M",
+    "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M",
+    "%d-%m-%Y %H:%M:%S", "%d-%m-%Y %H:%M",
+    "%Y/%m/%d %H:%M:%S", "%Y/%m/%d %H:%M",
+    "%d/%m/%Y", "%Y-%m-%d", "%m/%d/%Y %H:%M", "%m/%d/%Y",
+)
+
 def parse_datetime_guess(s):
     """แปลงเป็น datetime(TH) แบบทนทาน: รองรับรูปแบบตัวอักษร, Excel serial, Unix ts; ปฏิเสธเลขเล็ก ๆ"""
     if s is None:
@@ -92,15 +125,7 @@ def parse_datetime_guess(s):
         return None
     txt = txt.replace("T", " ").replace("  ", " ").strip()
 
-    patterns = [
-        "%d %b %Y %H:%M:%S", "%d %b %Y %H:%M",
-        "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M",
-        "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M",
-        "%d-%m-%Y %H:%M:%S", "%d-%m-%Y %H:%M",
-        "%Y/%m/%d %H:%M:%S", "%Y/%m/%d %H:%M",
-        "%d/%m/%Y", "%Y-%m-%d", "%m/%d/%Y %H:%M", "%m/%d/%Y",
-    ]
-    for p in patterns:
+    for p in DATETIME_PATTERNS:
         try:
             dt = datetime.strptime(txt, p)
             return TH_TZ.localize(dt)
@@ -123,6 +148,78 @@ def parse_datetime_guess(s):
 
     return None
 
+# ===================== Column datetime parsing (vectorized) =====================
+# แปลงคอลัมน์เวลาทั้งก้อนด้วย pd.to_datetime(format=...) แทน parse_datetime_guess ทีละค่า
+# ผลต้องเหมือน parse_datetime_guess ทุกค่า: ค่าที่รูปแบบที่ตรวจพบแปลงไม่ได้ (BE, ปีเกินช่วงของ pandas,
+# รูปแบบปนกันในไฟล์) หรือค่าที่ parse_datetime_guess จะเลือกรูปแบบก่อนหน้า (dd/mm กับ mm/dd) -> แปลงทีละค่าแบบเดิม
+_DT_SAMPLE = 50
+_DT_FORMATS_MAX = 256
+_dt_formats_lock = threading.Lock()
+_dt_formats: Dict[tuple, str] = {}  # (แพลตฟอร์ม, หัวคอลัมน์) -> รูปแบบที่ตรวจพบล่าสุด
+
+def _guess_pattern(txt: str) -> Optional[str]:
+    for p in DATETIME_PATTERNS:
+        try:
+            datetime.strptime(txt, p)
+            return p
+        except ValueError:
+            pass
+    return None
+
+def detect_datetime_format(texts: Iterable[str]) -> Optional[str]:
+    """รูปแบบ (จาก DATETIME_PATTERNS) ที่ parse_datetime_guess ใช้กับค่าส่วนใหญ่ในตัวอย่าง"""
+    hits = Counter(p for p in map(_guess_pattern, texts) if p)
+    return hits.most_common(1)[0][0] if hits else None
+
+def _to_datetime(texts: pd.Series, fmt: str) -> pd.Series:
+    return pd.to_datetime(texts, format=fmt, errors="coerce")
+
+def parse_datetime_texts(values: Iterable, cache_key: Optional[tuple] = None) -> Dict[str, Optional[datetime]]:
+    """
+    parse_datetime_guess ของค่าสตริงทั้งคอลัมน์ในครั้งเดียว -> {ข้อความเดิม: datetime(TH) หรือ None}
+    - ตรวจรูปแบบจากตัวอย่างครั้งเดียว แล้วแปลงทั้งคอลัมน์ + tz_localize แบบ vectorized
+    - cache_key (เช่น แพลตฟอร์ม + หัวคอลัมน์): จำรูปแบบไว้ใช้กับไฟล์ถัดไป (ตรวจใหม่ถ้าแปลงได้ไม่ถึงครึ่ง)
+    - ค่าที่ไม่ใช่สตริงข้ามไป (ตัวเลข/datetime แปลงทีละค่าได้เร็วอยู่แล้ว)
+    - ค่าที่ parse_datetime_guess โยน exception จะไม่อยู่ในผลลัพธ์ (ผู้เรียกเรียกเองเพื่อได้ exception เดิม)
+    """
+    texts = list(dict.fromkeys(v for v in values if isinstance(v, str)))
+    if not texts:
+        return {}
+    norm = pd.Series(texts, dtype=object).str.strip()
+    norm = norm.str.replace("T", " ", regex=False).str.replace("  ", " ", regex=False).str.strip()
+
+    with _dt_formats_lock:
+        fmt = _dt_formats.get(cache_key) if cache_key is not None else None
+    parsed = _to_datetime(norm, fmt) if fmt else None
+    if parsed is None or parsed.notna().sum() * 2 < len(norm):
+        fmt = detect_datetime_format(norm[norm != ""].iloc[:_DT_SAMPLE])
+        parsed = _to_datetime(norm, fmt) if fmt else None
+        if fmt and cache_key is not None:
+            with _dt_formats_lock:
+                if len(_dt_formats) >= _DT_FORMATS_MAX:
+                    _dt_formats.pop(next(iter(_dt_formats)))
+                _dt_formats[cache_key] = fmt
+
+    out: Dict[str, Optional[datetime]] = {}
+    if parsed is not None:
+        ok = parsed.notna()
+        for p in DATETIME_PATTERNS[:DATETIME_PATTERNS.index(fmt)]:
+            if not ok.any():
+                break
+            idx = ok[ok].index
+            ok.loc[idx] = _to_datetime(norm.loc[idx], p).isna().to_numpy()
+        if ok.any():
+            local = parsed[ok].dt.tz_localize(TH_TZ)
+            out = {texts[i]: ts.to_pydatetime() for i, ts in zip(local.index, local)}
+
+    for txt in texts:
+        if txt not in out:
+            try:
+                out[txt] = parse_datetime_guess(txt)
+            except Exception:
+                pass
+    return out
+
 # =====================================================================
 # ===================== Business-day aware SLA ========================
 # =====================================================================
@@ -144,7 +241,123 @@ def is_holiday(d: date) -> bool:
 def is_business_day(d: date) -> bool:
     return (not is_weekend(d)) and (not is_holiday(d))
 
+# ===================== Business-day calendar (precomputed) =====================
+class BusinessCalendar:
+    """
+    ปฏิทินวันทำการที่คำนวณล่วงหน้าในช่วง [start, end]
+    - cum[i]  = จำนวนวันทำการตั้งแต่ start ถึงวันที่ i (รวมวันที่ i)
+    - bd[k]   = index ของวันทำการลำดับที่ k (นับจาก 0)
+    ทำให้ "วันทำการถัดไป" และ "ผลต่างวันทำการ" เป็น O(1)
+    """
+
+    def __init__(self, holidays: Iterable[date], start: date, end: date):
+        self.holidays = frozenset(holidays)
+        self.start = start
+        self.end = end
+        self._cum: list[int] = []
+        self._bd: list[int] = []
+        cnt = 0
+        for i in range((end - start).days + 1):
+            d = start + timedelta(days=i)
+            if d.weekday() < 5 and d not in self.holidays:
+                self._bd.append(i)
+                cnt += 1
+            self._cum.append(cnt)
+
+    def covers(self, d: date, margin: int = 0) -> bool:
+        return self.start <= d and (self.end - d).days >= margin
+
+    def _idx(self, d: date) -> int:
+        return (d - self.start).days
+
+    def is_business_day(self, d: date) -> bool:
+        i = self._idx(d)
+        return self._cum[i] != (self._cum[i - 1] if i else 0)
+
+    def next_business_day(self, d: date) -> date:
+        """วันทำการแรกที่ "หลัง" d (เท่ากับ add_business_days(d, 1))"""
+        return self.start + timedelta(days=self._bd[self._cum[self._idx(d)]])
+
+    def first_business_day_on_or_after(self, d: date) -> date:
+        return d if self.is_business_day(d) else self.next_business_day(d)
+
+    def add_business_days(self, d: date, n: int) -> Optional[date]:
+        """n > 0 เท่านั้น คืน None ถ้าผลเลยท้ายปฏิทิน (ผู้เรียกนับต่อเอง)"""
+        k = self._cum[self._idx(d)] + n - 1
+        if k >= len(self._bd):
+            return None
+        return self.start + timedelta(days=self._bd[k])
+
+    def diff(self, d1: date, d2: date) -> int:
+        """จำนวนวันทำการ (d2 - d1) ความหมายเดียวกับ diff_business_days แบบวนทีละวัน"""
+        i1, i2 = self._idx(d1), self._idx(d2)
+        if i2 >= i1:
+            # นับวันทำการในช่วง (d1, d2]
+            return self._cum[i2] - self._cum[i1]
+        # นับวันทำการในช่วง [d2, d1) เป็นค่าติดลบ
+        b1 = self._cum[i1] - (self._cum[i1 - 1] if i1 else 0)
+        b2 = self._cum[i2] - (self._cum[i2 - 1] if i2 else 0)
+        return (self._cum[i2] - b2) - (self._cum[i1] - b1)
+
+
+# ช่วงที่สร้างปฏิทินเพิ่มรอบวันที่ที่ถูกถาม / ระยะเผื่อท้ายช่วงสำหรับหา "วันทำการถัดไป"
+_CALENDAR_SPAN_DAYS = 800
+_CALENDAR_MARGIN_DAYS = 60
+# ปฏิทินขยายได้แค่วันที่ในช่วง วันนี้ ± _CALENDAR_LIMIT_DAYS
+# วันที่นอกช่วง (import_date ผิด เช่น ปี 1900 / ใกล้ date.max) คำนวณตรงโดยไม่ใช้ปฏิทิน
+_CALENDAR_LIMIT_DAYS = 3660
+_calendar: Optional[BusinessCalendar] = None
+_calendar_lock = threading.Lock()
+
+
+def _in_calendar_limit(d: date) -> bool:
+    today = date.today()
+    return abs((d - today).days) <= _CALENDAR_LIMIT_DAYS
+
+
+def business_calendar(*dates: date) -> Optional[BusinessCalendar]:
+    """ปฏิทินวันทำการที่ครอบคลุม dates (สร้างใหม่อัตโนมัติเมื่อ TH_HOLIDAYS เปลี่ยนหรือวันที่อยู่นอกช่วง)
+    คืน None ถ้ามีวันที่อยู่นอก วันนี้ ± _CALENDAR_LIMIT_DAYS (ผู้เรียกคำนวณเองโดยไม่ใช้ปฏิทิน)"""
+    global _calendar
+    cal = _calendar
+    if cal is not None and cal.holidays == TH_HOLIDAYS and all(
+            cal.covers(d, _CALENDAR_MARGIN_DAYS) for d in dates):
+        return cal
+    with _calendar_lock:
+        cal = _calendar
+        holidays_changed = cal is not None and cal.holidays != TH_HOLIDAYS
+        if holidays_changed:
+            _sla_cached.cache_clear()
+        if not all(_in_calendar_limit(d) for d in dates):
+            if holidays_changed:
+                _calendar = BusinessCalendar(TH_HOLIDAYS, cal.start, cal.end)
+            return None
+        lo = min(dates, default=date.today())
+        hi = max(dates, default=date.today())
+        if cal is not None and not holidays_changed:
+            lo, hi = min(lo, cal.start), max(hi, cal.end)
+        start = lo - timedelta(days=_CALENDAR_SPAN_DAYS // 2)
+        end = hi + timedelta(days=_CALENDAR_SPAN_DAYS // 2 + _CALENDAR_MARGIN_DAYS)
+        _calendar = BusinessCalendar(TH_HOLIDAYS, start, end)
+        return _calendar
+
+
+def _count_business_days(a: date, b: date) -> int:
+    """จำนวนวันทำการในช่วง (a, b] (a <= b) โดยไม่ใช้ปฏิทิน: นับวันจันทร์-ศุกร์แล้วหักวันหยุด"""
+    weeks, rest = divmod((b - a).days, 7)
+    n = weeks * 5 + sum(1 for k in range(1, rest + 1) if (a.weekday() + k) % 7 < 5)
+    return n - sum(1 for h in TH_HOLIDAYS if a < h <= b and h.weekday() < 5)
+
+
 def add_business_days(d: date, n: int) -> date:
+    cal = business_calendar(d) if n > 0 else None
+    if cal is not None:
+        due = cal.add_business_days(d, n)
+        if due is not None:
+            return due
+        # ผลเลยท้ายปฏิทิน: เริ่มนับต่อจากวันทำการสุดท้ายในปฏิทิน
+        covered = len(cal._bd) - cal._cum[cal._idx(d)]
+        d, n = cal.start + timedelta(days=cal._bd[-1]), n - covered
     step = 1 if n >= 0 else -1
     cur = d
     cnt = 0
@@ -155,17 +368,16 @@ def add_business_days(d: date, n: int) -> date:
     return cur
 
 def diff_business_days(d1: date, d2: date) -> int:
-    """จำนวนวันทำการ (d2 - d1) ใช้บวก/ลบทีละวันโดยข้ามวันหยุด/เสาร์อาทิตย์"""
+    """จำนวนวันทำการ (d2 - d1) ข้ามวันหยุด/เสาร์อาทิตย์ (O(1) ผ่าน BusinessCalendar)"""
     if d1 == d2:
         return 0
-    step = 1 if d2 >= d1 else -1
-    cur = d1
-    cnt = 0
-    while cur != d2:
-        cur = cur + timedelta(days=step)
-        if is_business_day(cur):
-            cnt += step
-    return cnt
+    cal = business_calendar(d1, d2)
+    if cal is not None:
+        return cal.diff(d1, d2)
+    if d2 > d1:
+        return _count_business_days(d1, d2)
+    # วันทำการในช่วง [d2, d1) เป็นค่าติดลบ (ความหมายเดียวกับ BusinessCalendar.diff)
+    return -(_count_business_days(d2, d1) + is_business_day(d2) - is_business_day(d1))
 
 def _platform_cutoff_hour(platform: str) -> int:
     platform = normalize_platform(platform) or "อื่นๆ"
@@ -178,6 +390,11 @@ def compute_due_date(platform: str, order_dt: datetime) -> date:
     - ถ้า 'หลัง cutoff'     => due = 'วันทำการถัดไป'
     - เสาร์/อาทิตย์/วันหยุด ไม่นับเป็นวันส่ง
     """
+    base, after_cutoff = _order_day_and_cutoff(platform, order_dt)
+    return _due_from_day(base, after_cutoff)
+
+def _order_day_and_cutoff(platform: str, order_dt: datetime) -> Tuple[date, bool]:
+    """(วันที่สั่งตามเวลาไทย, สั่งหลัง cutoff หรือไม่) — เงื่อนไขเดียวกับ compute_due_date เดิมทุกประการ"""
     if order_dt.tzinfo is None:
         order_dt = TH_TZ.localize(order_dt)
     else:
@@ -185,14 +402,41 @@ def compute_due_date(platform: str, order_dt: datetime) -> date:
 
     cutoff_hour = _platform_cutoff_hour(platform)
     cutoff = datetime(order_dt.year, order_dt.month, order_dt.day, cutoff_hour, 0, 0, tzinfo=TH_TZ)
+    return order_dt.date(), not (order_dt <= cutoff)
+
+def _due_from_day(base: date, after_cutoff: bool) -> date:
+    cal = business_calendar(base)
+    if cal is not None:
+        if after_cutoff:
+            return cal.next_business_day(base)
+        return cal.first_business_day_on_or_after(base)
+    # นอกช่วงปฏิทิน: เดินทีละวัน (ไม่เกิน date.max)
+    due = base + timedelta(days=1) if after_cutoff and base < date.max else base
+    while not is_business_day(due) and due < date.max:
+        due += timedelta(days=1)
+    return due
+
+def _sla_text_from_due(due: date, today0: date) -> str:
+    diff = diff_business_days(due, today0)  # today0 - due
 
-    base = order_dt.date()
-    due = base if order_dt <= cutoff else add_business_days(base, 1)
+    if diff > 0:
+        return f"เลยกำหนด ({diff} วัน)"
+    if diff == 0:
+        return "วันนี้"
+    if diff == -1:
+        return "พรุ่งนี้"
+    return f"อีก {-diff} วัน"
 
-    while not is_business_day(due):
-        due = add_business_days(due, 1)
+def _sla(platform: str, order_dt: datetime, today0: date) -> Tuple[str, date]:
+    order_day, after_cutoff = _order_day_and_cutoff(platform, order_dt)
+    business_calendar(order_day, today0)  # ถ้า TH_HOLIDAYS เปลี่ยน จะล้าง memo ให้ก่อน
+    return _sla_cached(platform, order_day, after_cutoff, today0)
 
-    return due
+@lru_cache(maxsize=65536)
+def _sla_cached(platform: str, order_day: date, after_cutoff: bool, today0: date) -> Tuple[str, date]:
+    """(ข้อความSLA, due_date) ต่อ (platform, วันที่สั่ง, ก่อน/หลัง cutoff, วันนี้) — ออเดอร์จำนวนมากใช้ key ซ้ำกัน"""
+    due = _due_from_day(order_day, after_cutoff)
+    return _sla_text_from_due(due, today0), due
 
 def sla_text(platform: str, order_dt: datetime, today_dt: Optional[datetime] = None) -> str:
     """
@@ -208,17 +452,7 @@ def sla_text(platform: str, order_dt: datetime, today_dt: Optional[datetime] = N
     if today_dt is None:
         today_dt = now_thai()
 
-    due = compute_due_date(platform, order_dt)
-    today0 = today_dt.date()
-    diff = diff_business_days(due, today0)  # today0 - due
-
-    if diff > 0:
-        return f"เลยกำหนด ({diff} วัน)"
-    if diff == 0:
-        return "วันนี้"
-    if diff == -1:
-        return "พรุ่งนี้"
-    return f"อีก {-diff} วัน"
+    return _sla(platform, order_dt, today_dt.date())[0]
 
 # =====================================================================
 # ========== Backward-compatible wrappers (สำหรับโค้ดเดิม) ============
@@ -232,5 +466,6 @@ def sla_status(platform: str, order_time: datetime, ref_now: Optional[datetime]
     ฟังก์ชันเดิม: คืน (ข้อความSLA, due_date).
     - ถ้า PACKED ควรจัดการเว้นว่างจากฝั่งผู้เรียก
     """
-    txt = sla_text(platform, order_time, ref_now)
-    return txt, compute_due_date(platform, order_time)
\ No newline at end of file
+    if ref_now is None:
+        ref_now = now_thai()
+    return _sla(platform, order_time, ref_now.date())
\ No newline at end of file